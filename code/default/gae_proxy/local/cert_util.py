@@ -3,8 +3,11 @@
 
 import os
 import sys
+import ssl
 import glob
 import time
+import calendar
+import collections
 import random
 import base64
 import threading
@@ -64,7 +67,11 @@ class CertUtil(object):
     ca_subject = None
     ca_certdir = os.path.join(data_path, 'certs')
     ca_digest = 'sha256'
-    ca_lock = threading.Lock()
+    # lock striping, certs of different hosts can be created at the same time.
+    cert_locks = [threading.Lock() for _ in range(16)]
+    context_locks = [threading.Lock() for _ in range(16)]
+    cert_expire = {}  # certfile => not after time, no need to parse the file again.
+    cert_renew = 30 * 24 * 3600  # cert expire in 30 days will be created again
     ca_validity_years = 10
     ca_validity = 24 * 60 * 60 * 365 * ca_validity_years
     cert_validity_years = 2
@@ -73,6 +80,14 @@ class CertUtil(object):
     cert_keyfile = os.path.join(data_path, 'Certkey.pem')
     serial_reduce =  3600 * 24 * 365 * 46
 
+    # ready SSLContext for MITM
+    default_host = b'www.google.com'
+    context_cache = collections.OrderedDict()  # host => (context, renew_time)
+    context_cache_size = 1000
+    context_lock = threading.Lock()
+    pre_generate_hosts = []
+    pre_generate_running = False
+
     @staticmethod
     def create_ca():
         key = OpenSSL.crypto.PKey()
@@ -167,43 +182,156 @@ class CertUtil(object):
             fp.write(OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert))
             if CertUtil.cert_publickey is None:
                 fp.write(OpenSSL.crypto.dump_privatekey(OpenSSL.crypto.FILETYPE_PEM, pkey))
+        CertUtil.cert_expire[certfile] = time.time() + CertUtil.cert_validity
         return certfile
 
     @staticmethod
     def _get_old_cert(commonname):
         certfile = os.path.join(CertUtil.ca_certdir, utils.to_str(commonname) + '.crt')
-        if os.path.exists(certfile):
+        expire = CertUtil.cert_expire.get(certfile)
+        if expire is None:
+            if not os.path.exists(certfile):
+                return
+
             with open(certfile, 'rb') as fp:
                 cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, fp.read())
-            if datetime.datetime.strptime(utils.to_str(cert.get_notAfter()), '%Y%m%d%H%M%SZ') < datetime.datetime.utcnow() + datetime.timedelta(days=30):
-                try:
-                    os.remove(certfile)
-                except OSError as e:
-                    xlog.warning('CertUtil._get_old_cert failed: unable to remove outdated cert, %r', e)
-                else:
-                    return
-                # well, have to use the old one
-            return certfile
+            expire = calendar.timegm(time.strptime(utils.to_str(cert.get_notAfter()), '%Y%m%d%H%M%SZ'))
+            CertUtil.cert_expire[certfile] = expire
+
+        if expire < time.time() + CertUtil.cert_renew:
+            try:
+                os.remove(certfile)
+            except OSError as e:
+                xlog.warning('CertUtil._get_old_cert failed: unable to remove outdated cert, %r', e)
+            else:
+                CertUtil.cert_expire.pop(certfile, None)
+                return
+            # well, have to use the old one
+        return certfile
+
+    @staticmethod
+    def get_lock(commonname, locks=None):
+        locks = locks or CertUtil.cert_locks
+        return locks[hash(commonname) % len(locks)]
 
     @staticmethod
     def get_cert(commonname, sans=None, full_name=False):
         commonname = utils.to_bytes(commonname)
         isip =  check_ip_valid(commonname)
-        with CertUtil.ca_lock:
+        with CertUtil.get_lock(commonname):
             certfile = CertUtil._get_old_cert(commonname)
             if certfile:
                 return certfile
 
             # some site need full name cert
             # like https://about.twitter.com in Google Chrome
-            if not isip and not full_name and commonname.count(b'.') >= 2 and [len(x) for x in reversed(commonname.split(b'.'))] > [2, 4]:
-                commonname = commonname.partition(b'.')[-1]
-                certfile = CertUtil._get_old_cert(commonname)
-                if certfile:
-                    return certfile
+            if isip or full_name or commonname.count(b'.') < 2 or \
+                    [len(x) for x in reversed(commonname.split(b'.'))] <= [2, 4]:
+                return CertUtil._get_cert(commonname, isip, sans)
+
+        commonname = commonname.partition(b'.')[-1]
+        with CertUtil.get_lock(commonname):
+            certfile = CertUtil._get_old_cert(commonname)
+            if certfile:
+                return certfile
 
             return CertUtil._get_cert(commonname, isip, sans)
 
+    @staticmethod
+    def _create_context(host, full_name=False):
+        certfile = CertUtil.get_cert(host, full_name=full_name)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, CertUtil.cert_keyfile)
+        context.sni_callback = CertUtil.sni_callback
+        renew_time = CertUtil.cert_expire.get(certfile, time.time() + CertUtil.cert_validity) - CertUtil.cert_renew
+
+        with CertUtil.context_lock:
+            CertUtil.context_cache.pop(host, None)
+            if len(CertUtil.context_cache) >= CertUtil.context_cache_size:
+                CertUtil.context_cache.popitem(last=False)
+            CertUtil.context_cache[host] = (context, renew_time)
+        return context
+
+    @staticmethod
+    def get_context(host=None, full_name=False):
+        # SSLContext with the cert of host, cached in memory,
+        # no disk access and no cert parse for the cached hosts.
+        host = utils.to_bytes(host or CertUtil.default_host)
+        if not full_name:
+            with CertUtil.context_lock:
+                item = CertUtil.context_cache.get(host)
+                if item:
+                    CertUtil.context_cache.move_to_end(host)
+            if item:
+                context, renew_time = item
+                time_now = time.time()
+                if time_now < renew_time:
+                    return context
+                elif time_now < renew_time + CertUtil.cert_renew:
+                    # still valid, create the new one in background.
+                    CertUtil.pre_generate([host])
+                    return context
+
+        with CertUtil.get_lock(host, CertUtil.context_locks):
+            if not full_name:
+                with CertUtil.context_lock:
+                    item = CertUtil.context_cache.get(host)
+                if item and time.time() < item[1]:
+                    return item[0]
+
+            return CertUtil._create_context(host, full_name)
+
+    @staticmethod
+    def sni_callback(ssl_sock, server_name, context):
+        # switch to the cert of the SNI, CONNECT may use IP as host.
+        if not server_name:
+            return
+
+        try:
+            ssl_sock.context = CertUtil.get_context(server_name)
+        except Exception as e:
+            xlog.warn("switch context for SNI:%s fail:%r", server_name, e)
+
+    @staticmethod
+    def wrap_socket(sock, host=None):
+        return CertUtil.get_context(host).wrap_socket(sock, server_side=True)
+
+    @staticmethod
+    def pre_generate(hosts):
+        # create contexts for hot hosts in background, so CONNECT don't wait for cert creation.
+        with CertUtil.context_lock:
+            for host in hosts:
+                host = utils.to_bytes(host)
+                if host not in CertUtil.pre_generate_hosts:
+                    CertUtil.pre_generate_hosts.append(host)
+
+            if CertUtil.pre_generate_running or not CertUtil.pre_generate_hosts:
+                return
+            CertUtil.pre_generate_running = True
+
+        threading.Thread(target=CertUtil.pre_generate_worker, name="cert_pre_generate").start()
+
+    @staticmethod
+    def pre_generate_worker():
+        while True:
+            with CertUtil.context_lock:
+                if not CertUtil.pre_generate_hosts:
+                    CertUtil.pre_generate_running = False
+                    return
+                host = CertUtil.pre_generate_hosts.pop(0)
+
+            try:
+                with CertUtil.get_lock(host, CertUtil.context_locks):
+                    CertUtil._create_context(host)
+            except Exception as e:
+                xlog.warn("pre generate cert for %s fail:%r", host, e)
+
+    @staticmethod
+    def clean_cache():
+        with CertUtil.context_lock:
+            CertUtil.context_cache.clear()
+        CertUtil.cert_expire.clear()
+
     @staticmethod
     def win32_notify( msg="msg", title="Title"):
         import ctypes
@@ -496,7 +624,7 @@ class CertUtil(object):
 
 
     @staticmethod
-    def init_ca(no_mess_system=0):
+    def init_ca(no_mess_system=0, pre_generate_hosts=()):
         import OpenSSL
         #xlog.debug("Initializing CA")
 
@@ -566,6 +694,9 @@ class CertUtil(object):
             if remove_certs:
                 xlog.info("clean old site certs in XX-Net cert dir")
                 any(os.remove(x) for x in certfiles)
+                CertUtil.clean_cache()
+
+        CertUtil.pre_generate(pre_generate_hosts)
 
         if not no_mess_system:
             CertUtil.import_ca(CertUtil.ca_keyfile)
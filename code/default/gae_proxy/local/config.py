@@ -24,9 +24,21 @@ class Config(ConfigBase):
         # proxy
         self.set_var("listen_ip", "127.0.0.1")
         self.set_var("listen_port", 8087)
+        # browser connections served by a worker pool, idle keep-alive connections don't hold a thread.
+        # 0 for a thread per connection.
+        self.set_var("listen_workers", 128)
+
+        # MITM certs created in background at start
+        self.set_var("cert_pre_generate_hosts", [
+            b"www.google.com",
+            b"www.youtube.com",
+            b"mail.google.com",
+            b"accounts.google.com"
+        ])
 
         # auto range
-        self.set_var("AUTORANGE_THREADS", 10)
+        self.set_var("AUTORANGE_THREADS", 10)  # max chunks in flight for one download
+        self.set_var("AUTORANGE_WORKERS", 20)  # fetch workers shared by all downloads
         self.set_var("AUTORANGE_MAXSIZE", 512 * 1024)
         # if mobile:
         #     self.set_var("AUTORANGE_MAXBUFFERSIZE", 10 * 1024 * 1024 / 8)
@@ -34,6 +46,11 @@ class Config(ConfigBase):
         self.set_var("AUTORANGE_MAXBUFFERSIZE", 20 * 1024 * 1024)
         self.set_var("JS_MAXSIZE", 0)
 
+        # local cache of GAE responses, 0 to disable
+        self.set_var("http_cache_size", 200 * 1024 * 1024)
+        self.set_var("http_cache_mem_size", 16 * 1024 * 1024)
+        self.set_var("http_cache_max_item_size", 10 * 1024 * 1024)
+
         # gae
         self.set_var("GAE_PASSWORD", "")
         self.set_var("GAE_VALIDATE", 1)
@@ -55,6 +55,7 @@ response:
 """
 
 import errno
+import os
 import sys
 import time
 import xstruct as struct
@@ -74,6 +75,9 @@ except ImportError:
 from xx_six import ConnectionError, ConnectionResetError, BrokenPipeError, ConnectionAbortedError
 
 from . import check_local_network
+from . import http_cache
+from .range_fetch import RangeFetchScheduler
+from .config import module_data_path
 from .front import front
 import utils
 from xlog import getLogger
@@ -476,6 +480,74 @@ def request_gae_proxy(method, url, headers, body, timeout=None):
     raise GAE_Exception(600, "".join(error_msg))
 
 
+response_cache = http_cache.HttpCache(os.path.join(module_data_path, "http_cache"),
+                                      front.config.http_cache_size, front.config.http_cache_mem_size,
+                                      front.config.http_cache_max_item_size)
+
+
+def send_cached_response(wfile, method, headers, meta, stat_name):
+    response_headers = response_cache.get_headers(meta)
+    size = meta["size"]
+    etag = response_headers.get(b"Etag")
+    last_modified = response_headers.get(b"Last-Modified")
+
+    if_none_match = http_cache.get_header(headers, b"if-none-match")
+    if_modified_since = http_cache.get_header(headers, b"if-modified-since")
+    not_modified = False
+    if if_none_match:
+        not_modified = etag is not None and (if_none_match.strip() == b"*" or etag in if_none_match)
+    elif if_modified_since and last_modified:
+        since = http_cache.parse_http_date(if_modified_since)
+        modified = http_cache.parse_http_date(last_modified)
+        not_modified = since is not None and modified is not None and modified <= since
+
+    status = meta["status"]
+    reason = utils.to_bytes(meta["reason"], "latin-1")
+    begin, end = 0, size - 1
+    req_range = http_cache.get_header(headers, b"range")
+    if_range = http_cache.get_header(headers, b"if-range")
+    if not not_modified and req_range and (not if_range or if_range in (etag, last_modified)):
+        byte_range = http_cache.parse_range(req_range, size)
+        if byte_range:
+            begin, end = byte_range
+            status = 206
+            reason = b"Partial Content"
+            response_headers[b"Content-Range"] = b"bytes %d-%d/%d" % (begin, end, size)
+
+    if not_modified:
+        status = 304
+        reason = b"Not Modified"
+        response_headers.pop(b"Content-Length", None)
+    else:
+        response_headers[b"Content-Length"] = b"%d" % (end - begin + 1)
+    response_headers[b"Age"] = b"%d" % max(0, time.time() - meta["update"])
+    response_headers[b"Persist"] = b""
+    response_headers[b"Connection"] = b"Persist"
+
+    try:
+        wfile.write(b"HTTP/1.1 %d %s\r\n" % (status, reason))
+        for key, value in list(response_headers.items()):
+            send_header(wfile, key, value)
+        wfile.write(b"\r\n")
+
+        sent = 0
+        if method != b"HEAD" and not not_modified:
+            for data in response_cache.read_body(meta, begin, end):
+                wfile.write(data)
+                sent += len(data)
+    except IOError as e:
+        if isinstance(e, (BrokenPipeError, ConnectionAbortedError, ConnectionResetError, ssl.SSLError)):
+            return
+
+        xlog.warn("GAE cache read %s fail:%r", meta["url"], e)
+        response_cache.remove(meta["url"])
+        return
+
+    response_cache.report(stat_name, size if not_modified else sent)
+    xlog.info("GAE cache %s %d %s %s", stat_name, status, method, meta["url"])
+    return "ok"
+
+
 def handler(method, host, url, headers, body, wfile, fallback=None):
     if not url.startswith(b"http") and not url.startswith(b"HTTP"):
         xlog.error("gae:%s", url)
@@ -502,6 +574,26 @@ def handler(method, host, url, headers, body, wfile, fallback=None):
     for key in remove_list:
         del headers[key]
 
+    cache_meta = None
+    if method in (b"GET", b"HEAD"):
+        cache_meta = response_cache.get(url, headers)
+        if cache_meta and response_cache.is_fresh(cache_meta, headers):
+            return send_cached_response(wfile, method, org_headers, cache_meta, "hit")
+
+        cache_headers = response_cache.get_headers(cache_meta) if cache_meta else {}
+        if cache_meta and not req_range and \
+                not http_cache.get_header(headers, b"if-none-match") and \
+                not http_cache.get_header(headers, b"if-modified-since") and \
+                (b"Etag" in cache_headers or b"Last-Modified" in cache_headers):
+            # revalidate, body is sent from cache if not modified.
+            if b"Etag" in cache_headers:
+                headers[b"If-None-Match"] = cache_headers[b"Etag"]
+            if b"Last-Modified" in cache_headers:
+                headers[b"If-Modified-Since"] = cache_headers[b"Last-Modified"]
+        else:
+            cache_meta = None
+            response_cache.report("miss")
+
     # force to get content range
     # reduce wait time
     if method == b"GET":
@@ -558,6 +650,12 @@ def handler(method, host, url, headers, body, wfile, fallback=None):
     else:
         response.status = response.app_status
 
+    if cache_meta:
+        if response.status == 304:
+            response_cache.update(cache_meta, dict((k.title(), v) for k, v in response.headers.items()))
+            return send_cached_response(wfile, method, org_headers, cache_meta, "revalidated")
+        response_cache.report("miss")
+
     if response.status == 206:
         # use org_headers
         # RangeFetch need to known the real range end
@@ -692,65 +790,76 @@ def handler(method, host, url, headers, body, wfile, fallback=None):
                     xlog.exception("gae_handler.handler try decode and send response fail. e:%r %s", e, url)
                     return
 
+    cache_writer = response_cache.create_writer(method, url, headers, response.status, response.reason,
+                                                response_headers, body_length)
     try:
-        send_response_headers()
+        try:
+            send_response_headers()
 
-        if data0:
-            wfile.write(data0)
-            body_sended = len(data0)
-        else:
-            body_sended = 0
-    except Exception as e:
-        if sys.version_info[0] == 3 and \
-                (isinstance(e, BrokenPipeError) or
-                 isinstance(e, ConnectionAbortedError) or
-                 isinstance(e, ssl.SSLEOFError)):
+            if data0:
+                wfile.write(data0)
+                body_sended = len(data0)
+                if cache_writer:
+                    cache_writer.write(data0)
+            else:
+                body_sended = 0
+        except Exception as e:
+            if sys.version_info[0] == 3 and \
+                    (isinstance(e, BrokenPipeError) or
+                     isinstance(e, ConnectionAbortedError) or
+                     isinstance(e, ssl.SSLEOFError)):
+                return
+
+            xlog.exception("gae_handler.handler send response fail. e:%r %s", e, url)
             return
 
-        xlog.exception("gae_handler.handler send response fail. e:%r %s", e, url)
-        return
+        while True:
+            # 可能分片发给客户端
+            if body_sended >= body_length:
+                break
 
-    while True:
-        # 可能分片发给客户端
-        if body_sended >= body_length:
-            break
+            data = response.task.read()
+            if not data:
+                xlog.warn("get body fail, until:%d %s",
+                          body_length - body_sended, url)
+                break
 
-        data = response.task.read()
-        if not data:
-            xlog.warn("get body fail, until:%d %s",
-                      body_length - body_sended, url)
-            break
+            body_sended += len(data)
+            if cache_writer:
+                cache_writer.write(data)
+            try:
+                # https 包装
+                ret = wfile.write(data)
+                if ret == ssl.SSL_ERROR_WANT_WRITE or ret == ssl.SSL_ERROR_WANT_READ:
+                    #xlog.debug("send to browser wfile.write ret:%d", ret)
+                    #ret = wfile.write(data)
+                    wfile.write(data)
+            except Exception as e_b:
+                if sys.version_info[0] == 3 and \
+                        (isinstance(e_b, BrokenPipeError) or isinstance(e_b, ConnectionAbortedError)):
+                    return
 
-        body_sended += len(data)
-        try:
-            # https 包装
-            ret = wfile.write(data)
-            if ret == ssl.SSL_ERROR_WANT_WRITE or ret == ssl.SSL_ERROR_WANT_READ:
-                #xlog.debug("send to browser wfile.write ret:%d", ret)
-                #ret = wfile.write(data)
-                wfile.write(data)
-        except Exception as e_b:
-            if sys.version_info[0] == 3 and \
-                    (isinstance(e_b, BrokenPipeError) or isinstance(e_b, ConnectionAbortedError)):
+                if e_b.args[0] in (errno.ECONNABORTED, errno.EPIPE,
+                              errno.ECONNRESET) or 'bad write retry' in repr(e_b):
+                    xlog.info('gae_handler send to browser return %r %r, len:%d, sended:%d', e_b, url, body_length, body_sended)
+                else:
+                    xlog.info('gae_handler send to browser return %r %r', e_b, url)
                 return
 
-            if e_b.args[0] in (errno.ECONNABORTED, errno.EPIPE,
-                          errno.ECONNRESET) or 'bad write retry' in repr(e_b):
-                xlog.info('gae_handler send to browser return %r %r, len:%d, sended:%d', e_b, url, body_length, body_sended)
-            else:
-                xlog.info('gae_handler send to browser return %r %r', e_b, url)
-            return
+        # 完整一次https请求
+        appid = response.ssl_sock.host.split(".")[0]
+        xlog.info("GAE t:%d s:%d %s %s %s appid:%s", (time.time() - request_time) * 1000, content_length, method, url,
+                  response.task.get_trace(), appid)
+        return "ok"
+    finally:
+        if cache_writer:
+            cache_writer.close()
 
-    # 完整一次https请求
-    appid = response.ssl_sock.host.split(".")[0]
-    xlog.info("GAE t:%d s:%d %s %s %s appid:%s", (time.time() - request_time) * 1000, content_length, method, url,
-              response.task.get_trace(), appid)
-    return "ok"
 
+range_fetch_scheduler = RangeFetchScheduler(front.config)
 
-class RangeFetch2(object):
 
-    all_data_size = {}
+class RangeFetch2(object):
 
     def __init__(self, method, url, headers, body, response, wfile):
         self.method = method
@@ -761,7 +870,7 @@ class RangeFetch2(object):
         self.response = response
 
         self.keep_running = True
-        self.blocked = False
+        self.in_flight = 0  # chunks fetching by range_fetch_scheduler
 
         self.lock = threading.Lock()
         self.waiter = threading.Condition(self.lock)
@@ -774,18 +883,19 @@ class RangeFetch2(object):
         self.req_end = 0
         self.wait_begin = 0
 
-    def get_all_buffer_size(self):
-        return sum(v for k, v in list(self.all_data_size.items()))
-
     def put_data(self, range_begin, payload):
         with self.lock:
+            if not self.keep_running:
+                return
+
             if range_begin < self.wait_begin:
                 raise Exception("range_begin:%d expect:%d" %
                                 (range_begin, self.wait_begin))
 
             self.data_list[range_begin] = payload
             self.data_size += len(payload)
-            self.all_data_size[self] = self.data_size
+
+            range_fetch_scheduler.data_received(len(payload))
 
             if self.wait_begin in self.data_list:
                 self.waiter.notify()
@@ -852,12 +962,7 @@ class RangeFetch2(object):
                 xlog.exception("RangeFetch send response fail:%r %s", e, self.url)
                 return
 
-        data_left_to_fetch = self.req_end - self.req_begin + 1
-        fetch_times = int(
-            (data_left_to_fetch + front.config.AUTORANGE_MAXSIZE - 1) / front.config.AUTORANGE_MAXSIZE)
-        thread_num = min(front.config.AUTORANGE_THREADS, fetch_times)
-        for i in range(0, thread_num):
-            threading.Thread(target=self.fetch_worker, name="gae_fetch_work").start()
+        range_fetch_scheduler.add(self)
 
         threading.Thread(target=self.fetch, args=(
             res_begin, res_end, self.response), name="gae_fetch").start()
@@ -881,7 +986,7 @@ class RangeFetch2(object):
                     del self.data_list[self.wait_begin]
                     self.wait_begin += len(data)
                     self.data_size -= len(data)
-                    self.all_data_size[self] = self.data_size
+            range_fetch_scheduler.data_sent(len(data))
 
             try:
                 ret = self.wfile.write(data)
@@ -895,36 +1000,14 @@ class RangeFetch2(object):
                 xlog.info('RangeFetch client closed(%s). %s', e, self.url)
                 ok = None
                 break
-        self.keep_running = False
-        self.all_data_size.pop(self, None)
+        with self.lock:
+            self.keep_running = False
+            buffer_size = self.data_size
+            self.data_list = {}
+            self.data_size = 0
+        range_fetch_scheduler.remove(self, buffer_size)
         return ok
 
-    def fetch_worker(self):
-        blocked = False
-        while self.keep_running:
-            if blocked:
-                time.sleep(0.5)
-
-            with self.lock:
-                # at least 2 wait workers keep running
-                if self.req_begin > self.wait_begin + front.config.AUTORANGE_MAXSIZE:
-                    if self.get_all_buffer_size() > front.config.AUTORANGE_MAXBUFFERSIZE * (0.8 + len(self.all_data_size) * 0.2):
-                        if not self.blocked:
-                            xlog.debug("fetch_worker blocked, buffer:%d %s",
-                                       self.data_size, self.url)
-                        self.blocked = blocked = True
-                        continue
-                    self.blocked = blocked = False
-
-                if self.req_begin >= self.req_end + 1:
-                    break
-
-                begin = self.req_begin
-                end = min(begin + front.config.AUTORANGE_MAXSIZE - 1, self.req_end)
-                self.req_begin = end + 1
-
-            self.fetch(begin, end, None)
-
     def fetch(self, begin, end, first_response):
         headers = dict((k.title(), v) for k, v in list(self.headers.items()))
         retry_num = 0
@@ -0,0 +1,398 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import collections
+from email.utils import parsedate_tz, mktime_tz
+
+import utils
+from xlog import getLogger
+xlog = getLogger("gae_proxy")
+
+
+# Private HTTP cache in front of GAE fetch.
+# Only full 200 GET responses with Content-Length are stored.
+# File format: first line is json of the meta, then the body.
+# Small bodies also stay in memory.
+# url and headers are kept as latin-1 str in meta, any bytes can go through json.
+# Response header names are titled, like b"Etag".
+
+
+def parse_http_date(value):
+    try:
+        return mktime_tz(parsedate_tz(utils.to_str(value)))
+    except Exception:
+        return None
+
+
+def parse_cache_control(value):
+    directives = {}
+    for item in utils.to_bytes(value).lower().split(b","):
+        key, _, v = item.strip().partition(b"=")
+        if key:
+            directives[key] = v.strip(b'"')
+    return directives
+
+
+def get_header(headers, key):
+    # headers from browser are not titled.
+    for k, v in headers.items():
+        if k.lower() == key:
+            return v
+    return None
+
+
+def get_expire(headers, time_now):
+    # return None if the response should not be stored.
+    cache_control = parse_cache_control(headers.get(b"Cache-Control", b""))
+    if b"no-store" in cache_control:
+        return None
+
+    if b"no-cache" in cache_control:
+        return time_now
+
+    if b"max-age" in cache_control:
+        try:
+            return time_now + int(cache_control[b"max-age"])
+        except ValueError:
+            return time_now
+
+    date = parse_http_date(headers.get(b"Date", b"")) or time_now
+    if b"Expires" in headers:
+        expires = parse_http_date(headers[b"Expires"])
+        if expires is None:
+            return time_now
+        return time_now + max(0, expires - date)
+
+    last_modified = parse_http_date(headers.get(b"Last-Modified", b""))
+    if last_modified:
+        # heuristic freshness, 10% of the age, at most a day.
+        return time_now + min(max(0, date - last_modified) * 0.1, 24 * 3600)
+
+    return time_now
+
+
+def parse_range(value, size):
+    # single range only, return (begin, end) or None.
+    m = re.match(br'bytes=(\d*)-(\d*)$', utils.to_bytes(value).strip())
+    if not m:
+        return None
+
+    begin, end = m.group(1, 2)
+    if not begin:
+        if not end:
+            return None
+        begin = max(0, size - int(end))
+        end = size - 1
+    else:
+        begin = int(begin)
+        end = int(end) if end else size - 1
+        end = min(end, size - 1)
+
+    if begin > end:
+        return None
+    return begin, end
+
+
+class CacheWriter(object):
+    # fill the cache while the body is sent to browser.
+    def __init__(self, cache, meta, file_path):
+        self.cache = cache
+        self.meta = meta
+        self.file_path = file_path
+        self.tmp_path = file_path + ".%d.tmp" % id(self)
+        self.written = 0
+        self.mem_data = [] if meta["size"] <= cache.mem_item_size else None
+        try:
+            self.fd = open(self.tmp_path, "wb")
+            self.fd.write(utils.to_bytes(json.dumps(meta)) + b"\n")
+        except Exception as e:
+            xlog.warn("http cache create %s fail:%r", self.tmp_path, e)
+            self.fd = None
+
+    def write(self, data):
+        if not self.fd:
+            return
+
+        try:
+            self.fd.write(data)
+        except Exception as e:
+            xlog.warn("http cache write %s fail:%r", self.tmp_path, e)
+            self.abort()
+            return
+
+        self.written += len(data)
+        if self.mem_data is not None:
+            self.mem_data.append(bytes(data))
+
+    def abort(self):
+        if not self.fd:
+            return
+        self.fd.close()
+        self.fd = None
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+    def close(self):
+        # commit only if the whole body is received.
+        if not self.fd:
+            return
+
+        if self.written != self.meta["size"]:
+            return self.abort()
+
+        self.fd.close()
+        self.fd = None
+        try:
+            os.replace(self.tmp_path, self.file_path)
+        except OSError as e:
+            xlog.warn("http cache commit %s fail:%r", self.file_path, e)
+            return
+
+        body = b"".join(self.mem_data) if self.mem_data is not None else None
+        self.cache.add(self.meta, body)
+        self.cache.report("stored")
+
+
+class HttpCache(object):
+    block_size = 64 * 1024
+
+    def __init__(self, cache_path, max_size=200 * 1024 * 1024, mem_size=16 * 1024 * 1024,
+                 max_item_size=10 * 1024 * 1024, mem_item_size=64 * 1024):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.mem_size = mem_size
+        self.max_item_size = max_item_size
+        self.mem_item_size = mem_item_size
+
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # url => meta, LRU
+        self.size = 0
+        self.mem_bodies = collections.OrderedDict()  # url => body
+        self.mem_used = 0
+        self.stat = {"hit": 0, "revalidated": 0, "miss": 0, "stored": 0, "bytes_saved": 0}
+
+        if self.max_size:
+            self.load()
+
+    def load(self):
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+
+        metas = []
+        for filename in os.listdir(self.cache_path):
+            file_path = os.path.join(self.cache_path, filename)
+            if filename.endswith(".tmp"):
+                os.remove(file_path)
+                continue
+
+            try:
+                with open(file_path, "rb") as fd:
+                    meta = json.loads(utils.to_str(fd.readline()))
+                metas.append((os.path.getmtime(file_path), meta))
+            except Exception as e:
+                xlog.warn("http cache load %s fail:%r", file_path, e)
+                os.remove(file_path)
+
+        for _, meta in sorted(metas, key=lambda x: x[0]):
+            self.add(meta)
+
+    def get_file_path(self, url):
+        return os.path.join(self.cache_path, hashlib.sha1(utils.to_bytes(url, "latin-1")).hexdigest())
+
+    def add(self, meta, body=None):
+        url = meta["url"]
+        with self.lock:
+            self._remove(url)
+            self.entries[url] = meta
+            self.size += meta["size"]
+            if body is not None:
+                self.mem_bodies[url] = body
+                self.mem_used += len(body)
+
+            while self.mem_used > self.mem_size:
+                _, old_body = self.mem_bodies.popitem(last=False)
+                self.mem_used -= len(old_body)
+
+            removed = []
+            while self.size > self.max_size and self.entries:
+                old_url, old_meta = self.entries.popitem(last=False)
+                self.size -= old_meta["size"]
+                old_body = self.mem_bodies.pop(old_url, None)
+                if old_body is not None:
+                    self.mem_used -= len(old_body)
+                removed.append(old_url)
+
+        for old_url in removed:
+            self._remove_file(old_url)
+
+    def _remove(self, url):
+        # called with lock.
+        meta = self.entries.pop(url, None)
+        if meta:
+            self.size -= meta["size"]
+        body = self.mem_bodies.pop(url, None)
+        if body is not None:
+            self.mem_used -= len(body)
+
+    def _remove_file(self, url):
+        try:
+            os.remove(self.get_file_path(url))
+        except OSError:
+            pass
+
+    def remove(self, url):
+        with self.lock:
+            self._remove(url)
+        self._remove_file(url)
+
+    def clean(self):
+        with self.lock:
+            urls = list(self.entries)
+            self.entries.clear()
+            self.mem_bodies.clear()
+            self.size = 0
+            self.mem_used = 0
+        for url in urls:
+            self._remove_file(url)
+
+    def get(self, url, req_headers):
+        # return meta of url if it can be used for this request.
+        if not self.max_size:
+            return None
+
+        url = utils.to_str(url, "latin-1")
+        with self.lock:
+            meta = self.entries.get(url)
+            if not meta:
+                return None
+            self.entries.move_to_end(url)
+
+        if meta["vary"] is not None and \
+                meta["vary"] != utils.to_str(get_header(req_headers, b"accept-encoding") or b"", "latin-1"):
+            return None
+        return meta
+
+    def is_fresh(self, meta, req_headers=None):
+        if time.time() >= meta["expire"]:
+            return False
+
+        # forced reload of browser, revalidate or fetch again.
+        if req_headers:
+            if b"no-cache" in (get_header(req_headers, b"pragma") or b"").lower():
+                return False
+
+            cache_control = parse_cache_control(get_header(req_headers, b"cache-control") or b"")
+            if b"no-cache" in cache_control:
+                return False
+
+            if b"max-age" in cache_control:
+                try:
+                    max_age = int(cache_control[b"max-age"])
+                except ValueError:
+                    max_age = 0
+                if time.time() - meta["update"] >= max_age:
+                    return False
+        return True
+
+    def create_writer(self, method, url, req_headers, status, reason, headers, size):
+        # return a CacheWriter if the response can be stored.
+        if not self.max_size or method != b"GET" or status != 200:
+            return None
+
+        if size <= 0 or size > self.max_item_size or b"Content-Length" not in headers or \
+                b"Content-Range" in headers or b"Set-Cookie" in headers:
+            return None
+
+        if get_header(req_headers, b"authorization") or get_header(req_headers, b"range"):
+            return None
+
+        if b"no-store" in parse_cache_control(get_header(req_headers, b"cache-control") or b""):
+            return None
+
+        vary = None
+        if b"Vary" in headers:
+            fields = [x.strip().lower() for x in headers[b"Vary"].split(b",")]
+            if fields != [b"accept-encoding"]:
+                return None
+            vary = utils.to_str(get_header(req_headers, b"accept-encoding") or b"", "latin-1")
+
+        expire = get_expire(headers, time.time())
+        if expire is None:
+            return None
+        if expire <= time.time() and b"Etag" not in headers and b"Last-Modified" not in headers:
+            return None
+
+        meta = {
+            "url": utils.to_str(url, "latin-1"),
+            "status": status,
+            "reason": utils.to_str(reason or b"OK", "latin-1"),
+            "headers": [[utils.to_str(k, "latin-1"), utils.to_str(v, "latin-1")] for k, v in headers.items()],
+            "size": size,
+            "expire": expire,
+            "update": time.time(),
+            "vary": vary,
+        }
+        return CacheWriter(self, meta, self.get_file_path(meta["url"]))
+
+    def update(self, meta, headers):
+        # 304 from server, refresh the stored headers and expire time.
+        stored = self.get_headers(meta)
+        for key in (b"Cache-Control", b"Expires", b"Date", b"Etag", b"Last-Modified"):
+            if key in headers:
+                stored[key] = headers[key]
+
+        expire = get_expire(stored, time.time())
+        if expire is None:
+            self.remove(meta["url"])
+            return
+
+        meta["headers"] = [[utils.to_str(k, "latin-1"), utils.to_str(v, "latin-1")] for k, v in stored.items()]
+        meta["expire"] = expire
+        meta["update"] = time.time()
+
+    def get_headers(self, meta):
+        return dict((utils.to_bytes(k, "latin-1"), utils.to_bytes(v, "latin-1")) for k, v in meta["headers"])
+
+    def read_body(self, meta, begin=0, end=None):
+        # yield body blocks of [begin, end].
+        if end is None:
+            end = meta["size"] - 1
+
+        with self.lock:
+            body = self.mem_bodies.get(meta["url"])
+            if body is not None:
+                self.mem_bodies.move_to_end(meta["url"])
+        if body is not None:
+            yield body[begin:end + 1]
+            return
+
+        with open(self.get_file_path(meta["url"]), "rb") as fd:
+            fd.readline()
+            fd.seek(begin, os.SEEK_CUR)
+            left = end - begin + 1
+            while left > 0:
+                data = fd.read(min(left, self.block_size))
+                if not data:
+                    raise IOError("http cache file of %s is truncated" % meta["url"])
+                left -= len(data)
+                yield data
+
+    def report(self, name, saved=0):
+        with self.lock:
+            self.stat[name] += 1
+            self.stat["bytes_saved"] += saved
+
+    def status(self):
+        with self.lock:
+            stat = dict(self.stat)
+            stat["entries"] = len(self.entries)
+            stat["size"] = self.size
+            stat["mem_size"] = self.mem_used
+        requests = stat["hit"] + stat["revalidated"] + stat["miss"]
+        stat["hit_ratio"] = (stat["hit"] + stat["revalidated"]) / float(requests) if requests else 0
+        return stat
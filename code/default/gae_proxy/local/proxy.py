@@ -76,6 +76,7 @@ os.chdir(work_path)
 sys.path.append(root_path)
 from gae_proxy.local.cert_util import CertUtil
 from gae_proxy.local import proxy_handler
+from gae_proxy.local import gae_handler
 from gae_proxy.local.front import front, direct_front
 
 
@@ -124,7 +125,8 @@ def main(args):
 
     log_info()
 
-    threading.Thread(target=CertUtil.init_ca, args=(no_mess_system,), name="init_ca").start()
+    threading.Thread(target=CertUtil.init_ca, args=(no_mess_system, front.config.cert_pre_generate_hosts),
+                     name="init_ca").start()
 
     listen_ips = front.config.listen_ip
     if isinstance(listen_ips, str):
@@ -139,8 +141,12 @@ def main(args):
     front.start()
     direct_front.start()
 
-    proxy_server = simple_http_server.HTTPServer(
-        addresses, proxy_handler.GAEProxyHandler, logger=xlog)
+    if front.config.listen_workers:
+        proxy_server = simple_http_server.HTTPServer(
+            addresses, proxy_handler.GAEProxyHandler, logger=xlog, mode="pool", pool_size=front.config.listen_workers)
+    else:
+        proxy_server = simple_http_server.HTTPServer(
+            addresses, proxy_handler.GAEProxyHandler, logger=xlog)
 
     ready = True  # checked by launcher.module_init
     
@@ -155,6 +161,7 @@ def terminate():
     ready = False
     front.stop()
     direct_front.stop()
+    gae_handler.range_fetch_scheduler.stop()
     proxy_server.shutdown()
 
 
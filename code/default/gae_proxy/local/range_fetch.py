@@ -0,0 +1,129 @@
+import time
+import threading
+
+from xlog import getLogger
+xlog = getLogger("gae_proxy")
+
+
+class RangeFetchScheduler(object):
+    # One worker pool and one buffer budget for all RangeFetch2.
+    # Worker take the chunk from the download with fewest chunks in flight,
+    # the chunk browser will wait for soon is not limited by the buffer budget.
+    min_chunk_size = 64 * 1024
+    chunk_time = 2.0  # seconds a chunk should cost, chunk size is adapted by the worker speed
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.notify = threading.Condition(self.lock)
+        self.fetches = []
+        self.buffer_size = 0  # received but not sent to browser
+        self.reserved_size = 0  # chunks in flight
+        self.worker_speed = []
+        self.running = False
+
+    def start(self):
+        # called with lock.
+        self.running = True
+        self.worker_speed = [0] * self.config.AUTORANGE_WORKERS
+        for i in range(self.config.AUTORANGE_WORKERS):
+            threading.Thread(target=self.worker, args=(i,), name="gae_fetch_work_%d" % i).start()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.notify.notify_all()
+
+    def add(self, fetch):
+        with self.lock:
+            if not self.running:
+                self.start()
+            self.fetches.append(fetch)
+            self.notify.notify_all()
+
+    def remove(self, fetch, buffer_size):
+        with self.lock:
+            if fetch in self.fetches:
+                self.fetches.remove(fetch)
+            self.buffer_size -= buffer_size
+            self.notify.notify_all()
+
+    def data_received(self, size):
+        with self.lock:
+            self.buffer_size += size
+
+    def data_sent(self, size):
+        with self.lock:
+            self.buffer_size -= size
+            self.notify.notify()
+
+    def get_chunk_size(self, worker_id):
+        speed = self.worker_speed[worker_id]
+        if not speed:
+            return self.config.AUTORANGE_MAXSIZE
+        return int(min(self.config.AUTORANGE_MAXSIZE, max(self.min_chunk_size, speed * self.chunk_time)))
+
+    def select_fetch(self):
+        urgent = None
+        normal = None
+        for fetch in self.fetches:
+            if not fetch.keep_running or fetch.req_begin > fetch.req_end or \
+                    fetch.in_flight >= self.config.AUTORANGE_THREADS:
+                continue
+
+            if fetch.req_begin <= fetch.wait_begin + self.config.AUTORANGE_MAXSIZE:
+                if not urgent or fetch.in_flight < urgent.in_flight:
+                    urgent = fetch
+            elif not normal or fetch.in_flight < normal.in_flight:
+                normal = fetch
+
+        if urgent:
+            return urgent
+
+        if normal and self.buffer_size + self.reserved_size < self.config.AUTORANGE_MAXBUFFERSIZE:
+            return normal
+
+    def get_task(self, worker_id):
+        with self.lock:
+            while self.running:
+                fetch = self.select_fetch()
+                if not fetch:
+                    self.notify.wait()
+                    continue
+
+                # round robin between downloads with the same chunks in flight.
+                self.fetches.remove(fetch)
+                self.fetches.append(fetch)
+
+                begin = fetch.req_begin
+                end = min(begin + self.get_chunk_size(worker_id) - 1, fetch.req_end)
+                fetch.req_begin = end + 1
+                fetch.in_flight += 1
+                self.reserved_size += end - begin + 1
+                return fetch, begin, end
+
+    def task_done(self, worker_id, fetch, size, time_cost):
+        with self.lock:
+            fetch.in_flight -= 1
+            self.reserved_size -= size
+            if fetch.keep_running and time_cost > 0:
+                speed = size / time_cost
+                if self.worker_speed[worker_id]:
+                    speed = self.worker_speed[worker_id] * 0.7 + speed * 0.3
+                self.worker_speed[worker_id] = speed
+            self.notify.notify_all()
+
+    def worker(self, worker_id):
+        while self.running:
+            task = self.get_task(worker_id)
+            if not task:
+                break
+
+            fetch, begin, end = task
+            start_time = time.time()
+            try:
+                fetch.fetch(begin, end, None)
+            except Exception as e:
+                xlog.exception("RangeFetch %d-%d except:%r %s", begin, end, e, fetch.url)
+                fetch.close()
+            self.task_done(worker_id, fetch, end - begin + 1, time.time() - start_time)
@@ -33,6 +33,7 @@ from . import cert_util
 from . import ipv6_tunnel
 from .front import front, direct_front
 from . import download_gae_lib
+from . import gae_handler
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 
@@ -153,6 +154,8 @@ class ControlHandler(simple_http_server.HttpServerHandler):
             return self.req_check_ip_handler()
         elif path == "/debug":
             return self.req_debug_handler()
+        elif path == "/http_cache":
+            return self.req_http_cache_handler()
         elif path.startswith("/ipv6_tunnel"):
             return self.req_ipv6_tunnel_handler()
         elif path == "/quit":
@@ -511,7 +514,7 @@ class ControlHandler(simple_http_server.HttpServerHandler):
 
         elif reqs['cmd'] == ['exportip']:
             data = '{"res":"'
-            for ip in front.ip_manager.ip_list:
+            for ip in list(front.ip_manager.ip_list):
                 if front.ip_manager.ip_dict[ip]['fail_times'] > 0:
                     continue
                 data += "%s|" % ip
@@ -710,7 +713,7 @@ class ControlHandler(simple_http_server.HttpServerHandler):
 
     def req_debug_handler(self):
         data = ""
-        for obj in [front.connect_manager, front.http_dispatcher]:
+        for obj in [front.connect_manager, front.http_dispatcher, gae_handler.range_fetch_scheduler]:
             data += "%s\r\n" % obj.__class__
             for attr in dir(obj):
                 if attr.startswith("__"):
@@ -720,6 +723,14 @@ class ControlHandler(simple_http_server.HttpServerHandler):
         mimetype = 'text/plain'
         self.send_response_nc(mimetype, data)
 
+    def req_http_cache_handler(self):
+        reqs = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+        if reqs.get("cmd") == ["clean"]:
+            gae_handler.response_cache.clean()
+
+        data = json.dumps(gae_handler.response_cache.status(), indent=0, sort_keys=True)
+        self.send_response_nc('text/plain', data)
+
     def req_ipv6_tunnel_handler(self):
         req = urlparse(self.path).query
         reqs = parse_qs(req, keep_blank_values=True)
@@ -0,0 +1,138 @@
+import os
+import sys
+import ssl
+import time
+import shutil
+import random
+import socket
+import argparse
+import tempfile
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+gae_path = os.path.abspath(os.path.join(current_path, os.pardir))
+default_path = os.path.abspath(os.path.join(gae_path, os.pardir))
+sys.path.append(os.path.join(default_path, "lib", "noarch"))
+sys.path.append(os.path.join(gae_path, "local"))
+
+from cert_util import CertUtil
+
+# MITM CONNECT to first byte latency, need pyOpenSSL.
+# --clients browsers CONNECT to --hosts sites (first hosts are hotter), do the TLS handshake and read the first byte.
+#   file: the old way, get_cert under one global lock and a new SSL context from the cert files for every CONNECT
+#   context: cached SSLContext per host, striped locks
+
+
+def file_wrap(sock, host, global_lock=threading.Lock()):
+    with global_lock:
+        certfile = CertUtil.get_cert(host)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, CertUtil.cert_keyfile)
+    return context.wrap_socket(sock, server_side=True)
+
+
+def context_wrap(sock, host):
+    return CertUtil.wrap_socket(sock, host)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(args, mode):
+    wrap = file_wrap if mode == "file" else context_wrap
+    CertUtil.clean_cache()
+
+    listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_sock.bind(("127.0.0.1", 0))
+    listen_sock.listen(args.clients * 2)
+    address = listen_sock.getsockname()
+
+    def handle(sock):
+        try:
+            req = b""
+            while b"\r\n\r\n" not in req:
+                req += sock.recv(1024)
+            host = req.split()[1].rpartition(b":")[0]
+            sock.sendall(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            ssl_sock = wrap(sock, host)
+            ssl_sock.sendall(b"H")
+            ssl_sock.close()
+        except Exception as e:
+            print("server e:%r" % e)
+            sock.close()
+
+    def server():
+        while True:
+            sock, _ = listen_sock.accept()
+            if not running[0]:
+                sock.close()
+                break
+            threading.Thread(target=handle, args=(sock,)).start()
+
+    running = [True]
+    threading.Thread(target=server).start()
+
+    hosts = ["www.site%d.com" % i for i in range(args.hosts)]
+    weights = [1.0 / (i + 1) for i in range(args.hosts)]
+    client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    client_context.check_hostname = False
+    client_context.verify_mode = ssl.CERT_NONE
+
+    latencies = []
+    end_time = time.time() + args.duration
+
+    def client():
+        while time.time() < end_time:
+            host = random.choices(hosts, weights)[0]
+            start = time.time()
+            sock = socket.create_connection(address)
+            sock.sendall(b"CONNECT %s:443 HTTP/1.1\r\n\r\n" % host.encode())
+            res = b""
+            while b"\r\n\r\n" not in res:
+                res += sock.recv(1024)
+            ssl_sock = client_context.wrap_socket(sock, server_hostname=host)
+            ssl_sock.recv(1)
+            latencies.append(time.time() - start)
+            ssl_sock.close()
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    running[0] = False
+    socket.create_connection(address).close()
+    listen_sock.close()
+
+    print("%s clients:%d hosts:%d" % (mode, args.clients, args.hosts))
+    print("  connects:%d  p50:%.2fms p90:%.2fms p99:%.2fms" % (
+        len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 90) * 1000,
+        percentile(latencies, 99) * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="gae_proxy MITM cert CONNECT latency")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--hosts", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--modes", nargs="+", default=["file", "context"])
+    args = parser.parse_args()
+
+    tmp_path = tempfile.mkdtemp()
+    try:
+        CertUtil.ca_certfile = os.path.join(tmp_path, "CA.crt")
+        CertUtil.ca_keyfile = os.path.join(tmp_path, "CAkey.pem")
+        CertUtil.cert_keyfile = os.path.join(tmp_path, "Certkey.pem")
+        CertUtil.ca_certdir = os.path.join(tmp_path, "certs")
+        CertUtil.init_ca(no_mess_system=1)
+        # all modes start with the certs on disk.
+        for i in range(args.hosts):
+            CertUtil.get_cert("www.site%d.com" % i)
+        for mode in args.modes:
+            run(args, mode)
+    finally:
+        shutil.rmtree(tmp_path)
+    os._exit(0)
@@ -0,0 +1,238 @@
+import os
+import sys
+import ssl
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import threading
+import subprocess
+import collections
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+gae_path = os.path.abspath(os.path.join(current_path, os.pardir))
+default_path = os.path.abspath(os.path.join(gae_path, os.pardir))
+sys.path.append(os.path.join(default_path, "lib", "noarch"))
+sys.path.append(os.path.join(gae_path, "local"))
+
+from cert_util import CertUtil
+
+
+# pyOpenSSL may not be installed, site certs are made by the openssl command and
+# CertUtil._get_cert is replaced by a copy of them.
+class TestCertUtil(unittest.TestCase):
+    hosts = [b"a.com", b"b.com", b"c.com", b"d.com", b"1.2.3.4", b"www.google.com"]
+
+    @classmethod
+    def setUpClass(cls):
+        if not shutil.which("openssl"):
+            raise unittest.SkipTest("openssl not found")
+
+        cls.cert_path = tempfile.mkdtemp()
+        cls.keyfile = os.path.join(cls.cert_path, "key.pem")
+        subprocess.check_call(["openssl", "genrsa", "-out", cls.keyfile, "2048"],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        cls.pem = {}
+        for host in cls.hosts:
+            fn = os.path.join(cls.cert_path, host.decode() + ".pem")
+            subprocess.check_call(["openssl", "req", "-x509", "-key", cls.keyfile, "-days", "1",
+                                   "-subj", "/CN=%s" % host.decode(), "-out", fn],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            with open(fn, "r") as fd:
+                cls.pem[host] = fd.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.cert_path)
+
+    def setUp(self):
+        self.saved = dict((k, vars(CertUtil)[k]) for k in [
+            "ca_certdir", "cert_keyfile", "cert_expire", "context_cache", "context_cache_size",
+            "pre_generate_hosts", "_get_cert"])
+
+        self.tmp_path = tempfile.mkdtemp()
+        CertUtil.ca_certdir = self.tmp_path
+        CertUtil.cert_keyfile = self.keyfile
+        CertUtil.cert_expire = {}
+        CertUtil.context_cache = collections.OrderedDict()
+        CertUtil.pre_generate_hosts = []
+
+        self.created = []
+        self.create_delay = 0
+        self.expire = time.time() + CertUtil.cert_validity
+
+        def fake_get_cert(commonname, isip=False, sans=None):
+            self.created.append(commonname)
+            time.sleep(self.create_delay)
+            certfile = os.path.join(CertUtil.ca_certdir, commonname.decode() + ".crt")
+            with open(certfile, "w") as fd:
+                fd.write(self.pem.get(commonname, self.pem[b"a.com"]))
+            CertUtil.cert_expire[certfile] = self.expire
+            return certfile
+
+        CertUtil._get_cert = staticmethod(fake_get_cert)
+
+    def tearDown(self):
+        self.wait_pre_generate()
+        for k, v in self.saved.items():
+            setattr(CertUtil, k, v)
+        shutil.rmtree(self.tmp_path)
+
+    def wait_pre_generate(self):
+        for _ in range(100):
+            if not CertUtil.pre_generate_running:
+                return
+            time.sleep(0.05)
+
+    def peer_cert(self, context, server_hostname=None):
+        # handshake with a socketpair, return the cert PEM the server sent.
+        server_sock, client_sock = socket.socketpair()
+        result = {}
+
+        def serve():
+            try:
+                ssl_sock = context.wrap_socket(server_sock, server_side=True)
+                ssl_sock.close()
+            except Exception as e:
+                result["error"] = e
+
+        th = threading.Thread(target=serve)
+        th.start()
+        client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        client_context.check_hostname = False
+        client_context.verify_mode = ssl.CERT_NONE
+        ssl_sock = client_context.wrap_socket(client_sock, server_hostname=server_hostname)
+        der = ssl_sock.getpeercert(binary_form=True)
+        ssl_sock.close()
+        th.join()
+        self.assertNotIn("error", result)
+        return ssl.DER_cert_to_PEM_cert(der)
+
+    def assertCertOf(self, pem, host):
+        self.assertEqual(ssl.PEM_cert_to_DER_cert(pem), ssl.PEM_cert_to_DER_cert(self.pem[host]))
+
+    def test_get_context_cache(self):
+        context = CertUtil.get_context(b"a.com")
+        self.assertIsInstance(context, ssl.SSLContext)
+        self.assertIs(CertUtil.get_context("a.com"), context)
+        self.assertEqual(self.created, [b"a.com"])
+
+        self.assertCertOf(self.peer_cert(context), b"a.com")
+
+        # default host
+        self.assertIs(CertUtil.get_context(), CertUtil.get_context(CertUtil.default_host))
+
+    def test_full_name(self):
+        context = CertUtil.get_context(b"www.a.com")
+        self.assertEqual(self.created, [b"a.com"])
+
+        full_context = CertUtil.get_context(b"www.a.com", full_name=True)
+        self.assertIsNot(full_context, context)
+        self.assertEqual(self.created, [b"a.com", b"www.a.com"])
+
+    def test_lru(self):
+        CertUtil.context_cache_size = 3
+        a = CertUtil.get_context(b"a.com")
+        CertUtil.get_context(b"b.com")
+        CertUtil.get_context(b"c.com")
+
+        # a.com is used again, b.com is the oldest.
+        self.assertIs(CertUtil.get_context(b"a.com"), a)
+        CertUtil.get_context(b"d.com")
+        self.assertEqual(list(CertUtil.context_cache.keys()), [b"c.com", b"a.com", b"d.com"])
+
+        self.assertIs(CertUtil.get_context(b"a.com"), a)
+        self.assertEqual(len(self.created), 4)
+
+    def test_renew(self):
+        # need renew but still valid, old context is served and new one is made in background.
+        self.expire = time.time() + CertUtil.cert_renew - 100
+        old = CertUtil.get_context(b"a.com")
+        self.expire = time.time() + CertUtil.cert_validity
+        for filename in os.listdir(self.tmp_path):
+            CertUtil.cert_expire.pop(os.path.join(self.tmp_path, filename))
+            os.remove(os.path.join(self.tmp_path, filename))
+
+        self.assertIs(CertUtil.get_context(b"a.com"), old)
+        self.wait_pre_generate()
+        new = CertUtil.get_context(b"a.com")
+        self.assertIsNot(new, old)
+        self.assertEqual(self.created, [b"a.com", b"a.com"])
+
+        # expired context is not served.
+        CertUtil.context_cache[b"a.com"] = (new, time.time() - CertUtil.cert_renew - 1)
+        self.assertIsNot(CertUtil.get_context(b"a.com"), new)
+
+    def test_old_cert(self):
+        certfile = CertUtil.get_cert(b"a.com")
+        self.assertEqual(CertUtil.get_cert(b"a.com"), certfile)
+        self.assertEqual(self.created, [b"a.com"])
+
+        # cert near expire is created again.
+        CertUtil.cert_expire[certfile] = time.time() + 100
+        self.assertEqual(CertUtil.get_cert(b"a.com"), certfile)
+        self.assertEqual(self.created, [b"a.com", b"a.com"])
+
+    def test_sni_callback(self):
+        context = CertUtil.get_context(b"1.2.3.4")
+        self.assertCertOf(self.peer_cert(context), b"1.2.3.4")
+        self.assertCertOf(self.peer_cert(context, "b.com"), b"b.com")
+        self.assertIn(b"b.com", CertUtil.context_cache)
+
+    def test_sni_callback_fail(self):
+        context = CertUtil.get_context(b"1.2.3.4")
+
+        def fail_get_cert(commonname, isip=False, sans=None):
+            raise Exception("create cert fail")
+        CertUtil._get_cert = staticmethod(fail_get_cert)
+
+        # keep the cert of the CONNECT host.
+        self.assertCertOf(self.peer_cert(context, "b.com"), b"1.2.3.4")
+
+    def test_pre_generate(self):
+        CertUtil.pre_generate(["a.com", b"b.com"])
+        CertUtil.pre_generate([b"b.com", b"c.com"])
+        self.wait_pre_generate()
+
+        self.assertFalse(CertUtil.pre_generate_running)
+        self.assertEqual(sorted(self.created), [b"a.com", b"b.com", b"c.com"])
+        for host in [b"a.com", b"b.com", b"c.com"]:
+            self.assertIn(host, CertUtil.context_cache)
+
+        CertUtil.get_context(b"b.com")
+        self.assertEqual(len(self.created), 3)
+
+    def test_striped_lock(self):
+        self.assertIs(CertUtil.get_lock(b"a.com"), CertUtil.get_lock(b"a.com"))
+
+        hosts = [b"a.com"]
+        for host in self.hosts[1:]:
+            if CertUtil.get_lock(host) is not CertUtil.get_lock(b"a.com"):
+                hosts.append(host)
+                break
+        self.assertEqual(len(hosts), 2)
+
+        # certs of different hosts are created at the same time.
+        self.create_delay = 0.3
+        start = time.time()
+        ths = [threading.Thread(target=CertUtil.get_cert, args=(host,)) for host in hosts]
+        for th in ths:
+            th.start()
+        for th in ths:
+            th.join()
+        self.assertLess(time.time() - start, 0.55)
+
+        # same host only once.
+        self.created = []
+        ths = [threading.Thread(target=CertUtil.get_context, args=(b"d.com",)) for _ in range(3)]
+        for th in ths:
+            th.start()
+        for th in ths:
+            th.join()
+        self.assertEqual(self.created, [b"d.com"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+gae_path = os.path.abspath(os.path.join(current_path, os.pardir))
+default_path = os.path.abspath(os.path.join(gae_path, os.pardir))
+sys.path.append(os.path.join(default_path, "lib", "noarch"))
+sys.path.append(os.path.join(gae_path, "local"))
+
+import http_cache
+
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.cache = http_cache.HttpCache(self.tmp_path, max_size=1000, mem_size=100, mem_item_size=50)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def store(self, url, body, headers=None, req_headers=None):
+        headers = dict({b"Cache-Control": b"max-age=60"} if headers is None else headers)
+        headers[b"Content-Length"] = b"%d" % len(body)
+        writer = self.cache.create_writer(b"GET", url, req_headers or {}, 200, b"OK", headers, len(body))
+        if not writer:
+            return False
+        writer.write(body[:10])
+        writer.write(body[10:])
+        writer.close()
+        return True
+
+    def read(self, meta, begin=0, end=None):
+        return b"".join(self.cache.read_body(meta, begin, end))
+
+    def test_get_expire(self):
+        now = time.time()
+        self.assertEqual(http_cache.get_expire({b"Cache-Control": b"public, max-age=100"}, now), now + 100)
+        self.assertIsNone(http_cache.get_expire({b"Cache-Control": b"no-store"}, now))
+        self.assertEqual(http_cache.get_expire({b"Cache-Control": b"no-cache"}, now), now)
+        self.assertEqual(http_cache.get_expire({
+            b"Date": b"Sun, 06 Nov 1994 08:49:37 GMT",
+            b"Expires": b"Sun, 06 Nov 1994 09:49:37 GMT"}, now), now + 3600)
+        self.assertEqual(http_cache.get_expire({
+            b"Date": b"Sun, 16 Nov 1994 08:49:37 GMT",
+            b"Last-Modified": b"Sun, 06 Nov 1994 08:49:37 GMT"}, now), now + 24 * 3600)
+
+    def test_parse_range(self):
+        self.assertEqual(http_cache.parse_range(b"bytes=0-9", 100), (0, 9))
+        self.assertEqual(http_cache.parse_range(b"bytes=90-", 100), (90, 99))
+        self.assertEqual(http_cache.parse_range(b"bytes=-10", 100), (90, 99))
+        self.assertEqual(http_cache.parse_range(b"bytes=50-200", 100), (50, 99))
+        self.assertIsNone(http_cache.parse_range(b"bytes=200-", 100))
+        self.assertIsNone(http_cache.parse_range(b"bytes=0-1,5-6", 100))
+
+    def test_store(self):
+        body = os.urandom(300)
+        self.assertTrue(self.store(b"http://a.com/a.js", body))
+        meta = self.cache.get(b"http://a.com/a.js", {})
+        self.assertTrue(self.cache.is_fresh(meta))
+        self.assertEqual(self.read(meta), body)
+        self.assertEqual(self.read(meta, 10, 19), body[10:20])
+        self.assertEqual(self.cache.get_headers(meta)[b"Cache-Control"], b"max-age=60")
+
+        # not storable.
+        self.assertFalse(self.store(b"http://a.com/b", body, {b"Cache-Control": b"no-store"}))
+        self.assertFalse(self.store(b"http://a.com/b", body, {b"Set-Cookie": b"a=b", b"Cache-Control": b"max-age=60"}))
+        self.assertFalse(self.store(b"http://a.com/b", body, {}))
+        self.assertFalse(self.store(b"http://a.com/b", body, req_headers={b"authorization": b"x"}))
+
+        # not complete body is dropped.
+        writer = self.cache.create_writer(b"GET", b"http://a.com/c", {}, 200, b"OK",
+                                          {b"Content-Length": b"10", b"Cache-Control": b"max-age=60"}, 10)
+        writer.write(b"12345")
+        writer.close()
+        self.assertIsNone(self.cache.get(b"http://a.com/c", {}))
+        self.assertEqual(len(os.listdir(self.tmp_path)), 1)
+
+    def test_vary(self):
+        headers = {b"Cache-Control": b"max-age=60", b"Vary": b"Accept-Encoding"}
+        self.assertTrue(self.store(b"http://a.com/v", b"x" * 20, headers, {b"Accept-Encoding": b"gzip"}))
+        self.assertTrue(self.cache.get(b"http://a.com/v", {b"accept-encoding": b"gzip"}))
+        self.assertIsNone(self.cache.get(b"http://a.com/v", {}))
+        self.assertFalse(self.store(b"http://a.com/v", b"x" * 20, {b"Cache-Control": b"max-age=60", b"Vary": b"Cookie"}))
+
+    def test_lru(self):
+        for i in range(4):
+            self.assertTrue(self.store(b"http://a.com/%d" % i, b"%d" % i * 300))
+            # keep 0 used.
+            self.cache.get(b"http://a.com/0", {})
+
+        self.assertTrue(self.cache.get(b"http://a.com/0", {}))
+        self.assertIsNone(self.cache.get(b"http://a.com/1", {}))
+        self.assertEqual(self.cache.size, 900)
+        self.assertEqual(len(os.listdir(self.tmp_path)), 3)
+
+        # index is loaded from disk.
+        cache = http_cache.HttpCache(self.tmp_path, max_size=1000)
+        self.assertEqual(cache.size, 900)
+        self.assertEqual(b"".join(cache.read_body(cache.get(b"http://a.com/3", {}))), b"3" * 300)
+
+    def test_request_no_cache(self):
+        self.assertTrue(self.store(b"http://a.com/r", b"x" * 20))
+        meta = self.cache.get(b"http://a.com/r", {})
+        self.assertTrue(self.cache.is_fresh(meta, {b"accept": b"*/*"}))
+        self.assertTrue(self.cache.is_fresh(meta, {b"cache-control": b"max-age=100"}))
+        self.assertFalse(self.cache.is_fresh(meta, {b"cache-control": b"no-cache"}))
+        self.assertFalse(self.cache.is_fresh(meta, {b"Cache-Control": b"max-age=0"}))
+        self.assertFalse(self.cache.is_fresh(meta, {b"pragma": b"no-cache"}))
+
+    def test_revalidate(self):
+        self.assertTrue(self.store(b"http://a.com/e", b"x" * 20, {b"Cache-Control": b"no-cache", b"Etag": b'"1"'}))
+        meta = self.cache.get(b"http://a.com/e", {})
+        self.assertFalse(self.cache.is_fresh(meta))
+
+        self.cache.update(meta, {b"Cache-Control": b"max-age=60", b"Etag": b'"1"'})
+        self.assertTrue(self.cache.is_fresh(meta))
+        self.assertEqual(self.cache.get_headers(meta)[b"Cache-Control"], b"max-age=60")
+
+        self.cache.report("hit", 20)
+        self.cache.report("miss")
+        status = self.cache.status()
+        self.assertEqual(status["hit_ratio"], 0.5)
+        self.assertEqual(status["bytes_saved"], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+import os
+import sys
+import unittest
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+gae_path = os.path.abspath(os.path.join(current_path, os.pardir))
+default_path = os.path.abspath(os.path.join(gae_path, os.pardir))
+sys.path.append(os.path.join(default_path, "lib", "noarch"))
+sys.path.append(os.path.join(gae_path, "local"))
+
+from range_fetch import RangeFetchScheduler
+
+
+class FakeConfig(object):
+    AUTORANGE_WORKERS = 4
+    AUTORANGE_THREADS = 3
+    AUTORANGE_MAXSIZE = 1024 * 1024
+    AUTORANGE_MAXBUFFERSIZE = 8 * 1024 * 1024
+
+
+class FakeFetch(object):
+    def __init__(self, name, begin, end, wait_begin=0):
+        self.name = name
+        self.keep_running = True
+        self.in_flight = 0
+        self.req_begin = begin
+        self.req_end = end
+        self.wait_begin = wait_begin
+
+    def __repr__(self):
+        return self.name
+
+
+class TestRangeFetchScheduler(unittest.TestCase):
+    def setUp(self):
+        self.config = FakeConfig()
+        self.scheduler = RangeFetchScheduler(self.config)
+        # no worker thread, tasks are taken by the test.
+        self.scheduler.running = True
+        self.scheduler.worker_speed = [0] * self.config.AUTORANGE_WORKERS
+
+    def normal_fetch(self, name):
+        # far from the browser, not urgent.
+        return FakeFetch(name, 10 * self.config.AUTORANGE_MAXSIZE, 100 * self.config.AUTORANGE_MAXSIZE)
+
+    def test_fair(self):
+        a = self.normal_fetch("a")
+        b = self.normal_fetch("b")
+        c = self.normal_fetch("c")
+        self.scheduler.fetches = [a, b, c]
+
+        names = [self.scheduler.get_task(0)[0].name for _ in range(6)]
+        self.assertEqual(sorted(names[:3]), ["a", "b", "c"])
+        self.assertEqual(sorted(names[3:]), ["a", "b", "c"])
+
+        # fewest in flight first.
+        self.scheduler.task_done(0, b, self.config.AUTORANGE_MAXSIZE, 1)
+        self.assertIs(self.scheduler.get_task(0)[0], b)
+
+    def test_in_flight_limit(self):
+        a = self.normal_fetch("a")
+        self.scheduler.fetches = [a]
+        for _ in range(self.config.AUTORANGE_THREADS):
+            self.assertIs(self.scheduler.select_fetch(), a)
+            self.scheduler.get_task(0)
+
+        self.assertEqual(a.in_flight, self.config.AUTORANGE_THREADS)
+        self.assertIsNone(self.scheduler.select_fetch())
+
+    def test_chunks(self):
+        a = FakeFetch("a", 1000, 1000 + self.config.AUTORANGE_MAXSIZE + 99)
+        self.scheduler.fetches = [a]
+
+        fetch, begin, end = self.scheduler.get_task(0)
+        self.assertEqual((begin, end), (1000, 1000 + self.config.AUTORANGE_MAXSIZE - 1))
+        self.assertEqual(self.scheduler.reserved_size, self.config.AUTORANGE_MAXSIZE)
+
+        fetch, begin, end = self.scheduler.get_task(0)
+        self.assertEqual((begin, end), (1000 + self.config.AUTORANGE_MAXSIZE, a.req_end))
+        self.assertIsNone(self.scheduler.select_fetch())
+
+        self.scheduler.task_done(0, a, self.config.AUTORANGE_MAXSIZE, 1)
+        self.scheduler.task_done(0, a, 100, 1)
+        self.assertEqual(self.scheduler.reserved_size, 0)
+        self.assertEqual(a.in_flight, 0)
+
+    def test_budget(self):
+        a = self.normal_fetch("a")
+        self.scheduler.fetches = [a]
+
+        self.scheduler.data_received(self.config.AUTORANGE_MAXBUFFERSIZE - 100)
+        self.assertEqual(self.scheduler.buffer_size, self.config.AUTORANGE_MAXBUFFERSIZE - 100)
+        self.assertIs(self.scheduler.select_fetch(), a)
+
+        # reserved chunk count in the budget.
+        self.scheduler.get_task(0)
+        self.assertIsNone(self.scheduler.select_fetch())
+
+        self.scheduler.data_sent(self.config.AUTORANGE_MAXSIZE)
+        self.assertEqual(self.scheduler.buffer_size,
+                         self.config.AUTORANGE_MAXBUFFERSIZE - 100 - self.config.AUTORANGE_MAXSIZE)
+        self.assertIs(self.scheduler.select_fetch(), a)
+
+        self.scheduler.data_received(self.config.AUTORANGE_MAXSIZE)
+        self.assertIsNone(self.scheduler.select_fetch())
+
+        # finished download return its buffer.
+        b = self.normal_fetch("b")
+        self.scheduler.fetches.append(b)
+        self.scheduler.remove(a, self.config.AUTORANGE_MAXBUFFERSIZE - 100)
+        self.assertEqual(self.scheduler.fetches, [b])
+        self.assertEqual(self.scheduler.buffer_size, 0)
+        self.assertIs(self.scheduler.select_fetch(), b)
+
+        # remove twice only return the buffer.
+        self.scheduler.remove(a, 0)
+        self.assertEqual(self.scheduler.fetches, [b])
+
+    def test_urgent(self):
+        a = self.normal_fetch("a")
+        # browser is waiting for the next chunk.
+        b = FakeFetch("b", 5000, 100 * self.config.AUTORANGE_MAXSIZE, wait_begin=4000)
+        self.scheduler.fetches = [a, b]
+
+        self.scheduler.data_received(self.config.AUTORANGE_MAXBUFFERSIZE)
+        self.assertIs(self.scheduler.select_fetch(), b)
+
+        self.scheduler.get_task(0)
+        # next chunk of b is too far, limited by the budget.
+        self.assertIsNone(self.scheduler.select_fetch())
+
+        self.scheduler.data_sent(self.config.AUTORANGE_MAXBUFFERSIZE)
+        self.scheduler.task_done(0, b, self.config.AUTORANGE_MAXSIZE, 1)
+        # urgent is preferred even with less in flight on the other.
+        a.in_flight = 0
+        b.wait_begin = b.req_begin
+        b.in_flight = 2
+        self.assertIs(self.scheduler.select_fetch(), b)
+
+    def test_skip_stopped(self):
+        a = self.normal_fetch("a")
+        a.keep_running = False
+        b = self.normal_fetch("b")
+        b.req_begin = b.req_end + 1
+        self.scheduler.fetches = [a, b]
+        self.assertIsNone(self.scheduler.select_fetch())
+
+    def test_chunk_size(self):
+        max_size = self.config.AUTORANGE_MAXSIZE
+        self.assertEqual(self.scheduler.get_chunk_size(0), max_size)
+
+        self.scheduler.worker_speed[0] = 1000
+        self.assertEqual(self.scheduler.get_chunk_size(0), RangeFetchScheduler.min_chunk_size)
+
+        self.scheduler.worker_speed[0] = max_size
+        self.assertEqual(self.scheduler.get_chunk_size(0), max_size)
+
+        self.scheduler.worker_speed[0] = 100 * 1024
+        self.assertEqual(self.scheduler.get_chunk_size(0), int(100 * 1024 * RangeFetchScheduler.chunk_time))
+
+    def test_worker_speed(self):
+        a = self.normal_fetch("a")
+        self.scheduler.fetches = [a]
+
+        self.scheduler.get_task(1)
+        self.scheduler.task_done(1, a, 100 * 1024, 1.0)
+        self.assertEqual(self.scheduler.worker_speed[1], 100 * 1024)
+
+        self.scheduler.get_task(1)
+        self.scheduler.task_done(1, a, 200 * 1024, 1.0)
+        self.assertAlmostEqual(self.scheduler.worker_speed[1], 100 * 1024 * 0.7 + 200 * 1024 * 0.3)
+        self.assertEqual(self.scheduler.worker_speed[0], 0)
+
+        # chunk of a stopped download don't count.
+        a.keep_running = False
+        self.scheduler.task_done(1, a, 1, 1.0)
+        self.assertAlmostEqual(self.scheduler.worker_speed[1], 100 * 1024 * 0.7 + 200 * 1024 * 0.3)
+
+    def test_stop(self):
+        self.scheduler.stop()
+        self.assertIsNone(self.scheduler.get_task(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -38,6 +38,7 @@ config.set_var("webui_auth", {})
 
 config.set_var("gae_show_detail", 0)
 config.set_var("show_compat_suggest", 1)
+config.set_var("async_log", 0)  # write logs in a background thread, for debug log on busy proxy
 config.set_var("proxy_by_app", 0)
 config.set_var("enabled_app_list", [])
 
@@ -42,7 +42,7 @@ def create_data_path():
 
 create_data_path()
 
-from xlog import getLogger
+from xlog import getLogger, set_async_mode
 log_file = os.path.join(data_launcher_path, "launcher.log")
 xlog = getLogger("launcher", log_path=data_launcher_path, save_start_log=500, save_warning_log=True)
 xlog.set_buffer(100)
@@ -57,6 +57,9 @@ import download_modules
 import global_var
 
 
+if config.async_log:
+    set_async_mode(True)
+
 current_version = update_from_github.current_version()
 
 xlog.info("start Version %s", current_version)
@@ -191,6 +194,7 @@ try:
 except KeyboardInterrupt:  # Ctrl + C on console
     global_var.running = False
     module_init.stop_all()
+    set_async_mode(False)
     os._exit(0)
     sys.exit()
 except Exception as e:
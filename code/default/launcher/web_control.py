@@ -1082,7 +1082,8 @@ def start(allow_remote=0):
 
     xlog.info("begin to start web control:%s", addresses)
 
-    server = simple_http_server.HTTPServer(addresses, Http_Handler, logger=xlog, max_thread=2048)
+    # idle connections of the web ui don't hold a thread.
+    server = simple_http_server.HTTPServer(addresses, Http_Handler, logger=xlog, mode="pool", pool_size=32)
     server.start()
 
     xlog.info("launcher web control started.")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+import re
+import collections
+
+import utils
+
+
+# Match a host against many domain lists in one walk.
+#
+# Every list is a bit flag, add() the domains of a list with it's flag,
+# match() return the flags of all lists the host is in.
+#   "google.com"  match google.com and *.google.com
+#   ".google.com" match *.google.com only
+#
+# match() cost is one dict lookup per label of the host,
+# bytes.endswith(tuple) cost is one compare per domain in the lists.
+
+class DomainMatcher(object):
+    def __init__(self):
+        self.hosts = {}  # host => flags
+        self.suffixes = {}  # ".suffix" => flags, match sub domains
+
+    def add(self, domain, flag):
+        domain = utils.to_bytes(domain).strip()
+        if not domain:
+            return
+
+        if domain.startswith(b"*."):
+            domain = domain[1:]
+
+        if not domain.startswith(b"."):
+            self.hosts[domain] = self.hosts.get(domain, 0) | flag
+            domain = b"." + domain
+
+        self.suffixes[domain] = self.suffixes.get(domain, 0) | flag
+
+    def add_list(self, domains, flag):
+        for domain in domains:
+            self.add(domain, flag)
+
+    def match(self, host):
+        host = utils.to_bytes(host)
+        flags = self.hosts.get(host, 0)
+
+        pos = host.find(b".")
+        while pos != -1:
+            flags |= self.suffixes.get(host[pos:], 0)
+            pos = host.find(b".", pos + 1)
+
+        return flags
+
+    def __len__(self):
+        return len(self.suffixes)
+
+
+class KeywordMatcher(object):
+    # Aho-Corasick automaton, find any keyword in one pass of the host.
+    # goto table is completed with the fail links when built, so match() never walk back.
+    #
+    # re alternation try every keyword at every position, but it's C code,
+    # it's faster until about 25 keywords, see smart_router/tests/bench_domain_matcher.py
+    max_regex_keywords = 20
+
+    def __init__(self, keywords=()):
+        self.goto = [{}]
+        self.output = [False]
+        self.keywords = []
+        self.keyword_re = None
+        for keyword in keywords:
+            self.add(keyword)
+        self.build()
+
+    def add(self, keyword):
+        keyword = utils.to_bytes(keyword)
+        if not keyword:
+            return
+
+        self.keywords.append(keyword)
+        state = 0
+        for c in keyword:
+            next_state = self.goto[state].get(c)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.output.append(False)
+                self.goto[state][c] = next_state
+            state = next_state
+        self.output[state] = True
+
+    def build(self):
+        if 0 < len(self.keywords) <= self.max_regex_keywords:
+            self.keyword_re = re.compile(b"|".join(re.escape(k) for k in self.keywords))
+        else:
+            self.keyword_re = None
+
+        fail = [0] * len(self.goto)
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self.output[state] = self.output[state] or self.output[fail[state]]
+
+            fail_goto = self.goto[fail[state]]
+            for c, next_state in list(self.goto[state].items()):
+                fail[next_state] = fail_goto.get(c, 0)
+                queue.append(next_state)
+
+            # missing transition go where the fail state go, except back to root.
+            for c, next_state in fail_goto.items():
+                if c not in self.goto[state] and next_state:
+                    self.goto[state][c] = next_state
+
+    def search(self, host):
+        host = utils.to_bytes(host)
+        if self.keyword_re:
+            return self.keyword_re.search(host) is not None
+
+        goto = self.goto
+        output = self.output
+        state = 0
+        for c in host:
+            state = goto[state].get(c, 0)
+            if output[state]:
+                return True
+        return False
@@ -25,6 +25,7 @@
 import os
 import sys
 import hashlib
+import threading
 import logging as xlog
 
 
@@ -60,7 +61,7 @@ def EVP_BytesToKey(password, key_len, iv_len):
     # so that we make the same key and iv as nodejs version
     if hasattr(password, 'encode'):
         password = password.encode('utf-8')
-    r = cached_keys.get(password, None)
+    r = cached_keys.get((password, key_len, iv_len), None)
     if r:
         return r
     m = []
@@ -76,7 +77,7 @@ def EVP_BytesToKey(password, key_len, iv_len):
     ms = b''.join(m)
     key = ms[:key_len]
     iv = ms[key_len:key_len + iv_len]
-    cached_keys[password] = (key, iv)
+    cached_keys[(password, key_len, iv_len)] = (key, iv)
     return key, iv
 
 
@@ -88,7 +89,10 @@ class Encryptor(object):
         self.iv_sent = False
         self.cipher_iv = b''
         self.decipher = None
+        if hasattr(method, 'encode'):
+            method = method.encode('utf-8')
         method = method.lower()
+        self.method = method
         self._method_info = self.get_method_info(method)
         if self._method_info:
             self.cipher = self.get_cipher(key, method, 1,
@@ -129,7 +133,7 @@ class Encryptor(object):
             head = self.cipher_iv
             self.iv_sent = True
         else:
-            head = ""
+            head = b""
         return head + self.cipher.update(buf)
 
     def decrypt(self, buf):
@@ -145,6 +149,109 @@ class Encryptor(object):
                 return buf
         return self.decipher.update(buf)
 
+cipher_contexts = {}
+cipher_contexts_lock = threading.Lock()
+
+
+def get_cipher_context(password, method):
+    # CipherContext is cached by (password, method) and shared by all threads.
+    ctx = cipher_contexts.get((password, method))
+    if ctx:
+        return ctx
+
+    with cipher_contexts_lock:
+        ctx = cipher_contexts.get((password, method))
+        if not ctx:
+            ctx = CipherContext(password, method)
+            cipher_contexts[(password, method)] = ctx
+        return ctx
+
+
+class CipherContext(object):
+    # Encrypt/decrypt whole messages, same format as Encryptor: iv + cipher text.
+    #
+    # Encryptor is created for one message, derive key and create cipher every time.
+    # CipherContext derive key once, every thread keep its own ciphers and
+    # reset them with the new iv for next message if the cipher support it.
+    # Result is written to a preallocated bytearray.
+    def __init__(self, password, method):
+        if hasattr(password, 'encode'):
+            password = password.encode('utf-8')
+        if hasattr(method, 'encode'):
+            method = method.encode('utf-8')
+        self.method = method.lower()
+
+        m = method_supported.get(self.method)
+        if not m:
+            raise Exception('method %s not supported' % method)
+        self.key_len, self.iv_len, self.cipher_class = m
+        if self.key_len > 0:
+            self.key, _ = EVP_BytesToKey(password, self.key_len, self.iv_len)
+        else:
+            # key_length == 0 indicates we should use the key directly
+            self.key = password
+
+        # cipher factory like rc4-md5 derive key from iv, can't reset.
+        self.reusable = hasattr(self.cipher_class, "reset")
+        self.local = threading.local()
+
+    def _get_cipher(self, op, iv):
+        if not self.reusable:
+            return self.cipher_class(self.method, self.key, iv, op)
+
+        ciphers = getattr(self.local, "ciphers", None)
+        if ciphers is None:
+            ciphers = self.local.ciphers = {}
+
+        cipher = ciphers.get(op)
+        if cipher:
+            cipher.reset(iv)
+            return cipher
+
+        cipher = self.cipher_class(self.method, self.key, iv, op)
+        ciphers[op] = cipher
+        return cipher
+
+    @staticmethod
+    def _update_into(cipher, data, out):
+        if hasattr(cipher, "update_into"):
+            cipher.update_into(data, out)
+        else:
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            out[:] = cipher.update(data)
+
+    def encrypt(self, data):
+        # data can also be a scatter/gather buffer with buffer_list, like x_tunnel WriteBuffer,
+        # every segment is encrypted to its place in the output, no join.
+        if hasattr(data, 'encode'):
+            data = data.encode('utf-8')
+        if len(data) == 0:
+            return bytearray()
+
+        iv = random_string(self.iv_len)
+        out = bytearray(self.iv_len + len(data))
+        out[:self.iv_len] = iv
+        out_view = memoryview(out)
+        cipher = self._get_cipher(1, iv)
+        pos = self.iv_len
+        for segment in getattr(data, "buffer_list", [data]):
+            self._update_into(cipher, segment, out_view[pos:pos + len(segment)])
+            pos += len(segment)
+        return out
+
+    def decrypt(self, data):
+        # data can be bytes, bytearray or memoryview, no need to convert.
+        if len(data) <= self.iv_len:
+            return bytearray()
+
+        data = memoryview(data)
+        iv = data[:self.iv_len].tobytes()
+        out = bytearray(len(data) - self.iv_len)
+        self._update_into(self._get_cipher(0, iv), data[self.iv_len:], out)
+        return out
+
+
 def encrypt_all(password, method, op, data):
     result = []
     method = method.lower()
@@ -27,6 +27,7 @@ class ConfigBase(xconfig.Config):
         self.set_var("dispather_ping_upload_size", 1024)
         self.set_var("dispather_ping_rtt_download_size", 512)
         self.set_var("dispather_ping_speed_download_size", 1024 * 100)
+        self.set_var("dispather_shard_num", 1)  # number of dispatcher loops, each own part of the workers.
 
         self.set_var("max_task_num", 100)
 
@@ -47,6 +48,9 @@ class ConfigBase(xconfig.Config):
         self.set_var("http2_show_debug", 0)
         self.set_var("http2_ping_min_interval", 5)
         self.set_var("http2_idle_ping_min_interval", 235)
+        # >0: http/2 workers share this number of selector loop threads,
+        # instead of a send and a recv thread for every worker. only for build in ssl.
+        self.set_var("http2_io_loop_num", 0)
 
         # worker_base
         self.set_var("show_state_debug", 0)
@@ -78,6 +82,8 @@ class ConfigBase(xconfig.Config):
         self.set_var("connect_send_buffer", 1024 * 512)
         self.set_var("connect_force_http1", 0)
         self.set_var("connect_force_http2", 0)
+        self.set_var("tls_session_cache_size", 1000)  # 0 to disable TLS session resumption
+        self.set_var("tls_session_cache_ttl", 3600)
         self.set_var("check_pkp", [])
         self.set_var("check_commonname", "")
         self.set_var("check_sni", 0) # 0, 1, string
@@ -107,6 +113,7 @@ class ConfigBase(xconfig.Config):
         self.set_var("ip_cal_speed_min_package_size", 100000)
         self.set_var("ip_cal_expect_time_package_size", 40000)
         self.set_var("ip_speed_save_interval", 60)
+        self.set_var("ip_store_binary", 1)  # save ip list and speed in binary file, only write changed ip.
 
         # ip source
         self.set_var("use_ipv6", "auto") #force_ipv4/force_ipv6
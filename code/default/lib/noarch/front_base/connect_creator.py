@@ -6,6 +6,7 @@ import sys
 import socks
 import utils
 from . import openssl_wrap
+from .tls_session_cache import TlsSessionCache
 from subj_alt_name import SubjectAltName
 from pyasn1.codec.der import decoder as der_decoder
 
@@ -23,6 +24,12 @@ class ConnectCreator(object):
         self.peer_cert = None
         if check_cert:
             self.check_cert = check_cert
+
+        if self.config.tls_session_cache_size and getattr(openssl_wrap.SSLConnection, "support_session", False):
+            self.session_cache = TlsSessionCache(self.config.tls_session_cache_ttl, self.config.tls_session_cache_size)
+        else:
+            # boringssl wrap don't export session api.
+            self.session_cache = None
         self.update_config()
 
         self.connect_force_http1 = self.config.connect_force_http1
@@ -80,10 +87,20 @@ class ConnectCreator(object):
             sock.settimeout(self.timeout)
 
         time_begin = time.time()
-        ssl_sock = openssl_wrap.SSLConnection(self.openssl_context.context, sock,
-                                              ip_str=ip_str,
-                                              sni=sni,
-                                              on_close=close_cb)
+        if self.session_cache:
+            session = self.session_cache.get(ip_str, utils.to_str(sni))
+            ssl_sock = openssl_wrap.SSLConnection(self.openssl_context.context, sock,
+                                                  ip_str=ip_str,
+                                                  sni=sni,
+                                                  on_close=close_cb,
+                                                  session=session,
+                                                  session_cb=self.session_cache.put)
+        else:
+            session = None
+            ssl_sock = openssl_wrap.SSLConnection(self.openssl_context.context, sock,
+                                                  ip_str=ip_str,
+                                                  sni=sni,
+                                                  on_close=close_cb)
 
         ssl_sock.sni = utils.to_str(sni)
 
@@ -93,8 +110,20 @@ class ConnectCreator(object):
             ssl_sock.do_handshake()
         except Exception as e:
             # self.logger.exception("handshake except:%r", e)
+            if session:
+                # don't save the failed session back on close.
+                ssl_sock._session_cb = None
+                self.session_cache.remove(ip_str, ssl_sock.sni)
             raise socket.error('tls handshake fail, sni:%s, top:%s e:%r' % (sni, host, e))
 
+        # resumed handshake skip cert exchange, it's time can't compare with full handshake.
+        ssl_sock.resumed = bool(session) and ssl_sock.is_session_reused()
+        if self.session_cache:
+            self.session_cache.report_handshake(ssl_sock.resumed)
+            if not ssl_sock.resumed:
+                # TLS 1.2 session is ready now, TLS 1.3 ticket is saved when connection closed.
+                self.session_cache.put(ip_str, ssl_sock.sni, ssl_sock.get_session())
+
         if ssl_sock.is_support_h2():
             ssl_sock.h2 = True
         else:
@@ -348,9 +348,10 @@ class ConnectManager(object):
             if not ssl_sock or isinstance(ssl_sock, ValueError) or isinstance(ssl_sock, OSError) or not hasattr(ssl_sock, "handshake_time"):
                 raise socket.error("timeout")
 
-            self.ip_manager.update_ip(ip_str, sni, ssl_sock.handshake_time)
-            self.logger.debug("create_ssl update ip:%s time:%d h2:%d sni:%s, host:%s",
-                              ip_str, ssl_sock.handshake_time, ssl_sock.h2, ssl_sock.sni, ssl_sock.host)
+            resumed = getattr(ssl_sock, "resumed", False)
+            self.ip_manager.update_ip(ip_str, sni, ssl_sock.handshake_time, resumed=resumed)
+            self.logger.debug("create_ssl update ip:%s time:%d resumed:%d h2:%d sni:%s, host:%s",
+                              ip_str, ssl_sock.handshake_time, resumed, ssl_sock.h2, ssl_sock.sni, ssl_sock.host)
             ssl_sock.host_info = host_info
 
             return ssl_sock
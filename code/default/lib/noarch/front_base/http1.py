@@ -146,12 +146,14 @@ class Http1Worker(HttpWorker):
 
         try:
             self.ssl_sock.send(request_data)
-            payload_len = len(task.body)
-            start = 0
-            while start < payload_len:
-                send_size = min(payload_len - start, 65535)
-                sended = self.ssl_sock.send(task.body[start:start + send_size])
-                start += sended
+            for segment in get_body_segments(task.body):
+                segment = memoryview(segment)
+                payload_len = len(segment)
+                start = 0
+                while start < payload_len:
+                    send_size = min(payload_len - start, 65535)
+                    sended = self.ssl_sock.send(segment[start:start + send_size])
+                    start += sended
 
             task.set_state("h1_req_sent")
         except Exception as e:
@@ -222,6 +224,9 @@ class Http1Worker(HttpWorker):
             if read_target and data_len >= read_target:
                 break
 
+        # Response.__del__ close the sock, keep the connection for next task.
+        response.sock = None
+
         if read_target > data_len:
             self.logger.warn("read fail, ip:%s, chunk:%d url:%s task.timeout:%d ",
                              self.ip_str, response.chunked, task.url, task.timeout)
@@ -280,6 +285,7 @@ class Http1Worker(HttpWorker):
                 return False
 
             content = response.readall(timeout=5)
+            response.sock = None
             self.record_active("head end")
             self.last_recv_time = time.time()
             return True
@@ -5,7 +5,7 @@ import threading
 import socket
 import errno
 import struct
-from ssl import SSLError
+from ssl import SSLError, SSLWantReadError, SSLWantWriteError
 
 from .http_common import *
 
@@ -19,6 +19,7 @@ from hyper.packages.hyperframe.frame import (
     BlockedFrame, FRAME_MAX_ALLOWED_LEN, FRAME_MAX_LEN
 )
 from .http2_stream import Stream
+from .io_loop import LoopSendQueue
 from hyper.http20.window import BaseFlowControlManager
 
 from hyper.packages.hpack import Encoder, Decoder
@@ -86,9 +87,20 @@ class Http2Worker(HttpWorker):
         else:
             self.stream_class = Stream
 
+        # set by dispatcher when http2_io_loop_num > 0,
+        # socket io is done by the shared loop thread instead of send/recv threads of this worker.
+        self.io_loop = getattr(ssl_sock, "io_loop", None)
+
         # Google http/2 time out is 4 mins.
-        self.ssl_sock.settimeout(240)
-        self._sock = BufferedSocket(ssl_sock, self.network_buffer_size)
+        self.recv_timeout = 240
+        if self.io_loop:
+            self.ssl_sock._connection.setblocking(False)
+            self.loop_recv_buf = bytearray()
+            self.loop_send_buf = None
+            self.loop_bytes_received = 0
+        else:
+            self.ssl_sock.settimeout(self.recv_timeout)
+            self._sock = BufferedSocket(ssl_sock, self.network_buffer_size)
 
         self.next_stream_id = 1
         self.streams = {}
@@ -109,7 +121,10 @@ class Http2Worker(HttpWorker):
         # then send by send_loop
         # every frame put to this queue must allowed by stream window and connection window
         # any data frame blocked by connection window should put to self.blocked_send_frames
-        self.send_queue = queue.Queue()
+        if self.io_loop:
+            self.send_queue = LoopSendQueue(self.io_loop, self)
+        else:
+            self.send_queue = queue.Queue()
         self.encoder = Encoder()
         self.decoder = Decoder()
 
@@ -140,8 +155,18 @@ class Http2Worker(HttpWorker):
         # send Setting frame before accept task.
         self._send_preamble()
 
-        threading.Thread(target=self.h2_send_loop, name="h2_send_%s" % self.ip_str).start()
-        threading.Thread(target=self.h2_recv_loop, name="h2_recv_%s" % self.ip_str).start()
+        if self.io_loop:
+            self.io_loop.add(self)
+        else:
+            threading.Thread(target=self.h2_send_loop, name="h2_send_%s" % self.ip_str).start()
+            threading.Thread(target=self.h2_recv_loop, name="h2_recv_%s" % self.ip_str).start()
+
+    @property
+    def bytes_received(self):
+        if self.io_loop:
+            return self.loop_bytes_received
+        else:
+            return self._sock.bytes_received
 
     # export api
     def request(self, task):
@@ -219,6 +244,87 @@ class Http2Worker(HttpWorker):
                 self.logger.exception("recv fail:%r", e)
                 self.close("recv fail:%r" % e)
 
+    def loop_recv(self):
+        # io_loop mode, socket is readable.
+        # read all data in socket and ssl buffer, then process every complete frame.
+        conn = self.ssl_sock._connection
+        buf = self.loop_recv_buf
+        while True:
+            try:
+                data = conn.recv(self.network_buffer_size)
+            except (SSLWantReadError, SSLWantWriteError):
+                break
+            except Exception as e:
+                self.close("recv fail:%r" % e)
+                return
+
+            if not data:
+                self.close("ConnectionReset:closed by peer")
+                return
+            buf += data
+            self.loop_bytes_received += len(data)
+
+        self.last_recv_time = time.time()
+
+        pos = 0
+        buf_len = len(buf)
+        while buf_len - pos >= 9:
+            frame, length = Frame.parse_frame_header(bytes(buf[pos:pos + 9]))
+            if buf_len - pos - 9 < length:
+                break
+
+            if length > FRAME_MAX_ALLOWED_LEN:
+                self.logger.error("%s Frame size exceeded on stream %d (received: %d, max: %d)",
+                                  self.ip_str, frame.stream_id, length, FRAME_MAX_LEN)
+
+            data = memoryview(bytes(buf[pos + 9:pos + 9 + length]))
+            pos += 9 + length
+            self._consume_frame_payload(frame, data)
+            if not self.keep_running:
+                return
+
+        if pos:
+            del buf[:pos]
+
+    def loop_send(self):
+        # io_loop mode, send queued frames, combine small frames to one ssl record.
+        conn = self.ssl_sock._connection
+        while True:
+            if not self.loop_send_buf:
+                out = []
+                out_len = 0
+                while self.send_queue.frames and out_len < self.network_buffer_size:
+                    frame = self.send_queue.get()
+                    if not frame:
+                        continue
+
+                    if self.config.http2_show_debug:
+                        self.logger.debug("%s Send:%s", self.ip_str, str(frame))
+                    data = frame.serialize()
+                    out.append(data)
+                    out_len += len(data)
+
+                if not out:
+                    self.io_loop.set_write_interest(self, False)
+                    return
+                self.loop_send_buf = memoryview(b"".join(out))
+
+            try:
+                sent = conn.send(self.loop_send_buf)
+            except (SSLWantReadError, SSLWantWriteError):
+                self.io_loop.set_write_interest(self, True)
+                return
+            except Exception as e:
+                self.close("send fail:%r" % e)
+                return
+
+            self.last_send_time = time.time()
+            self.loop_send_buf = self.loop_send_buf[sent:]
+
+    def loop_check_timeout(self, now):
+        if now - self.last_recv_time > self.recv_timeout:
+            self.close("recv.timeout:inactive %d" % (now - self.last_recv_time))
+
     def close(self, reason="conn close"):
         # Notify loop to exit
         # This function may be call by out side http2
@@ -230,6 +336,8 @@ class Http2Worker(HttpWorker):
         else:
             self.logger.warn("%s close, reason: %s, trace:%s", self.ip_str, reason, self.get_trace())
         self.send_queue.put(None)
+        if self.io_loop:
+            self.io_loop.remove(self)
 
         for stream in list(self.streams.values()):
             if stream.task.responsed or stream.task.start_time + stream.task.timeout < time.time():
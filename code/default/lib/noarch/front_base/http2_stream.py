@@ -72,7 +72,7 @@ class Stream(object):
         self.task = task
         self.state = STATE_IDLE
         self.get_head_time = None
-        self.start_connection_point = self.connection._sock.bytes_received
+        self.start_connection_point = self.connection.bytes_received
         self.get_head_stream_num = 0
 
         # There are two flow control windows: one for data we're sending,
@@ -96,12 +96,15 @@ class Stream(object):
 
         self.request_headers = HTTPHeaderMap()
 
-        # Convert the body to bytes if needed.
-        self.request_body = to_bytestring(self.task.body)
+        # body segments are sent without join, segment index and offset of next data to send.
+        self.request_body_segments = [memoryview(s) for s in get_body_segments(self.task.body) if len(s)]
+        self.request_body_len = sum(len(s) for s in self.request_body_segments)
+        self.request_body_index = 0
+        self.request_body_offset = 0
 
         # request body not send blocked by send window
         # the left body will send when send window opened.
-        self.request_body_left = len(self.request_body)
+        self.request_body_left = self.request_body_len
         self.request_body_sended = False
 
         # data list before decode
@@ -187,8 +190,7 @@ class Stream(object):
             send_size = min(self.remote_window_size, self.request_body_left, self.max_frame_size)
 
             f = DataFrame(self.stream_id)
-            data_start = len(self.request_body) - self.request_body_left
-            f.data = self.request_body[data_start:data_start+send_size]
+            f.data = self._get_body_data(send_size)
 
             self.remote_window_size -= send_size
             self.request_body_left -= send_size
@@ -208,6 +210,23 @@ class Stream(object):
                 self._close_local()
                 self.task.set_state("end send left body")
 
+    def _get_body_data(self, size):
+        # data in one segment is a memoryview, only data cross segments is joined.
+        pieces = []
+        while size:
+            segment = self.request_body_segments[self.request_body_index]
+            piece = segment[self.request_body_offset:self.request_body_offset + size]
+            pieces.append(piece)
+            size -= len(piece)
+            self.request_body_offset += len(piece)
+            if self.request_body_offset == len(segment):
+                self.request_body_index += 1
+                self.request_body_offset = 0
+
+        if len(pieces) == 1:
+            return pieces[0]
+        return b"".join(pieces)
+
     def receive_frame(self, frame):
         """
         Handle a frame received on this stream.
@@ -311,7 +330,7 @@ class Stream(object):
             time_now = time.time()
             whole_cost = time_now - self.start_time
             rtt = whole_cost - xcost
-            bytes_received = self.connection._sock.bytes_received - self.start_connection_point
+            bytes_received = self.connection.bytes_received - self.start_connection_point
             if self.config.http2_show_debug:
                 self.logger.debug("%s stream:%d END_STREAM %s%s", self.connection.ssl_sock.ip_str,
                                   self.stream_id, self.task.host, self.task.path)
@@ -320,13 +339,13 @@ class Stream(object):
                 self.logger.debug("got pong for %s", self.connection.ip_str)
 
             if rtt > 0 and not self.task.finished and xcost >= 0.0:
-                self.connection.update_speed(rtt, len(self.request_body), bytes_received)
+                self.connection.update_speed(rtt, self.request_body_len, bytes_received)
                 self.task.set_state("h2_finish[RTT:%d]" % (rtt * 1000))
                 if self.config.http2_show_debug:
                     self.logger.debug("%s rtt:%f send_len:%d recv_len:%d "
                                       "whole_Cost:%f xcost:%f",
                                       self.connection.ssl_sock.ip_str, rtt * 1000,
-                                      len(self.request_body), bytes_received,
+                                      self.request_body_len, bytes_received,
                                       whole_cost, xcost)
 
             self._close_remote()
@@ -2,12 +2,21 @@ import threading
 import time
 import random
 
-from queue import Queue
 import simple_http_client
+import simple_queue
 
 import utils
 
 
+def get_body_segments(body):
+    # body is bytes or a scatter/gather buffer with buffer_list, like x_tunnel WriteBuffer.
+    # workers send the segments one by one, the body is not joined to one bytes.
+    buffer_list = getattr(body, "buffer_list", None)
+    if buffer_list is None:
+        return [body]
+    return buffer_list
+
+
 class Task(object):
     def __init__(self, logger, config, method, host, path, headers, body, queue, url, timeout):
         self.logger = logger
@@ -25,7 +34,8 @@ class Task(object):
             path = headers.get(b"X-Path", b"/")
         self.unique_id = "%s%s:%f" % (url, path, self.start_time)
         self.trace_time = []
-        self.body_queue = Queue()
+        # get(timeout) return None on timeout, read() return b'' then.
+        self.body_queue = simple_queue.Queue()
         self.body_len = 0
         self.body_readed = 0
         self.content_length = None
@@ -195,6 +205,9 @@ class Task(object):
 class HttpWorker(object):
     max_payload = 32 * 1024
 
+    # set by dispatcher, called when score changed to keep the worker index sorted.
+    score_changed_cb = None
+
     def __init__(self, logger, ip_manager, config, ssl_sock, close_cb, retry_task_cb, idle_cb, log_debug_data):
         self.logger = logger
         self.ip_manager = ip_manager
@@ -276,6 +289,9 @@ class HttpWorker(object):
         if self.version == "1.1":
             self.ip_manager.update_score(self.ip_str, self.score)
 
+        if self.score_changed_cb:
+            self.score_changed_cb(self)
+
     def get_score(self):
         # The smaller, the better
         if self.version == "1.1":
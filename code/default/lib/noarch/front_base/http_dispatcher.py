@@ -25,15 +25,116 @@ import traceback
 
 from utils import SimpleCondition
 from queue import Queue
+import simple_queue
 import utils
+from sortedcontainers import SortedListWithKey
 
 from . import http_common
 from .http1 import Http1Worker
 from .http2_connection import Http2Worker, Stream
+from . import io_loop
+
+
+class WorkerIndex(object):
+    # Keep workers sorted by score, the smaller the better.
+    # The sorted key is worker.index_score, the score when the worker is put in.
+    # Worker call update() when it's score changed, so the best worker can be found
+    # without calling get_score() on all the workers for every task.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sorted_workers = SortedListWithKey(key=operator.attrgetter("index_score"))
+
+    def __len__(self):
+        return len(self.sorted_workers)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.sorted_workers))
+
+    def add(self, worker):
+        with self.lock:
+            if getattr(worker, "index_score", None) is not None:
+                return
+
+            worker.index_score = worker.get_score()
+            self.sorted_workers.add(worker)
+
+    def remove(self, worker):
+        with self.lock:
+            if getattr(worker, "index_score", None) is None:
+                return
+
+            self.sorted_workers.discard(worker)
+            worker.index_score = None
+
+    def update(self, worker):
+        score = worker.get_score()
+        with self.lock:
+            if getattr(worker, "index_score", None) is None or worker.index_score == score:
+                return
+
+            self.sorted_workers.discard(worker)
+            worker.index_score = score
+            self.sorted_workers.add(worker)
+
+    def refresh(self):
+        # score of http1 worker is kept in ip_manager and may be changed by other worker on the same ip.
+        with self.lock:
+            workers = list(self.sorted_workers)
+            for worker in workers:
+                worker.index_score = worker.get_score()
+            self.sorted_workers.clear()
+            self.sorted_workers.update(workers)
+
+    def clear(self):
+        with self.lock:
+            for worker in self.sorted_workers:
+                worker.index_score = None
+            self.sorted_workers.clear()
+
+    def get_best(self, min_idle_num=0):
+        # return (top_score, best_worker, best_score, idle_num)
+        # idle_num is only counted until it reach min_idle_num.
+        top_score = 99999999
+        best_score = 99999999
+        best_worker = None
+        idle_num = 0
+        with self.lock:
+            for worker in self.sorted_workers:
+                score = worker.index_score
+                if top_score > score:
+                    top_score = score
+
+                if best_worker and idle_num >= min_idle_num:
+                    break
+
+                if not worker.accept_task or worker.is_life_end():
+                    continue
+
+                if worker.version == "1.1" or len(worker.streams) == 0:
+                    idle_num += 1
+
+                if best_worker is None:
+                    best_score = score
+                    best_worker = worker
+
+        return top_score, best_worker, best_score, idle_num
+
+
+class DispatchShard(object):
+    # A dispatcher loop with it's own request queue and partition of workers.
+
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.request_queue = Queue()
+        self.worker_index = WorkerIndex()
 
 
 class HttpsDispatcher(object):
     idle_time = 2 * 60
+    maintain_interval = 1
+    steal_interval = 0.1
 
     base_headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/101.0.4951.67 Safari/537.36",
@@ -62,8 +163,16 @@ class HttpsDispatcher(object):
         else:
             self.http2stream_class = Stream
 
-        self.request_queue = Queue()
+        # dispather_shard_num > 1 run multiple dispatcher loops,
+        # a slow get_worker on one shard will not block tasks on other shards.
+        self.shards = [DispatchShard(i) for i in range(max(1, self.config.dispather_shard_num))]
+        self.request_queue = self.shards[0].request_queue
+        self.worker_index = self.shards[0].worker_index
+        self.shard_pointer = 0
+        self.claim_lock = threading.Lock()
         self.workers = []
+        self.last_maintain_time = 0
+        self.life_end_worker_num = 0
         self.working_tasks = {}
         self.account = ""
         self.last_host = None
@@ -100,10 +209,21 @@ class HttpsDispatcher(object):
         }
         self.ping_speed_ip_str_last_active = {}  # ip_str => last_active
 
+        if self.config.http2_io_loop_num:
+            self.io_loops = io_loop.IoLoopPool(self.logger, self.config.http2_io_loop_num,
+                                               "%s_io_loop" % self.logger.name)
+        else:
+            self.io_loops = None
+
         self.trigger_create_worker_cv = SimpleCondition()
         self.wait_a_worker_cv = SimpleCondition()
 
-        threading.Thread(target=self.dispatcher, name="%s_dispatcher" % self.logger.name).start()
+        if len(self.shards) == 1:
+            threading.Thread(target=self.dispatcher, name="%s_dispatcher" % self.logger.name).start()
+        else:
+            for shard in self.shards:
+                threading.Thread(target=self.dispatcher, args=(shard,),
+                                 name="%s_dispatcher_%d" % (self.logger.name, shard.shard_id)).start()
         threading.Thread(target=self.create_worker_thread, name="%s_create_worker_thread" % self.logger.name).start()
         threading.Thread(target=self.connection_checker, name="%s_connection_checker" % self.logger.name).start()
 
@@ -112,8 +232,11 @@ class HttpsDispatcher(object):
 
     def stop(self):
         self.running = False
-        self.request_queue.put(None)
+        for shard in self.shards:
+            shard.request_queue.put(None)
         self.close_all_worker("stop")
+        if self.io_loops:
+            self.io_loops.stop()
 
     def _debug_log(self, fmt, *args, **kwargs):
         if not self.config.show_state_debug:
@@ -132,6 +255,9 @@ class HttpsDispatcher(object):
             raise Exception("on_ssl_created_cb ssl_sock None")
 
         if ssl_sock.h2:
+            if self.io_loops and io_loop.is_supported(ssl_sock):
+                ssl_sock.io_loop = self.io_loops.get()
+
             worker = self.http2worker(
                 self.logger, self.ip_manager, self.config, ssl_sock,
                 self.close_cb, self.retry_task_cb, self._on_worker_idle_cb, self.log_debug_data,
@@ -143,7 +269,7 @@ class HttpsDispatcher(object):
                 self.close_cb, self.retry_task_cb, self._on_worker_idle_cb, self.log_debug_data)
             self.h1_num += 1
 
-        self.workers.append(worker)
+        self._add_worker(worker)
 
         if time.time() - self.ping_speed_ip_str_last_active.get(worker.ip_str, 0) > self.config.dispather_ping_check_speed_interval:
             self.ping_speed(worker, self.config.dispather_ping_rtt_download_size)
@@ -174,7 +300,27 @@ class HttpsDispatcher(object):
         worker.request(task)
 
     def _on_worker_idle_cb(self):
-        self.wait_a_worker_cv.notify()
+        if len(self.shards) == 1:
+            self.wait_a_worker_cv.notify()
+        else:
+            self.wait_a_worker_cv.notify_all()
+
+    def _on_worker_score_changed_cb(self, worker):
+        worker.dispatch_shard.worker_index.update(worker)
+
+    def _add_worker(self, worker):
+        # put new worker to the shard with the least workers.
+        shard = min(self.shards, key=lambda s: len(s.worker_index))
+        worker.dispatch_shard = shard
+        self.workers.append(worker)
+        worker.score_changed_cb = self._on_worker_score_changed_cb
+        shard.worker_index.add(worker)
+
+    def _remove_worker(self, worker):
+        shard = getattr(worker, "dispatch_shard", None)
+        if shard:
+            shard.worker_index.remove(worker)
+        self.workers.remove(worker)
 
     def create_worker_thread(self):
         self.logger.info("%s create_worker_thread start", self.logger.name)
@@ -213,17 +359,19 @@ class HttpsDispatcher(object):
 
     def _remove_life_end_workers(self):
         to_close = []
-        for worker in self.workers:
+        life_end_num = 0
+        for worker in list(self.workers):
             if not worker.is_life_end():
                 continue
 
+            life_end_num += 1
             if worker.version == "1.1" and not worker.request_onway:
                 to_close.append(worker)
                 continue
 
             now = time.time()
             task_finished = True
-            for stream_id, stream in worker.streams.items():
+            for stream_id, stream in list(worker.streams.items()):
                 if stream.task.start_time + stream.task.timeout > now:
                     task_finished = False
                     break
@@ -236,47 +384,61 @@ class HttpsDispatcher(object):
             worker.close("life end:" + reason)
             if worker in self.workers:
                 try:
-                    self.workers.remove(worker)
+                    self._remove_worker(worker)
                 except:
                     pass
 
-    def get_worker(self, nowait=False):
-        # self._debug_log("start get_worker")
+        self.life_end_worker_num = life_end_num - len(to_close)
 
-        while self.running:
-            top_score = 99999999
-            best_score = 99999999
-            best_worker = None
-            good_worker = 0
-            idle_num = 0
-            now = time.time()
-
-            self._remove_life_end_workers()
+    def _maintain_workers(self):
+        # full scan of workers is slow when there are many workers,
+        # only do it once per maintain_interval, not on every task.
+        now = time.time()
+        if now - self.last_maintain_time < self.maintain_interval:
+            return
 
-            for worker in self.workers:
-                score = worker.get_score()
-                if top_score > score:
-                    top_score = score
+        self.last_maintain_time = now
+        self._remove_life_end_workers()
+        for shard in self.shards:
+            shard.worker_index.refresh()
+
+    def _get_best_worker(self, shard=None):
+        # shard is None: find the best worker in all shards.
+        # else find in the shard first, steal worker from other shards if the shard have no worker available.
+        min_idle_num = self.config.dispather_min_idle_workers
+        if shard is None or len(self.shards) == 1:
+            shards = self.shards
+        else:
+            shards = [shard] + [s for s in self.shards if s is not shard]
+
+        top_score = 99999999
+        best_score = 99999999
+        best_worker = None
+        idle_num = 0
+        for s in shards:
+            s_top_score, s_best_worker, s_best_score, s_idle_num = \
+                s.worker_index.get_best(max(0, min_idle_num - idle_num))
+            top_score = min(top_score, s_top_score)
+            idle_num += s_idle_num
+            if s_best_worker and (best_worker is None or (shard is None and s_best_score < best_score)):
+                best_score = s_best_score
+                best_worker = s_best_worker
+
+            if shard is not None and best_worker and idle_num >= min_idle_num:
+                break
 
-                if worker.is_life_end():
-                    self._debug_log("life end worker: %s", worker.ip_str)
-                    # self.close_cb(worker)
-                    continue
+        return top_score, best_worker, best_score, idle_num
 
-                good_worker += 1
+    def get_worker(self, nowait=False, shard=None):
+        # self._debug_log("start get_worker")
 
-                if not worker.accept_task:
-                    continue
+        while self.running:
+            now = time.time()
 
-                if worker.version == "1.1":
-                    idle_num += 1
-                else:
-                    if len(worker.streams) == 0:
-                        idle_num += 1
+            self._maintain_workers()
 
-                if best_score > score:
-                    best_score = score
-                    best_worker = worker
+            top_score, best_worker, best_score, idle_num = self._get_best_worker(shard)
+            good_worker = len(self.workers) - self.life_end_worker_num
 
             if good_worker < self.config.dispather_max_workers and \
                     (best_worker is None or
@@ -333,7 +495,8 @@ class HttpsDispatcher(object):
         host = utils.to_bytes(host)
         path = utils.to_bytes(path)
         headers = utils.to_bytes(headers)
-        body = utils.to_bytes(body)
+        if not hasattr(body, "buffer_list"):
+            body = utils.to_bytes(body)
 
         if self.task_count > self.config.max_task_num:
             self.logger.warn("task num exceed")
@@ -352,10 +515,11 @@ class HttpsDispatcher(object):
             self._debug_log("task start request %s" % url)
 
             self.last_request_time = time.time()
-            q = Queue()
+            # one response, wait with timeout on a condition, no polling.
+            q = simple_queue.Queue()
             task = http_common.Task(self.logger, self.config, method, host, path, headers, body, q, url, timeout)
             task.set_state("start_request")
-            self.request_queue.put(task)
+            self._put_task(task)
 
             try:
                 response = q.get(timeout=timeout)
@@ -421,15 +585,81 @@ class HttpsDispatcher(object):
 
         task.set_state("retry(%s)" % reason)
         task.retry_count += 1
-        self.request_queue.put(task)
+        self._put_task(task)
 
-    def dispatcher(self):
-        while self.running:
-            start_time = time.time()
+    def _put_task(self, task):
+        if len(self.shards) == 1:
+            self.request_queue.put(task)
+            return
+
+        # round robin, but skip the shard which is stalled by waiting worker.
+        shard_num = len(self.shards)
+        self.shard_pointer = (self.shard_pointer + 1) % shard_num
+        shard = self.shards[self.shard_pointer]
+        for s in self.shards:
+            if s.request_queue.qsize() < shard.request_queue.qsize():
+                shard = s
+        shard.request_queue.put(task)
+
+    def _steal_task(self, shard):
+        # take a task from the busiest other shard.
+        busiest = None
+        for s in self.shards:
+            if s is shard:
+                continue
+            if busiest is None or s.request_queue.qsize() > busiest.request_queue.qsize():
+                busiest = s
+
+        if busiest is None or not busiest.request_queue.qsize():
+            return None
+
+        try:
+            task = busiest.request_queue.get_nowait()
+        except queue.Empty:
+            return None
+
+        if task is None:
+            # exit notify for that shard, put it back.
+            busiest.request_queue.put(None)
+            return None
+
+        task.set_state("stolen_by_shard(%d)" % shard.shard_id)
+        return task
+
+    def _get_task(self, shard):
+        if shard is None:
             try:
-                task = self.request_queue.get()
+                return self.request_queue.get()
             except:
-                task = None
+                return None
+
+        while self.running:
+            try:
+                return shard.request_queue.get(timeout=self.steal_interval)
+            except queue.Empty:
+                pass
+
+            task = self._steal_task(shard)
+            if task:
+                return task
+
+    def _claim_worker(self, shard):
+        # the best worker may be stolen by other shards at the same time,
+        # http1 worker can only process one task, so claim it under lock.
+        while self.running:
+            worker = self.get_worker(shard=shard)
+            if worker is None or shard is None or worker.version != "1.1":
+                return worker
+
+            with self.claim_lock:
+                if worker.accept_task:
+                    worker.accept_task = False
+                    return worker
+
+    def dispatcher(self, shard=None):
+        while self.running:
+            start_time = time.time()
+            task = self._get_task(shard)
 
             if task is None:
                 # exit
@@ -440,7 +670,7 @@ class HttpsDispatcher(object):
 
             task.set_state("get_task(%d)" % get_cost)
             try:
-                worker = self.get_worker()
+                worker = self._claim_worker(shard)
             except Exception as e:
                 self.logger.warn("get worker fail:%r", e)
                 task.response_fail(reason="get worker fail:%r" % e)
@@ -511,7 +741,7 @@ class HttpsDispatcher(object):
 
     def close_cb(self, worker):
         try:
-            self.workers.remove(worker)
+            self._remove_worker(worker)
             if worker.version == "2":
                 self.h2_num -= 1
             else:
@@ -525,6 +755,8 @@ class HttpsDispatcher(object):
                 w.close(reason)
 
         self.workers = []
+        for shard in self.shards:
+            shard.worker_index.clear()
         self.h1_num = 0
         self.h2_num = 0
 
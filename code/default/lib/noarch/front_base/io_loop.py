@@ -0,0 +1,227 @@
+import ssl
+import time
+import socket
+import threading
+import collections
+
+import selectors2 as selectors
+
+
+# One selector thread drive the socket io of many workers.
+#
+# Handler(worker) interface, all called in the loop thread:
+#   io_fd: fileno, saved when added, socket may be closed before removed.
+#   loop_recv(): socket is readable.
+#   loop_send(): socket is writable, or want_write() was called.
+#   loop_check_timeout(now): called every second.
+#
+# Other threads only use add/remove/want_write/call_soon, they never touch the selector.
+
+
+def is_supported(ssl_sock):
+    # need non-blocking recv/send, only build in ssl module is supported.
+    # boringssl/pyopenssl connections still use the thread workers.
+    return isinstance(getattr(ssl_sock, "_connection", None), ssl.SSLSocket)
+
+
+class IoLoop(object):
+    def __init__(self, logger, name="io_loop"):
+        self.logger = logger
+        self.name = name
+        self.running = True
+        self.selector = selectors.DefaultSelector()
+        self.handlers = {}  # fd => handler
+        self.callbacks = collections.deque()
+        self.send_ready = collections.deque()
+        self.last_check_time = time.time()
+
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.wake_pending = False
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+
+        self.th = threading.Thread(target=self.loop, name=name)
+        self.th.daemon = True
+        self.th.start()
+
+    def in_loop(self):
+        return threading.current_thread() is self.th
+
+    def wake(self):
+        if self.wake_pending or self.in_loop():
+            return
+
+        self.wake_pending = True
+        try:
+            self.wake_w.send(b"w")
+        except (socket.error, OSError):
+            # buffer full, the loop will wake anyway.
+            pass
+
+    def call_soon(self, callback, *args):
+        self.callbacks.append((callback, args))
+        self.wake()
+
+    def add(self, handler):
+        # call after the worker is fully created.
+        handler.io_fd = handler.ssl_sock.fileno()
+        self.call_soon(self._add, handler)
+
+    def remove(self, handler):
+        if self.in_loop():
+            self._remove(handler)
+        else:
+            self.call_soon(self._remove, handler)
+
+    def want_write(self, handler):
+        # frames wait to send, flushed after the current events are processed.
+        # append before check the flag, loop clear the flag before send, so no frame is missed.
+        if handler.io_send_scheduled:
+            return
+
+        handler.io_send_scheduled = True
+        self.send_ready.append(handler)
+        self.wake()
+
+    def set_write_interest(self, handler, enable):
+        # in loop thread, when socket send buffer is full.
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if enable else selectors.EVENT_READ
+        if handler.io_events == events or handler.io_fd not in self.handlers:
+            return
+
+        handler.io_events = events
+        self.selector.modify(handler.io_fd, events, handler)
+
+    def _add(self, handler):
+        if not handler.keep_running:
+            return
+
+        try:
+            self.selector.register(handler.io_fd, handler.io_events, handler)
+        except Exception as e:
+            self.logger.warn("%s add %s fail:%r", self.name, handler.ip_str, e)
+            handler.close("io_loop add fail:%r" % e)
+            return
+
+        self.handlers[handler.io_fd] = handler
+        # data may be received during handshake and wait in ssl buffer.
+        self._call(handler, handler.loop_recv)
+        self._call(handler, handler.loop_send)
+
+    def _remove(self, handler):
+        if self.handlers.get(handler.io_fd) is not handler:
+            return
+
+        del self.handlers[handler.io_fd]
+        try:
+            self.selector.unregister(handler.io_fd)
+        except Exception:
+            pass
+
+    def _call(self, handler, fn, *args):
+        if not handler.keep_running:
+            return
+
+        try:
+            fn(*args)
+        except Exception as e:
+            self.logger.exception("%s %s %s except:%r", self.name, handler.ip_str, fn.__name__, e)
+            handler.close("io_loop except:%r" % e)
+
+    def stop(self):
+        self.running = False
+        self.wake()
+
+    def loop(self):
+        while self.running:
+            try:
+                events = self.selector.select(timeout=1)
+            except Exception as e:
+                # socket closed before removed, select() on some platform fail.
+                self.logger.warn("%s select fail:%r", self.name, e)
+                for handler in list(self.handlers.values()):
+                    if not handler.keep_running:
+                        self._remove(handler)
+                time.sleep(0.01)
+                events = []
+
+            for key, mask in events:
+                handler = key.data
+                if handler is None:
+                    # drain before clear the flag, or a wake between them is lost.
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except (socket.error, OSError):
+                        pass
+                    self.wake_pending = False
+                    continue
+
+                if mask & selectors.EVENT_READ:
+                    self._call(handler, handler.loop_recv)
+                if mask & selectors.EVENT_WRITE:
+                    self._call(handler, handler.loop_send)
+
+            while self.callbacks:
+                callback, args = self.callbacks.popleft()
+                try:
+                    callback(*args)
+                except Exception as e:
+                    self.logger.exception("%s callback %r except:%r", self.name, callback, e)
+
+            while self.send_ready:
+                handler = self.send_ready.popleft()
+                handler.io_send_scheduled = False
+                # handler not added yet is sent by _add.
+                if self.handlers.get(handler.io_fd) is handler:
+                    self._call(handler, handler.loop_send)
+
+            now = time.time()
+            if now - self.last_check_time > 1:
+                self.last_check_time = now
+                for handler in list(self.handlers.values()):
+                    self._call(handler, handler.loop_check_timeout, now)
+
+        for handler in list(self.handlers.values()):
+            self._remove(handler)
+        self.selector.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+
+class IoLoopPool(object):
+    # a small fixed number of loops for a front, workers are put to loops by round robin.
+    def __init__(self, logger, num, name="io_loop"):
+        self.loops = [IoLoop(logger, "%s_%d" % (name, i)) for i in range(num)]
+        self.pointer = 0
+
+    def get(self):
+        self.pointer = (self.pointer + 1) % len(self.loops)
+        return self.loops[self.pointer]
+
+    def stop(self):
+        for loop in self.loops:
+            loop.stop()
+
+
+class LoopSendQueue(object):
+    # replace the send_queue of the thread worker, put() only wake the loop.
+    def __init__(self, io_loop, handler):
+        self.io_loop = io_loop
+        self.handler = handler
+        self.frames = collections.deque()
+
+        handler.io_fd = None
+        handler.io_events = selectors.EVENT_READ
+        handler.io_send_scheduled = False
+
+    def put(self, frame):
+        self.frames.append(frame)
+        self.io_loop.want_write(self.handler)
+
+    def get(self):
+        return self.frames.popleft()
+
+    def _qsize(self):
+        return len(self.frames)
@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 import json
 from six.moves import queue
-import operator
 import os
 import threading
 import time
@@ -11,6 +10,8 @@ import random
 import six
 
 import utils
+from sortedcontainers import SortedListWithKey
+from .ip_store import IpStore
 
 
 class IpManagerBase():
@@ -26,6 +27,10 @@ class IpManagerBase():
         self.ip_str_states = {}  # will not save state to disk
 
         self.speed_fn = speed_fn
+        self.speed_store = None
+        self.changed_speed_ips = set()
+        if speed_fn and self.config.ip_store_binary:
+            self.speed_store = IpStore(logger, os.path.splitext(speed_fn)[0] + ".bin", "<ddd")
         self.ip_str_info = self.load_ip_str_info()  # will save info to disk.
         self.ip_str_info_last_save_time = time.time()
         self.default_info = {
@@ -41,6 +46,15 @@ class IpManagerBase():
         return o
 
     def load_ip_str_info(self):
+        if self.speed_store and self.speed_store.exists():
+            ip_values = self.speed_store.load()
+            if ip_values is not None:
+                ip_str_info = {}
+                for ip_str, (score, rtt, speed) in ip_values.items():
+                    ip_str_info[ip_str] = {"score": score, "rtt": rtt, "speed": speed}
+                return ip_str_info
+            # broken store, load from json file again.
+
         if not self.speed_fn or not os.path.isfile(self.speed_fn):
             return {}
 
@@ -51,6 +65,12 @@ class IpManagerBase():
             for ip_str, info in ip_str_info.items():
                 if "rtt" not in info:
                     return {}
+
+            if self.speed_store:
+                # migrate from json file.
+                self.speed_store.save_all({
+                    ip_str: (info["score"], info["rtt"], info["speed"]) for ip_str, info in ip_str_info.items()
+                })
             return ip_str_info
         except Exception as e:
             self.logger.exception("load speed info %s failed:%r", self.speed_fn, e)
@@ -60,6 +80,17 @@ class IpManagerBase():
         if not self.speed_fn:
             return
 
+        if self.speed_store:
+            # only write the changed ip.
+            changed_ips, self.changed_speed_ips = self.changed_speed_ips, set()
+            changes = {}
+            for ip_str in changed_ips:
+                info = self.ip_str_info.get(ip_str)
+                if info:
+                    changes[ip_str] = (info["score"], info["rtt"], info["speed"])
+            self.speed_store.update(changes)
+            return
+
         try:
             with open(self.speed_fn, "w") as fd:
                 json.dump(self.ip_str_info, fd, indent=2)
@@ -118,6 +149,7 @@ class IpManagerBase():
         all_traffic_cost = sum(state["traffic_cost_history"]) + virtual_traffic_cost
         speed = all_traffic / all_traffic_cost
         info["speed"] = speed
+        self.changed_speed_ips.add(ip_str)
 
         state["speed_history"].append(speed)
         if len(state["speed_history"]) > self.config.http_query_history_size:
@@ -137,6 +169,7 @@ class IpManagerBase():
 
         info = self._get_info(ip_str)
         info["score"] = score
+        self.changed_speed_ips.add(ip_str)
 
         state["score_history"].append(score)
         if len(state["score_history"]) > self.config.http_query_history_size:
@@ -161,7 +194,7 @@ class IpManagerBase():
             return ""
         return random.choice(self.ips)
 
-    def update_ip(self, ip_str, sni, handshake_time):
+    def update_ip(self, ip_str, sni, handshake_time, resumed=False):
         pass
 
     def report_connect_fail(self, ip_str, sni=None, reason="", force_remove=True):
@@ -218,6 +251,10 @@ class IpManager(IpManagerBase):
 
         self.default_ip_list_fn = default_ip_list_fn
         self.ip_list_fn = ip_list_fn
+        self.ip_store = None
+        if ip_list_fn and config.ip_store_binary:
+            # domain, server, handshake_time, fail_times, down_fail
+            self.ip_store = IpStore(logger, os.path.splitext(ip_list_fn)[0] + ".bin", "<64p16pIII")
 
         self.scan_thread_lock = threading.Lock()
         self.ip_lock = threading.Lock()
@@ -266,8 +303,15 @@ class IpManager(IpManagerBase):
 
         self.ip_dict = {}
 
-        # gererate from ip_dict, sort by handshake_time, when get_batch_ip
-        self.ip_list = []
+        # ip_str changed or removed since last save, for incremental save to ip_store.
+        self.changed_ips = set()
+
+        # ip_str => rate when put in ip_list, the sort key of ip_list.
+        self.ip_rank = {}
+
+        # gererate from ip_dict, sort by _ip_rate.
+        # updated on every change of ip_dict by _ip_changed, no need to sort periodically.
+        self.ip_list = SortedListWithKey(key=self._rank_key)
         self.to_check_ip_queue = queue.Queue()
         self.scan_exist_ip_queue = queue.Queue()
         self.ip_lock.release()
@@ -294,6 +338,21 @@ class IpManager(IpManagerBase):
         self.record_ip_history = self.config.record_ip_history
 
     def load_ip(self):
+        if self.ip_store and self.ip_store.exists():
+            ip_values = self.ip_store.load()
+            # None for broken store, load from text file and rewrite it.
+            if ip_values:
+                for ip_str, (domain, server, handshake_time, fail_times, down_fail) in ip_values.items():
+                    self.add_ip(ip_str, handshake_time, utils.to_str(domain), utils.to_str(server),
+                                fail_times, down_fail, False)
+                self.changed_ips.clear()
+                self.logger.info("load ip_store %s num:%d, target num:%d",
+                                 self.ip_store.fn, len(self.ip_dict), len(self.ip_list))
+                self.try_sort_ip(force=True)
+                if self.ip_store.need_compact():
+                    self.save(force=True, full=True)
+                return
+
         for file_path in [self.ip_list_fn, self.default_ip_list_fn]:
             if not file_path or not os.path.isfile(file_path):
                 continue
@@ -336,17 +395,45 @@ class IpManager(IpManagerBase):
                 except Exception as e:
                     self.logger.exception("load_ip line:%s err:%s", line, e)
 
+            # with shuffle_ip_on_first_load, the random handshake_time make ip_list in random order.
             self.logger.info("load ip_list %s num:%d, target num:%d", file_path, len(self.ip_dict), len(self.ip_list))
-            if file_path == self.default_ip_list_fn and self.config.shuffle_ip_on_first_load:
-                # self.logger.debug("first load, shuffle all ip")
-                random.shuffle(self.ip_list)
-                # self.logger.debug("ip:%s",self.ip_list)
-            else:
-                self.try_sort_ip(force=True)
+            self.try_sort_ip(force=True)
 
+            if self.ip_store:
+                # migrate from text file
+                self.save(force=True, full=True)
             return
 
-    def save(self, force=False):
+    def _ip_store_values(self, ip_str):
+        property = self.ip_dict[ip_str]
+        return (utils.to_bytes(property['domain'] or ""),
+                utils.to_bytes(property['server'] or ""),
+                property['handshake_time'],
+                property['fail_times'],
+                property['down_fail'])
+
+    def _save_ip_store(self, full=False):
+        # only hold ip_lock to copy the changed ip, file write is outside of the lock.
+        with self.ip_lock:
+            if full:
+                self.changed_ips.clear()
+                ip_values = {ip_str: self._ip_store_values(ip_str) for ip_str in self.ip_dict}
+            else:
+                changed_ips, self.changed_ips = self.changed_ips, set()
+                changes = {}
+                for ip_str in changed_ips:
+                    if ip_str in self.ip_dict:
+                        changes[ip_str] = self._ip_store_values(ip_str)
+                    else:
+                        changes[ip_str] = None
+            self.iplist_need_save = False
+
+        if full:
+            self.ip_store.save_all(ip_values)
+        else:
+            self.ip_store.update(changes)
+
+    def save(self, force=False, full=False):
         if not force:
             if not self.iplist_need_save:
                 return
@@ -355,6 +442,13 @@ class IpManager(IpManagerBase):
 
         self.iplist_saved_time = time.time()
 
+        if self.ip_store:
+            try:
+                self._save_ip_store(full)
+            except Exception as e:
+                self.logger.error("save %s fail %s", self.ip_store.fn, e)
+            return
+
         try:
             self.ip_lock.acquire()
             ip_dict = sorted(list(self.ip_dict.items()),
@@ -387,41 +481,69 @@ class IpManager(IpManagerBase):
             self.good_ipv6_num += num
         self.good_ip_num += num
 
-    def try_sort_ip(self, force=False):
-        if time.time() - self.last_sort_time < 10 and not force:
-            return
+    def _rank_key(self, ip_str):
+        return self.ip_rank[ip_str], ip_str
 
-        self.ip_lock.acquire()
-        self.last_sort_time = time.time()
-        try:
-            self.good_ip_num = 0
-            self.good_ipv4_num = 0
-            self.good_ipv6_num = 0
-            ip_rate = {}
-            for ip_str in self.ip_dict:
-                if "." in ip_str and self.config.use_ipv6 == "force_ipv6":
-                    continue
+    def _is_rank_ip(self, ip_str, ip_info):
+        if "." in ip_str and self.config.use_ipv6 == "force_ipv6":
+            return False
 
-                if not "." in ip_str and self.config.use_ipv6 == "force_ipv4":
-                    continue
+        if not "." in ip_str and self.config.use_ipv6 == "force_ipv4":
+            return False
 
-                if 'gws' not in self.ip_dict[ip_str]['server']:
-                    continue
-                ip_rate[ip_str] = self._ip_rate(self.ip_dict[ip_str])
-                if self.ip_dict[ip_str]['fail_times'] == 0:
-                    self._add_ip_num(ip_str, 1)
+        return 'gws' in ip_info['server']
 
-            ip_time = sorted(list(ip_rate.items()), key=operator.itemgetter(1))
-            self.ip_list = [ip_str for ip_str, rate in ip_time]
+    def _ip_changed(self, ip_str):
+        # call with ip_lock after ip_dict[ip_str] is changed or removed.
+        self.changed_ips.add(ip_str)
+        self._update_rank(ip_str)
 
-        except Exception as e:
-            self.logger.error("try_sort_ip_by_handshake_time:%s", e)
-        finally:
-            self.ip_lock.release()
+    def _update_rank(self, ip_str):
+        # keep ip_list sorted, O(log n)
+        ip_info = self.ip_dict.get(ip_str)
+        if ip_info and self._is_rank_ip(ip_str, ip_info):
+            rate = self._ip_rate(ip_info)
+        else:
+            rate = None
+
+        if ip_str in self.ip_rank:
+            if rate == self.ip_rank[ip_str]:
+                return
+
+            self.ip_list.discard(ip_str)
+            del self.ip_rank[ip_str]
 
-        time_cost = ((time.time() - self.last_sort_time) * 1000)
-        if time_cost > 30:
-            self.logger.debug("sort ip time:%dms", time_cost)  # 5ms for 1000 ip. 70~150ms for 30000 ip.
+        if rate is not None:
+            self.ip_rank[ip_str] = rate
+            self.ip_list.add(ip_str)
+
+    def try_sort_ip(self, force=False):
+        # ip_list is kept sorted by _ip_changed,
+        # force rebuild all only when config like use_ipv6 changed.
+        if time.time() - self.last_sort_time < 10 and not force:
+            return
+
+        self.last_sort_time = time.time()
+        if force:
+            self.ip_lock.acquire()
+            try:
+                self.good_ip_num = 0
+                self.good_ipv4_num = 0
+                self.good_ipv6_num = 0
+                self.ip_rank = {}
+                self.ip_list.clear()
+                for ip_str in list(self.ip_dict.keys()):
+                    self._update_rank(ip_str)
+                    if ip_str in self.ip_rank and self.ip_dict[ip_str]['fail_times'] == 0:
+                        self._add_ip_num(ip_str, 1)
+            except Exception as e:
+                self.logger.error("try_sort_ip_by_handshake_time:%s", e)
+            finally:
+                self.ip_lock.release()
+
+            time_cost = ((time.time() - self.last_sort_time) * 1000)
+            if time_cost > 30:
+                self.logger.debug("sort ip time:%dms", time_cost)
 
         self.adjust_scan_thread_num()
 
@@ -596,6 +718,7 @@ class IpManager(IpManagerBase):
                     self.ip_dict[ip_str]['fail_time'] = 0
                     self._add_ip_num(ip_str, 1)
                 self.append_ip_history(ip_str, handshake_time)
+                self._ip_changed(ip_str)
                 return False
 
             self.iplist_need_save = True
@@ -617,10 +740,9 @@ class IpManager(IpManagerBase):
                                     "last_active": 0,
                                     }
 
+            self._ip_changed(ip_str)
             if 'gws' not in server:
                 return
-
-            self.ip_list.append(ip_str)
         except Exception as e:
             self.logger.exception("add_ip err:%s", e)
         finally:
@@ -628,13 +750,15 @@ class IpManager(IpManagerBase):
 
         return True
 
-    def update_ip(self, ip_str, sni, handshake_time):
+    def update_ip(self, ip_str, sni, handshake_time, resumed=False):
+        # resumed: TLS session resumed, handshake is faster than a full one,
+        #   only mark success, keep the rank by full handshake time.
         if not isinstance(ip_str, str):
             self.logger.error("update_ip input error:%s %s", ip_str, sni)
             return
 
         handshake_time = int(handshake_time)
-        if handshake_time < 5:  # that's impossible
+        if handshake_time < 5 and not resumed:  # that's impossible
             self.logger.warn("%s handshake:%d impossible", ip_str, 1000 * handshake_time)
             return
 
@@ -649,19 +773,21 @@ class IpManager(IpManagerBase):
                 # some times ip package lost cause handshake time become 2000ms
                 # this ip will not return back to good ip front until all become bad
                 # There for, prevent handshake time increase too quickly.
-                org_time = self.ip_dict[ip_str]['handshake_time']
-                if handshake_time - org_time > 500:
-                    self.ip_dict[ip_str]['handshake_time'] = org_time + 500
-                else:
-                    self.ip_dict[ip_str]['handshake_time'] = handshake_time
+                if not resumed:
+                    org_time = self.ip_dict[ip_str]['handshake_time']
+                    if handshake_time - org_time > 500:
+                        self.ip_dict[ip_str]['handshake_time'] = org_time + 500
+                    else:
+                        self.ip_dict[ip_str]['handshake_time'] = handshake_time
+                    self.append_ip_history(ip_str, handshake_time)
 
                 self.ip_dict[ip_str]['success_time'] = time_now
                 if self.ip_dict[ip_str]['fail_times'] > 0:
                     self._add_ip_num(ip_str, 1)
                 self.ip_dict[ip_str]['fail_times'] = 0
-                self.append_ip_history(ip_str, handshake_time)
                 self.ip_dict[ip_str]["fail_time"] = 0
 
+                self._ip_changed(ip_str)
                 self.iplist_need_save = True
 
             # self.logger.debug("update ip:%s not exist", ip)
@@ -686,9 +812,7 @@ class IpManager(IpManagerBase):
                 if self.ip_dict[ip]['fail_times'] == 0:
                     self._add_ip_num(ip, -1)
                 del self.ip_dict[ip]
-
-                if ip in self.ip_list:
-                    self.ip_list.remove(ip)
+                self._ip_changed(ip)
 
                 self.logger.info("remove ip:%s left amount:%d target_num:%d", ip, len(self.ip_dict),
                                  len(self.ip_list))
@@ -711,6 +835,7 @@ class IpManager(IpManagerBase):
             if self.ip_dict[ip]['fail_times'] == 0:
                 self._add_ip_num(ip, -1)
             self.ip_dict[ip]['fail_times'] += 1
+            self._ip_changed(ip)
             self.append_ip_history(ip, "fail")
             self.ip_dict[ip]["fail_time"] = time_now
 
@@ -747,6 +872,7 @@ class IpManager(IpManagerBase):
                 self._add_ip_num(ip, -1)
 
             self.ip_dict[ip]['down_fail'] += 1
+            self._ip_changed(ip)
             self.append_ip_history(ip, reason)
             self.ip_dict[ip]["down_fail_time"] = time_now
             self.logger.debug("report_connect_closed %s, reason:%s", ip, reason)
@@ -787,6 +913,7 @@ class IpManager(IpManagerBase):
                 try:
                     if self.ip_dict[ip_str]['fail_times']:
                         self.ip_dict[ip_str]['fail_times'] = 0
+                        self._ip_changed(ip_str)
                         self._add_ip_num(ip_str, 1)
                 except:
                     pass
@@ -804,8 +931,6 @@ class IpManager(IpManagerBase):
         if len(self.ip_list) <= self.max_good_ip_num:
             return
 
-        self.try_sort_ip(force=True)
-
         self.ip_lock.acquire()
         try:
             ip_num = len(self.ip_list)
@@ -821,9 +946,7 @@ class IpManager(IpManagerBase):
                 if fails == 0:
                     self._add_ip_num(ip_str, -1)
                 del self.ip_dict[ip_str]
-
-                if ip_str in self.ip_list:
-                    self.ip_list.remove(ip_str)
+                self._ip_changed(ip_str)
 
                 ip_num -= 1
 
@@ -1010,6 +1133,7 @@ class IpManager(IpManagerBase):
                         self._add_ip_num(ip_str, -1)
                     self.ip_dict[ip_str]['fail_times'] += 1
                     self.ip_dict[ip_str]["fail_time"] = time.time()
+                    self._ip_changed(ip_str)
                 finally:
                     self.ip_lock.release()
             elif result.ok:
@@ -1025,8 +1149,10 @@ class IpManager(IpManagerBase):
                 to_remove.append(ip_str)
                 self.logger.debug("ip_manager remove continue fail ip:%s", ip_str)
 
-        for ip_str in to_remove:
-            del self.ip_dict[ip_str]
+        with self.ip_lock:
+            for ip_str in to_remove:
+                del self.ip_dict[ip_str]
+                self._ip_changed(ip_str)
 
         self.try_sort_ip(True)
 
@@ -1035,9 +1161,11 @@ class IpManager(IpManagerBase):
             if ip_str not in self.ip_dict:
                 self.add_ip(ip_str, scan_result=False)
 
-        for ip_str in list(self.ip_dict.keys()):
-            if ip_str not in ips:
-                del self.ip_dict[ip_str]
+        with self.ip_lock:
+            for ip_str in list(self.ip_dict.keys()):
+                if ip_str not in ips:
+                    del self.ip_dict[ip_str]
+                    self._ip_changed(ip_str)
 
         self.try_sort_ip(True)
 
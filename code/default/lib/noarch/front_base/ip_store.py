@@ -0,0 +1,204 @@
+import os
+import re
+import struct
+import threading
+
+
+class IpStore(object):
+    # Persistent ip_str => values table in a binary file with fixed size records.
+    #
+    # File layout:
+    #   header: magic(4) version(2) record_size(2)
+    #   records: used(1) ip_str(pascal string, 64) values(value_format)
+    #
+    # Every ip_str own a slot, update only rewrite the slot of the changed ip,
+    # removed slot is put to free list and reused by next new ip.
+    # So save don't need to sort or rewrite the whole ip list.
+    #
+    # Strings longer than the field size can't be stored, the ip is skipped.
+
+    magic = b"XXIP"
+    version = 1
+    header = struct.Struct("<4sHH")
+    key_format = "<B64p"
+
+    def __init__(self, logger, fn, value_format):
+        self.logger = logger
+        self.fn = fn
+        self.record = struct.Struct(self.key_format + value_format.lstrip("<"))
+        self.empty_record = b"\x00" * self.record.size
+        # max length of the string fields, (index in record, max len)
+        self.str_sizes = self._str_sizes(self.record.format)
+        self.lock = threading.Lock()
+        self.slots = {}  # ip_str => slot number
+        self.free_slots = []
+        self.slot_num = 0
+        self.fd = None
+
+    def exists(self):
+        return os.path.isfile(self.fn)
+
+    def load(self):
+        # return dict of ip_str => values tuple,
+        # None if the file is broken or format changed, file is reset to empty.
+        result = {}
+        with self.lock:
+            self._close()
+            self.slots = {}
+            self.free_slots = []
+            self.slot_num = 0
+
+            if not self.exists():
+                return result
+
+            try:
+                with open(self.fn, "rb") as fd:
+                    data = fd.read()
+
+                magic, version, record_size = self.header.unpack_from(data, 0)
+                if magic != self.magic or version != self.version or record_size != self.record.size:
+                    raise Exception("format not match")
+
+                body_len = (len(data) - self.header.size) // record_size * record_size
+                body = memoryview(data)[self.header.size:self.header.size + body_len]
+                for slot, record in enumerate(self.record.iter_unpack(body)):
+                    if not record[0]:
+                        self.free_slots.append(slot)
+                        continue
+
+                    ip_str = record[1].decode("ascii")
+                    self.slots[ip_str] = slot
+                    result[ip_str] = record[2:]
+                self.slot_num = body_len // record_size
+            except Exception as e:
+                self.logger.warn("load ip store %s fail:%r", self.fn, e)
+                self.slots = {}
+                self.free_slots = []
+                self.slot_num = 0
+                # don't let update write records after the stale header.
+                try:
+                    with open(self.fn, "wb") as fd:
+                        fd.write(self.header.pack(self.magic, self.version, self.record.size))
+                except Exception as e:
+                    self.logger.warn("reset ip store %s fail:%r", self.fn, e)
+                return None
+
+        return result
+
+    def save_all(self, ip_values):
+        # rewrite the whole file, used for migrate from old file and compact.
+        with self.lock:
+            self._close()
+            self.slots = {}
+            self.free_slots = []
+
+            tmp_fn = self.fn + ".tmp"
+            try:
+                with open(tmp_fn, "wb") as fd:
+                    fd.write(self.header.pack(self.magic, self.version, self.record.size))
+                    for ip_str, values in ip_values.items():
+                        dat = self._pack(ip_str, values)
+                        if dat is None:
+                            continue
+
+                        fd.write(dat)
+                        self.slots[ip_str] = len(self.slots)
+                self.slot_num = len(self.slots)
+                os.replace(tmp_fn, self.fn)
+            except Exception as e:
+                self.logger.warn("save ip store %s fail:%r", self.fn, e)
+                self.slots = {}
+                self.slot_num = 0
+
+    def update(self, changes):
+        # changes: ip_str => values tuple, or None for removed ip.
+        if not changes:
+            return
+
+        with self.lock:
+            try:
+                fd = self._open()
+                for ip_str, values in changes.items():
+                    dat = None
+                    if values is not None:
+                        dat = self._pack(ip_str, values)
+
+                    if dat is None:
+                        # removed, or can't be stored any more.
+                        slot = self.slots.pop(ip_str, None)
+                        if slot is None:
+                            continue
+
+                        self.free_slots.append(slot)
+                        dat = self.empty_record
+                    else:
+                        slot = self.slots.get(ip_str)
+                        if slot is None:
+                            if self.free_slots:
+                                slot = self.free_slots.pop()
+                            else:
+                                slot = self.slot_num
+                                self.slot_num += 1
+                            self.slots[ip_str] = slot
+
+                    fd.seek(self.header.size + slot * self.record.size)
+                    fd.write(dat)
+                fd.flush()
+            except Exception as e:
+                self.logger.warn("update ip store %s fail:%r", self.fn, e)
+                self._close()
+
+    def need_compact(self):
+        return len(self.free_slots) > 100 and len(self.free_slots) > len(self.slots)
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    @staticmethod
+    def _str_sizes(fmt):
+        sizes = []
+        index = 0
+        for count, code in re.findall(r"(\d*)([a-zA-Z?])", fmt):
+            count = int(count) if count else 1
+            if code == "x":
+                continue
+            elif code in "ps":
+                # pascal string keep one byte for the length.
+                sizes.append((index, count - 1 if code == "p" else count))
+                index += 1
+            else:
+                index += count
+        return sizes
+
+    def _pack(self, ip_str, values):
+        # return None if some string is too long, struct would truncate it silently.
+        record = (1, ip_str.encode("ascii")) + tuple(values)
+        for index, max_len in self.str_sizes:
+            if len(record[index]) > max_len:
+                self.logger.warn("ip store %s skip %s, value too long:%r", self.fn, ip_str, record[index])
+                return None
+
+        return self.record.pack(*record)
+
+    def _open(self):
+        if self.fd:
+            return self.fd
+
+        if not self.exists():
+            with open(self.fn, "wb") as fd:
+                fd.write(self.header.pack(self.magic, self.version, self.record.size))
+            self.slots = {}
+            self.free_slots = []
+            self.slot_num = 0
+
+        self.fd = open(self.fn, "r+b")
+        return self.fd
+
+    def _close(self):
+        if self.fd:
+            try:
+                self.fd.close()
+            except:
+                pass
+            self.fd = None
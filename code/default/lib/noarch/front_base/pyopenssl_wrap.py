@@ -20,13 +20,17 @@ import utils
 
 
 class SSLConnection(object):
-    def __init__(self, context, sock, ip_str=None, sni=None, on_close=None):
+    support_session = True
+
+    def __init__(self, context, sock, ip_str=None, sni=None, on_close=None, session=None, session_cb=None):
         self._context = context
         self._sock = sock
         self.ip_str = ip_str
         self.sni = sni
         self._makefile_refs = 0
         self._on_close = on_close
+        self._session = session
+        self._session_cb = session_cb
         self.peer_cert = None
         self.socket_closed = False
         self.timeout = self._sock.gettimeout() or 0.1
@@ -48,10 +52,13 @@ class SSLConnection(object):
                 raise socket.error('conn %s fail, sni:%s, e:%r' % (self.ip_str, self.sni, e))
 
             self._connection = self._context.wrap_socket(self._sock, server_hostname=self.sni,
-                                                         do_handshake_on_connect=False)
+                                                         do_handshake_on_connect=False,
+                                                         session=self._session)
         else:
             self._connection = OpenSSL.SSL.Connection(self._context, self._sock)
             self._connection.set_connect_state()
+            if self._session:
+                self._connection.set_session(self._session)
             if self.sni:
                 try:
                     self._connection.set_tlsext_host_name(self.sni)
@@ -65,6 +72,32 @@ class SSLConnection(object):
         else:
             return self._connection.get_alpn_proto_negotiated()
 
+    def is_session_reused(self):
+        if sys.version_info[0] == 3:
+            return self._connection.session_reused
+        else:
+            # pyOpenSSL don't export SSL_session_reused, count as full handshake.
+            return False
+
+    def get_session(self):
+        try:
+            if sys.version_info[0] == 3:
+                session = self._connection.session
+                if session and (session.has_ticket or session.id):
+                    return session
+                return None
+            else:
+                return self._connection.get_session()
+        except Exception:
+            return None
+
+    def save_session(self):
+        if not self._session_cb:
+            return
+
+        session_cb, self._session_cb = self._session_cb, None
+        session_cb(self.ip_str, self.sni, self.get_session())
+
     def __getattr__(self, attr):
         if attr == "socket_closed":
             # work around in case close before finished init.
@@ -263,6 +296,7 @@ class SSLConnection(object):
             if not self.socket_closed:
                 socket.socket.close(self._sock)
                 self.socket_closed = True
+                self.save_session()
                 if self._on_close:
                     self._on_close(self.ip_str, self.sni, reason=reason)
                     self._on_close = None
@@ -0,0 +1,71 @@
+import time
+import threading
+import collections
+
+
+# Keep the last TLS session of every (ip_str, sni),
+# next connection to the same ip/sni can resume it and skip the cert exchange.
+# session objects are opaque, they come from SSLConnection.get_session() of the openssl_wrap implementation.
+
+class TlsSessionCache(object):
+    def __init__(self, ttl=3600, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()  # (ip_str, sni) => (session, expire_time)
+
+        self.hit_num = 0
+        self.miss_num = 0
+        self.full_handshake_num = 0
+        self.resumed_handshake_num = 0
+
+    def get(self, ip_str, sni):
+        key = (ip_str, sni)
+        with self.lock:
+            item = self.cache.get(key)
+            if not item:
+                self.miss_num += 1
+                return None
+
+            session, expire_time = item
+            if time.time() > expire_time:
+                del self.cache[key]
+                self.miss_num += 1
+                return None
+
+            self.cache.move_to_end(key)
+            self.hit_num += 1
+            return session
+
+    def put(self, ip_str, sni, session):
+        if not session:
+            return
+
+        key = (ip_str, sni)
+        with self.lock:
+            self.cache[key] = (session, time.time() + self.ttl)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def remove(self, ip_str, sni):
+        # session rejected or connection failed, don't try it again.
+        with self.lock:
+            self.cache.pop((ip_str, sni), None)
+
+    def report_handshake(self, resumed):
+        with self.lock:
+            if resumed:
+                self.resumed_handshake_num += 1
+            else:
+                self.full_handshake_num += 1
+
+    def status(self):
+        with self.lock:
+            return {
+                "size": len(self.cache),
+                "hit": self.hit_num,
+                "miss": self.miss_num,
+                "full_handshake": self.full_handshake_num,
+                "resumed_handshake": self.resumed_handshake_num,
+            }
@@ -14,13 +14,17 @@ import utils
 
 
 class SSLConnection(object):
-    def __init__(self, context, sock, ip_str=None, sni=None, on_close=None):
+    support_session = True
+
+    def __init__(self, context, sock, ip_str=None, sni=None, on_close=None, session=None, session_cb=None):
         self._context = context
         self._sock = sock
         self.ip_str = utils.to_bytes(ip_str)
         self.sni = sni
         self._makefile_refs = 0
         self._on_close = on_close
+        self._session = session
+        self._session_cb = session_cb
         self.peer_cert = None
         self.socket_closed = False
         self.timeout = self._sock.gettimeout() or 0.1
@@ -49,6 +53,22 @@ class SSLConnection(object):
     def setblocking(self, block):
         self._sock.setblocking(block)
 
+    def is_session_reused(self):
+        return self._connection.resumed
+
+    def get_session(self):
+        session = self._connection.session
+        if session and session.valid():
+            return session
+        return None
+
+    def save_session(self):
+        if not self._session_cb:
+            return
+
+        session_cb, self._session_cb = self._session_cb, None
+        session_cb(utils.to_str(self.ip_str), self.sni, self.get_session())
+
     def __getattr__(self, attr):
         if attr == "socket_closed":
             # work around in case close before finished init.
@@ -95,7 +115,7 @@ class SSLConnection(object):
     def do_handshake(self):
         cert_chain = None
         privateKey = None
-        self._connection.handshakeClientCert(cert_chain, privateKey, None,
+        self._connection.handshakeClientCert(cert_chain, privateKey, self._session,
             self._context.settings, None, None, None, self.sni, False, self._context.alpn)
 
     def connect(self, *args, **kwargs):
@@ -133,6 +153,7 @@ class SSLConnection(object):
             if not self.socket_closed:
                 socket.socket.close(self._sock)
                 self.socket_closed = True
+                self.save_session()
                 if self._on_close:
                     self._on_close(self.ip_str, self.sni, reason=reason)
         else:
@@ -0,0 +1,95 @@
+import socket
+import struct
+import bisect
+
+
+# Check if an ip is in a list of CIDR or ranges.
+#
+# Ranges are merged and sorted when built, lookup is a bisect on the integer of the ip, O(log n).
+# IPv4 and IPv6 are kept in separate lists.
+#
+#   index = IpPrefixIndex(["10.0.0.0/8", "fc00::/7"])
+#   index.add_range("127.0.0.0", "127.255.255.255")
+#   index.build()
+#   "10.1.2.3" in index
+
+
+def ip_to_num(ip):
+    # return (is_ipv6, number), raise socket.error/ValueError if not a valid ip.
+    if isinstance(ip, bytes):
+        ip = ip.decode("ascii")
+
+    if ":" in ip:
+        hi, lo = struct.unpack("!QQ", socket.inet_pton(socket.AF_INET6, ip))
+        return True, hi << 64 | lo
+    else:
+        return False, struct.unpack("!I", socket.inet_pton(socket.AF_INET, ip))[0]
+
+
+class IpPrefixIndex(object):
+    def __init__(self, cidrs=()):
+        self.ranges = ([], [])  # ipv4, ipv6 list of (begin, end) before build
+        self.begins = ([], [])
+        self.ends = ([], [])
+
+        for cidr in cidrs:
+            self.add_cidr(cidr)
+        self.build()
+
+    def add_cidr(self, cidr):
+        if isinstance(cidr, bytes):
+            cidr = cidr.decode("ascii")
+
+        ip, _, bits = cidr.strip().partition("/")
+        ipv6, num = ip_to_num(ip)
+        total_bits = 128 if ipv6 else 32
+        bits = int(bits) if bits else total_bits
+        if not 0 <= bits <= total_bits:
+            raise ValueError("cidr %s not valid" % cidr)
+
+        host_mask = (1 << (total_bits - bits)) - 1
+        begin = num & ~host_mask
+        self.ranges[ipv6].append((begin, begin | host_mask))
+
+    def add_range(self, begin, end):
+        ipv6, nbegin = ip_to_num(begin)
+        end_ipv6, nend = ip_to_num(end)
+        if ipv6 != end_ipv6 or nend < nbegin:
+            raise ValueError("range %s - %s not valid" % (begin, end))
+
+        self.ranges[ipv6].append((nbegin, nend))
+
+    def build(self):
+        # merge added ranges into sorted, non overlapped lists.
+        for ipv6 in (False, True):
+            ranges = sorted(self.ranges[ipv6] + list(zip(self.begins[ipv6], self.ends[ipv6])))
+            begins = []
+            ends = []
+            for begin, end in ranges:
+                if ends and begin <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    begins.append(begin)
+                    ends.append(end)
+
+            self.begins[ipv6][:] = begins
+            self.ends[ipv6][:] = ends
+            del self.ranges[ipv6][:]
+
+    def contains_num(self, num, ipv6=False):
+        begins = self.begins[ipv6]
+        i = bisect.bisect_right(begins, num) - 1
+        return i >= 0 and num <= self.ends[ipv6][i]
+
+    def contains(self, ip):
+        try:
+            ipv6, num = ip_to_num(ip)
+        except (socket.error, ValueError, UnicodeError, TypeError):
+            return False
+        return self.contains_num(num, ipv6)
+
+    def __contains__(self, ip):
+        return self.contains(ip)
+
+    def __len__(self):
+        return len(self.begins[0]) + len(self.begins[1])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Throughput of every supported method, per message like x_tunnel encrypt_data/decrypt_data.
+#   Encryptor: create a new Encryptor for every message.
+#   CipherContext: cached key and cipher, reset iv for every message.
+#
+# Usage: python bench.py [--size 1024 65536] [--total 4] [--methods aes-256-cfb rc4-md5]
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+noarch_lib = os.path.abspath(os.path.join(current_path, os.pardir))
+sys.path.append(noarch_lib)
+
+import encrypt
+
+
+def bench_encryptor(password, method, messages):
+    start = time.time()
+    for data in messages:
+        cipher_text = encrypt.Encryptor(password, method).encrypt(data)
+        encrypt.Encryptor(password, method).decrypt(memoryview(cipher_text).tobytes())
+    return time.time() - start
+
+
+def bench_context(password, method, messages):
+    start = time.time()
+    for data in messages:
+        ctx = encrypt.get_cipher_context(password, method)
+        cipher_text = ctx.encrypt(data)
+        ctx.decrypt(memoryview(cipher_text))
+    return time.time() - start
+
+
+def bench_threads(fn, password, method, messages, thread_num):
+    threads = [threading.Thread(target=fn, args=(password, method, messages)) for _ in range(thread_num)]
+    start = time.time()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return time.time() - start
+
+
+def check(password, method):
+    data = os.urandom(1000)
+    ctx = encrypt.get_cipher_context(password, method)
+    if bytes(ctx.decrypt(encrypt.Encryptor(password, method).encrypt(data))) != data:
+        raise Exception("decrypt Encryptor data fail")
+    if encrypt.Encryptor(password, method).decrypt(bytes(ctx.encrypt(data))) != data:
+        raise Exception("decrypt CipherContext data fail")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="encrypt method throughput")
+    parser.add_argument("--size", type=int, nargs="+", default=[1024, 64 * 1024])
+    parser.add_argument("--total", type=int, default=4, help="MB per test")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--methods", nargs="+", default=None)
+    args = parser.parse_args()
+
+    password = "encrypt_pass"
+    methods = args.methods or sorted(m.decode() for m in encrypt.method_supported)
+    for method in methods:
+        try:
+            check(password, method)
+        except BaseException as e:
+            print("%s: not available, %r" % (method, e))
+            continue
+
+        for size in args.size:
+            num = max(1, args.total * 1024 * 1024 // size)
+            messages = [os.urandom(size)] * num
+            traffic = 2.0 * size * num / 1024 / 1024
+
+            t1 = bench_encryptor(password, method, messages)
+            t2 = bench_context(password, method, messages)
+            t3 = bench_threads(bench_context, password, method, messages, args.threads)
+            print("%s size:%d  Encryptor:%.1fMB/s  CipherContext:%.1fMB/s  %d threads:%.1fMB/s" % (
+                method, size, traffic / t1, traffic / t2, args.threads, traffic * args.threads / t3))
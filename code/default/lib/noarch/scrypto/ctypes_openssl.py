@@ -23,19 +23,20 @@
 
 
 import xlog
-from ctypes import CDLL, c_char_p, c_int, c_long, byref,\
+from ctypes import CDLL, c_char_p, c_char, c_int, c_long, byref,\
     create_string_buffer, c_void_p
 
 __all__ = ['ciphers']
 
 libcrypto = None
+ctx_reset = None
 loaded = False
 
 buf_size = 2048
 
 
 def load_openssl():
-    global loaded, libcrypto, buf
+    global loaded, libcrypto, ctx_reset
 
     from ctypes.util import find_library
     for p in ('crypto', 'eay32', 'libeay32'):
@@ -55,12 +56,14 @@ def load_openssl():
     libcrypto.EVP_CipherUpdate.argtypes = (c_void_p, c_void_p, c_void_p,
                                            c_char_p, c_int)
 
-    libcrypto.EVP_CIPHER_CTX_cleanup.argtypes = (c_void_p,)
+    # EVP_CIPHER_CTX_cleanup is renamed to EVP_CIPHER_CTX_reset since OpenSSL 1.1
+    ctx_reset = getattr(libcrypto, 'EVP_CIPHER_CTX_reset', None) or \
+        libcrypto.EVP_CIPHER_CTX_cleanup
+    ctx_reset.argtypes = (c_void_p,)
     libcrypto.EVP_CIPHER_CTX_free.argtypes = (c_void_p,)
     if hasattr(libcrypto, 'OpenSSL_add_all_ciphers'):
         libcrypto.OpenSSL_add_all_ciphers()
 
-    buf = create_string_buffer(buf_size)
     loaded = True
 
 
@@ -77,14 +80,18 @@ def load_cipher(cipher_name):
 
 class CtypesCrypto(object):
     def __init__(self, cipher_name, key, iv, op):
+        self._ctx = None
         if not loaded:
             load_openssl()
-        self._ctx = None
         cipher = libcrypto.EVP_get_cipherbyname(cipher_name)
         if not cipher:
             cipher = load_cipher(cipher_name)
         if not cipher:
             raise Exception('cipher %s not found in libcrypto' % cipher_name)
+        self._key = key
+        # every cipher own its output buffer, a shared one is overwritten by other threads.
+        self._buf_size = buf_size
+        self._buf = create_string_buffer(self._buf_size)
         key_ptr = c_char_p(key)
         iv_ptr = c_char_p(iv)
         self._ctx = libcrypto.EVP_CIPHER_CTX_new()
@@ -96,25 +103,52 @@ class CtypesCrypto(object):
             self.clean()
             raise Exception('can not initialize cipher context')
 
+    def reset(self, iv):
+        # start a new message with the same key and op, reuse the context.
+        # key is set again, rc4 don't use iv and restart only on new key.
+        r = libcrypto.EVP_CipherInit_ex(self._ctx, None, None,
+                                        c_char_p(self._key), c_char_p(iv), c_int(-1))
+        if not r:
+            raise Exception('can not reset cipher context')
+
     def update(self, data):
-        global buf_size, buf
         cipher_out_len = c_long(0)
         l = len(data)
-        if buf_size < l:
-            buf_size = l * 2
-            buf = create_string_buffer(buf_size)
-        libcrypto.EVP_CipherUpdate(self._ctx, byref(buf),
+        if self._buf_size < l:
+            self._buf_size = l * 2
+            self._buf = create_string_buffer(self._buf_size)
+        libcrypto.EVP_CipherUpdate(self._ctx, byref(self._buf),
                                    byref(cipher_out_len), c_char_p(data), l)
         # buf is copied to a str object when we access buf.raw
-        return buf.raw[:cipher_out_len.value]
+        return self._buf.raw[:cipher_out_len.value]
+
+    def update_into(self, data, out):
+        # write result to out(bytearray or writable memoryview), no copy.
+        # data can be bytes, bytearray or memoryview.
+        l = len(data)
+        if not l:
+            return 0
+
+        if isinstance(data, bytes):
+            data_ptr = data
+        elif isinstance(data, memoryview) and data.readonly:
+            data_ptr = data.tobytes()
+        else:
+            data_ptr = (c_char * l).from_buffer(data)
+
+        cipher_out_len = c_long(0)
+        libcrypto.EVP_CipherUpdate(self._ctx, (c_char * l).from_buffer(out),
+                                   byref(cipher_out_len), data_ptr, l)
+        return cipher_out_len.value
 
     def __del__(self):
         self.clean()
 
     def clean(self):
         if self._ctx:
-            libcrypto.EVP_CIPHER_CTX_cleanup(self._ctx)
+            ctx_reset(self._ctx)
             libcrypto.EVP_CIPHER_CTX_free(self._ctx)
+            self._ctx = None
 
 
 ciphers = {
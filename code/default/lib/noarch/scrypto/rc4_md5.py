@@ -36,7 +36,7 @@ def create_cipher(alg, key, iv, op, key_as_bytes=0, d=None, salt=None,
     rc4_key = md5.digest()
 
     try:
-        from crypto import ctypes_openssl
+        from . import ctypes_openssl
         return ctypes_openssl.CtypesCrypto(b'rc4', rc4_key, b'', op)
     except:
         import M2Crypto.EVP
@@ -366,9 +366,12 @@ class Response(BaseResponse):
 
 
 class Client(object):
-    def __init__(self, proxy=None, timeout=60, cert=""):
+    def __init__(self, proxy=None, timeout=60, cert="", verify_tls=False):
         self.timeout = timeout
         self.cert = cert
+        # always wrap https and verify against system CAs (and cert if given),
+        # otherwise https is only wrapped when cert file exist.
+        self.verify_tls = verify_tls
         self.sock = None
         self.host = None
         self.port = None
@@ -459,10 +462,16 @@ class Client(object):
         if tls:
             if not self.ssl_context:
                 self.ssl_context = ssl.create_default_context()
-                self.ssl_context.check_hostname = False
+                # the cert must be for the host of the url, ip literal is matched with the IP SANs.
+                self.ssl_context.check_hostname = bool(self.verify_tls)
                 self.ssl_context.verify_mode = ssl.CERT_REQUIRED
 
-            if os.path.isfile(self.cert):
+                if self.verify_tls and os.path.isfile(self.cert):
+                    self.ssl_context.load_verify_locations(self.cert)
+
+            if self.verify_tls:
+                sock = self.ssl_context.wrap_socket(sock, server_hostname=utils.to_str(host))
+            elif os.path.isfile(self.cert):
                 sock = self.ssl_context.wrap_socket(sock, server_hostname=host)
 
         self.sock = sock
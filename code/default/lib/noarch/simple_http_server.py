@@ -10,6 +10,19 @@ import json
 import base64
 import hashlib
 import struct
+import io
+import collections
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import asyncio
+    import concurrent.futures
+except ImportError:
+    asyncio = None
 
 try:
     from urllib.parse import urlparse, urlencode, parse_qs
@@ -23,6 +36,7 @@ except ImportError:
 
 import xlog
 import utils
+import selectors2 as selectors
 
 
 class GetReqTimeout(Exception):
@@ -48,13 +62,14 @@ class HttpServerHandler():
 
     rbufsize = 32 * 1024
     wbufsize = 32 * 1024
+    timeout = 60
 
     res_headers = {}
 
     def __init__(self, sock, client, args, logger=None):
         self.connection = sock
         sock.setblocking(1)
-        sock.settimeout(60)
+        sock.settimeout(self.timeout)
         self.rfile = self.connection.makefile('rb', self.rbufsize)
         self.wfile = self.connection.makefile('wb', self.wbufsize)
         self.client_address = client
@@ -94,6 +109,16 @@ class HttpServerHandler():
         self.connection.close()
         # self.logger.debug("closed from %s:%d", self.client_address[0], self.client_address[1])
 
+    def has_pending_request(self):
+        # data of next request already buffered or received, like pipelined request.
+        # leave the socket non-blocking, worker set the timeout again before use.
+        try:
+            self.connection.setblocking(0)
+            return len(self.rfile.peek(1)) > 0
+        except Exception:
+            # ssl want read, or closed.
+            return False
+
     def address_string(self):
         return '%s:%s' % self.client_address[:2]
 
@@ -460,9 +485,231 @@ class HttpServerHandler():
         self.send_response(b'application/json', data, headers=headers)
 
 
+class WorkerPool(object):
+    # fixed workers serve requests from the accept queue.
+    # idle keep-alive connection wait in a selector, not hold a worker.
+    def __init__(self, size, queue_size, keep_alive_timeout, logger):
+        self.size = size
+        self.keep_alive_timeout = keep_alive_timeout
+        self.logger = logger
+        self.running = True
+        self.accept_queue = queue.Queue(maxsize=queue_size)
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.new_idle = []
+        self.idle = collections.OrderedDict()  # handler => park time
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(0)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.threads = []
+
+    def start(self):
+        for i in range(self.size):
+            th = threading.Thread(target=self.worker, name="http_worker_%d" % i)
+            th.daemon = True
+            th.start()
+            self.threads.append(th)
+
+        th = threading.Thread(target=self.idle_loop, name="http_idle")
+        th.daemon = True
+        th.start()
+        self.threads.append(th)
+
+    def stop(self):
+        self.running = False
+        while True:
+            try:
+                handler = self.accept_queue.get_nowait()
+            except queue.Empty:
+                break
+            if handler:
+                handler.connection.close()
+
+        for _ in range(self.size):
+            self.accept_queue.put(None)
+        self.wake()
+
+    def put(self, handler):
+        # block the accept loop if queue is full, new connections wait in listen backlog.
+        self.accept_queue.put(handler)
+
+    def wake(self):
+        try:
+            self.wake_w.send(b"w")
+        except Exception:
+            pass
+
+    def park(self, handler):
+        with self.lock:
+            self.new_idle.append(handler)
+        self.wake()
+
+    def worker(self):
+        while True:
+            handler = self.accept_queue.get()
+            if handler is None:
+                break
+
+            if not self.running:
+                handler.connection.close()
+                continue
+
+            try:
+                self.serve(handler)
+            except Exception as e:
+                self.logger.warn("worker serve %s except:%r", handler.address_string(), e)
+                handler.connection.close()
+
+    def serve(self, handler):
+        if type(handler).handle is not HttpServerHandler.handle:
+            # handler take the whole connection, like socks.
+            return handler.handle()
+
+        while True:
+            handler.connection.settimeout(handler.timeout)
+            handler.handle_one_request()
+            if handler.close_connection or not self.running:
+                break
+
+            if not handler.has_pending_request():
+                return self.park(handler)
+
+        handler.connection.close()
+
+    def close_idle(self, handler):
+        try:
+            self.selector.unregister(handler.connection)
+        except Exception:
+            pass
+        handler.connection.close()
+
+    def idle_loop(self):
+        while self.running:
+            try:
+                events = self.selector.select(timeout=1)
+            except Exception as e:
+                self.logger.warn("idle select except:%r", e)
+                time.sleep(1)
+                continue
+
+            with self.lock:
+                new_idle, self.new_idle = self.new_idle, []
+
+            time_now = time.time()
+            for handler in new_idle:
+                try:
+                    self.selector.register(handler.connection, selectors.EVENT_READ, handler)
+                    self.idle[handler] = time_now
+                except Exception as e:
+                    self.logger.warn("idle register %s except:%r", handler.address_string(), e)
+                    handler.connection.close()
+
+            for key, _ in events:
+                if key.fileobj is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except Exception:
+                        pass
+                    continue
+
+                handler = key.data
+                if handler not in self.idle:
+                    continue
+                del self.idle[handler]
+                self.selector.unregister(key.fileobj)
+                self.accept_queue.put(handler)
+
+            while self.idle:
+                handler, park_time = next(iter(self.idle.items()))
+                if park_time + self.keep_alive_timeout > time_now:
+                    break
+                del self.idle[handler]
+                self.close_idle(handler)
+
+        for handler in list(self.idle) + self.new_idle:
+            self.close_idle(handler)
+        self.idle.clear()
+        self.selector.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+
+class AsyncWriter(object):
+    # wfile of handler in asyncio mode, called from executor thread.
+    def __init__(self, loop, writer, bufsize):
+        self.loop = loop
+        self.writer = writer
+        self.bufsize = bufsize
+        self.buf = []
+        self.size = 0
+
+    def write(self, data):
+        self.buf.append(bytes(data))
+        self.size += len(data)
+        self.flush()
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.buf)
+        self.buf = []
+        self.size = 0
+        return data
+
+    def flush(self):
+        # small data is sent by the loop after the handler return, save a round trip to the loop.
+        if self.size < self.bufsize:
+            return
+        # wait for drain, big response won't fill the memory.
+        asyncio.run_coroutine_threadsafe(self.send(self.take()), self.loop).result()
+
+    async def send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def close(self):
+        pass
+
+
+class AsyncConnection(object):
+    # socket like object given to handler in asyncio mode.
+    # request is read by the event loop, handler get it from a BytesIO rfile.
+    def __init__(self, loop, writer, bufsize):
+        self.loop = loop
+        self.writer = writer
+        self.wfile = AsyncWriter(loop, writer, bufsize)
+
+    def setblocking(self, flag):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def makefile(self, mode, bufsize=-1):
+        if "r" in mode:
+            return io.BytesIO()
+        return self.wfile
+
+    def sendall(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
 class HTTPServer():
+    # mode:
+    #   thread: one thread for each connection.
+    #   pool: pool_size workers and a accept queue, idle keep-alive connection don't hold a thread.
+    #   asyncio: event loop read requests, handler run in pool_size executor threads.
+    #            request body is read before handler, for control endpoints, not for tunnel or websocket.
     def __init__(self, address, handler, args=(), use_https=False, cert="", logger=xlog, max_thread=1024,
-                 check_listen_interval=None):
+                 check_listen_interval=None, mode="thread", pool_size=64, queue_size=1024, keep_alive_timeout=60):
         self.sockets = []
         if isinstance(address, tuple):
             self.server_address = [address]
@@ -476,6 +723,12 @@ class HTTPServer():
         self.cert = cert
         self.max_thread = max_thread
         self.check_listen_interval = check_listen_interval
+        self.mode = mode
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.keep_alive_timeout = keep_alive_timeout
+        self.pool = None
+        self.loop = None
         # self.logger.info("server %s:%d started.", address[0], address[1])
 
     def start(self):
@@ -532,7 +785,7 @@ class HTTPServer():
             ctx.use_privatekey_file(fpem)
             ctx.use_certificate_file(fpem)
             sock = OpenSSL.SSL.Connection(ctx, sock)
-        sock.listen(200)
+        sock.listen(1024)
         self.sockets.append(sock)
         self.logger.info("server %s:%d started.", addr[0], addr[1])
 
@@ -541,6 +794,13 @@ class HTTPServer():
         if not self.sockets:
             self.init_socket()
 
+        if self.mode == "asyncio":
+            return self.serve_asyncio()
+
+        if self.mode == "pool":
+            self.pool = WorkerPool(self.pool_size, self.queue_size, self.keep_alive_timeout, self.logger)
+            self.pool.start()
+
         last_connect_time = time.time()
         if hasattr(select, 'epoll'):
             fn_map = {}
@@ -634,9 +894,16 @@ class HTTPServer():
                 except Exception as e:
                     self.logger.exception("serve except:%r", e)
         self.server_close()
+        if self.pool:
+            self.pool.stop()
+            self.pool = None
 
     def process_connect(self, sock, address):
         # self.logger.debug("connect from %s:%d", address[0], address[1])
+        if self.pool:
+            self.pool.put(self.handler(sock, address, self.args))
+            return
+
         if threading.active_count() > self.max_thread:
             self.logger.warn("thread num exceed the limit. drop request from %s.", address)
             sock.close()
@@ -646,6 +913,113 @@ class HTTPServer():
         client_thread = threading.Thread(target=client_obj.handle, name="handle:{}".format(address))
         client_thread.start()
 
+    def serve_asyncio(self):
+        if asyncio is None or self.use_https:
+            raise Exception("asyncio mode not supported")
+
+        self.loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.pool_size,
+                                                              thread_name_prefix="http_async")
+        self.async_busy = 0
+        self.async_servers = servers = []
+        for sock in self.sockets:
+            servers.append(loop.run_until_complete(
+                asyncio.start_server(self.serve_async_connection, sock=sock, limit=65536 * 2)))
+
+        try:
+            loop.run_forever()
+        finally:
+            for server in servers:
+                server.close()
+            for task in asyncio.all_tasks(loop):
+                task.cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+            self.executor.shutdown(wait=False)
+            self.loop = None
+            loop.close()
+            self.server_close()
+
+    def stop_async(self):
+        # called in loop, stop accepting and stop the loop after requests in process are answered.
+        for server in self.async_servers:
+            server.close()
+        self.loop.create_task(self.wait_async_idle())
+
+    async def wait_async_idle(self, timeout=10):
+        end_time = time.time() + timeout
+        while self.async_busy and time.time() < end_time:
+            await asyncio.sleep(0.05)
+        self.loop.stop()
+
+    async def read_async_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            # closed by client.
+            return None
+
+        length = 0
+        chunked = False
+        for line in head.split(b"\r\n")[1:]:
+            key, _, value = line.partition(b":")
+            key = key.strip().lower()
+            if key == b"content-length":
+                length = int(value)
+            elif key == b"transfer-encoding":
+                chunked = b"chunked" in value.lower()
+
+        data = [head]
+        if chunked:
+            # keep the raw chunks, handler decode them.
+            while True:
+                line = await reader.readuntil(b"\r\n")
+                data.append(line)
+                size = int(line.split(b";")[0], 16)
+                if size == 0:
+                    while True:
+                        line = await reader.readuntil(b"\r\n")
+                        data.append(line)
+                        if line == b"\r\n":
+                            break
+                    break
+                data.append(await reader.readexactly(size + 2))
+        elif length:
+            data.append(await reader.readexactly(length))
+        return b"".join(data)
+
+    async def serve_async_connection(self, reader, writer):
+        address = writer.get_extra_info("peername")
+        try:
+            connection = AsyncConnection(self.loop, writer, HttpServerHandler.wbufsize)
+            handler = self.handler(connection, address, self.args)
+            while self.running:
+                try:
+                    data = await asyncio.wait_for(self.read_async_request(reader), self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    break
+
+                self.async_busy += 1
+                try:
+                    handler.rfile = io.BytesIO(data)
+                    await self.loop.run_in_executor(self.executor, handler.handle_one_request)
+                    data = connection.wfile.take()
+                    if data:
+                        writer.write(data)
+                        await writer.drain()
+                finally:
+                    self.async_busy -= 1
+
+                if handler.close_connection:
+                    break
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.logger.warn("async serve %s except:%r", address, e)
+        writer.close()
+
     def check_listen_port(self, ip, port):
         if ':' in ip:
             info = [(socket.AF_INET6, socket.SOCK_STREAM, 0, "", (ip, port, 0, 0))]
@@ -685,6 +1059,10 @@ class HTTPServer():
     def shutdown(self):
         self.logger.info("shutdown")
         self.running = False
+        if self.loop:
+            # sockets are closed by the loop thread.
+            self.loop.call_soon_threadsafe(self.stop_async)
+            return
         self.server_close()
 
     def server_close(self):
@@ -1,74 +1,24 @@
-import time
+import collections
 import threading
-import sys
+import time
 
 # This simple Queue fix the performance problem in the system build-in Queue.
 # Every get with time out will run in thread sleep check sleep check...
 # cost too many CPU and delay queue response.
 
-# This solution will run a thread to check timeout, default is 0.1 second.
-# And message send queue with no delay, use thread lock/release.
-
-
-list_lock = threading.Lock()
-th_lock = threading.Lock()
-queue_list = []
-timer_th = None
-
-timeout_interval = 0.1
-
-# User can change  timeout_interval to bigger to reduce CPU load.
-
-
-def timer_thread():
-    global timer_th
-    while True:
-        with list_lock:
-            to_del = []
-            wait_count = 0
-            for q in queue_list:
-                wait_count += q.check()
-
-                c = sys.getrefcount(q)
-                # print(c, id(q))
-                if c <= 3:
-                    # reference of object, less then 3 means no out side use.
-                    to_del.append(q)
-
-            for q in to_del:
-                # print("del queue")
-                queue_list.remove(q)
-
-            if wait_count == 0:
-                break
-
-        time.sleep(timeout_interval)
-
-    with th_lock:
-        timer_th = None
-    # print("simple queue timer exit")
-
-
-def _add_queue(qq):
-    with list_lock:
-        queue_list.append(qq)
-
-
-def _add_wait():
-    global timer_th
-    with th_lock:
-        if not timer_th:
-            timer_th = threading.Thread(target=timer_thread)
-            timer_th.start()
+# Every waiter wait on the condition with it's own timeout,
+# so no timer thread is needed to check timeout and the timeout have no extra delay.
+# put() wake up one waiter directly.
 
 
 class Queue(object):
     def __init__(self):
         self.lock = threading.Lock()
-        self.queue = []
-        self.waiters = []
-        self.running = True
-        _add_queue(self)
+        self.not_empty = threading.Condition(self.lock)
+        self.queue = collections.deque()
+
+        # increase on reset, waiters before reset will return.
+        self.reset_count = 0
 
     def __sizeof__(self):
         return len(self.queue)
@@ -77,87 +27,40 @@ class Queue(object):
         return len(self.queue)
 
     def reset(self):
-        self.running = False
-        self.queue = []
-        self.notify_all()
-        self.running = True
-
-    def check(self):
-        if not self.waiters:
-            return 0
-
-        try:
-            if time.time() > self.waiters[0][0]:
-                self.notify()
-        except:
-            pass
-
-        return 1
+        with self.lock:
+            self.queue.clear()
+            self.reset_count += 1
+            self.not_empty.notify_all()
 
     def put(self, item):
         with self.lock:
             self.queue.append(item)
-            self.notify()
+            self.not_empty.notify()
 
     def get(self, timeout=None):
-        if not timeout:
-            with self.lock:
-                if not self.queue:
-                    return
-                else:
-                    return self.queue.pop(0)
-
-        end_time = time.time() + timeout
-        while self.running:
-            with self.lock:
-                if self.queue:
-                    return self.queue.pop(0)
+        # timeout is None or 0 means don't wait.
+        with self.lock:
+            if self.queue:
+                return self.queue.popleft()
 
-            if time.time() > end_time:
+            if not timeout:
                 return
 
-            self.wait(end_time)
+            end_time = time.time() + timeout
+            reset_count = self.reset_count
+            while not self.queue:
+                time_left = end_time - time.time()
+                if time_left <= 0 or reset_count != self.reset_count:
+                    return
 
-    def notify_all(self):
-        while self.waiters:
-            self.notify()
+                self.not_empty.wait(time_left)
 
-    def notify(self):
-        if len(self.waiters) == 0:
-            return
+            return self.queue.popleft()
 
-        try:
-            end_time, lock = self.waiters.pop(0)
-            lock.release()
-        except:
-            pass
+    def notify_all(self):
+        with self.lock:
+            self.not_empty.notify_all()
 
-    def wait(self, end_time):
+    def notify(self):
         with self.lock:
-            lock = threading.Lock()
-            lock.acquire()
-
-            if len(self.waiters) == 0:
-                self.waiters.append((end_time, lock))
-            else:
-                is_max = True
-                for i in range(0, len(self.waiters)):
-                    try:
-                        iend_time, ilock = self.waiters[i]
-                        if iend_time > end_time:
-                            is_max = False
-                            break
-                    except Exception as e:
-                        if i >= len(self.waiters):
-                            break
-                        # xlog.warn("get %d from size:%d fail.", i, len(self.waiters))
-                        continue
-
-                if is_max:
-                    self.waiters.append((end_time, lock))
-                else:
-                    self.waiters.insert(i, (end_time, lock))
-
-            _add_wait()
-
-        lock.acquire()
+            self.not_empty.notify()
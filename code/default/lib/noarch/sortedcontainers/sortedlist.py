@@ -7,7 +7,10 @@ from sys import hexversion
 
 from bisect import bisect_left, bisect_right, insort
 from itertools import chain, repeat, starmap
-from collections import MutableSequence
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
 from operator import iadd, add
 from functools import wraps
 from math import log
@@ -4,7 +4,10 @@
 
 from .sortedlist import SortedList, recursive_repr
 from .sortedlistwithkey import SortedListWithKey
-from collections import Set, MutableSet, Sequence
+try:
+    from collections.abc import Set, MutableSet, Sequence
+except ImportError:
+    from collections import Set, MutableSet, Sequence
 from itertools import chain
 import operator as op
 
@@ -7,6 +7,8 @@ import threading
 from functools import reduce
 from six import string_types
 
+from ip_prefix import IpPrefixIndex
+
 ipv4_pattern = re.compile(br'^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$')
 
 ipv6_pattern = re.compile(br"""
@@ -194,6 +196,11 @@ class SimpleCondition(object):
         self.lock.notify()
         self.lock.release()
 
+    def notify_all(self):
+        self.lock.acquire()
+        self.lock.notify_all()
+        self.lock.release()
+
     def wait(self, timeout=None):
         self.lock.acquire()
         self.lock.wait(timeout)
@@ -229,38 +236,14 @@ private_ipv6_range = [
     ("fc00::", "fdff:ffff:ffff:ffff:ffff:ffff:ffff:ffff")
 ]
 
-private_ipv4_range_bin = []
-for b, e in private_ipv4_range:
-    bb = ip_string_to_num(b)
-    ee = ip_string_to_num(e)
-    private_ipv4_range_bin.append((bb, ee))
+private_ip_index = IpPrefixIndex()
+for b, e in private_ipv4_range + private_ipv6_range:
+    private_ip_index.add_range(b, e)
+private_ip_index.build()
 
 
 def is_private_ip(ip):
-    ip = to_str(ip)
-    try:
-        if "." in ip:
-            ip_bin = ip_string_to_num(ip)
-            for b, e in private_ipv4_range_bin:
-                if b <= ip_bin <= e:
-                    return True
-            return False
-        else:
-            if ip == "::1":
-                return True
-
-            fi = ip.find(":")
-            if fi != 4:
-                return False
-
-            be = ip[0:2]
-            if be in ["fc", "fd"]:
-                return True
-            else:
-                return False
-    except Exception as e:
-        # print(("is_private_ip(%s), except:%r", ip, e))
-        return False
+    return private_ip_index.contains(ip)
 
 
 import string
@@ -6,6 +6,8 @@ import traceback
 import threading
 import json
 import shutil
+import atexit
+import collections
 from os.path import join
 
 from six import string_types
@@ -21,11 +23,25 @@ INFO = 20
 DEBUG = 10
 NOTSET = 0
 
+level_values = {
+    "DEBUG": DEBUG,
+    "INFO": INFO,
+    "WARN": WARN,
+    "WARNING": WARNING,
+    "ERROR": ERROR,
+    "CRITICAL": CRITICAL,
+}
+warning_levels = ["WARN", "WARNING", "ERROR", "CRITICAL"]
+
 # full_log set by server, upload full log for debug (maybe next time start session), remove old log file on reset log
 full_log = False
 
 # keep log set by UI, keep all logs, never delete old log, also upload log to server.
 
+# set by set_async_mode, log call only put the record to the queue,
+# format and write to console/files are done in the writer thread.
+async_writer = None
+
 
 class Logger():
     def __init__(self, name, buffer_size=0, file_name=None, roll_num=1,
@@ -38,6 +54,9 @@ class Logger():
         self.last_no = 0
         self.min_level = NOTSET
         self.log_fd = None
+        self.dropped_num = 0  # records dropped when async queue is full
+        self.reported_dropped_num = 0
+        self.console = True  # write to stderr
         self.set_color()
         self.roll_num = roll_num
         if file_name:
@@ -182,28 +201,60 @@ class Logger():
 
         shutil.move(self.log_filename, self.log_filename + ".1")
 
+    def set_console(self, enable):
+        self.console = enable
+
+    def has_sink(self, level):
+        # console, files and buffer, format is skipped if nobody want it.
+        if level_values.get(level, NOTSET) < self.min_level:
+            return False
+
+        if self.console and sys.stderr is not None:
+            return True
+
+        if self.log_fd or self.start_log or self.buffer_size:
+            return True
+
+        return bool(self.warning_log and level in warning_levels)
+
     def log(self, level, console_color, html_color, fmt, *args, **kwargs):
+        if not self.has_sink(level):
+            return
+
+        if async_writer:
+            async_writer.put(self, level, console_color, fmt, args)
+            return
+
+        self.buffer_lock.acquire()
+        try:
+            self.write_record(datetime.now(), level, console_color, fmt, args)
+        finally:
+            self.buffer_lock.release()
+
+    def write_record(self, now, level, console_color, fmt, args, flush=True):
+        # caller hold buffer_lock
         args = utils.bytes2str_only(args)
-        now = datetime.now()
         time_str = now.strftime("%Y-%m-%d %H:%M:%S.%f")[:23]
-        string = '%s - [%s] %s\n' % (time_str, level, fmt % args)
-        self.buffer_lock.acquire()
         try:
-            try:
-                console_string = '%s [%s][%s] %s\n' % (time_str, self.name, level, fmt % args)
+            msg = fmt % args
+            string = '%s - [%s] %s\n' % (time_str, level, msg)
+            if self.console and sys.stderr is not None:
+                try:
+                    console_string = '%s [%s][%s] %s\n' % (time_str, self.name, level, msg)
 
-                self.set_console_color(console_color)
-                sys.stderr.write(console_string)
-                self.set_console_color(self.reset_color)
-            except:
-                pass
+                    self.set_console_color(console_color)
+                    sys.stderr.write(console_string)
+                    self.set_console_color(self.reset_color)
+                except:
+                    pass
 
             if self.log_fd:
                 self.log_fd.write(string)
-                try:
-                    self.log_fd.flush()
-                except:
-                    pass
+                if flush:
+                    try:
+                        self.log_fd.flush()
+                    except:
+                        pass
 
                 self.file_size += len(string)
                 if self.file_size > self.file_max_size:
@@ -215,22 +266,24 @@ class Logger():
 
             if self.start_log:
                 self.start_log.write(string)
-                try:
-                    self.start_log.flush()
-                except:
-                    pass
+                if flush:
+                    try:
+                        self.start_log.flush()
+                    except:
+                        pass
                 self.start_log_num += 1
 
                 if self.start_log_num > self.save_start_log and not self.keep_log and not full_log:
                     self.start_log.close()
                     self.start_log = None
 
-            if self.warning_log and level in ["WARN", "WARNING", "ERROR", "CRITICAL"]:
+            if self.warning_log and level in warning_levels:
                 self.warning_log.write(string)
-                try:
-                    self.warning_log.flush()
-                except:
-                    pass
+                if flush:
+                    try:
+                        self.warning_log.flush()
+                    except:
+                        pass
 
             if self.buffer_size:
                 self.last_no += 1
@@ -240,14 +293,21 @@ class Logger():
                     del self.buffer[self.last_no - self.buffer_size]
         except Exception as e:
             string = '%s - [%s]LOG_EXCEPT: %s, Except:%s<br> %s' % \
-                     (time.ctime()[4:-5], level, fmt % args, e, traceback.format_exc())
+                     (time.ctime()[4:-5], level, fmt, e, traceback.format_exc())
             self.last_no += 1
             self.buffer[self.last_no] = string
             buffer_len = len(self.buffer)
             if buffer_len > self.buffer_size:
                 del self.buffer[self.last_no - self.buffer_size]
-        finally:
-            self.buffer_lock.release()
+
+    def flush(self):
+        for fd in [self.log_fd, self.start_log, self.warning_log]:
+            if not fd:
+                continue
+            try:
+                fd.flush()
+            except:
+                pass
 
     def debug(self, fmt, *args, **kwargs):
         if self.min_level > DEBUG:
@@ -329,6 +389,83 @@ class null():
         pass
 
 
+class AsyncLogWriter(object):
+    # log() only append the record to a deque, no lock and no syscall.
+    # writer thread format and write the records in batch,
+    # files are flushed once per batch, every flush_interval or when batch_size records are waiting.
+    # queue is bounded by max_queue_size, record is dropped and counted if full.
+    def __init__(self, flush_interval=0.5, max_queue_size=20000, batch_size=1000):
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.queue = collections.deque()
+        self.wake_event = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="xlog_writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, logger, level, console_color, fmt, args):
+        if len(self.queue) >= self.max_queue_size:
+            logger.dropped_num += 1
+            return
+
+        self.queue.append((logger, time.time(), level, console_color, fmt, args))
+        if len(self.queue) >= self.batch_size and not self.wake_event.is_set():
+            self.wake_event.set()
+
+    def stop(self):
+        self.running = False
+        self.wake_event.set()
+        self.thread.join(5)
+        self.write_batch()
+
+    def run(self):
+        while self.running:
+            self.wake_event.wait(self.flush_interval)
+            self.wake_event.clear()
+            self.write_batch()
+
+    def write_batch(self):
+        loggers = set()
+        while True:
+            try:
+                logger, t, level, console_color, fmt, args = self.queue.popleft()
+            except IndexError:
+                break
+
+            with logger.buffer_lock:
+                logger.write_record(datetime.fromtimestamp(t), level, console_color, fmt, args, flush=False)
+            loggers.add(logger)
+
+        for logger in loggers:
+            with logger.buffer_lock:
+                if logger.dropped_num != logger.reported_dropped_num:
+                    dropped_num = logger.dropped_num
+                    logger.write_record(datetime.now(), "WARNING", logger.warn_color,
+                                        "log queue full, dropped %d lines", (dropped_num - logger.reported_dropped_num,),
+                                        flush=False)
+                    logger.reported_dropped_num = dropped_num
+
+                logger.flush()
+
+
+def set_async_mode(enable=True, flush_interval=0.5, max_queue_size=20000, batch_size=1000):
+    # args are formatted in the writer thread,
+    # don't log an object and change it right after in async mode.
+    global async_writer
+    if enable:
+        if not async_writer:
+            async_writer = AsyncLogWriter(flush_interval, max_queue_size, batch_size)
+    elif async_writer:
+        writer = async_writer
+        async_writer = None
+        writer.stop()
+
+
+atexit.register(set_async_mode, False)
+
+
 loggerDict = {}
 
 
@@ -0,0 +1,346 @@
+import os
+import sys
+import ssl
+import time
+import random
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_lib = os.path.abspath(os.path.join(root_path, 'lib', 'noarch'))
+sys.path.append(root_path)
+sys.path.append(noarch_lib)
+
+import xlog
+from hyper.packages.hyperframe.frame import (
+    Frame, DataFrame, HeadersFrame, SettingsFrame, PingFrame, GoAwayFrame
+)
+from hyper.packages.hpack import Encoder
+from front_base.config import ConfigBase
+from front_base.openssl_wrap import SSLContext
+from front_base.connect_creator import ConnectCreator
+from front_base.connect_manager import ConnectManager
+from front_base.http_dispatcher import HttpsDispatcher
+from front_base.ip_manager import IpManagerBase
+
+logger = xlog.getLogger("bench_connect")
+
+# Connection churn benchmark.
+# Start a farm of TLS servers on loopback, every server can delay the handshake and fail a part of connections.
+# Drive real ConnectCreator -> ConnectManager -> HttpsDispatcher -> Http1/Http2 worker,
+# workers are closed after --tasks-per-conn requests, so new connections are created all the time.
+
+SNI = "bench.local"
+
+
+def gen_cert(path):
+    # self signed cert by openssl command line.
+    cert_fn = os.path.join(path, "cert.pem")
+    key_fn = os.path.join(path, "key.pem")
+    subprocess.check_call([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-keyout", key_fn, "-out", cert_fn, "-subj", "/CN=%s" % SNI
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_fn, key_fn
+
+
+def recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        dat = sock.recv(size - len(buf))
+        if not dat:
+            raise socket.error("closed")
+        buf += dat
+    return bytes(buf)
+
+
+class BenchServer(object):
+    def __init__(self, cert_fn, key_fn, h2=True, handshake_delay=0.0, fail_rate=0.0):
+        self.handshake_delay = handshake_delay
+        self.fail_rate = fail_rate
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert_fn, key_fn)
+        self.context.set_alpn_protocols(["h2", "http/1.1"] if h2 else ["http/1.1"])
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(1024)
+        self.port = self.sock.getsockname()[1]
+        self.ip_str = "127.0.0.1:%d" % self.port
+
+        self.accepted = 0
+        self.failed = 0
+        self.requests = 0
+        self.running = True
+        threading.Thread(target=self.accept_thread, name="bench_server_%d" % self.port).start()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except:
+            pass
+
+    def accept_thread(self):
+        while self.running:
+            try:
+                sock, _ = self.sock.accept()
+            except Exception:
+                break
+            self.accepted += 1
+            th = threading.Thread(target=self.handle, args=(sock,))
+            th.daemon = True
+            th.start()
+
+    def handle(self, sock):
+        try:
+            if random.random() < self.fail_rate:
+                self.failed += 1
+                sock.close()
+                return
+
+            if self.handshake_delay:
+                time.sleep(self.handshake_delay)
+
+            conn = self.context.wrap_socket(sock, server_side=True)
+            if conn.selected_alpn_protocol() == "h2":
+                self.serve_h2(conn)
+            else:
+                self.serve_h1(conn)
+        except Exception:
+            pass
+        finally:
+            try:
+                sock.close()
+            except:
+                pass
+
+    def serve_h1(self, conn):
+        buf = b""
+        while self.running:
+            while b"\r\n\r\n" not in buf:
+                dat = conn.recv(65536)
+                if not dat:
+                    return
+                buf += dat
+
+            head, buf = buf.split(b"\r\n\r\n", 1)
+            content_length = 0
+            for line in head.split(b"\r\n")[1:]:
+                k, _, v = line.partition(b":")
+                if k.strip().lower() == b"content-length":
+                    content_length = int(v.strip())
+            if len(buf) < content_length:
+                buf += recv_exact(conn, content_length - len(buf))
+            buf = buf[content_length:]
+
+            self.requests += 1
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\nok")
+
+    def serve_h2(self, conn):
+        encoder = Encoder()
+        recv_exact(conn, 24)  # client preface
+        conn.sendall(SettingsFrame(0).serialize())
+
+        while self.running:
+            frame, length = Frame.parse_frame_header(recv_exact(conn, 9))
+            frame.parse_body(memoryview(recv_exact(conn, length)))
+
+            if isinstance(frame, SettingsFrame):
+                if b"ACK" not in frame.flags:
+                    ack = SettingsFrame(0)
+                    ack.flags.add(b"ACK")
+                    conn.sendall(ack.serialize())
+            elif isinstance(frame, PingFrame):
+                if b"ACK" not in frame.flags:
+                    pong = PingFrame(0)
+                    pong.flags.add(b"ACK")
+                    pong.opaque_data = frame.opaque_data
+                    conn.sendall(pong.serialize())
+            elif isinstance(frame, GoAwayFrame):
+                return
+            elif isinstance(frame, (HeadersFrame, DataFrame)) and b"END_STREAM" in frame.flags:
+                self.requests += 1
+                headers = HeadersFrame(frame.stream_id)
+                headers.data = encoder.encode([(":status", "200"), ("content-length", "2")])
+                headers.flags.add(b"END_HEADERS")
+                data = DataFrame(frame.stream_id)
+                data.data = b"ok"
+                data.flags.add(b"END_STREAM")
+                conn.sendall(headers.serialize() + data.serialize())
+
+
+class FakeCheckLocalNetwork(object):
+    def report_ok(self, ip_str=None):
+        pass
+
+    def report_fail(self, ip_str=None):
+        pass
+
+    def is_ok(self, ip_str=None):
+        return True
+
+
+class BenchIpManager(IpManagerBase):
+    # pick a random server for every connection, count connect result.
+    def __init__(self, config, servers):
+        super(BenchIpManager, self).__init__(config, None, logger)
+        self.servers = servers
+        self.stat_lock = threading.Lock()
+        self.connect_ok = 0
+        self.connect_fail = 0
+        self.handshake_times = []
+        self.resumed_handshake_times = []
+
+    def get_ip_sni_host(self):
+        server = random.choice(self.servers)
+        return {"ip_str": server.ip_str, "sni": SNI, "host": SNI}
+
+    def update_ip(self, ip_str, sni, handshake_time, resumed=False):
+        with self.stat_lock:
+            self.connect_ok += 1
+            if resumed:
+                self.resumed_handshake_times.append(handshake_time)
+            else:
+                self.handshake_times.append(handshake_time)
+
+    def report_connect_fail(self, ip_str, sni=None, reason="", force_remove=True):
+        with self.stat_lock:
+            self.connect_fail += 1
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(len(values) * p / 100))
+    return values[idx]
+
+
+def max_rss_mb():
+    if not resource:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / 1024.0 / 1024
+    return rss / 1024.0
+
+
+def run(args, cert_fn, key_fn):
+    servers = [BenchServer(cert_fn, key_fn, h2=not args.http1,
+                           handshake_delay=args.handshake_delay, fail_rate=args.fail_rate)
+               for _ in range(args.servers)]
+
+    config = ConfigBase(os.path.join(current_path, "not_exist_config.json"))
+    config.load()
+    config.dispather_max_workers = args.max_workers
+    config.dispather_ping_check_speed_interval = 999999
+    config.max_task_num = args.clients * 2
+    config.https_max_connect_thread = args.connect_threads
+    config.https_connection_pool_max = args.connect_threads
+    config.connect_create_interval = 0
+    config.http1_max_process_tasks = args.tasks_per_conn
+    config.http2_max_process_tasks = args.tasks_per_conn
+    config.socket_timeout = 5
+    config.tls_session_cache_size = 0 if args.no_session_cache else 1000
+
+    ip_manager = BenchIpManager(config, servers)
+    openssl_context = SSLContext(logger, support_http2=not args.http1)
+    openssl_context.context.check_hostname = False
+    openssl_context.context.verify_mode = ssl.CERT_NONE
+    connect_creator = ConnectCreator(logger, config, openssl_context, check_cert=lambda ssl_sock: None)
+    connect_manager = ConnectManager(logger, config, connect_creator, ip_manager, FakeCheckLocalNetwork())
+    dispatcher = HttpsDispatcher(logger, config, ip_manager, connect_manager)
+
+    # handshake finished => first response on this connection.
+    first_request_latencies = []
+    request_latencies = []
+    seen_socks = set()
+    stat_lock = threading.Lock()
+    max_threads = [threading.active_count()]
+    end_time = time.time() + args.duration
+
+    def client():
+        while time.time() < end_time:
+            start = time.time()
+            res = dispatcher.request(b"GET", SNI, b"/", {}, b"", timeout=10)
+            now = time.time()
+            if not res or res.status != 200:
+                continue
+
+            ssl_sock = res.worker.ssl_sock
+            with stat_lock:
+                request_latencies.append(now - start)
+                if id(ssl_sock) not in seen_socks:
+                    seen_socks.add(id(ssl_sock))
+                    handshaked = ssl_sock.create_time + ssl_sock.handshake_time / 1000.0
+                    first_request_latencies.append(now - handshaked)
+                max_threads[0] = max(max_threads[0], threading.active_count())
+
+    start_time = time.time()
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    time_cost = time.time() - start_time
+
+    dispatcher.stop()
+    connect_manager.stop()
+    for server in servers:
+        server.stop()
+
+    print("servers:%d %s handshake_delay:%.0fms fail_rate:%.2f clients:%d tasks_per_conn:%d" % (
+        args.servers, "http/1.1" if args.http1 else "h2", args.handshake_delay * 1000, args.fail_rate,
+        args.clients, args.tasks_per_conn))
+    print("  connections/sec: %.1f  (ok:%d fail:%d accepted:%d)" % (
+        ip_manager.connect_ok / time_cost, ip_manager.connect_ok, ip_manager.connect_fail,
+        sum(s.accepted for s in servers)))
+    print("  full handshake:%d p50:%dms p99:%dms" % (
+        len(ip_manager.handshake_times),
+        percentile(ip_manager.handshake_times, 50), percentile(ip_manager.handshake_times, 99)))
+    print("  resumed handshake:%d p50:%dms p99:%dms" % (
+        len(ip_manager.resumed_handshake_times),
+        percentile(ip_manager.resumed_handshake_times, 50), percentile(ip_manager.resumed_handshake_times, 99)))
+    print("  handshake to first request p50:%.1fms p99:%.1fms" % (
+        percentile(first_request_latencies, 50) * 1000, percentile(first_request_latencies, 99) * 1000))
+    print("  requests/sec: %.1f  latency p50:%.1fms p99:%.1fms" % (
+        len(request_latencies) / time_cost,
+        percentile(request_latencies, 50) * 1000, percentile(request_latencies, 99) * 1000))
+    print("  threads max:%d  max rss:%.1fMB" % (max_threads[0], max_rss_mb()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ConnectManager connection churn benchmark on loopback")
+    parser.add_argument("--servers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--tasks-per-conn", type=int, default=20)
+    parser.add_argument("--max-workers", type=int, default=20)
+    parser.add_argument("--connect-threads", type=int, default=4)
+    parser.add_argument("--handshake-delay", type=float, default=0.0, help="seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="0 - 1")
+    parser.add_argument("--http1", action="store_true", help="servers only offer http/1.1")
+    parser.add_argument("--no-session-cache", action="store_true", help="disable TLS session resumption")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+    logger.setLevel(args.log_level)
+
+    tmp_path = tempfile.mkdtemp()
+    try:
+        cert_fn, key_fn = gen_cert(tmp_path)
+        run(args, cert_fn, key_fn)
+    finally:
+        shutil.rmtree(tmp_path)
+    os._exit(0)
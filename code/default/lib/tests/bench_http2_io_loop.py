@@ -0,0 +1,126 @@
+import os
+import sys
+import ssl
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_path)
+
+from bench_connect_manager import (
+    logger, SNI, gen_cert, BenchServer, FakeCheckLocalNetwork, BenchIpManager, percentile, max_rss_mb
+)
+from front_base.config import ConfigBase
+from front_base.openssl_wrap import SSLContext
+from front_base.connect_creator import ConnectCreator
+from front_base.connect_manager import ConnectManager
+from front_base.http_dispatcher import HttpsDispatcher
+
+# Http2 workers on thread per worker vs shared selector loops (http2_io_loop_num).
+# Open --workers h2 connections to loopback servers, then --clients threads send requests for --duration.
+# Report threads, cpu time, requests/sec and latency.
+
+
+def run(args, cert_fn, key_fn, io_loop_num):
+    servers = [BenchServer(cert_fn, key_fn, h2=True) for _ in range(args.servers)]
+
+    config = ConfigBase(os.path.join(current_path, "not_exist_config.json"))
+    config.load()
+    config.http2_io_loop_num = io_loop_num
+    config.dispather_min_workers = args.workers
+    config.dispather_max_workers = args.workers
+    config.dispather_ping_check_speed_interval = 999999
+    config.max_task_num = args.clients * 2
+    config.https_max_connect_thread = 8
+    config.https_connection_pool_max = 8
+    config.connect_create_interval = 0
+    config.socket_timeout = 5
+
+    ip_manager = BenchIpManager(config, servers)
+    openssl_context = SSLContext(logger, support_http2=True)
+    openssl_context.context.check_hostname = False
+    openssl_context.context.verify_mode = ssl.CERT_NONE
+    connect_creator = ConnectCreator(logger, config, openssl_context, check_cert=lambda ssl_sock: None)
+    connect_manager = ConnectManager(logger, config, connect_creator, ip_manager, FakeCheckLocalNetwork())
+    dispatcher = HttpsDispatcher(logger, config, ip_manager, connect_manager)
+
+    dispatcher.start_connect_all_ips()
+    deadline = time.time() + 30
+    while len(dispatcher.workers) < args.workers and time.time() < deadline:
+        time.sleep(0.1)
+    time.sleep(0.5)
+
+    latencies = []
+    stat_lock = threading.Lock()
+    max_threads = [threading.active_count()]
+    end_time = time.time() + args.duration
+
+    def client():
+        while time.time() < end_time:
+            start = time.time()
+            res = dispatcher.request(b"GET", SNI, b"/", {}, b"", timeout=10)
+            if not res or res.status != 200:
+                continue
+
+            with stat_lock:
+                latencies.append(time.time() - start)
+                max_threads[0] = max(max_threads[0], threading.active_count())
+
+    cpu_start = time.process_time()
+    start_time = time.time()
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    time_cost = time.time() - start_time
+    cpu_cost = time.process_time() - cpu_start
+
+    workers = len(dispatcher.workers)
+    dispatcher.stop()
+    connect_manager.stop()
+    for server in servers:
+        server.stop()
+
+    # server threads run in the same process, count them out.
+    server_threads = sum(s.accepted for s in servers) + args.servers
+    print("%s workers:%d clients:%d" % (
+        "io_loop:%d" % io_loop_num if io_loop_num else "thread", workers, args.clients))
+    print("  threads max:%d (client side about %d)" % (max_threads[0], max_threads[0] - server_threads - args.clients))
+    print("  cpu:%.2fs  cpu per 1k requests:%.3fs" % (cpu_cost, cpu_cost * 1000 / max(1, len(latencies))))
+    print("  requests/sec: %.1f  latency p50:%.1fms p99:%.1fms" % (
+        len(latencies) / time_cost, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+    print("  max rss:%.1fMB" % max_rss_mb())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="http/2 worker thread model vs io loop on loopback")
+    parser.add_argument("--servers", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=40)
+    parser.add_argument("--clients", type=int, default=40)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--io-loops", type=int, nargs="+", default=[0, 1, 2], help="0 is thread model")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+    logger.setLevel(args.log_level)
+
+    if len(args.io_loops) > 1:
+        # threads of the last run are still closing, run every mode in a new process.
+        for io_loop_num in args.io_loops:
+            subprocess.call([sys.executable, os.path.abspath(__file__),
+                             "--servers", str(args.servers), "--workers", str(args.workers),
+                             "--clients", str(args.clients), "--duration", str(args.duration),
+                             "--log-level", args.log_level, "--io-loops", str(io_loop_num)])
+        os._exit(0)
+
+    tmp_path = tempfile.mkdtemp()
+    try:
+        cert_fn, key_fn = gen_cert(tmp_path)
+        run(args, cert_fn, key_fn, args.io_loops[0])
+    finally:
+        shutil.rmtree(tmp_path)
+    os._exit(0)
@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_lib = os.path.abspath(os.path.join(root_path, 'lib', 'noarch'))
+sys.path.append(root_path)
+sys.path.append(noarch_lib)
+
+import xlog
+import simple_http_client
+from front_base.config import ConfigBase
+from front_base.http_dispatcher import HttpsDispatcher
+
+logger = xlog.getLogger("bench_dispatcher")
+
+
+class FakeIpManager(object):
+    def report_connect_closed(self, ip_str, sni=None, reason=""):
+        pass
+
+
+class FakeConnectManager(object):
+    def set_ssl_created_cb(self, cb):
+        pass
+
+    def get_ssl_connection(self, timeout=60):
+        time.sleep(1)
+        return None
+
+
+class FakeWorker(object):
+    # Act like a http/2 worker which response immediately.
+    score_changed_cb = None
+
+    def __init__(self, ip_str, latencies, lock):
+        self.ip_str = ip_str
+        self.version = "2"
+        self.accept_task = True
+        self.keep_running = True
+        self.streams = {}
+        self.score = random.uniform(0.05, 1)
+        self.last_recv_time = time.time()
+        self.last_request_time = time.time()
+        self.last_send_time = time.time()
+        self.continue_fail_tasks = 0
+        self.latencies = latencies
+        self.lock = lock
+        self.processed = 0
+
+    def get_score(self):
+        return self.score
+
+    def is_life_end(self):
+        return False
+
+    def request(self, task):
+        now = time.time()
+        with self.lock:
+            self.latencies.append(now - task.start_time)
+
+        self.processed += 1
+        if self.processed % 10 == 0:
+            # simulate update_speed
+            self.score = random.uniform(0.05, 1)
+            if self.score_changed_cb:
+                self.score_changed_cb(self)
+
+        res = simple_http_client.BaseResponse(status=200)
+        res.task = task
+        res.worker = self
+        task.responsed = True
+        task.queue.put(res)
+
+    def send_ping(self):
+        pass
+
+    def close(self, reason=""):
+        self.keep_running = False
+        self.accept_task = False
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(len(values) * p / 100))
+    return values[idx]
+
+
+def run(worker_num, task_num, client_num, shard_num=1):
+    config = ConfigBase(os.path.join(current_path, "not_exist_config.json"))
+    config.load()
+    config.dispather_max_workers = worker_num
+    config.dispather_min_workers = 0
+    config.max_task_num = client_num * 2
+    config.dispather_ping_check_speed_interval = 999999
+    config.dispather_shard_num = shard_num
+
+    latencies = []
+    lock = threading.Lock()
+    dispatcher = HttpsDispatcher(logger, config, FakeIpManager(), FakeConnectManager())
+    for i in range(worker_num):
+        dispatcher._add_worker(FakeWorker("10.0.%d.%d" % (i // 250, i % 250), latencies, lock))
+
+    per_client = task_num // client_num
+
+    def client():
+        for _ in range(per_client):
+            dispatcher.request(b"POST", b"bench.host", b"/", {}, b"", timeout=10)
+
+    start_time = time.time()
+    threads = [threading.Thread(target=client) for _ in range(client_num)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    time_cost = time.time() - start_time
+
+    dispatcher.stop()
+
+    done = len(latencies)
+    print("workers:%d shards:%d tasks:%d clients:%d" % (worker_num, shard_num, done, client_num))
+    print("  tasks/sec: %.1f" % (done / time_cost))
+    print("  dispatch latency p50:%.3fms p99:%.3fms max:%.3fms" % (
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, percentile(latencies, 100) * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HttpsDispatcher dispatch benchmark with fake workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--tasks", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1])
+    args = parser.parse_args()
+
+    for shard_num in args.shards:
+        for num in args.workers:
+            run(num, args.tasks, args.clients, shard_num)
+    os._exit(0)
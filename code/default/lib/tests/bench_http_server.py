@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import resource
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_lib = os.path.abspath(os.path.join(root_path, 'lib', 'noarch'))
+sys.path.append(noarch_lib)
+
+import simple_http_server
+
+# HTTPServer under a connection storm.
+# --clients keep-alive connections open at once, each send --requests requests with a --think ms pause between,
+# like browsers keep idle connections.
+# Clients run in one asyncio thread, so the thread count is the server's.
+#   thread: one thread for each connection
+#   pool: worker pool and accept queue
+#   asyncio: event loop and executor
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def client(port, args, connect_times, latencies, errors):
+    try:
+        start = time.time()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        connect_times.append((start, time.time()))
+
+        for i in range(args.requests):
+            await asyncio.sleep(random.random() * args.think / 1000.0)
+            start = time.time()
+            writer.write(b"GET / HTTP/1.1\r\nHost: bench\r\n\r\n")
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            latencies.append(time.time() - start)
+        writer.close()
+    except Exception as e:
+        errors.append(e)
+
+
+def run(args, mode):
+    server = simple_http_server.HTTPServer(('127.0.0.1', 0), simple_http_server.TestHttpServer, ".",
+                                           mode=mode, pool_size=args.workers)
+    server.start()
+    port = server.sockets[0].getsockname()[1]
+    base_threads = threading.active_count()
+
+    max_threads = [0]
+    running = [True]
+
+    def monitor():
+        while running[0]:
+            max_threads[0] = max(max_threads[0], threading.active_count() - base_threads)
+            time.sleep(0.01)
+
+    threading.Thread(target=monitor).start()
+
+    connect_times = []
+    latencies = []
+    errors = []
+
+    async def main():
+        await asyncio.gather(*[client(port, args, connect_times, latencies, errors) for _ in range(args.clients)])
+
+    start_time = time.time()
+    asyncio.run(main())
+    time_cost = time.time() - start_time
+
+    running[0] = False
+    server.shutdown()
+    server.http_thread.join()
+
+    print("%s clients:%d requests:%d workers:%d" % (mode, args.clients, args.requests, args.workers))
+    connect_costs = [end - start for start, end in connect_times] or [0]
+    connect_span = max([end for _, end in connect_times] or [start_time + 1]) - start_time
+    print("  accept rate:%.0f conn/s  connect p50:%.2fms p99:%.2fms" % (
+        len(connect_times) / connect_span, percentile(connect_costs, 50) * 1000, percentile(connect_costs, 99) * 1000))
+    print("  requests:%.0f/s  p50:%.2fms p99:%.2fms  max threads:%d  errors:%d" % (
+        len(latencies) / time_cost, percentile(latencies or [0], 50) * 1000, percentile(latencies or [0], 99) * 1000,
+        max_threads[0], len(errors)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="simple_http_server connection storm")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--think", type=float, default=100, help="max ms between requests")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--modes", nargs="+", default=["thread", "pool", "asyncio"])
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, args.clients * 4)), hard))
+
+    for mode in args.modes:
+        run(args, mode)
+    os._exit(0)
@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import queue
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_lib = os.path.abspath(os.path.join(root_path, 'lib', 'noarch'))
+sys.path.append(noarch_lib)
+
+import simple_queue
+
+
+# The previous simple_queue, with a timer thread checking all queues every 0.1 second.
+# Kept here for comparison.
+old_list_lock = threading.Lock()
+old_th_lock = threading.Lock()
+old_queue_list = []
+old_timer_th = None
+old_timeout_interval = 0.1
+
+
+def old_timer_thread():
+    global old_timer_th
+    while True:
+        with old_list_lock:
+            to_del = []
+            wait_count = 0
+            for q in old_queue_list:
+                wait_count += q.check()
+
+                c = sys.getrefcount(q)
+                if c <= 3:
+                    to_del.append(q)
+
+            for q in to_del:
+                old_queue_list.remove(q)
+
+            if wait_count == 0:
+                break
+
+        time.sleep(old_timeout_interval)
+
+    with old_th_lock:
+        old_timer_th = None
+
+
+def old_add_wait():
+    global old_timer_th
+    with old_th_lock:
+        if not old_timer_th:
+            old_timer_th = threading.Thread(target=old_timer_thread)
+            old_timer_th.start()
+
+
+class OldQueue(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = []
+        self.waiters = []
+        self.running = True
+        with old_list_lock:
+            old_queue_list.append(self)
+
+    def check(self):
+        if not self.waiters:
+            return 0
+
+        try:
+            if time.time() > self.waiters[0][0]:
+                self.notify()
+        except:
+            pass
+
+        return 1
+
+    def put(self, item):
+        with self.lock:
+            self.queue.append(item)
+            self.notify()
+
+    def get(self, timeout=None):
+        if not timeout:
+            with self.lock:
+                if not self.queue:
+                    return
+                else:
+                    return self.queue.pop(0)
+
+        end_time = time.time() + timeout
+        while self.running:
+            with self.lock:
+                if self.queue:
+                    return self.queue.pop(0)
+
+            if time.time() > end_time:
+                return
+
+            self.wait(end_time)
+
+    def notify(self):
+        if len(self.waiters) == 0:
+            return
+
+        try:
+            end_time, lock = self.waiters.pop(0)
+            lock.release()
+        except:
+            pass
+
+    def wait(self, end_time):
+        with self.lock:
+            lock = threading.Lock()
+            lock.acquire()
+
+            i = 0
+            is_max = True
+            for i in range(0, len(self.waiters)):
+                if self.waiters[i][0] > end_time:
+                    is_max = False
+                    break
+
+            if is_max:
+                self.waiters.append((end_time, lock))
+            else:
+                self.waiters.insert(i, (end_time, lock))
+
+            old_add_wait()
+
+        lock.acquire()
+
+
+class StdQueue(queue.Queue):
+    # adapt to simple_queue api, get without timeout don't block.
+    def get(self, timeout=None):
+        try:
+            if not timeout:
+                return super(StdQueue, self).get_nowait()
+            return super(StdQueue, self).get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+IMPLEMENTATIONS = [
+    ("simple_queue", simple_queue.Queue),
+    ("old_simple_queue", OldQueue),
+    ("queue.Queue", StdQueue),
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_latency(queue_class, num):
+    # one consumer block on get, measure put to get latency.
+    q = queue_class()
+    latencies = []
+
+    def consumer():
+        for _ in range(num):
+            put_time = q.get(timeout=5)
+            latencies.append(time.time() - put_time)
+
+    th = threading.Thread(target=consumer)
+    th.start()
+    for _ in range(num):
+        q.put(time.time())
+        time.sleep(0.0005)
+    th.join()
+    return percentile(latencies, 50), percentile(latencies, 99)
+
+
+def bench_idle_cpu(queue_class, num, duration):
+    # many queues with a waiter blocked on get, nothing is put.
+    queues = [queue_class() for _ in range(num)]
+    threads = [threading.Thread(target=q.get, kwargs={"timeout": duration}) for q in queues]
+    cpu_start = time.process_time()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return time.process_time() - cpu_start
+
+
+def bench_waiters(queue_class, num, timeout):
+    # many waiters on one queue, measure timeout jitter and the time to wake all by put.
+    q = queue_class()
+    overshoots = []
+
+    def waiter():
+        start = time.time()
+        q.get(timeout=timeout)
+        overshoots.append(time.time() - start - timeout)
+
+    threads = [threading.Thread(target=waiter) for _ in range(num)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    jitter = percentile(overshoots, 99)
+
+    got = []
+
+    def taker():
+        got.append(q.get(timeout=10))
+
+    threads = [threading.Thread(target=taker) for _ in range(num)]
+    for th in threads:
+        th.start()
+    time.sleep(0.2)
+    start = time.time()
+    for i in range(num):
+        q.put(i)
+    for th in threads:
+        th.join()
+    return jitter, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="simple_queue benchmark")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--queues", type=int, default=1000)
+    parser.add_argument("--idle", type=float, default=3)
+    parser.add_argument("--waiters", type=int, default=1000)
+    args = parser.parse_args()
+
+    for name, queue_class in IMPLEMENTATIONS:
+        p50, p99 = bench_latency(queue_class, args.messages)
+        cpu = bench_idle_cpu(queue_class, args.queues, args.idle)
+        jitter, wake_time = bench_waiters(queue_class, args.waiters, 0.5)
+        print("%s:" % name)
+        print("  put/get latency p50:%.3fms p99:%.3fms" % (p50 * 1000, p99 * 1000))
+        print("  idle cpu with %d waiting queues for %.1fs: %.3fs" % (args.queues, args.idle, cpu))
+        print("  %d waiters timeout overshoot p99:%.1fms, wake all by put:%.1fms" % (
+            args.waiters, jitter * 1000, wake_time * 1000))
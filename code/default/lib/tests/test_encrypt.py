@@ -0,0 +1,57 @@
+import os
+import threading
+import unittest
+
+import encrypt
+
+
+class TestCipherContext(unittest.TestCase):
+    methods = ["aes-256-cfb", "aes-128-ctr", "table"]
+
+    def test_compatible_with_encryptor(self):
+        data = os.urandom(3000)
+        for method in self.methods:
+            ctx = encrypt.get_cipher_context("pass", method)
+            self.assertIs(ctx, encrypt.get_cipher_context("pass", method))
+
+            cipher_text = ctx.encrypt(data)
+            self.assertEqual(encrypt.Encryptor("pass", method).decrypt(bytes(cipher_text)), data)
+
+            cipher_text = encrypt.Encryptor("pass", method).encrypt(data)
+            self.assertEqual(ctx.decrypt(memoryview(cipher_text)), data)
+
+    def test_reuse_cipher(self):
+        ctx = encrypt.get_cipher_context("pass", "aes-256-cfb")
+        results = []
+
+        def worker():
+            for i in range(200):
+                data = os.urandom(i * 10 + 1)
+                results.append(ctx.decrypt(ctx.encrypt(data)) == data)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertTrue(all(results))
+        self.assertEqual(len(results), 800)
+
+    def test_empty(self):
+        ctx = encrypt.get_cipher_context("pass", "aes-256-cfb")
+        self.assertEqual(ctx.encrypt(b""), b"")
+        self.assertEqual(ctx.decrypt(b""), b"")
+        self.assertEqual(ctx.decrypt(ctx.encrypt("json string")), b"json string")
+
+    def test_encrypt_segments(self):
+        class Segments(object):
+            def __init__(self, buffer_list):
+                self.buffer_list = buffer_list
+
+            def __len__(self):
+                return sum(len(s) for s in self.buffer_list)
+
+        segments = [os.urandom(20), os.urandom(5000), b"", os.urandom(7)]
+        ctx = encrypt.get_cipher_context("pass", "aes-256-cfb")
+        cipher_text = ctx.encrypt(Segments(segments))
+        self.assertEqual(ctx.decrypt(cipher_text), b"".join(segments))
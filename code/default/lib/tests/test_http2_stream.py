@@ -0,0 +1,42 @@
+import os
+import unittest
+
+import xlog
+from front_base.config import ConfigBase
+from front_base.http_common import Task
+from front_base.http2_stream import Stream
+
+
+class FakeConnection(object):
+    bytes_received = 0
+
+
+class WriteBuffer(object):
+    def __init__(self, buffer_list):
+        self.buffer_list = buffer_list
+
+    def __len__(self):
+        return sum(len(s) for s in self.buffer_list)
+
+
+class TestStreamBody(unittest.TestCase):
+    def test_send_segments(self):
+        logger = xlog.getLogger("test_http2_stream")
+        config = ConfigBase(os.path.join("not_exist", "config.json"))
+        config.load()
+
+        segments = [os.urandom(20), os.urandom(40000), b"", os.urandom(100), os.urandom(30000)]
+        task = Task(logger, config, b"POST", b"host", b"/", {}, WriteBuffer(segments), None, b"", 10)
+        frames = []
+        stream = Stream(logger, config, FakeConnection(), "1.1.1.1", 1, task, frames.append, None,
+                        None, None, None, 65535, 16384)
+        stream.send_left_body()
+        stream.remote_window_size = 65535
+        stream.send_left_body()
+
+        self.assertTrue(stream.request_body_sended)
+        self.assertEqual(b"".join(bytes(f.data) for f in frames), b"".join(segments))
+        self.assertTrue(all(len(f.data) <= 16384 for f in frames))
+        self.assertIn(b"END_STREAM", frames[-1].flags)
+        # frame inside one segment is not copied.
+        self.assertIsInstance(frames[1].data, memoryview)
@@ -1,5 +1,10 @@
 import os
+import ssl
+import socket
+import shutil
 import unittest
+import threading
+import subprocess
 import time
 import utils
 import json
@@ -75,3 +80,124 @@ class HttpClientTest(unittest.TestCase):
                     fp.write(chunk)
                     downloaded += len(chunk)
                     left -= len(chunk)
+
+
+class LocalServer(object):
+    # one response for each connection, tls if ssl_context is given.
+    def __init__(self, ssl_context=None):
+        self.ssl_context = ssl_context
+        self.listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_sock.bind(("127.0.0.1", 0))
+        self.listen_sock.listen(10)
+        self.port = self.listen_sock.getsockname()[1]
+        self.running = True
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while self.running:
+            try:
+                sock, _ = self.listen_sock.accept()
+            except socket.error:
+                break
+            threading.Thread(target=self.handle, args=(sock,), daemon=True).start()
+
+    def handle(self, sock):
+        try:
+            if self.ssl_context:
+                sock = self.ssl_context.wrap_socket(sock, server_side=True)
+            data = b""
+            while b"\r\n\r\n" not in data:
+                d = sock.recv(4096)
+                if not d:
+                    return
+                data += d
+            sock.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+        except Exception:
+            pass
+        finally:
+            sock.close()
+
+    def stop(self):
+        self.running = False
+        self.listen_sock.close()
+
+
+class HttpClientTlsTest(unittest.TestCase):
+    # only the DoH client ask verify_tls,
+    # other callers (check_local_network, update_from_github, download_gae_lib) keep the old behavior.
+
+    @classmethod
+    def setUpClass(cls):
+        if not shutil.which("openssl"):
+            raise unittest.SkipTest("openssl not found")
+
+        cls.cert_dir = tempfile.mkdtemp()
+        cls.cert = os.path.join(cls.cert_dir, "cert.pem")
+        cls.key = os.path.join(cls.cert_dir, "key.pem")
+        subprocess.check_call([
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", cls.key, "-out", cls.cert], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # trusted by the client but for other host.
+        cls.other_cert = os.path.join(cls.cert_dir, "other_cert.pem")
+        cls.other_key = os.path.join(cls.cert_dir, "other_key.pem")
+        subprocess.check_call([
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=dns.example.com", "-addext", "subjectAltName=DNS:dns.example.com",
+            "-keyout", cls.other_key, "-out", cls.other_cert], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cls.cert, cls.key)
+        cls.tls_server = LocalServer(context)
+        cls.plain_server = LocalServer()
+
+        other_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        other_context.load_cert_chain(cls.other_cert, cls.other_key)
+        cls.other_server = LocalServer(other_context)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tls_server.stop()
+        cls.plain_server.stop()
+        cls.other_server.stop()
+        shutil.rmtree(cls.cert_dir)
+
+    def test_network_check_client(self):
+        # check_local_network: Client(proxy, timeout=...) without cert.
+        client = simple_http_client.Client(None, timeout=2)
+        res = client.request("HEAD", "https://127.0.0.1:%d/" % self.plain_server.port, read_payload=False)
+        self.assertEqual(res.status, 200)
+        self.assertNotIsInstance(client.sock, ssl.SSLSocket)
+
+    def test_updater_client(self):
+        # update_from_github first try: Client(timeout=...) without cert.
+        client = simple_http_client.Client(timeout=2)
+        res = client.request("GET", "https://127.0.0.1:%d/" % self.plain_server.port)
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.text, b"ok")
+
+    def test_updater_client_cert(self):
+        # update_from_github retry and download_gae_lib: Client(cert=CA.crt) wrap with system CAs.
+        client = simple_http_client.Client(timeout=2, cert=self.cert)
+        res = client.request("GET", "https://127.0.0.1:%d/" % self.tls_server.port)
+        self.assertIsNone(res)
+
+    def test_verify_tls(self):
+        client = simple_http_client.Client(timeout=2, cert=self.cert, verify_tls=True)
+        res = client.request("GET", "https://127.0.0.1:%d/" % self.tls_server.port)
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.text, b"ok")
+        self.assertIsInstance(client.sock, ssl.SSLSocket)
+
+    def test_verify_tls_fail(self):
+        # self signed cert is not in system CAs.
+        client = simple_http_client.Client(timeout=2, verify_tls=True)
+        res = client.request("GET", "https://127.0.0.1:%d/" % self.tls_server.port)
+        self.assertIsNone(res)
+
+    def test_verify_tls_wrong_host(self):
+        # valid cert of other host is rejected.
+        client = simple_http_client.Client(timeout=2, cert=self.other_cert, verify_tls=True)
+        res = client.request("GET", "https://127.0.0.1:%d/" % self.other_server.port)
+        self.assertIsNone(res)
@@ -0,0 +1,150 @@
+import os
+import time
+import unittest
+
+import xlog
+import simple_http_client
+from front_base.config import ConfigBase
+from front_base import http_common
+from front_base.http_dispatcher import WorkerIndex, HttpsDispatcher
+
+
+class FakeConnectManager(object):
+    def set_ssl_created_cb(self, cb):
+        pass
+
+    def get_ssl_connection(self, timeout=60):
+        time.sleep(0.1)
+        return None
+
+
+class FakeWorker(object):
+    score_changed_cb = None
+
+    def __init__(self, score, version="2"):
+        self.score = score
+        self.version = version
+        self.accept_task = True
+        self.keep_running = True
+        self.streams = {}
+        self.ip_str = "1.1.1.%d" % int(score * 100)
+        self.last_recv_time = time.time()
+        self.continue_fail_tasks = 0
+        self.processed = 0
+
+    def get_score(self):
+        return self.score
+
+    def is_life_end(self):
+        return False
+
+    def request(self, task):
+        self.processed += 1
+        if task.path == b"/no_response":
+            return
+        res = simple_http_client.BaseResponse(status=200)
+        task.responsed = True
+        task.queue.put(res)
+
+    def close(self, reason=""):
+        self.keep_running = False
+        self.accept_task = False
+
+
+class TestWorkerIndex(unittest.TestCase):
+    def test_best_worker(self):
+        index = WorkerIndex()
+        workers = [FakeWorker(s) for s in [0.5, 0.1, 0.3]]
+        for worker in workers:
+            index.add(worker)
+
+        top_score, best_worker, best_score, idle_num = index.get_best()
+        self.assertEqual(top_score, 0.1)
+        self.assertIs(best_worker, workers[1])
+
+        workers[1].accept_task = False
+        top_score, best_worker, best_score, idle_num = index.get_best()
+        self.assertEqual(top_score, 0.1)
+        self.assertIs(best_worker, workers[2])
+
+    def test_update_and_remove(self):
+        index = WorkerIndex()
+        workers = [FakeWorker(s) for s in [0.5, 0.1, 0.3]]
+        for worker in workers:
+            index.add(worker)
+
+        workers[0].score = 0.01
+        index.update(workers[0])
+        self.assertIs(index.get_best()[1], workers[0])
+
+        index.remove(workers[0])
+        self.assertEqual(len(index), 2)
+        self.assertIs(index.get_best()[1], workers[1])
+
+        # update after remove should not put it back.
+        index.update(workers[0])
+        self.assertEqual(len(index), 2)
+
+    def test_idle_num(self):
+        index = WorkerIndex()
+        workers = [FakeWorker(s) for s in [0.1, 0.2, 0.3, 0.4]]
+        for worker in workers:
+            index.add(worker)
+        workers[0].streams = {1: None}
+
+        _, best_worker, _, idle_num = index.get_best(min_idle_num=2)
+        self.assertIs(best_worker, workers[0])
+        self.assertEqual(idle_num, 2)
+
+        _, _, _, idle_num = index.get_best(min_idle_num=10)
+        self.assertEqual(idle_num, 3)
+
+
+class TestShardDispatcher(unittest.TestCase):
+    def test_shard_request(self):
+        config = ConfigBase(os.path.join(os.path.dirname(__file__), "not_exist_config.json"))
+        config.load()
+        config.dispather_shard_num = 3
+        dispatcher = HttpsDispatcher(xlog.getLogger("test_dispatcher"), config, None, FakeConnectManager())
+        try:
+            self.assertEqual(len(dispatcher.shards), 3)
+            workers = [FakeWorker(s) for s in [0.1, 0.2, 0.3, 0.4, 0.5, 0.6]]
+            for worker in workers:
+                dispatcher._add_worker(worker)
+
+            for shard in dispatcher.shards:
+                self.assertEqual(len(shard.worker_index), 2)
+
+            for _ in range(30):
+                res = dispatcher.request(b"GET", b"test.host", b"/", {}, b"", timeout=5)
+                self.assertEqual(res.status, 200)
+
+            # tasks are spread over the shards, all processed.
+            self.assertEqual(sum(w.processed for w in workers), 30)
+
+            dispatcher.close_cb(workers[0])
+            self.assertEqual(len(dispatcher.workers), 5)
+
+            start = time.time()
+            self.assertIsNone(dispatcher.request(b"GET", b"test.host", b"/no_response", {}, b"", timeout=0.3))
+            self.assertLess(time.time() - start, 2)
+        finally:
+            dispatcher.stop()
+
+
+class TestTaskBody(unittest.TestCase):
+    def test_read(self):
+        config = ConfigBase(os.path.join(os.path.dirname(__file__), "not_exist_config.json"))
+        task = http_common.Task(xlog.getLogger("test_dispatcher"), config, b"GET", b"test.host", b"/", {}, b"",
+                                None, b"", 0.2)
+        task.content_length = 10
+        task.put_data(b"12345")
+        task.put_data(memoryview(b"678"))
+        self.assertEqual(task.read(4), b"1234")
+        self.assertEqual(task.read(), b"5")
+        self.assertEqual(task.read(), b"678")
+
+        # no more data, return b'' after timeout.
+        start = time.time()
+        self.assertEqual(task.read(), b"")
+        self.assertGreaterEqual(time.time() - start, 0.15)
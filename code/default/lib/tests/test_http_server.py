@@ -1,3 +1,5 @@
+import time
+import socket
 import unittest
 import utils
 import simple_http_client
@@ -17,3 +19,77 @@ class HttpClientTest(unittest.TestCase):
         print(content)
 
         server.shutdown()
+
+    def request_keep_alive(self, mode):
+        server = simple_http_server.HTTPServer(('127.0.0.1', 0), simple_http_server.TestHttpServer, ".",
+                                               mode=mode, pool_size=2)
+        server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        # more keep-alive connections than workers.
+        socks = [socket.create_connection(("127.0.0.1", port)) for _ in range(5)]
+        rfiles = [sock.makefile("rb") for sock in socks]
+        for i in range(3):
+            for sock, rfile in zip(socks, rfiles):
+                sock.sendall(b"GET / HTTP/1.1\r\nHost: a\r\n\r\n")
+                self.assertEqual(read_response(rfile), b"OK\r\n")
+
+        # pipelined.
+        socks[0].sendall(b"GET / HTTP/1.1\r\nHost: a\r\n\r\n" * 2)
+        self.assertEqual(read_response(rfiles[0]), b"OK\r\n")
+        self.assertEqual(read_response(rfiles[0]), b"OK\r\n")
+
+        for sock in socks:
+            sock.close()
+        server.shutdown()
+        return server
+
+    def test_pool(self):
+        server = self.request_keep_alive("pool")
+        server.http_thread.join(5)
+        self.assertFalse(server.http_thread.is_alive())
+
+    def test_asyncio(self):
+        server = self.request_keep_alive("asyncio")
+        server.http_thread.join(5)
+        self.assertFalse(server.http_thread.is_alive())
+
+    def stop_in_request(self, mode):
+        # like the launcher allow_remote switch, shutdown in a request still answer it.
+        server = simple_http_server.HTTPServer(('127.0.0.1', 0), StopHandler, None, mode=mode, pool_size=2)
+        server.args = server
+        server.start()
+        port = server.sockets[0].getsockname()[1]
+
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(b"GET /stop HTTP/1.1\r\nHost: a\r\n\r\n")
+        self.assertEqual(read_response(sock.makefile("rb")), b"stopped")
+        sock.close()
+        server.http_thread.join(5)
+        self.assertFalse(server.http_thread.is_alive())
+
+    def test_pool_stop_in_request(self):
+        self.stop_in_request("pool")
+
+    def test_asyncio_stop_in_request(self):
+        self.stop_in_request("asyncio")
+
+
+class StopHandler(simple_http_server.HttpServerHandler):
+    def do_GET(self):
+        self.args.shutdown()
+        time.sleep(0.2)
+        self.send_response(b"text/plain", b"stopped")
+
+
+def read_response(rfile):
+    length = 0
+    while True:
+        line = rfile.readline()
+        if not line:
+            raise Exception("closed")
+        if line == b"\r\n":
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    return rfile.read(length)
@@ -0,0 +1,320 @@
+import time
+import socket
+import unittest
+import threading
+
+import xlog
+import selectors2 as selectors
+from front_base.io_loop import IoLoop, IoLoopPool, LoopSendQueue
+
+
+logger = xlog.getLogger("test_io_loop")
+
+
+class FakeWorker(object):
+    # like the http2 worker in io_loop mode, on a plain socket.
+    def __init__(self, io_loop, sock, recv_timeout=240):
+        self.io_loop = io_loop
+        self.ssl_sock = sock
+        self.ip_str = "127.0.0.1"
+        self.keep_running = True
+        self.close_reason = None
+        self.closed = threading.Event()
+        self.received = bytearray()
+        self.recv_event = threading.Event()
+        self.send_buf = None
+        self.write_blocked = 0
+        self.recv_timeout = recv_timeout
+        self.last_recv_time = time.time()
+        self.check_num = 0
+        sock.setblocking(False)
+        self.send_queue = LoopSendQueue(io_loop, self)
+
+    def loop_recv(self):
+        while True:
+            try:
+                data = self.ssl_sock.recv(65536)
+            except BlockingIOError:
+                break
+
+            if not data:
+                self.close("closed by peer")
+                return
+            if data == b"raise":
+                raise Exception("recv except")
+
+            self.received += data
+            self.last_recv_time = time.time()
+        self.recv_event.set()
+
+    def loop_send(self):
+        while True:
+            if not self.send_buf:
+                out = []
+                while self.send_queue.frames:
+                    frame = self.send_queue.get()
+                    if frame:
+                        out.append(frame)
+                if not out:
+                    self.io_loop.set_write_interest(self, False)
+                    return
+                self.send_buf = memoryview(b"".join(out))
+
+            try:
+                sent = self.ssl_sock.send(self.send_buf)
+            except BlockingIOError:
+                self.write_blocked += 1
+                self.io_loop.set_write_interest(self, True)
+                return
+
+            self.send_buf = self.send_buf[sent:]
+
+    def loop_check_timeout(self, now):
+        self.check_num += 1
+        if now - self.last_recv_time > self.recv_timeout:
+            self.close("recv timeout")
+
+    def close(self, reason):
+        self.keep_running = False
+        self.close_reason = reason
+        self.io_loop.remove(self)
+        self.closed.set()
+
+
+def wait_until(fn, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if fn():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def recv_all(sock, size, timeout=5):
+    sock.settimeout(timeout)
+    data = b""
+    while len(data) < size:
+        d = sock.recv(size - len(data))
+        if not d:
+            break
+        data += d
+    return data
+
+
+class TestIoLoop(unittest.TestCase):
+    def setUp(self):
+        self.loop = IoLoop(logger, "test_io_loop")
+        self.socks = []
+
+    def tearDown(self):
+        self.loop.stop()
+        self.loop.th.join(5)
+        for sock in self.socks:
+            sock.close()
+
+    def create_worker(self, **kwargs):
+        worker_sock, peer_sock = socket.socketpair()
+        self.socks += [worker_sock, peer_sock]
+        worker = FakeWorker(self.loop, worker_sock, **kwargs)
+        return worker, peer_sock
+
+    def registered(self, worker):
+        return worker.io_fd in self.loop.handlers and worker.io_fd in self.loop.selector.get_map()
+
+    def test_add_recv(self):
+        worker, peer = self.create_worker()
+        # received before add is read by _add.
+        peer.sendall(b"first")
+        self.loop.add(worker)
+        self.assertTrue(wait_until(lambda: worker.received == b"first"))
+        self.assertTrue(self.registered(worker))
+
+        peer.sendall(b"second")
+        self.assertTrue(wait_until(lambda: worker.received == b"firstsecond"))
+
+    def test_send_order(self):
+        worker, peer = self.create_worker()
+        # frames put before add are sent by _add.
+        worker.send_queue.put(b"0000,")
+        self.loop.add(worker)
+
+        expected = b"".join(b"%04d," % i for i in range(2000))
+        for i in range(1, 2000):
+            worker.send_queue.put(b"%04d," % i)
+
+        self.assertEqual(recv_all(peer, len(expected)), expected)
+        self.assertTrue(wait_until(lambda: not worker.io_send_scheduled))
+        self.assertEqual(worker.send_queue._qsize(), 0)
+
+    def test_send_order_threads(self):
+        worker, peer = self.create_worker()
+        self.loop.add(worker)
+
+        def put(name):
+            for i in range(500):
+                worker.send_queue.put(b"%s%03d," % (name, i))
+
+        ths = [threading.Thread(target=put, args=(name,)) for name in [b"a", b"b", b"c"]]
+        for th in ths:
+            th.start()
+        for th in ths:
+            th.join()
+
+        data = recv_all(peer, 3 * 500 * 5)
+        frames = data.split(b",")[:-1]
+        self.assertEqual(len(frames), 1500)
+        for name in [b"a", b"b", b"c"]:
+            # order is kept for each thread.
+            self.assertEqual([f for f in frames if f.startswith(name)], [b"%s%03d" % (name, i) for i in range(500)])
+
+    def test_partial_write(self):
+        worker, peer = self.create_worker()
+        worker.ssl_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        peer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.loop.add(worker)
+
+        frame = b"x" * 100000
+        for i in range(10):
+            worker.send_queue.put(frame[:-1] + b"%d" % i)
+
+        # peer don't read, socket buffer full and the loop wait for writable.
+        self.assertTrue(wait_until(lambda: worker.write_blocked > 0))
+        self.assertEqual(worker.io_events, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+        data = recv_all(peer, len(frame) * 10)
+        self.assertEqual(len(data), len(frame) * 10)
+        for i in range(10):
+            self.assertEqual(data[(i + 1) * len(frame) - 1:(i + 1) * len(frame)], b"%d" % i)
+
+        self.assertTrue(wait_until(lambda: worker.io_events == selectors.EVENT_READ))
+
+        # recv still work after.
+        peer.sendall(b"ping")
+        self.assertTrue(wait_until(lambda: worker.received == b"ping"))
+
+    def test_timeout_check(self):
+        worker, peer = self.create_worker(recv_timeout=0.2)
+        self.loop.add(worker)
+        self.assertTrue(wait_until(lambda: self.registered(worker)))
+
+        # checked every second.
+        self.loop.last_check_time = 0
+        self.loop.call_soon(lambda: None)
+        self.assertTrue(wait_until(lambda: worker.check_num > 0))
+        self.assertTrue(worker.keep_running)
+
+        time.sleep(0.3)
+        self.loop.last_check_time = 0
+        self.loop.call_soon(lambda: None)
+        self.assertTrue(worker.closed.wait(5))
+        self.assertEqual(worker.close_reason, "recv timeout")
+        self.assertTrue(wait_until(lambda: not self.registered(worker)))
+
+    def test_idle_check(self):
+        # active worker is not closed, idle one is.
+        active, active_peer = self.create_worker(recv_timeout=1.5)
+        idle, idle_peer = self.create_worker(recv_timeout=1.5)
+        self.loop.add(active)
+        self.loop.add(idle)
+
+        end = time.time() + 3
+        while time.time() < end and not idle.closed.is_set():
+            active_peer.sendall(b"a")
+            time.sleep(0.1)
+
+        self.assertTrue(idle.closed.is_set())
+        self.assertTrue(active.keep_running)
+        self.assertTrue(self.registered(active))
+        self.assertTrue(wait_until(lambda: not self.registered(idle)))
+
+    def test_close_unregister(self):
+        worker, peer = self.create_worker()
+        self.loop.add(worker)
+        self.assertTrue(wait_until(lambda: self.registered(worker)))
+
+        # closed by other thread.
+        worker.close("close")
+        self.assertTrue(wait_until(lambda: not self.registered(worker)))
+
+        # removed worker don't get data or send.
+        peer.sendall(b"data")
+        worker.send_queue.put(b"data")
+        time.sleep(0.1)
+        self.assertEqual(worker.received, b"")
+        peer.settimeout(0.1)
+        self.assertRaises(socket.timeout, peer.recv, 10)
+
+    def test_close_by_peer(self):
+        worker, peer = self.create_worker()
+        self.loop.add(worker)
+        self.assertTrue(wait_until(lambda: self.registered(worker)))
+
+        peer.close()
+        self.assertTrue(worker.closed.wait(5))
+        self.assertEqual(worker.close_reason, "closed by peer")
+        self.assertTrue(wait_until(lambda: not self.registered(worker)))
+
+    def test_except_close(self):
+        worker, peer = self.create_worker()
+        self.loop.add(worker)
+        self.assertTrue(wait_until(lambda: self.registered(worker)))
+
+        peer.sendall(b"raise")
+        self.assertTrue(worker.closed.wait(5))
+        self.assertTrue(worker.close_reason.startswith("io_loop except"))
+        self.assertTrue(wait_until(lambda: not self.registered(worker)))
+
+        # loop still work for others.
+        other, other_peer = self.create_worker()
+        self.loop.add(other)
+        other_peer.sendall(b"ok")
+        self.assertTrue(wait_until(lambda: other.received == b"ok"))
+
+    def test_add_closed(self):
+        worker, peer = self.create_worker()
+        worker.keep_running = False
+        self.loop.add(worker)
+        time.sleep(0.1)
+        self.assertNotIn(worker.io_fd, self.loop.handlers)
+
+    def test_remove_in_loop(self):
+        worker, peer = self.create_worker()
+        self.loop.add(worker)
+        self.assertTrue(wait_until(lambda: self.registered(worker)))
+
+        self.loop.call_soon(self.loop.remove, worker)
+        self.assertTrue(wait_until(lambda: not self.registered(worker)))
+        # remove twice is ok.
+        self.loop.remove(worker)
+        time.sleep(0.05)
+        self.assertTrue(self.loop.th.is_alive())
+
+    def test_call_soon_order(self):
+        result = []
+        for i in range(100):
+            self.loop.call_soon(result.append, i)
+        self.assertTrue(wait_until(lambda: len(result) == 100))
+        self.assertEqual(result, list(range(100)))
+
+    def test_stop(self):
+        worker, peer = self.create_worker()
+        self.loop.add(worker)
+        self.assertTrue(wait_until(lambda: self.registered(worker)))
+
+        self.loop.stop()
+        self.loop.th.join(5)
+        self.assertFalse(self.loop.th.is_alive())
+        self.assertEqual(self.loop.handlers, {})
+
+
+class TestIoLoopPool(unittest.TestCase):
+    def test_round_robin(self):
+        pool = IoLoopPool(logger, 3, "test_pool")
+        try:
+            loops = [pool.get() for _ in range(6)]
+            self.assertEqual(len(set(loops)), 3)
+            self.assertEqual(loops[:3], loops[3:])
+        finally:
+            pool.stop()
+            for loop in pool.loops:
+                loop.th.join(5)
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+
+import xlog
+from front_base.config import ConfigBase
+from front_base.ip_manager import IpManager
+
+
+class FakeCheckLocalNetwork(object):
+    def report_ok(self, ip_str=None):
+        pass
+
+    def report_fail(self, ip_str=None):
+        pass
+
+    def is_ok(self, ip_str=None):
+        return True
+
+
+class FakeHostManager(object):
+    def get_sni_host(self, ip_str):
+        return "sni.com", "host.com"
+
+
+class TestIpRank(unittest.TestCase):
+    def setUp(self):
+        config = ConfigBase(os.path.join(tempfile.gettempdir(), "not_exist_config.json"))
+        config.load()
+        self.ip_manager = IpManager(xlog.getLogger("test_ip_manager"), config, None, FakeHostManager(),
+                                    FakeCheckLocalNetwork(), None, None, None)
+
+    def tearDown(self):
+        self.ip_manager.stop()
+
+    def assert_sorted(self):
+        rates = [self.ip_manager._ip_rate(self.ip_manager.ip_dict[ip_str]) for ip_str in self.ip_manager.ip_list]
+        self.assertEqual(rates, sorted(rates))
+
+    def test_rank_update(self):
+        m = self.ip_manager
+        m.add_ip("1.1.1.1", 300, "a.com", "gws", scan_result=False)
+        m.add_ip("2.2.2.2", 200, "a.com", "gws", scan_result=False)
+        m.add_ip("3.3.3.3", 100, "a.com", "gvs", scan_result=False)
+        self.assertEqual(list(m.ip_list), ["2.2.2.2", "1.1.1.1"])
+
+        m.update_ip("1.1.1.1", None, 100)
+        self.assertEqual(list(m.ip_list), ["1.1.1.1", "2.2.2.2"])
+
+        m.report_connect_fail("1.1.1.1")
+        self.assertEqual(list(m.ip_list), ["2.2.2.2", "1.1.1.1"])
+        self.assert_sorted()
+
+        m.report_connect_closed("2.2.2.2", reason="down fail")
+        self.assertEqual(m.ip_dict["2.2.2.2"]["down_fail"], 1)
+        self.assertEqual(list(m.ip_list), ["1.1.1.1", "2.2.2.2"])
+
+        m.report_connect_fail("2.2.2.2", force_remove=True)
+        self.assertEqual(list(m.ip_list), ["1.1.1.1"])
+        self.assertNotIn("2.2.2.2", m.ip_rank)
+
+    def test_get_best_ip(self):
+        m = self.ip_manager
+        for i in range(100):
+            m.add_ip("10.0.0.%d" % i, 1000 - i, "a.com", "gws", scan_result=False)
+        self.assert_sorted()
+
+        host_info = m.get_ip_sni_host()
+        self.assertEqual(host_info["ip_str"], "10.0.0.99")
+
+        m.max_good_ip_num = 10
+        m.remove_slowest_ip()
+        self.assertEqual(len(m.ip_list), 10)
+        self.assertEqual(m.ip_list[-1], "10.0.0.90")
+
+    def test_resumed_handshake(self):
+        m = self.ip_manager
+        m.add_ip("1.1.1.1", 300, "a.com", "gws", scan_result=False)
+        m.add_ip("2.2.2.2", 200, "a.com", "gws", scan_result=False)
+        m.report_connect_fail("2.2.2.2", force_remove=False)
+
+        # resumed handshake is fast, it should not change the rank.
+        m.update_ip("1.1.1.1", None, 20, resumed=True)
+        m.update_ip("2.2.2.2", None, 3, resumed=True)
+        self.assertEqual(m.ip_dict["1.1.1.1"]["handshake_time"], 300)
+        self.assertEqual(m.ip_dict["2.2.2.2"]["fail_times"], 0)
+        self.assertEqual(list(m.ip_list), ["2.2.2.2", "1.1.1.1"])
@@ -0,0 +1,40 @@
+import random
+import unittest
+import ipaddress
+
+from ip_prefix import IpPrefixIndex
+
+
+class TestIpPrefixIndex(unittest.TestCase):
+    def test_cidr(self):
+        index = IpPrefixIndex(["1.2.3.0/24", "1.2.0.0/16", "91.108.56.0/22", "2001:b28:f23d::/48", "8.8.8.8"])
+        index.add_range("10.0.0.1", "10.0.0.9")
+        index.build()
+
+        self.assertEqual(len(index), 5)
+        self.assertIn("1.2.200.1", index)
+        self.assertIn(b"91.108.59.255", index)
+        self.assertNotIn("91.108.60.0", index)
+        self.assertIn("8.8.8.8", index)
+        self.assertNotIn("8.8.8.9", index)
+        self.assertIn("10.0.0.9", index)
+        self.assertNotIn("10.0.0.0", index)
+        self.assertIn("2001:b28:f23d:1::1", index)
+        self.assertNotIn("2001:b28:f23e::1", index)
+        self.assertNotIn("1.2.3", index)
+        self.assertNotIn("www.google.com", index)
+
+        self.assertRaises(ValueError, index.add_cidr, "1.2.3.0/33")
+        self.assertRaises(ValueError, index.add_range, "1.2.3.4", "1.2.3.1")
+
+    def test_same_as_networks(self):
+        cidrs = []
+        for _ in range(300):
+            bits = random.randint(8, 28)
+            cidrs.append("%s/%d" % (ipaddress.IPv4Address(random.getrandbits(32)), bits))
+        index = IpPrefixIndex(cidrs)
+        networks = [ipaddress.ip_network(c, strict=False) for c in cidrs]
+
+        for _ in range(3000):
+            ip = ipaddress.IPv4Address(random.getrandbits(32))
+            self.assertEqual(str(ip) in index, any(ip in n for n in networks), ip)
@@ -0,0 +1,118 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import xlog
+from front_base.config import ConfigBase
+from front_base.ip_store import IpStore
+from front_base.ip_manager import IpManagerBase
+
+
+logger = xlog.getLogger("test_ip_store")
+
+
+class TestIpStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp_path, "ip.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_save_load(self):
+        store = IpStore(logger, self.fn, "<64p16pIII")
+        store.save_all({
+            "1.2.3.4": (b"a.com", b"gws", 100, 0, 0),
+            "2001:db8::1": (b"b.com", b"gws", 200, 1, 2),
+        })
+        store.update({"5.6.7.8": (b"c.com", b"gvs", 300, 0, 0)})
+        store.update({"1.2.3.4": (b"a.com", b"gws", 150, 1, 0)})
+        store.close()
+
+        res = IpStore(logger, self.fn, "<64p16pIII").load()
+        self.assertEqual(res["1.2.3.4"], (b"a.com", b"gws", 150, 1, 0))
+        self.assertEqual(res["2001:db8::1"], (b"b.com", b"gws", 200, 1, 2))
+        self.assertEqual(res["5.6.7.8"], (b"c.com", b"gvs", 300, 0, 0))
+
+    def test_remove_reuse_slot(self):
+        store = IpStore(logger, self.fn, "<d")
+        store.update({"1.1.1.1": (1.0,), "2.2.2.2": (2.0,), "3.3.3.3": (3.0,)})
+        size = os.path.getsize(self.fn)
+
+        store.update({"2.2.2.2": None})
+        store.update({"4.4.4.4": (4.0,)})
+        self.assertEqual(os.path.getsize(self.fn), size)
+        store.close()
+
+        store = IpStore(logger, self.fn, "<d")
+        self.assertEqual(store.load(), {"1.1.1.1": (1.0,), "3.3.3.3": (3.0,), "4.4.4.4": (4.0,)})
+
+    def test_format_change(self):
+        store = IpStore(logger, self.fn, "<d")
+        store.update({"1.1.1.1": (1.0,)})
+        store.close()
+
+        store = IpStore(logger, self.fn, "<dd")
+        self.assertIsNone(store.load())
+
+        # file is reset, update don't write under the old header.
+        store.update({"2.2.2.2": (2.0, 3.0)})
+        store.close()
+        self.assertEqual(IpStore(logger, self.fn, "<dd").load(), {"2.2.2.2": (2.0, 3.0)})
+
+    def test_too_long(self):
+        store = IpStore(logger, self.fn, "<64p16pIII")
+        store.save_all({
+            "1.2.3.4": (b"a.com", b"gws", 100, 0, 0),
+            "2.2.2.2": (b"a" * 64, b"gws", 100, 0, 0),
+        })
+        store.update({
+            "3.3.3.3": (b"c.com", b"server_name_too_long", 300, 0, 0),
+            "4" * 64: (b"d.com", b"gws", 300, 0, 0),
+            "5.5.5.5": (b"e" * 63, b"s" * 15, 300, 0, 0),
+        })
+        # existing ip changed to a too long value is removed.
+        store.update({"1.2.3.4": (b"a" * 100, b"gws", 100, 0, 0)})
+        store.close()
+
+        res = IpStore(logger, self.fn, "<64p16pIII").load()
+        self.assertEqual(res, {"5.5.5.5": (b"e" * 63, b"s" * 15, 300, 0, 0)})
+
+    def test_migrate_speed_json(self):
+        speed_fn = os.path.join(self.tmp_path, "speed.json")
+        with open(speed_fn, "w") as fd:
+            json.dump({"1.2.3.4": {"score": 0.1, "rtt": 0.2, "speed": 1000.0}}, fd)
+
+        config = ConfigBase(os.path.join(self.tmp_path, "config.json"))
+        config.load()
+        ip_manager = IpManagerBase(config, None, logger, speed_fn)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_path, "speed.bin")))
+
+        ip_manager.update_score("1.2.3.4", 0.5)
+        ip_manager.save_ip_str_info()
+        ip_manager.speed_store.close()
+
+        ip_manager = IpManagerBase(config, None, logger, speed_fn)
+        self.assertEqual(ip_manager.get_score("1.2.3.4"), 0.5)
+        self.assertEqual(ip_manager.get_speed("1.2.3.4"), (1000.0, 0.2))
+
+    def test_broken_speed_store(self):
+        speed_fn = os.path.join(self.tmp_path, "speed.json")
+        with open(speed_fn, "w") as fd:
+            json.dump({"1.2.3.4": {"score": 0.1, "rtt": 0.2, "speed": 1000.0}}, fd)
+        with open(os.path.join(self.tmp_path, "speed.bin"), "wb") as fd:
+            fd.write(b"broken" * 10)
+
+        config = ConfigBase(os.path.join(self.tmp_path, "config.json"))
+        config.load()
+        ip_manager = IpManagerBase(config, None, logger, speed_fn)
+        self.assertEqual(ip_manager.get_speed("1.2.3.4"), (1000.0, 0.2))
+
+        ip_manager.update_score("1.2.3.4", 0.5)
+        ip_manager.save_ip_str_info()
+        ip_manager.speed_store.close()
+
+        ip_manager = IpManagerBase(config, None, logger, speed_fn)
+        self.assertEqual(ip_manager.get_score("1.2.3.4"), 0.5)
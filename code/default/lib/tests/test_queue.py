@@ -1,7 +1,7 @@
 import time
 import threading
 from unittest import TestCase
-# from simple_queue import Queue
+import simple_queue
 from  queue import Queue
 
 
@@ -22,3 +22,35 @@ class TestSimpleQueue(TestCase):
         threading.Thread(target=self.pub, args=(q1, "b")).start()
         v = q1.get(5)
         self.assertEqual(v, "b")
+
+    def test_simple_queue(self):
+        q1 = simple_queue.Queue()
+        self.assertIsNone(q1.get())
+        q1.put("a")
+        q1.put("b")
+        self.assertEqual(q1.get(), "a")
+        self.assertEqual(q1.get(1), "b")
+
+        t0 = time.time()
+        self.assertIsNone(q1.get(0.2))
+        self.assertLess(time.time() - t0, 0.3)
+
+        threading.Timer(0.1, q1.put, args=("c",)).start()
+        self.assertEqual(q1.get(5), "c")
+
+    def test_simple_queue_reset(self):
+        q1 = simple_queue.Queue()
+        results = []
+
+        def waiter():
+            results.append(q1.get(10))
+
+        threads = [threading.Thread(target=waiter) for _ in range(5)]
+        for th in threads:
+            th.start()
+        time.sleep(0.1)
+
+        q1.reset()
+        for th in threads:
+            th.join(2)
+        self.assertEqual(results, [None] * 5)
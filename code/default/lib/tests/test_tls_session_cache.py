@@ -0,0 +1,27 @@
+import time
+import unittest
+
+from front_base.tls_session_cache import TlsSessionCache
+
+
+class TestTlsSessionCache(unittest.TestCase):
+    def test_lru_ttl(self):
+        cache = TlsSessionCache(ttl=3600, max_size=2)
+        cache.put("1.1.1.1:443", "a.com", "s1")
+        cache.put("2.2.2.2:443", "a.com", "s2")
+        cache.put("2.2.2.2:443", "b.com", None)
+        self.assertEqual(cache.get("1.1.1.1:443", "a.com"), "s1")
+
+        # 2.2.2.2 is the least recently used.
+        cache.put("3.3.3.3:443", "a.com", "s3")
+        self.assertIsNone(cache.get("2.2.2.2:443", "a.com"))
+        self.assertEqual(cache.get("3.3.3.3:443", "a.com"), "s3")
+
+        cache.remove("3.3.3.3:443", "a.com")
+        self.assertIsNone(cache.get("3.3.3.3:443", "a.com"))
+
+        cache.cache[("1.1.1.1:443", "a.com")] = ("s1", time.time() - 1)
+        self.assertIsNone(cache.get("1.1.1.1:443", "a.com"))
+        status = cache.status()
+        self.assertEqual(status["size"], 0)
+        self.assertEqual((status["hit"], status["miss"]), (2, 3))
@@ -28,6 +28,11 @@ class TestIP(unittest.TestCase):
         res = utils.is_private_ip(ip)
         self.assertFalse(res)
 
+        for ip in ["10.1.2.3", b"127.0.0.1", "172.31.255.255", "192.168.1.1", "::1", "fd00:1::2"]:
+            self.assertTrue(utils.is_private_ip(ip), ip)
+        for ip in ["8.8.8.8", "172.32.0.1", "192.169.0.1", "2001:db8::1", "10.1.2.3:443", ""]:
+            self.assertFalse(utils.is_private_ip(ip), ip)
+
     def test_merge_dict(self):
         x = {'a': 1, 'b': 2}
         y = {'b': 3, 'c': 4}
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import xlog
+
+
+class TestAsyncLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.logger = xlog.Logger("test_async_log", buffer_size=10, file_name=os.path.join(self.tmp_path, "t.log"))
+        self.logger.set_console_color = lambda color: None
+
+    def tearDown(self):
+        xlog.set_async_mode(False)
+        self.logger.log_fd.close()
+        shutil.rmtree(self.tmp_path)
+
+    def read_lines(self):
+        with open(self.logger.log_filename, "r") as fd:
+            return fd.read().splitlines()
+
+    def test_write(self):
+        xlog.set_async_mode(True, flush_interval=10)
+        for i in range(100):
+            self.logger.info("line %d %s", i, b"bytes")
+        self.assertEqual(self.read_lines(), [])
+
+        xlog.set_async_mode(False)
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 100)
+        self.assertTrue(lines[-1].endswith("[INFO] line 99 bytes"))
+        self.assertIn("line 99 bytes", self.logger.get_last_lines(1))
+
+    def test_drop(self):
+        xlog.set_async_mode(True, flush_interval=10, max_queue_size=10)
+        for i in range(30):
+            self.logger.info("line %d", i)
+        xlog.set_async_mode(False)
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 11)
+        self.assertTrue(lines[-1].endswith("log queue full, dropped 20 lines"))
+
+
+class Arg(object):
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "arg"
+
+    def __repr__(self):
+        self.formatted += 1
+        return "arg"
+
+
+class TestHasSink(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.logger = xlog.Logger("test_has_sink")
+        self.logger.set_console(False)
+
+    def tearDown(self):
+        xlog.set_async_mode(False)
+        if self.logger.warning_log:
+            self.logger.warning_log.close()
+        shutil.rmtree(self.tmp_path)
+
+    def test_no_sink(self):
+        arg = Arg()
+        self.assertFalse(self.logger.has_sink("ERROR"))
+        self.logger.info("%s", arg)
+        self.logger.error("%r", arg)
+        self.assertEqual(arg.formatted, 0)
+
+        xlog.set_async_mode(True, flush_interval=10)
+        self.logger.error("%s", arg)
+        self.assertEqual(len(xlog.async_writer.queue), 0)
+
+    def test_level(self):
+        arg = Arg()
+        self.logger.set_buffer(10)
+        self.logger.setLevel("WARN")
+        self.assertFalse(self.logger.has_sink("INFO"))
+        self.assertTrue(self.logger.has_sink("WARNING"))
+
+        self.logger.log("INFO", None, "", "%s", arg)
+        self.assertEqual(arg.formatted, 0)
+
+        self.logger.warning("%s", arg)
+        self.assertEqual(arg.formatted, 1)
+        self.assertIn("arg", self.logger.get_last_lines(1))
+
+    def test_warning_log(self):
+        self.logger.warning_log = open(os.path.join(self.tmp_path, "warning.log"), "a")
+        self.assertFalse(self.logger.has_sink("INFO"))
+        self.assertTrue(self.logger.has_sink("WARNING"))
+
+        arg = Arg()
+        self.logger.info("%s", arg)
+        self.assertEqual(arg.formatted, 0)
+        self.logger.error("%s", arg)
+        self.assertEqual(arg.formatted, 1)
+
+    def test_console(self):
+        self.logger.set_console(True)
+        self.assertTrue(self.logger.has_sink("DEBUG"))
@@ -69,14 +69,21 @@ def load_config():
     config.set_var("dns_port", 53)
     config.set_var("dns_backup_port", 8053)
     config.set_var("udp_relay_port", 8086)
+    config.set_var("dns_server_worker_num", 8)
+    config.set_var("dns_server_cache_size", 1000)  # 0 to disable the response cache
 
     config.set_var("proxy_bind_ip", "127.0.0.1")
     config.set_var("proxy_port", 8086)
 
     config.set_var("dns_cache_size", 200)
     config.set_var("pip_cache_size", 32*1024)
+    config.set_var("pipe_thread_num", 1)
+    config.set_var("pipe_splice", 1)  # linux only, plain TCP pairs relay in kernel
     config.set_var("ip_cache_size", 1000)
     config.set_var("dns_ttl", 60*30)
+    config.set_var("dns_negative_ttl", 30)
+    config.set_var("dns_query_worker_num", 16)
+    config.set_var("dns_query_fanout", 2)  # resolvers queried at first, the others only if they all fail
     config.set_var("direct_split_SNI", 1)
 
     config.set_var("pac_policy", "smart-router")
@@ -130,7 +137,8 @@ def start(args):
 
     connect_manager.load_proxy_config()
     g.connect_manager = connect_manager.ConnectManager()
-    g.pipe_socks = pipe_socks.PipeSocks(g.config.pip_cache_size)
+    g.pipe_socks = pipe_socks.PipeSocksGroup(g.config.pip_cache_size, g.config.pipe_thread_num,
+                                             g.config.pipe_splice)
     g.pipe_socks.run()
 
     allow_remote = args.get("allow_remote", 0)
@@ -161,12 +169,16 @@ def start(args):
         listen_ips.append("0.0.0.0")
 
     g.local_ips = dns_query.get_local_ips()
-    g.dns_query = dns_query.CombineDnsQuery()
+    g.dns_query = dns_query.CombineDnsQuery(negative_ttl=g.config.dns_negative_ttl,
+                                            worker_num=g.config.dns_query_worker_num,
+                                            fanout=g.config.dns_query_fanout)
 
     g.dns_srv = dns_server.DnsServer(
         bind_ip=listen_ips, port=g.config.dns_port,
         backup_port=g.config.dns_backup_port,
-        ttl=g.config.dns_ttl)
+        ttl=g.config.dns_ttl,
+        worker_num=g.config.dns_server_worker_num,
+        cache_size=g.config.dns_server_cache_size)
     g.dns_srv.start()
     xlog.debug("DNS server port %d", g.dns_srv.listen_port)
 
@@ -1,5 +1,6 @@
 import os
 import sys
+import errno
 import socket
 import operator
 import time
@@ -17,7 +18,8 @@ if __name__ == '__main__':
 
 
 from .socket_wrap import SocketWrap
-from queue import Queue
+from xx_six import BlockingIOError
+import selectors2 as selectors
 import socks
 from . import global_var as g
 from xlog import getLogger
@@ -42,63 +44,120 @@ def load_proxy_config():
                                 g.config.PROXY_USER, g.config.PROXY_PASSWD)
 
 
+class ConnectTask(object):
+    def __init__(self, host, port, ips, end_time):
+        self.host = host
+        self.port = port
+        self.host_port = "%s:%d" % (host, port)
+        self.ips = ips  # not tried yet, in happy eyeballs order
+        self.attempts = {}  # sock => (ip, start_time)
+        self.end_time = end_time
+        self.next_attempt_time = 0
+        self.result = None
+        self.abandoned = False
+        self.done = threading.Event()
+
+
+def interleave_ips(ips):
+    # RFC 8305 4: alternate address family, start with the family of the first(fastest) ip.
+    first = [ip for ip in ips if (b":" in ip) == (b":" in ips[0])]
+    second = [ip for ip in ips if (b":" in ip) != (b":" in ips[0])]
+    out = []
+    for i in range(max(len(first), len(second))):
+        out += first[i:i + 1] + second[i:i + 1]
+    return out
+
+
+def is_alive(sock):
+    # idle socket is readable only when peer closed it, or sent something first.
+    timeout = sock.gettimeout()
+    try:
+        sock.settimeout(0)
+        return sock.recv(1, socket.MSG_PEEK) != b""
+    except BlockingIOError:
+        return True
+    except Exception:
+        return False
+    finally:
+        try:
+            sock.settimeout(timeout)
+        except Exception:
+            pass
+
+
 class ConnectManager(object):
-    def __init__(self, connection_timeout=15, connect_threads=3, connect_timeout=5):
+    # Happy eyeballs(RFC 8305) on one selector thread:
+    # ips are tried in connect time order of IpRecord with address families interleaved,
+    # next ip is tried every attempt_delay until one is connected, or at once when an attempt fail.
+    # Attempts connected after the winner are kept in the idle pool of the host:port,
+    # pooled sockets are reused for the next request if still alive and younger than connection_timeout.
+    # With LAN proxy, socks handshake is blocking, ips are tried one by one in the caller thread.
+    def __init__(self, connection_timeout=15, connect_timeout=5, attempt_delay=0.25, pool_size=4):
         self.lock = threading.Lock()
         self.cache = {}
-        # host => [ { "conn":.., "create_time" }
+        # host_port => [ { "conn":.., "create_time" }
         #    ... ]
         self.connection_timeout = connection_timeout
         self.connect_timeout = connect_timeout
-        self.connect_threads = connect_threads
+        self.attempt_delay = attempt_delay
+        self.pool_size = pool_size
+
+        self.selector = selectors.DefaultSelector()
+        self.new_tasks = []
+        self.tasks = []
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        self.last_check_time = time.time()
 
         self.running = True
-        threading.Thread(target=self.connection_check_worker, name="smart_router_conn_checker").start()
+        self.th = threading.Thread(target=self.loop, name="smart_router_connect_loop")
+        self.th.start()
 
     def stop(self):
         self.running = False
+        self.wake()
 
-    def connection_check_worker(self):
-        while self.running:
-            time_now = time.time()
-            with self.lock:
-                for host_port in list(self.cache.keys()):
-                    try:
-                        cache = self.cache[host_port]
-                        for cc in list(cache):
-                            if time_now - cc["create_time"] > self.connection_timeout:
-                                cache.remove(cc)
-                                cc["conn"].close()
-                    except:
-                        pass
-
-            time.sleep(10)
+    def wake(self):
+        try:
+            self.wake_w.send(b"w")
+        except (socket.error, OSError):
+            pass
 
     def add_sock(self, host_port, sock):
         with self.lock:
-            if host_port not in self.cache:
-                self.cache[host_port] = []
-            self.cache[host_port].append({"create_time": time.time(), "conn": sock})
+            cache = self.cache.setdefault(host_port, [])
+            if len(cache) >= self.pool_size:
+                sock.close()
+                return
+            cache.append({"create_time": time.time(), "conn": sock})
 
     def get_sock_from_cache(self, host_port):
         time_now = time.time()
         with self.lock:
-            if host_port in self.cache:
+            cache = self.cache.get(host_port)
+            while cache:
+                cc = cache.pop()
+                if time_now - cc["create_time"] > self.connection_timeout or not is_alive(cc["conn"]._sock):
+                    cc["conn"].close()
+                    continue
+
+                return cc["conn"]
+
+    def clean_cache(self):
+        time_now = time.time()
+        with self.lock:
+            for host_port in list(self.cache.keys()):
                 cache = self.cache[host_port]
-                while len(cache):
-                    try:
-                        cc = cache.pop(0)
-                        if time_now - cc["create_time"] > self.connection_timeout:
-                            cc["conn"].close()
-                            continue
-
-                        return cc["conn"]
-                    except Exception as e:
-                        xlog.exception("get_conn:%r", e)
-                        break
-
-    def create_connect(self, queue, host, ip, port, timeout=5):
-        ip = utils.to_bytes(ip)
+                for cc in list(cache):
+                    if time_now - cc["create_time"] > self.connection_timeout:
+                        cache.remove(cc)
+                        cc["conn"].close()
+                if not cache:
+                    del self.cache[host_port]
+
+    def create_sock(self, ip):
         if int(g.config.PROXY_ENABLE):
             sock = socks.socksocket(socket.AF_INET if b':' not in ip else socket.AF_INET6)
         else:
@@ -111,22 +170,22 @@ class ConnectManager(object):
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 512 * 1024)
 
         sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, True)
-        sock.settimeout(timeout)
+        return sock
 
+    def create_connect_by_proxy(self, host, ip, port, timeout):
+        sock = self.create_sock(ip)
+        sock.settimeout(timeout)
         start_time = time.time()
         try:
             sock.connect((ip, port))
-            time_cost = (time.time() - start_time) * 1000
-            # xlog.debug("connect %s %s:%d time:%d", host, ip, port, time_cost)
-            g.ip_cache.update_connect_time(ip, port, time_cost)
-            s = SocketWrap(sock, ip, port, host)
-            host_port = "%s:%d" % (host, port)
-            self.add_sock(host_port, s)
-            queue.put(True)
         except Exception as e:
             # xlog.debug("connect %s %s:%d fail:%r", host, ip, port, e)
+            sock.close()
             g.ip_cache.report_connect_fail(ip, port)
-            queue.put(False)
+            return None
+
+        g.ip_cache.update_connect_time(ip, port, (time.time() - start_time) * 1000)
+        return SocketWrap(sock, ip, port, host)
 
     def get_conn(self, host, ips, port, timeout=5):
         # xlog.debug("connect to %s:%d %r", host, port, ips)
@@ -138,6 +197,7 @@ class ConnectManager(object):
 
         ip_rate = {}
         for ip in ips:
+            ip = utils.to_bytes(ip)
             connect_time = g.ip_cache.get_connect_time(ip, port)
             if connect_time >= 8000:
                 continue
@@ -148,31 +208,141 @@ class ConnectManager(object):
             return None
 
         ip_time = sorted(list(ip_rate.items()), key=operator.itemgetter(1))
-        ordered_ips = [ip for ip, rate in ip_time]
-
-        wait_queue = Queue()
-        wait_t = 0.2
-        for ip in ordered_ips:
-            threading.Thread(target=self.create_connect, args=(wait_queue, host, ip, port),
-                             name="smart_router_create_conn_%s" % ip).start()
-            try:
-                status = wait_queue.get(timeout=wait_t)
-                sock = self.get_sock_from_cache(host_port)
-                if sock:
-                    return sock
-            except:
-                time.sleep(wait_t)
-                wait_t += 0.1
-
-        while True:
-            time_left = end_time - time.time()
-            if time_left <= 0:
-                return self.get_sock_from_cache(host_port)
-
-            try:
-                status = wait_queue.get(timeout=time_left)
-                sock = self.get_sock_from_cache(host_port)
+        ordered_ips = interleave_ips([ip for ip, rate in ip_time])
+
+        if int(g.config.PROXY_ENABLE):
+            for ip in ordered_ips:
+                time_left = end_time - time.time()
+                if time_left <= 0:
+                    break
+
+                sock = self.create_connect_by_proxy(host, ip, port, time_left)
                 if sock:
                     return sock
-            except:
-                pass
\ No newline at end of file
+            return None
+
+        task = ConnectTask(host, port, ordered_ips, end_time)
+        with self.lock:
+            self.new_tasks.append(task)
+        self.wake()
+
+        task.done.wait(timeout + 1)
+        with self.lock:
+            task.abandoned = True
+            return task.result
+
+    def start_attempt(self, task, now):
+        ip = task.ips.pop(0)
+        sock = self.create_sock(ip)
+        sock.setblocking(False)
+        try:
+            err = sock.connect_ex((ip, task.port))
+        except Exception as e:
+            err = e
+
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, "WSAEWOULDBLOCK", -1)):
+            sock.close()
+            g.ip_cache.report_connect_fail(ip, task.port)
+            task.next_attempt_time = now
+            return
+
+        task.attempts[sock] = (ip, now)
+        self.selector.register(sock, selectors.EVENT_WRITE, task)
+        task.next_attempt_time = now + self.attempt_delay
+
+    def on_attempt_done(self, task, sock):
+        self.selector.unregister(sock)
+        ip, start_time = task.attempts.pop(sock)
+        now = time.time()
+
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            # xlog.debug("connect %s %s:%d fail:%d", task.host, ip, task.port, err)
+            sock.close()
+            g.ip_cache.report_connect_fail(ip, task.port)
+            task.next_attempt_time = now
+            return
+
+        g.ip_cache.update_connect_time(ip, task.port, (now - start_time) * 1000)
+        sock.settimeout(self.connect_timeout)
+        sw = SocketWrap(sock, ip, task.port, task.host)
+        with self.lock:
+            if not task.result and not task.abandoned:
+                task.result = sw
+                task.done.set()
+                return
+
+        self.add_sock(task.host_port, sw)
+
+    def check_task(self, task, now):
+        # return False when the task is finished.
+        if now >= task.end_time:
+            for sock, (ip, start_time) in list(task.attempts.items()):
+                self.selector.unregister(sock)
+                sock.close()
+                g.ip_cache.report_connect_fail(ip, task.port)
+            task.attempts = {}
+            task.done.set()
+            return False
+
+        if task.result or task.abandoned:
+            # keep connecting attempts for the pool, don't start new one.
+            return bool(task.attempts)
+
+        while task.ips and now >= task.next_attempt_time:
+            self.start_attempt(task, now)
+
+        if not task.ips and not task.attempts:
+            task.done.set()
+            return False
+
+        return True
+
+    def loop(self):
+        while self.running:
+            now = time.time()
+            timeout = 1
+            for task in self.tasks:
+                timeout = min(timeout, task.end_time - now)
+                if task.ips and not task.result:
+                    timeout = min(timeout, task.next_attempt_time - now)
+
+            for key, mask in self.selector.select(timeout=max(0, timeout)):
+                if key.data is None:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except (socket.error, OSError):
+                        pass
+                    continue
+
+                try:
+                    self.on_attempt_done(key.data, key.fileobj)
+                except Exception as e:
+                    xlog.exception("connect %s except:%r", key.data.host_port, e)
+
+            with self.lock:
+                self.tasks += self.new_tasks
+                self.new_tasks = []
+
+            now = time.time()
+            for task in list(self.tasks):
+                try:
+                    if self.check_task(task, now):
+                        continue
+                except Exception as e:
+                    xlog.exception("connect %s except:%r", task.host_port, e)
+                    task.done.set()
+                self.tasks.remove(task)
+
+            if now - self.last_check_time > 10:
+                self.last_check_time = now
+                self.clean_cache()
+
+        for task in self.tasks + self.new_tasks:
+            for sock in task.attempts:
+                sock.close()
+            task.done.set()
+        self.selector.close()
+        self.wake_r.close()
+        self.wake_w.close()
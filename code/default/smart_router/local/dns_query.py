@@ -25,7 +25,7 @@ sys.path.append(noarch_lib)
 import env_info
 data_path = os.path.join(env_info.data_path, 'smart_router')
 
-from queue import Queue
+from queue import Queue, Empty
 import lru_cache
 import utils
 import simple_http_client
@@ -37,6 +37,65 @@ from xlog import getLogger
 xlog = getLogger("smart_router")
 
 
+def report_ttl(domain, dns_type, p):
+    # keep the smallest ttl of the answer, DNS server use it for clients.
+    if not p.rr or not g.domain_cache:
+        return
+
+    g.domain_cache.set_ttl(utils.to_bytes(domain), dns_type, min(r.ttl for r in p.rr))
+
+
+class ResolverStats(object):
+    # latency of every resolver or server, the fastest ones are queried first.
+    # fail count as fail_latency, a resolver not tried for probe_interval is tried again to refresh it's latency.
+    # the next one is started if the fastest one don't answer in hedge_delay.
+    fail_latency = 5
+    probe_interval = 60
+    min_hedge_delay = 0.05
+    max_hedge_delay = 1.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}  # name => {"latency": ewma seconds, "success": num, "fail": num, "last_try": time}
+
+    def report(self, name, latency, success):
+        with self.lock:
+            stat = self.stats.get(name)
+            if not stat:
+                stat = self.stats[name] = {"latency": latency, "success": 0, "fail": 0, "last_try": 0}
+
+            if success:
+                stat["success"] += 1
+            else:
+                stat["fail"] += 1
+                latency = max(latency, self.fail_latency)
+
+            stat["latency"] = stat["latency"] * 0.7 + latency * 0.3
+            stat["last_try"] = time.time()
+
+    def sort(self, names, costly=()):
+        # never tried first, then fastest, costly ones always after the free ones.
+        with self.lock:
+            return sorted(names, key=lambda name: (
+                name in costly, self.stats[name]["latency"] if name in self.stats else -1))
+
+    def need_probe(self, name):
+        with self.lock:
+            stat = self.stats.get(name)
+            return not stat or time.time() - stat["last_try"] > self.probe_interval
+
+    def hedge_delay(self, name):
+        with self.lock:
+            stat = self.stats.get(name)
+            if not stat:
+                return self.max_hedge_delay
+            return min(max(stat["latency"] * 2, self.min_hedge_delay), self.max_hedge_delay)
+
+    def status(self):
+        with self.lock:
+            return {utils.to_str(name): dict(stat) for name, stat in self.stats.items()}
+
+
 def get_local_ips():
     def get_ip_address(NICname):
         import fcntl
@@ -98,7 +157,7 @@ def get_local_ips():
 
 def query_dns_from_xxnet(domain, dns_type=None):
     if not g.x_tunnel:
-        return []
+        return None
 
     t0 = time.time()
     content, status, response = g.x_tunnel.front_dispatcher.request(
@@ -107,7 +166,7 @@ def query_dns_from_xxnet(domain, dns_type=None):
 
     if status != 200:
         xlog.warn("query_dns_from_xxnet fail status:%d, cost=%f", status, t1 - t0)
-        return []
+        return None
 
     if isinstance(content, memoryview):
         content = content.tobytes()
@@ -127,14 +186,18 @@ def query_dns_from_xxnet(domain, dns_type=None):
         return ips_out
     except Exception as e:
         xlog.warn("query_dns_from_xxnet %s json:%s parse fail:%s", domain, content, e)
-        return []
+        return None
 
 
 class LocalDnsQuery():
+    # query the fastest server, the next one if it don't answer in hedge delay, at most race_num servers.
+    race_num = 3
+
     def __init__(self, timeout=3):
         self.timeout = timeout
         self.waiters = lru_cache.LruCache(100)
-        self.dns_server = self.get_local_dns_server()
+        self.dns_server = [utils.to_bytes(ip) for ip in self.get_local_dns_server()]
+        self.stats = ResolverStats()
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock6 = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
@@ -216,7 +279,7 @@ class LocalDnsQuery():
             try:
                 try:
                     response, server = sock.recvfrom(8192)
-                    server, port = server
+                    server = server[0]
                 except Exception as e:
                     # xlog.exception("sock.recvfrom except:%r", e)
                     continue
@@ -248,7 +311,13 @@ class LocalDnsQuery():
                     ip = utils.to_bytes(str(r.rdata))
                     ips.append(ip)
 
+                # answer without record is still a success, the server is removed from the not replied.
+                sent_time = que.sent.pop(utils.to_bytes(server), None)
+                if sent_time:
+                    self.stats.report(utils.to_bytes(server), time.time() - sent_time, True)
+
                 if ips:
+                    report_ttl(org_domain, p.questions[0].qtype, p)
                     que.put(ips)
             except Exception as e:
                 xlog.exception("dns recv_worker except:%r", e)
@@ -296,22 +365,38 @@ class LocalDnsQuery():
 
         que = Queue()
         que.domain = domain
+        que.sent = {}  # server_ip => send time, for the servers not replied yet
+        self.waiters[id] = que
+
+        servers = self.stats.sort(self.dns_server)
+        first = [ip for i, ip in enumerate(servers) if i == 0 or self.stats.need_probe(ip)]
+        rest = [ip for ip in servers if ip not in first][:max(0, self.race_num - len(first))]
+        for server_ip in first:
+            que.sent[server_ip] = time.time()
+            self.send_request(id, server_ip, domain, dns_type)
 
-        for server_ip in self.dns_server:
-            new_time = time.time()
-            if new_time > end_time:
+        ips = []
+        while True:
+            wait_end = end_time
+            if rest:
+                wait_end = min(end_time, time.time() + self.stats.hedge_delay(first[0]))
+
+            try:
+                ips = que.get(timeout=max(0, wait_end - time.time()))
                 break
+            except Empty:
+                if not rest or time.time() >= end_time:
+                    break
 
-            self.waiters[id] = que
+            server_ip = rest.pop(0)
+            que.sent[server_ip] = time.time()
             self.send_request(id, server_ip, domain, dns_type)
 
-        try:
-            ips = que.get(timeout=self.timeout)
-        except:
-            ips = []
-
         if ips:
             ips = list(set(ips))
+        else:
+            for server_ip, sent_time in list(que.sent.items()):
+                self.stats.report(server_ip, time.time() - sent_time, False)
 
         if id in self.waiters:
             del self.waiters[id]
@@ -322,6 +407,117 @@ class LocalDnsQuery():
         return ips
 
 
+class DnsStreamConnection(object):
+    # A TCP or TLS connection to a DNS server, queries are pipelined (RFC 7766).
+    # Responses may come out of order, the receive thread match them by transaction id.
+    # Connection is closed after idle_timeout without query, on socket error,
+    # or max_timeout_num queries timeout in a row. A single timeout only drop it's waiter.
+    max_timeout_num = 3
+
+    def __init__(self, sock, name, idle_timeout=60):
+        self.sock = sock
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.waiters = {}  # id => Queue
+        self.timeout_num = 0  # queries timeout in a row
+        self.running = True
+
+        self.sock.settimeout(idle_timeout)
+        threading.Thread(target=self.recv_worker, name="DnsStream_%s" % utils.to_str(name)).start()
+
+    def recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            try:
+                d = self.sock.recv(size - len(data))
+            except socket.timeout:
+                if data:
+                    raise socket.error("timeout in message")
+                raise
+
+            if not d:
+                raise socket.error("closed")
+            data += d
+        return data
+
+    def recv_worker(self):
+        while self.running:
+            try:
+                length = struct.unpack("!H", self.recv_exact(2))[0]
+                data = self.recv_exact(length)
+            except socket.timeout:
+                with self.lock:
+                    if self.waiters:
+                        continue
+                break
+            except Exception as e:
+                if self.running:
+                    xlog.debug("DNS %s recv except:%r", self.name, e)
+                break
+
+            id = struct.unpack("!H", data[:2])[0]
+            with self.lock:
+                self.timeout_num = 0
+                que = self.waiters.pop(id, None)
+            if que:
+                que.put(data)
+
+        self.close()
+
+    def query(self, data, timeout):
+        # data is a packed query, it's id is replaced by a free one.
+        # return the packed response, None if fail.
+        que = Queue()
+        with self.lock:
+            if not self.running:
+                return None
+
+            while True:
+                id = random.randint(0, 65535)
+                if id not in self.waiters:
+                    break
+            self.waiters[id] = que
+
+        try:
+            with self.send_lock:
+                self.sock.sendall(struct.pack("!HH", len(data), id) + data[2:])
+            return que.get(timeout=timeout)
+        except Empty:
+            with self.lock:
+                self.timeout_num += 1
+                timeout_num = self.timeout_num
+            if timeout_num >= self.max_timeout_num:
+                xlog.warn("DNS %s %d queries timeout, close", self.name, timeout_num)
+                self.close()
+            return None
+        except Exception as e:
+            xlog.warn("DNS %s send except:%r", self.name, e)
+            self.close()
+            return None
+        finally:
+            with self.lock:
+                self.waiters.pop(id, None)
+
+    def close(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            waiters = list(self.waiters.values())
+            self.waiters = {}
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        self.sock.close()
+
+        for que in waiters:
+            que.put(None)
+
+
 class DnsOverTcpQuery():
     def __init__(self, server_list=[b"114.114.114.114"], port=53):
         self.protocol = "Tcp"
@@ -329,10 +525,16 @@ class DnsOverTcpQuery():
         self.connection_timeout = 60
         self.public_list = server_list
         self.port = port
-        self.connections = []
+        self.stats = ResolverStats()
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def server_name(self, server):
+        return server
 
     def get_server(self):
-        return random.choice(self.public_list)
+        servers = {self.server_name(server): server for server in self.public_list}
+        return servers[self.stats.sort(list(servers.keys()))[0]]
 
     def direct_connect(self, host, port):
         connect_timeout = 30
@@ -393,49 +595,55 @@ class DnsOverTcpQuery():
         return sock
 
     def get_connection(self):
-        while len(self.connections):
-            try:
-                [sock, last_query_time] = self.connections.pop()
-                if time.time() - last_query_time < self.connection_timeout:
-                    return sock
-            except:
-                pass
+        with self.lock:
+            if self.connection and self.connection.running:
+                return self.connection
 
-        server_ip = self.get_server()
-        if not server_ip:
-            return None
-
-        sock = self.connect(server_ip, self.port)
-        return sock
-
-    def query(self, domain, dns_type=1):
+        server = self.get_server()
+        name = self.server_name(server)
         t0 = time.time()
         try:
-            sock = self.get_connection()
-            if not sock:
-                xlog.warn("query_over_tcp %s type:%s connect fail.", domain, dns_type)
-                return []
+            sock = self.connect(server, self.port)
+        except Exception as e:
+            xlog.warn("%s connect %s fail:%r", self.protocol, name, e)
+            sock = None
 
-            d = DNSRecord(DNSHeader())
-            d.add_question(DNSQuestion(domain, dns_type))
+        if not sock:
+            self.stats.report(name, time.time() - t0, False)
+            return None
 
-            data = d.pack()
-            data = struct.pack("!H", len(data)) + data
-            sock.sendall(data)
+        connection = DnsStreamConnection(sock, name, self.connection_timeout)
+        with self.lock:
+            if self.connection and self.connection.running:
+                # other thread connected at the same time.
+                connection.close()
+                return self.connection
 
-            response = sock.recv(8192)
-            if not response:
-                return []
+            self.connection = connection
+            return connection
 
-            length = struct.unpack("!H", bytes(response[:2]))[0]
-            while len(response) - 2 < length:
-                response += sock.recv(8192)
+    def query(self, domain, dns_type=1):
+        t0 = time.time()
+        connection = self.get_connection()
+        if not connection:
+            xlog.warn("query_over_tcp %s type:%s connect fail.", domain, dns_type)
+            return None
 
-            t2 = time.time()
+        d = DNSRecord(DNSHeader())
+        d.add_question(DNSQuestion(domain, dns_type))
+        response = connection.query(d.pack(), self.timeout)
 
-            p = DNSRecord.parse(response[2:])
+        t2 = time.time()
+        self.stats.report(connection.name, t2 - t0, bool(response))
+        if not response:
+            xlog.warn("query_over_tcp %s type:%s server:%s fail", domain, dns_type, connection.name)
+            return None
+
+        try:
+            p = DNSRecord.parse(response)
             if len(p.rr) == 0:
                 xlog.warn("query_over_tcp for %s type:%d return none, cost:%f", domain, dns_type, t2-t0)
+            report_ttl(domain, dns_type, p)
 
             ips = []
             for r in p.rr:
@@ -445,19 +653,20 @@ class DnsOverTcpQuery():
                         continue
 
                     ip_ips = self.query(ip, dns_type)
-                    ips += ip_ips
+                    ips += ip_ips or []
                 else:
                     ips.append(ip)
 
             xlog.debug("DNS %s %s return %s t:%f", self.protocol, domain, ips, t2-t0)
-            self.connections.append([sock, time.time()])
             return ips
-        except socket.timeout:
-            xlog.warn("query_over_tcp %s type:%s timeout", domain, dns_type)
-            return []
         except Exception as e:
             xlog.exception("query_over_tcp %s type:%s except:%r", domain, dns_type, e)
-            return []
+            return None
+
+    def stop(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
 
 
 class DnsOverTlsQuery(DnsOverTcpQuery):
@@ -480,6 +689,9 @@ class DnsOverTlsQuery(DnsOverTcpQuery):
         self.ssl_context.check_hostname = False
         self.ssl_context.verify_mode = ssl.CERT_REQUIRED
 
+    def server_name(self, server):
+        return server["domain"]
+
     def connect(self, host, port):
         domain = host["domain"]
         ipv4 =  random.choice(host["ipv4s"])
@@ -503,16 +715,18 @@ class DnsOverHttpsQuery(object):
             "https://dns.aa.net.uk/dns-query",
         ]
         self.connection_timeout = 60
-        self.connections = []
-
-    def get_connection(self):
-        while len(self.connections):
-            try:
-                [client, last_query_time] = self.connections.pop()
+        self.connections = {}  # url => [[client, last_query_time]]
+        self.lock = threading.Lock()
+        self.stats = ResolverStats()
+
+    def get_connection(self, url):
+        # keep-alive connections are reused, client.sock is None for new one.
+        with self.lock:
+            connections = self.connections.get(url, [])
+            while len(connections):
+                [client, last_query_time] = connections.pop()
                 if time.time() - last_query_time < self.connection_timeout:
                     return client
-            except:
-                pass
 
         if g.config.PROXY_ENABLE == 1:
             return simple_http_client.Client(proxy={
@@ -521,25 +735,30 @@ class DnsOverHttpsQuery(object):
                 "port": g.config.PROXY_PORT,
                 "user": g.config.PROXY_USER,
                 "pass": g.config.PROXY_PASSWD,
-            }, timeout=self.timeout)
+            }, timeout=self.timeout, verify_tls=True)
         else:
-            return simple_http_client.Client(timeout=self.timeout)
+            return simple_http_client.Client(timeout=self.timeout, verify_tls=True)
+
+    def put_connection(self, url, client):
+        with self.lock:
+            self.connections.setdefault(url, []).append([client, time.time()])
 
     @property
     def server(self):
-        return random.choice(self.other_servers)
+        return self.stats.sort(self.other_servers)[0]
 
     def query_json(self, domain, dns_type=1):
         try:
             t0 = time.time()
-            client = self.get_connection()
+            server = self.server
+            client = self.get_connection(server)
 
-            url = self.server + "?name=" + domain + "&type=A" # type need to map to Text.
+            url = server + "?name=" + domain + "&type=A" # type need to map to Text.
             r = client.request("GET", url, headers={"accept": "application/dns-json"})
             t2 = time.time()
             ips = []
             if not r:
-                xlog.warn("DNS server:%s domain:%s fail t:%f", self.server, domain,  t2 - t0)
+                xlog.warn("DNS server:%s domain:%s fail t:%f", server, domain,  t2 - t0)
                 return ips
 
             t = utils.to_str(r.text)
@@ -548,40 +767,52 @@ class DnsOverHttpsQuery(object):
             for answer in data["Answer"]:
                 ips.append(answer["data"])
 
-            self.connections.append([client, time.time()])
+            self.put_connection(server, client)
 
-            xlog.debug("DNS server:%s query:%s return %s t:%f", self.server, domain, ips, t2 - t0)
+            xlog.debug("DNS server:%s query:%s return %s t:%f", server, domain, ips, t2 - t0)
             return ips
         except Exception as e:
             xlog.warn("DNSOverHttpsQuery query fail:%r", e)
             return []
 
+    def request(self, url, data):
+        client = self.get_connection(url)
+        reused = client.sock is not None
+        r = client.request("POST", url, headers={"accept": "application/dns-message",
+                                                 "content-type": "application/dns-message"}, body=data)
+        if not r and reused:
+            # server closed the idle connection.
+            client = self.get_connection(url)
+            r = client.request("POST", url, headers={"accept": "application/dns-message",
+                                                     "content-type": "application/dns-message"}, body=data)
+
+        if r and r.status == 200:
+            self.put_connection(url, client)
+        return r
+
     def query(self, domain, dns_type=1, url=None):
         t0 = time.time()
-        try:
-            client = self.get_connection()
-
-            if not url:
-                url = self.server
-            # xlog.debug("DoH use %s", url)
+        if not url:
+            url = self.server
 
+        try:
             d = DNSRecord(DNSHeader())
             d.add_question(DNSQuestion(domain, dns_type))
             data = d.pack()
 
-            r = client.request("POST", url, headers={"accept": "application/dns-message",
-                                                     "content-type": "application/dns-message"}, body=data)
+            r = self.request(url, data)
 
             t2 = time.time()
-            ips = []
-            if not r:
-                xlog.warn("DNS s:%s query:%s fail t:%f", self.server, domain,  t2 - t0)
-                return ips
+            if not r or r.status != 200:
+                self.stats.report(url, t2 - t0, False)
+                xlog.warn("DNS s:%s query:%s fail t:%f", url, domain,  t2 - t0)
+                return None
 
             p = DNSRecord.parse(r.text)
+            self.stats.report(url, t2 - t0, True)
+            report_ttl(domain, dns_type, p)
 
-            self.connections.append([client, time.time()])
-
+            ips = []
             for r in p.rr:
                 ip = utils.to_bytes(str(r.rdata))
                 if not utils.check_ip_valid(ip):
@@ -589,7 +820,7 @@ class DnsOverHttpsQuery(object):
                         continue
 
                     ip_ips = self.query(ip, dns_type)
-                    ips += ip_ips
+                    ips += ip_ips or []
                 else:
                     ips.append(ip)
 
@@ -598,35 +829,132 @@ class DnsOverHttpsQuery(object):
         except Exception as e:
             t1 = time.time()
             t = t1 - t0
+            self.stats.report(url, t, False)
             xlog.warn("DnsOverHttpsQuery query %s cost:%f fail:%r", domain, t, e)
-            return []
+            return None
+
+
+class QueryTask(object):
+    def __init__(self, domain, dns_type):
+        self.domain = domain
+        self.dns_type = dns_type
+        self.ips = []
+        self.running_num = 0
+        self.cond = threading.Condition()
+
+    def add(self, num=1):
+        with self.cond:
+            self.running_num += num
+
+    def put(self, ips):
+        with self.cond:
+            self.running_num -= 1
+            if ips and not self.ips:
+                self.ips = ips
+            self.cond.notify_all()
+
+    def wait(self, end_time):
+        # return when get ips, all running finished or timeout.
+        with self.cond:
+            while not self.ips and self.running_num > 0:
+                time_left = end_time - time.time()
+                if time_left <= 0:
+                    break
+                self.cond.wait(time_left)
+            return self.ips
 
 
 class ParallelQuery():
-    def query_worker(self, task, function):
-        ips = function(task.domain, task.dns_type)
-        if len(ips):
-            g.domain_cache.set_ips(task.domain, ips, task.dns_type)
+    # Query resolvers on a shared pool of worker threads.
+    # The fanout fastest resolvers (and those need probe) go first,
+    # the next one is started when they all fail or the fastest don't answer in it's hedge delay.
+    # costly resolvers are never in the first batch, one is started only after all free ones fail,
+    # or the last free one don't answer in costly_delay.
+    # Queued query of a resolver is dropped when the task already get ips,
+    # a resolver still running after that save it's ips to domain_cache.
+    # A resolver return None if fail, [] if the answer has no record like NXDOMAIN,
+    # only fail and except count as fail in the stats.
+    costly_delay = 1.0
+
+    def __init__(self, worker_num=16, fanout=2, timeout=5):
+        self.fanout = fanout
+        self.timeout = timeout
+        self.stats = ResolverStats()
+        self.costly = set()
+        self.task_queue = Queue()
+        self.worker_num = worker_num
+        for i in range(worker_num):
+            threading.Thread(target=self.query_worker, name="ParallelQuery_%d" % i).start()
+
+    @staticmethod
+    def get_name(func):
+        return getattr(getattr(func, "__self__", None), "protocol", func.__name__)
+
+    def query_worker(self):
+        while True:
+            item = self.task_queue.get()
+            if not item:
+                break
+
+            task, func = item
+            if task.ips:
+                task.put([])
+                continue
+
+            t0 = time.time()
+            try:
+                ips = func(task.domain, task.dns_type)
+            except Exception as e:
+                xlog.warn("%s query %s except:%r", self.get_name(func), task.domain, e)
+                ips = None
+            self.stats.report(self.get_name(func), time.time() - t0, ips is not None)
+
+            ips = ips or []
+            if len(ips):
+                g.domain_cache.set_ips(task.domain, ips, task.dns_type)
             task.put(ips)
 
     def query(self, domain, dns_type, funcs):
-        task = Queue()
-        task.domain = domain
-        task.dns_type = dns_type
+        end_time = time.time() + self.timeout
+        task = QueryTask(domain, dns_type)
 
-        for func in funcs:
-            threading.Thread(target=self.query_worker, args=(task, func), name="ParalleQuery_%s" % domain).start()
+        funcs = {self.get_name(func): func for func in funcs}
+        names = self.stats.sort(list(funcs.keys()), self.costly)
+        free = [name for name in names if name not in self.costly]
+        costly = [name for name in names if name in self.costly]
+        first = [name for i, name in enumerate(free) if i < self.fanout or self.stats.need_probe(name)]
+        rest = [name for name in free if name not in first]
 
-        try:
-            ips = task.get(timeout=5)
-        except:
-            ips = []
+        task.add(len(first))
+        for name in first:
+            self.task_queue.put((task, funcs[name]))
 
-        return ips
+        while True:
+            wait_end = end_time
+            if rest:
+                wait_end = min(end_time, time.time() + self.stats.hedge_delay(first[0]))
+            elif costly:
+                wait_end = min(end_time, time.time() + self.costly_delay)
+
+            ips = task.wait(wait_end)
+            if ips or time.time() >= end_time or not (rest or costly):
+                return ips
+
+            name = rest.pop(0) if rest else costly.pop(0)
+            task.add()
+            self.task_queue.put((task, funcs[name]))
+
+    def stop(self):
+        for _ in range(self.worker_num):
+            self.task_queue.put(None)
 
 
 class CombineDnsQuery():
-    def __init__(self):
+    # Concurrent query of the same (domain, dns_type) wait for the first one,
+    # failed query is cached for negative_ttl seconds.
+    flight_timeout = 10
+
+    def __init__(self, negative_ttl=30, worker_num=16, fanout=2):
         self.domain_allowed_pattern = re.compile(br"(?!-)[A-Z\d-]{1,63}(?<!-)$")
         self.local_dns_resolve = LocalDnsQuery()
 
@@ -634,7 +962,16 @@ class CombineDnsQuery():
         self.tls_query = DnsOverTlsQuery()
         self.https_query = DnsOverHttpsQuery()
 
-        self.parallel_query = ParallelQuery()
+        self.parallel_query = ParallelQuery(worker_num, fanout)
+        # paid by x_tunnel traffic.
+        self.parallel_query.costly.add(ParallelQuery.get_name(query_dns_from_xxnet))
+
+        self.lock = threading.Lock()
+        self.in_flight = {}  # (domain, dns_type) => QueryTask
+        self.negative_ttl = negative_ttl
+        self.negative_cache = lru_cache.LruCache(1000)  # (domain, dns_type) => expire_time
+        self.coalesced_num = 0
+        self.negative_hit_num = 0
 
     def is_valid_hostname(self, hostname):
         hostname = hostname.upper()
@@ -664,7 +1001,7 @@ class CombineDnsQuery():
             query_dns_from_xxnet
         ])
 
-    def query(self, domain, dns_type=1, history=[]):
+    def query(self, domain, dns_type=1, history=None):
         domain = utils.to_bytes(domain)
         if utils.check_ip_valid(domain):
             return [domain]
@@ -677,6 +1014,41 @@ class CombineDnsQuery():
         if ips:
             return ips
 
+        key = (domain, dns_type)
+        expire_time = self.negative_cache.get(key)
+        if expire_time and time.time() < expire_time:
+            self.negative_hit_num += 1
+            return []
+
+        is_owner = False
+        with self.lock:
+            flight = self.in_flight.get(key)
+            if flight:
+                self.coalesced_num += 1
+            else:
+                flight = self.in_flight[key] = QueryTask(domain, dns_type)
+                flight.add()
+                is_owner = True
+
+        if not is_owner:
+            return flight.wait(time.time() + self.flight_timeout)
+
+        ips = []
+        try:
+            ips = self.query_uncached(domain, dns_type, history if history is not None else [])
+        finally:
+            if not ips:
+                self.negative_cache.set(key, time.time() + self.negative_ttl)
+
+            with self.lock:
+                del self.in_flight[key]
+            flight.put(ips)
+
+        return ips
+
+    def query_uncached(self, domain, dns_type, history):
+        history.append(domain)
+
         rule = g.user_rules.check_host(domain, 0)
         if rule == "black":
             # user define black list like advertisement or malware server.
@@ -736,5 +1108,24 @@ class CombineDnsQuery():
 
         return ips_out
 
+    def status(self):
+        with self.lock:
+            in_flight_num = len(self.in_flight)
+
+        return {
+            "in_flight": in_flight_num,
+            "coalesced": self.coalesced_num,
+            "negative_cache": len(self.negative_cache),
+            "negative_hit": self.negative_hit_num,
+            "resolvers": self.parallel_query.stats.status(),
+            "local_servers": self.local_dns_resolve.stats.status(),
+            "tcp_servers": self.tcp_query.stats.status(),
+            "tls_servers": self.tls_query.stats.status(),
+            "https_servers": self.https_query.stats.status(),
+        }
+
     def stop(self):
-        self.local_dns_resolve.stop()
\ No newline at end of file
+        self.local_dns_resolve.stop()
+        self.parallel_query.stop()
+        self.tcp_query.stop()
+        self.tls_query.stop()
\ No newline at end of file
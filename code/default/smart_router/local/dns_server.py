@@ -8,6 +8,8 @@ import socket
 import time
 import select
 import struct
+import collections
+from queue import Queue, Full
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
@@ -28,8 +30,76 @@ from xlog import getLogger
 xlog = getLogger("smart_router")
 
 
+def parse_question(data):
+    # return (qname, qtype, question_end) of a query with one question, None if not.
+    # qname is the lower case wire format, it's the key of the response cache.
+    if len(data) < 12 or data[2] & 0x80 or data[4:6] != b"\x00\x01":
+        return None
+
+    pos = 12
+    try:
+        while data[pos]:
+            if data[pos] & 0xC0:
+                return None
+            pos += data[pos] + 1
+    except IndexError:
+        return None
+
+    pos += 1
+    if pos + 4 > len(data):
+        return None
+
+    qtype = struct.unpack("!H", data[pos:pos + 2])[0]
+    return data[12:pos].lower(), qtype, pos + 4
+
+
+def parse_ttl_offsets(data, question_end):
+    # offsets of the ttl field of answer and authority records, None if the reply can't be parsed.
+    # additional records are skipped, ttl of OPT record is flags.
+    try:
+        rr_num = struct.unpack("!H", data[6:8])[0] + struct.unpack("!H", data[8:10])[0]
+        offsets = []
+        pos = question_end
+        for _ in range(rr_num):
+            while True:
+                if data[pos] & 0xC0 == 0xC0:
+                    pos += 2
+                    break
+                elif data[pos] == 0:
+                    pos += 1
+                    break
+                pos += data[pos] + 1
+
+            if pos + 10 > len(data):
+                return None
+            offsets.append(pos + 4)
+            pos += 10 + struct.unpack("!H", data[pos + 8:pos + 10])[0]
+
+        if pos > len(data):
+            return None
+        return offsets
+    except (IndexError, struct.error):
+        return None
+
+
+def set_ttl(data, ttl_offsets, ttl):
+    data = bytearray(data)
+    for offset in ttl_offsets:
+        struct.pack_into("!I", data, offset, ttl)
+    return bytes(data)
+
+
 class DnsServer(object):
-    def __init__(self, bind_ip="127.0.0.1", port=53, backup_port=8053, ttl=24*3600):
+    # The select loop answer cache hits itself,
+    # misses go to a fixed number of workers, same (qname, qtype) queried by many clients is resolved once.
+    #
+    # Response cache keep the packed reply until it's ttl expired,
+    # hit only take transaction id and question (case may differ) from the request,
+    # and the answer ttl is set to the time left.
+    default_ttl = 60
+    max_queue_size = 256
+
+    def __init__(self, bind_ip="127.0.0.1", port=53, backup_port=8053, ttl=24*3600, worker_num=8, cache_size=1000):
         self.sockets = []
         self.udp_relay_sock = None
         self.udp_relay_port = 0
@@ -45,6 +115,17 @@ class DnsServer(object):
         self.ttl = ttl
         self.th = None
 
+        self.worker_num = worker_num
+        self.workers = []
+        self.task_queue = Queue(maxsize=self.max_queue_size)
+
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # (qname, qtype) => (res_data, expire_time, ttl_offsets)
+        self.lock = threading.Lock()
+        self.pending = {}  # (qname, qtype) => [(rsock, req_data, addr, head)]
+        self.hit_num = 0
+        self.miss_num = 0
+
     def init_socket(self):
         ips = set(self.bind_ip)
         listen_all_v4 = "0.0.0.0" in ips
@@ -107,12 +188,13 @@ class DnsServer(object):
                 xlog.warn("bind UDP %s:%d fail", bind_ip, self.port)
 
     def dns_query(self, req_data, addr):
+        # return (res_data, ttl), ttl 0 mean don't cache.
         start_time = time.time()
         try:
             request = DNSRecord.parse(req_data)
             if len(request.questions) != 1:
                 xlog.warn("query num:%d %s", len(request.questions), request)
-                return
+                return None, 0
 
             domain = utils.to_bytes(str(request.questions[0].qname))
 
@@ -127,28 +209,145 @@ class DnsServer(object):
                 xlog.debug("query:%s type:%d from:%s, get fail, cost:%d", domain, dns_type, addr,
                            (time.time() - start_time) * 1000)
 
+            ttl = min(g.domain_cache.get_ttl(domain, dns_type) or self.default_ttl, self.ttl)
             reply = DNSRecord(DNSHeader(id=request.header.id, qr=1, aa=1, ra=1, auth=1), q=request.q)
             ips = utils.to_bytes(ips)
             for ip_cn in ips:
                 ipcn_p = ip_cn.split(b"|")
                 ip = ipcn_p[0]
                 if utils.check_ip_valid4(ip) and dns_type == 1:
-                    reply.add_answer(RR(domain, ttl=60, rdata=A(ip)))
+                    reply.add_answer(RR(domain, ttl=ttl, rdata=A(ip)))
                 elif utils.check_ip_valid6(ip) and dns_type == 28:
-                    reply.add_answer(RR(domain, rtype=dns_type, ttl=60, rdata=AAAA(ip)))
+                    reply.add_answer(RR(domain, rtype=dns_type, ttl=ttl, rdata=AAAA(ip)))
                 elif dns_type == 2:
-                    reply.add_answer(RR(domain, rtype=dns_type, ttl=60, rdata=NS(ip)))
+                    reply.add_answer(RR(domain, rtype=dns_type, ttl=ttl, rdata=NS(ip)))
             res_data = reply.pack()
 
             xlog.debug("query:%s type:%d from:%s, return ip num:%d cost:%d", domain, dns_type, addr,
                        len(reply.rr), (time.time()-start_time)*1000)
-            return res_data
+            if not reply.rr:
+                ttl = 0
+            return res_data, ttl
         except Exception as e:
             xlog.exception("on_query except:%r", e)
+            return None, 0
+
+    def get_cache(self, key):
+        with self.lock:
+            item = self.cache.get(key)
+            if not item:
+                self.miss_num += 1
+                return None
+
+            res_data, expire_time, ttl_offsets = item
+            time_now = time.time()
+            if time_now > expire_time:
+                del self.cache[key]
+                self.miss_num += 1
+                return None
+
+            self.hit_num += 1
+
+        return set_ttl(res_data, ttl_offsets, int(round(expire_time - time_now)))
+
+    def set_cache(self, key, res_data, ttl, question_end):
+        ttl_offsets = parse_ttl_offsets(res_data, question_end)
+        if ttl_offsets is None:
+            xlog.warn("DNS reply of %s can't be parsed, not cached", utils.str2hex(key[0]))
+            return
+
+        with self.lock:
+            self.cache[key] = (res_data, time.time() + ttl, ttl_offsets)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def on_query(self, rsock, req_data, addr, head=b""):
+        question = parse_question(req_data)
+        if not question:
+            # let dnslib handle and log it.
+            key = None
+        else:
+            qname, qtype, question_end = question
+            key = (qname, qtype)
+
+            if self.cache_size:
+                res_data = self.get_cache(key)
+                if res_data:
+                    self.send_response(rsock, req_data, addr, head, res_data, question_end)
+                    return
+
+            with self.lock:
+                if key in self.pending:
+                    self.pending[key].append((rsock, req_data, addr, head))
+                    return
+                self.pending[key] = [(rsock, req_data, addr, head)]
+
+        try:
+            self.task_queue.put_nowait((key, rsock, req_data, addr, head))
+        except Full:
+            # client will retry.
+            xlog.warn("DNS server busy, drop query from %s", addr)
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def send_response(self, rsock, req_data, addr, head, res_data, question_end):
+        # question_end 0 mean only transaction id is replaced.
+        if question_end:
+            res_data = res_data[2:12] + req_data[12:question_end] + res_data[question_end:]
+        else:
+            res_data = res_data[2:]
 
-    def on_udp_query(self, rsock, req_data, addr):
-        res_data = self.dns_query(req_data, addr)
-        rsock.sendto(res_data, addr)
+        try:
+            rsock.sendto(head + req_data[:2] + res_data, addr)
+        except Exception as e:
+            xlog.warn("DNS send to %s except:%r", addr, e)
+
+    def worker(self):
+        while True:
+            task = self.task_queue.get()
+            if not task:
+                break
+
+            key, rsock, req_data, addr, head = task
+            res_data, ttl = self.dns_query(req_data, addr)
+
+            if not key:
+                if res_data:
+                    try:
+                        rsock.sendto(head + res_data, addr)
+                    except Exception as e:
+                        xlog.warn("DNS send to %s except:%r", addr, e)
+                continue
+
+            question_end = len(key[0]) + 16
+            if res_data and res_data[12:question_end - 4].lower() != key[0]:
+                # dnslib packed the name in an other way, can't reuse it for other requests.
+                xlog.warn("DNS reply question not match %s", utils.str2hex(key[0]))
+                question_end = 0
+                ttl = 0
+
+            if ttl and self.cache_size:
+                self.set_cache(key, res_data, ttl, question_end)
+
+            with self.lock:
+                waiters = self.pending.pop(key, [])
+
+            if not res_data:
+                continue
+
+            for rsock, req_data, addr, head in waiters:
+                self.send_response(rsock, req_data, addr, head, res_data, question_end)
+
+    def status(self):
+        with self.lock:
+            return {
+                "cache_size": len(self.cache),
+                "hit": self.hit_num,
+                "miss": self.miss_num,
+                "pending": len(self.pending),
+                "queue": self.task_queue.qsize(),
+            }
 
     def on_udp_relay(self, rsock, req_data, from_addr):
         # We currently only support DNS query for UDP relay
@@ -190,12 +389,7 @@ class DnsServer(object):
 
             head_length = len(req_data) - len(data)
             head = req_data[:head_length]
-            res_data = self.dns_query(data, from_addr)
-            if not res_data:
-                return
-
-            rsock.sendto(head + res_data, from_addr)
-            xlog.debug("UDP relay from %s size:%d to:%s:%d res len:%d", from_addr, len(data), addr, port, len(res_data))
+            self.on_query(rsock, data, from_addr, head)
         except Exception as e:
             xlog.exception("on_udp_relay data:[%s] except:%r", utils.str2hex(req_data), e)
 
@@ -213,19 +407,27 @@ class DnsServer(object):
                     break
 
                 if rsock == self.udp_relay_sock:
-                    threading.Thread(target=self.on_udp_relay, args=(rsock, data, addr), name="UDP_relay").start()
+                    self.on_udp_relay(rsock, data, addr)
                 else:
-                    threading.Thread(target=self.on_udp_query, args=(rsock, data, addr), name="DNSServer_udp_handler").start()
+                    self.on_query(rsock, data, addr)
 
         self.th = None
 
     def start(self):
         self.init_socket()
+        for i in range(self.worker_num):
+            th = threading.Thread(target=self.worker, name="DNSServer_worker_%d" % i)
+            th.start()
+            self.workers.append(th)
+
         self.th = threading.Thread(target=self.server_forever, name="DNSServer")
         self.th.start()
 
     def stop(self):
         self.running = False
+        for _ in self.workers:
+            self.task_queue.put(None)
+        self.workers = []
         while self.th:
             time.sleep(1)
         for sock in self.sockets:
@@ -5,9 +5,6 @@
 import os
 import sys
 import base64
-import re
-import socket
-import struct
 try:
     from urllib.request import urlopen
 except ImportError:
@@ -24,63 +21,49 @@ if __name__ == '__main__':
 
 import env_info
 import utils
+from ip_prefix import IpPrefixIndex
+from domain_matcher import DomainMatcher, KeywordMatcher
 from xlog import getLogger
 xlog = getLogger("smart_router")
 
 data_path = os.path.join(env_info.data_path, "smart_router")
 
 
-class IpMask(object):
+class IpMask(IpPrefixIndex):
     def __init__(self, ip_masks):
-        self.masks = self.generate_masks(ip_masks)
-
-    def makeMask(self, n):
-        # return a mask of n bits as a long integer
-        return (2 << int(n) - 1) - 1
-
-    def dottedQuadToNum(self, ip):
-        # convert decimal dotted quad string to long integer
-        try:
-            i = socket.inet_aton(ip)
-        except Exception as e:
-            xlog.exception("inet_aton e:%r", e)
-
-        return struct.unpack('I', i)[0]
-
-    def networkMask(self, ip, bits):
-        # Convert a network address to a long integer
-        return self.dottedQuadToNum(ip) & self.makeMask(bits)
-
-    def generate_masks(self, ip_masks):
-        masks = []
+        super(IpMask, self).__init__()
         for ip_mask in ip_masks:
-            ip, m = ip_mask.split("/")
-            mask = self.networkMask(ip, m)
-            masks.append(mask)
-
-        return tuple(masks)
+            try:
+                self.add_cidr(ip_mask)
+            except Exception as e:
+                xlog.warn("ip mask %s not valid:%r", ip_mask, e)
+        self.build()
 
     def check_ip(self, ip):
-        address = self.dottedQuadToNum(ip)
-        for mask in self.masks:
-            if address & mask == mask:
-                return True
-
-        return False
+        return self.contains(ip)
 
 
 class GfwList(object):
+    # lists in self.domain_matcher
+    BLACK = 1
+    WHITE = 2
+    SPEEDTEST = 4
+    ADVERTISEMENT = 8
+
     def __init__(self):
         # self.gfw_black_list = utils.to_bytes(self.load("gfw_black_list.txt"))
         # https://johnshall.github.io/Shadowrocket-ADBlock-Rules-Forever/sr_top500_banlist.conf
         self.gfw_black_list, ip_masks, keywords = self.load_banlist("sr_top500_banlist.conf")
-        self.keyword_re = re.compile("|".join(keywords))
+        self.keyword_matcher = KeywordMatcher(keywords)
         self.black_subnets = IpMask(ip_masks)
         self.gfw_white_list = utils.to_bytes(self.load("gfw_white_list.txt"))
-        self.speedtest_whitelist = utils.to_bytes(self.load("speedtest_whitelist.txt"))
-        self.advertisement_list = utils.to_bytes(self.load("advertisement_list.txt"))
-        # xlog.debug("white_list size:%d mem:%d", len(self.gfw_white_list), sys.getsizeof(self.gfw_white_list))
-        # xlog.debug("black_list size:%d mem:%d", len(self.gfw_black_list), sys.getsizeof(self.gfw_black_list))
+
+        self.domain_matcher = DomainMatcher()
+        self.domain_matcher.add_list(self.gfw_black_list, self.BLACK)
+        self.domain_matcher.add_list(self.gfw_white_list, self.WHITE)
+        self.domain_matcher.add_list(self.load("speedtest_whitelist.txt"), self.SPEEDTEST)
+        self.domain_matcher.add_list(self.load("advertisement_list.txt"), self.ADVERTISEMENT)
+        # xlog.debug("domain_matcher size:%d", len(self.domain_matcher))
 
     @staticmethod
     def load(name):
@@ -99,7 +82,7 @@ class GfwList(object):
                 if not line:
                     continue
 
-                gfwdict["." + line] = 1
+                gfwdict[line] = 1
 
         gfwlist = [h for h in gfwdict]
         return tuple(gfwlist)
@@ -117,12 +100,11 @@ class GfwList(object):
 
                 if line.startswith("DOMAIN-SUFFIX,"):
                     suffix = line.split(",")[1]
-                    gfwdict["." + suffix] = 1
+                    gfwdict[suffix] = 1
 
-                if line.startswith("IP-CIDR,"):
+                if line.startswith("IP-CIDR,") or line.startswith("IP-CIDR6,"):
                     ip_mask = line.split(",")[1]
-                    if ":" not in ip_mask:
-                        ip_masks.append(ip_mask)
+                    ip_masks.append(ip_mask)
 
                 if line.startswith("DOMAIN-KEYWORD,"):
                     keyword = line.split(",")[1]
@@ -134,35 +116,26 @@ class GfwList(object):
     def ip_in_black_list(self, ip):
         return self.black_subnets.check_ip(ip)
 
+    def check_host(self, host):
+        # flags of all the lists host is in, keyword is not checked.
+        return self.domain_matcher.match(host)
+
     def in_block_list(self, host):
-        dot_host = b"." + utils.to_bytes(host)
-        if dot_host.endswith(self.gfw_black_list):
+        if self.domain_matcher.match(host) & self.BLACK:
             return True
-        elif self.keyword_re.search(utils.to_str(host)):
+        elif self.keyword_matcher.search(host):
             return True
         else:
             return False
 
     def in_white_list(self, host):
-        dot_host = b"." + host
-        if dot_host.endswith(self.gfw_white_list):
-            return True
-        else:
-            return False
+        return bool(self.domain_matcher.match(host) & self.WHITE)
 
     def in_speedtest_whitelist(self, host):
-        dot_host = b"." + host
-        if dot_host.endswith(self.speedtest_whitelist):
-            return True
-        else:
-            return False
+        return bool(self.domain_matcher.match(host) & self.SPEEDTEST)
 
     def is_advertisement(self, host):
-        dot_host = b"." + host
-        if dot_host.endswith(self.advertisement_list):
-            return True
-        else:
-            return False
+        return bool(self.domain_matcher.match(host) & self.ADVERTISEMENT)
 
 
 class UpdateGFWList(object):
@@ -190,6 +190,30 @@ class DomainRecords(object):
 
         return ips
 
+    def set_ttl(self, domain, dns_type, ttl):
+        # expire time of the upstream answer, the DNS server answer clients with the time left.
+        # ips are not changed, don't refresh the update time.
+        with self.lock:
+            record = self._get(domain)
+            record.setdefault("ttl", {})[dns_type] = time.time() + ttl
+            if self.cache.get(domain) is not record:
+                self._set(domain, record)
+
+    def get_ttl(self, domain, dns_type):
+        # seconds the ips of domain can be cached by clients, 0 if not in cache.
+        with self.lock:
+            record = self.cache.get(domain)
+            if not record or "update" not in record:
+                return 0
+
+            time_now = time.time()
+            ttl = int(record["update"] + self.ttl - time_now)
+            expire_time = record.get("ttl", {}).get(dns_type)
+            if expire_time is not None:
+                ttl = min(ttl, int(round(expire_time - time_now)))
+
+            return max(ttl, 0)
+
     def update_rule(self, domain, rule):
         record = self._get(domain)
         record["r"] = rule
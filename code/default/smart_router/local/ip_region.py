@@ -2,9 +2,11 @@
 # coding: utf-8
 
 import os
-import struct
 import sys
-import socket
+import mmap
+import array
+import bisect
+import struct
 try:
     from urllib.request import urlopen
 except ImportError:
@@ -24,225 +26,247 @@ if __name__ == '__main__':
 
 import env_info
 import utils
+from ip_prefix import IpPrefixIndex, ip_to_num
 from xlog import getLogger
 xlog = getLogger("smart_router")
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 data_path = os.path.join(env_info.data_path, "smart_router")
 
 
 class IpRegion(object):
     cn_ipv4_range = os.path.join(current_path, "cn_ipv4_range.txt")
-    cn_ipdb = os.path.join(data_path, "cn_ipdb.dat")
+    cn_ipv6_range = os.path.join(current_path, "cn_ipv6_range.txt")
+    cn_ipdb = os.path.join(data_path, "cn_ip_range.db")
+
+    #    +----------------------------------+
+    #    | 16 bytes header                  |  <- magic, byte order, ipv4 range num n, ipv6 range num m
+    #    +----------------------------------+
+    #    | n * 4 bytes ipv4 begin           |
+    #    | n * 4 bytes ipv4 end             |  <- native byte order uint32, mapped as array
+    #    +----------------------------------+
+    #    | m * 8 bytes ipv6 begin           |
+    #    | m * 8 bytes ipv6 end             |  <- high 64 bits of ipv6, uint64
+    #    +----------------------------------+
+    # Ranges are sorted and not overlapped, end is included.
+    db_magic = b"CNIP"
+    db_byte_order = 0x01020304
+    db_header = struct.Struct("=4sIII")
+
+    # batch bigger than this use numpy.searchsorted if numpy available.
+    numpy_min_batch = 64
+
+    keeprange = (
+        '0.0.0.0/8',  # 本地网络
+        '10.0.0.0/8',  # 私有网络
+        '100.64.0.0/10',  # 地址共享（运营商 NAT）
+        '127.0.0.0/8',  # 环回地址
+        '169.254.0.0/16',  # 链路本地
+        '172.16.0.0/12',  # 私有网络
+        '192.0.0.0/24',  # 保留地址（IANA）
+        '192.0.2.0/24',  # TEST-NET-1
+        '192.88.99.0/24',  # 6to4 中继
+        '192.168.0.0/16',  # 私有网络
+        '198.18.0.0/15',  # 网络基准测试
+        '198.51.100.0/24',  # TEST-NET-2
+        '203.0.113.0/24',  # TEST-NET-3
+        '224.0.0.0/4',  # 组播地址（D类）
+        '240.0.0.0/4',  # 保留地址（E类）
+        '::/64',  # 环回地址, IPv4 映射地址
+        'fc00::/7',  # 私有网络
+        'fe80::/10',  # 链路本地
+    )
 
     def __init__(self):
         self.cn = b"CN"
-        self.ipdb = self.load_db()
+        self.mm = None
+        self.load_db()
 
     def load_db(self):
-        if not os.path.isfile(self.cn_ipdb):
+        if not self.check_db():
             self.generate_db()
 
         with open(self.cn_ipdb, 'rb') as f:
-            # 读取 IP 范围数据长度 BE Ulong -> int
-            data_len, = struct.unpack('>L', f.read(4))
-            # 读取索引数据
-            index = f.read(224 * 4)
-            # 读取 IP 范围数据
-            data = f.read(data_len)
-            # 简单验证结束
-            if f.read(3) != b'end':
-                raise ValueError('%s file format error' % self.cn_ipdb)
-            # 读取更新信息
-            self.update = f.read().decode('ascii')
-        # 格式化并缓存索引数据
-        # 使用 struct.unpack 一次性分割数据效率更高
-        # 每 4 字节为一个索引范围 fip：BE short -> int，对应 IP 范围序数
-        self.index = struct.unpack('>' + 'h' * (224 * 2), index)
-        # 每 8 字节对应一段直连 IP 范围和一段非直连 IP 范围
-        self.raw_data = data
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, byte_order, ipv4_num, ipv6_num = self.db_header.unpack_from(mm)
+        if magic != self.db_magic or byte_order != self.db_byte_order or \
+                len(mm) != self.db_header.size + ipv4_num * 8 + ipv6_num * 16:
+            mm.close()
+            raise ValueError('%s file format error' % self.cn_ipdb)
+
+        view = memoryview(mm)
+        offset = self.db_header.size
+        self.ipv4_begins = view[offset:offset + ipv4_num * 4].cast("I")
+        offset += ipv4_num * 4
+        self.ipv4_ends = view[offset:offset + ipv4_num * 4].cast("I")
+        offset += ipv4_num * 4
+        self.ipv6_begins = view[offset:offset + ipv6_num * 8].cast("Q")
+        offset += ipv6_num * 8
+        self.ipv6_ends = view[offset:offset + ipv6_num * 8].cast("Q")
+
+        if numpy:
+            self.np_ipv4_begins = numpy.frombuffer(mm, dtype=numpy.uint32, count=ipv4_num,
+                                                   offset=self.db_header.size)
+            self.np_ipv4_ends = numpy.frombuffer(mm, dtype=numpy.uint32, count=ipv4_num,
+                                                 offset=self.db_header.size + ipv4_num * 4)
+        self.mm = mm
+        xlog.debug("load %s ipv4 range:%d ipv6 range:%d", self.cn_ipdb, ipv4_num, ipv6_num)
+
+    def close_db(self):
+        if not self.mm:
+            return
+
+        # the views and numpy arrays export the mmap buffer, close fail while they exist.
+        for view in [self.ipv4_begins, self.ipv4_ends, self.ipv6_begins, self.ipv6_ends]:
+            view.release()
+        self.ipv4_begins = self.ipv4_ends = array.array("I")
+        self.ipv6_begins = self.ipv6_ends = array.array("Q")
+        if numpy:
+            del self.np_ipv4_begins
+            del self.np_ipv4_ends
+
+        self.mm.close()
+        self.mm = None
+
+    def check_db(self):
+        if not os.path.isfile(self.cn_ipdb):
+            return False
 
-    def check_ip(self, ip):
-        ip = utils.to_str(ip)
-        if ":" in ip:
+        mtime = os.path.getmtime(self.cn_ipdb)
+        for fn in [self.cn_ipv4_range, self.cn_ipv6_range]:
+            if os.path.isfile(fn) and os.path.getmtime(fn) > mtime:
+                return False
+
+        with open(self.cn_ipdb, 'rb') as f:
+            header = f.read(self.db_header.size)
+        if len(header) != self.db_header.size:
             return False
 
-        #转换 IP 为 BE Uint32，实际类型 bytes
-        nip = socket.inet_aton(ip)
-        #确定索引范围
-        index = self.index
-        fip = ord(nip[0:1])
-        #从 224 开始都属于保留地址
-        if fip >= 224:
-            return True
-        fip *= 2
-        lo = index[fip]
-        if lo < 0:
+        magic, byte_order, _, _ = self.db_header.unpack(header)
+        # generated on other platform, or the old format.
+        return magic == self.db_magic and byte_order == self.db_byte_order
+
+    def check_ip(self, ip):
+        try:
+            ipv6, num = ip_to_num(ip)
+        except Exception:
             return False
-        hi = index[fip + 1]
-        #与 IP 范围比较确定 IP 位置
-        while lo < hi:
-            mid = (lo + hi) // 2
-            mid_dat_raw = self.raw_data[mid * 4: mid*4 + 4]
-            mid_dat = struct.unpack('4s', mid_dat_raw)[0]
-            if mid_dat > nip:
-                hi = mid
+
+        if ipv6:
+            num >>= 64
+            begins = self.ipv6_begins
+            ends = self.ipv6_ends
+        else:
+            begins = self.ipv4_begins
+            ends = self.ipv4_ends
+
+        i = bisect.bisect_right(begins, num) - 1
+        return i >= 0 and num <= ends[i]
+
+    def classify_ips(self, ips):
+        # return a list of bool, True if the ip in China, one call for a whole DNS answer.
+        ipv4_pos = []
+        ipv4_nums = []
+        results = [False] * len(ips)
+        for pos, ip in enumerate(ips):
+            try:
+                ipv6, num = ip_to_num(ip)
+            except Exception:
+                continue
+
+            if ipv6:
+                results[pos] = self.check_ip(ip)
             else:
-                lo = mid + 1
-        #根据位置序数奇偶确定是否属于直连 IP
-        return lo & 1
+                ipv4_pos.append(pos)
+                ipv4_nums.append(num)
+
+        if numpy and len(ipv4_nums) >= self.numpy_min_batch and len(self.np_ipv4_begins):
+            nums = numpy.array(ipv4_nums, dtype=numpy.uint32)
+            idx = numpy.searchsorted(self.np_ipv4_begins, nums, side="right") - 1
+            found = (idx >= 0) & (nums <= self.np_ipv4_ends[numpy.maximum(idx, 0)])
+            for pos, ok in zip(ipv4_pos, found.tolist()):
+                results[pos] = ok
+        else:
+            begins = self.ipv4_begins
+            ends = self.ipv4_ends
+            bisect_right = bisect.bisect_right
+            for pos, num in zip(ipv4_pos, ipv4_nums):
+                i = bisect_right(begins, num) - 1
+                results[pos] = i >= 0 and num <= ends[i]
+
+        return results
 
     def check_ips(self, ips):
         # return True if any ip in China
-        ips = utils.to_str(ips)
-        for ip in ips:
-            try:
-                if self.check_ip(ip):
-                    return True
-            except Exception as e:
-                xlog.exception("check ip %s fail:%r", ip, e)
-
-        return False
+        return any(self.classify_ips(utils.to_str(ips)))
+
+    def load_range_file(self, fn, index):
+        # lines like "1.0.1.0 256", "1.0.1.0/24" or "2001:250::/35"
+        if not os.path.isfile(fn):
+            return
+
+        with open(fn, "r") as fd:
+            for line in fd:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+
+                try:
+                    if "/" in line:
+                        index.add_cidr(line)
+                    else:
+                        ip, num = line.split()
+                        index.add_range(ip, utils.ip_num_to_string(utils.ip_string_to_num(ip) + int(num) - 1))
+                except Exception as e:
+                    xlog.warn("load ip range %s in %s fail:%r", line, fn, e)
 
     def generate_db(self):
-        keeprange = (
-                     '0.0.0.0/8',  # 本地网络
-                     '10.0.0.0/8',  # 私有网络
-                     '100.64.0.0/10',  # 地址共享（运营商 NAT）
-                     '127.0.0.0/8',  # 环回地址
-                     '169.254.0.0/16',  # 链路本地
-                     '172.16.0.0/12',  # 私有网络
-                     '192.0.0.0/24',  # 保留地址（IANA）
-                     '192.0.2.0/24',  # TEST-NET-1
-                     '192.88.99.0/24',  # 6to4 中继
-                     '192.168.0.0/16',  # 私有网络
-                     '198.18.0.0/15',  # 网络基准测试
-                     '198.51.100.0/24',  # TEST-NET-2
-                     '203.0.113.0/24',  # TEST-NET-3
-                     # 连续地址直到 IP 结束，特殊处理
-                     '224.0.0.0/4',  #组播地址（D类）
-                     # '240.0.0.0/4',  #保留地址（E类）
-                     )
-        keeplist = []
-        for iprange in keeprange:
-            ip, mask = iprange.split('/')
-            keeplist.append((utils.ip_string_to_num(ip), 32 - int(mask)))
-
-        mask_dict = dict((str(2 ** i), i) for i in range(8, 25))
-
-        def int2bytes2(n, pack=struct.pack):
-            '''将整数转换为大端序字节'''
-            return pack('>H', n)
-            # return bytes(map(lambda b: (-1 >> b & 255), (8, 0)))
-
-        def int2bytes4(n, pack=struct.pack):
-            '''将整数转换为大端序字节'''
-            return pack('>I', n)
-            # return bytes(map(lambda b: (n >> b & 255), (24, 16, 8, 0)))
-
-        def bytes2int(s):
-
-            nchars = len(s)
-            # string to int or long. Type depends on nchars
-            x = sum(ord(s[byte]) << 8 * (nchars - byte - 1) for byte in range(nchars))
-            return x
-
-
-        #    +---------+
-        #    | 4 bytes |                     <- data length
-        #    +---------------+
-        #    | 224 * 4 bytes |               <- first ip number index
-        #    +---------------+
-        #    |  2n * 4 bytes |               <- cn ip ranges data
-        #    +------------------------+
-        #    | b'end' and update info |      <- end verify
-        #    +------------------------+
-        lastip_s = 0
-        lastip_e = 0
-        index = {}
-        index_n = 0
-        index_fip = -1
-        offset = 0
-
-        padding = b'\xff\xff'
-        update = ""
-
-        iplist = []
-        fdi = open(self.cn_ipv4_range,"r")
-        for line in fdi.readlines():
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-
-            if "/" in line:
-                lp = line.split("/")
-                iplist.append((utils.ip_string_to_num(lp[0]), int(lp[1])))
+        index = IpPrefixIndex(self.keeprange)
+        self.load_range_file(self.cn_ipv4_range, index)
+        self.load_range_file(self.cn_ipv6_range, index)
+        index.build()
+
+        ipv4_begins = array.array("I", index.begins[0])
+        ipv4_ends = array.array("I", index.ends[0])
+
+        # route is at most /64, keep the high 64 bits, merge ranges again.
+        ipv6_begins = array.array("Q")
+        ipv6_ends = array.array("Q")
+        for begin, end in zip(index.begins[1], index.ends[1]):
+            begin >>= 64
+            end >>= 64
+            if len(ipv6_ends) and begin <= ipv6_ends[-1] + 1:
+                ipv6_ends[-1] = max(ipv6_ends[-1], end)
             else:
-                lp = line.split()
-                iplist.append((utils.ip_string_to_num(lp[0]), mask_dict[lp[1]]))
-
-        iplist.extend(keeplist)
-        # 排序，不然无法处理
-        iplist.sort(key=lambda x: x[0])
-        # 随便算一下
-        buffering = len(iplist) * 8 + 224 * 4 + 64 + 4
-        buffer = bytearray(buffering)
-        for ip, mask in iplist:
-            ip_s = ip >> mask << mask
-            ip_e = (ip >> mask) + 1 << mask
-            # 判断连续
-            if ip_s <= lastip_e:
-                # 判断覆盖
-                if ip_e > lastip_e:
-                    lastip_e = ip_e
-                continue
-            # 排除初始值
-            if lastip_e:
-                # 一段范围分为包含和排除
-                buffer[offset:] = lastip_s = int2bytes4(lastip_s)
-                buffer[offset + 4:] = int2bytes4(lastip_e)
-                # 一个索引分为开始和结束
-                fip = ord(lastip_s[0:1]) * 2
-                if fip != index_fip:
-                    # 前一个索引结束，序数多 1
-                    # 避免无法搜索从当前索引结尾地址到下个索引开始地址
-                    index[index_fip + 1] = index_b = int2bytes2(index_n)
-                    # 当前索引开始
-                    index[fip] = index_b
-                    index_fip = fip
-                index_n += 2
-                offset += 8
-            lastip_s = ip_s
-            lastip_e = ip_e
-        # 添加最后一段范围
-        buffer[offset:] = lastip_s = int2bytes4(lastip_s)
-        buffer[offset + 4:] = int2bytes4(lastip_e)
-        fip = ord(lastip_s[0:1]) * 2
-        if fip != index_fip:
-            index[index_fip + 1] = index_b = int2bytes2(index_n)
-            index[fip] = index_b
-        index_n += 2
-        offset += 8
-        # 添加最后一个结束索引
-        index[fip + 1] = int2bytes2(index_n)
-        # 写入文件
-        fd = open(self.cn_ipdb, 'wb', buffering)
-        fd.write(int2bytes4(offset))
-        for i in range(224 * 2):
-            fd.write(index.get(i, padding))
-        fd.write(buffer[:offset])
-        fd.write(b'endCN IP from ')
-        fd.write(update.encode('ascii'))
-
-        count = int(index_n // 2)
-        fd.write(b', range count: %d' % count)
-        fd.close()
-
-        xlog.debug('include IP range number: %s' % count)
+                ipv6_begins.append(begin)
+                ipv6_ends.append(end)
+
+        self.close_db()
+
+        tmp_fn = self.cn_ipdb + ".tmp"
+        with open(tmp_fn, "wb") as fd:
+            fd.write(self.db_header.pack(self.db_magic, self.db_byte_order, len(ipv4_begins), len(ipv6_begins)))
+            ipv4_begins.tofile(fd)
+            ipv4_ends.tofile(fd)
+            ipv6_begins.tofile(fd)
+            ipv6_ends.tofile(fd)
+
+        if os.path.isfile(self.cn_ipdb):
+            os.remove(self.cn_ipdb)
+        os.rename(tmp_fn, self.cn_ipdb)
+
+        xlog.debug('include IP range ipv4:%d ipv6:%d', len(ipv4_begins), len(ipv6_begins))
         xlog.debug('save to file:%s' % self.cn_ipdb)
 
 
 class UpdateIpRange(object):
     cn_ipv4_range = os.path.join(current_path, "cn_ipv4_range.txt")
+    cn_ipv6_range = os.path.join(current_path, "cn_ipv6_range.txt")
 
     def __init__(self):
         fn = os.path.join(data_path, "apnic.txt")
@@ -267,11 +291,16 @@ class UpdateIpRange(object):
         try:
             fd = open(fn, "br")
             fw = open(self.cn_ipv4_range, "bw")
+            fw6 = open(self.cn_ipv6_range, "bw")
             for line in fd.readlines():
                 if line.startswith(b'apnic|CN|ipv4'):
                     ip = line.split(b'|')
                     if len(ip) > 5:
                         fw.write(b"%s %s\n" % (ip[3], ip[4]))
+                elif line.startswith(b'apnic|CN|ipv6'):
+                    ip = line.split(b'|')
+                    if len(ip) > 5:
+                        fw6.write(b"%s/%s\n" % (ip[3], ip[4]))
 
         except Exception as e:
             xlog.exception("parse_apnic_cniplist %s e:%r", fn, e)
@@ -62,8 +62,8 @@ class PacHandler(simple_http_server.HttpServerHandler):
         proxy = host + ":" + str(port)
         content = content.replace(self.PROXY_LISTEN, proxy)
 
-        black_list = tuple([domain[1:] for domain in g.gfwlist.gfw_black_list])
-        white_list = tuple([domain[1:] for domain in g.gfwlist.gfw_white_list])
+        black_list = g.gfwlist.gfw_black_list
+        white_list = g.gfwlist.gfw_white_list
 
         black = b'",\n"'.join(black_list
                              + g.user_rules.rule_lists["gae"]
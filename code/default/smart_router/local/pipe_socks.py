@@ -1,8 +1,14 @@
+import os
+import ssl
 import threading
 import time
 import sys
 import socket
 import errno
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from xx_six import BlockingIOError
 import utils
@@ -13,22 +19,50 @@ from xlog import getLogger
 xlog = getLogger("smart_router")
 
 
+class SplicePipe(object):
+    # kernel pipe move data from src to dst by os.splice, data is never copied to python.
+    def __init__(self, src, dst, size):
+        self.src = src
+        self.dst = dst
+        self.r, self.w = os.pipe()
+        if fcntl and hasattr(fcntl, "F_SETPIPE_SZ"):
+            try:
+                fcntl.fcntl(self.w, fcntl.F_SETPIPE_SZ, size)
+            except Exception:
+                pass
+        self.pending = 0  # bytes in the pipe
+        self.src_closed = False
+
+    def close(self):
+        os.close(self.r)
+        os.close(self.w)
+
+
 class PipeSocks(object):
-    def __init__(self, buf_size=16*1024):
+    # Plain TCP pairs on linux use splice, data go socket -> pipe -> socket in kernel.
+    # SSL socket, url rewrite and SNI split need the data in python, they use recv/send.
+    splice_size = 256 * 1024
+    splice_flags = getattr(os, "SPLICE_F_MOVE", 0) | getattr(os, "SPLICE_F_NONBLOCK", 0)
+
+    def __init__(self, buf_size=16*1024, use_splice=True, name="pipe"):
         self.buf_size = buf_size
+        self.use_splice = use_splice and hasattr(os, "splice") and sys.platform.startswith("linux")
+        self.name = name
 
         self.select2 = selectors.DefaultSelector()
         self.read_set = set([])
         self.write_set = set([])
+        self.splices = {}  # src sock => SplicePipe
 
         self.running = True
         self.sock_lock = threading.Lock()
         self.sock_notify = threading.Condition(self.sock_lock)
 
     def __str__(self):
-        outs = ["Pipe Sockets:"]
+        outs = ["Pipe Sockets %s:" % self.name]
         outs.append("buf_size=%d" % self.buf_size)
         outs.append("running=%d" % self.running)
+        outs.append("splice=%d pairs:%d" % (self.use_splice, len(self.splices) // 2))
         outs.append("")
 
         outs.append("read dict:")
@@ -41,8 +75,11 @@ class PipeSocks(object):
 
         return "\n".join(outs)
 
+    def __len__(self):
+        return len(self.read_set | self.write_set)
+
     def run(self):
-        self.down_th = threading.Thread(target=self.pipe, name="pipe")
+        self.down_th = threading.Thread(target=self.pipe, name=self.name)
         self.down_th.start()
 
     def stop(self):
@@ -67,6 +104,9 @@ class PipeSocks(object):
         with self.sock_notify:
             s1.pair_sock = s2
             s2.pair_sock = s1
+            if self.can_splice(s1, s2):
+                self.splices[s1] = SplicePipe(s1, s2, self.splice_size)
+                self.splices[s2] = SplicePipe(s2, s1, self.splice_size)
             # self.select2.register(s1, selectors.EVENT_READ)
             # self.select2.register(s2, selectors.EVENT_READ)
             # self.read_set.add(s1)
@@ -76,6 +116,80 @@ class PipeSocks(object):
 
             self.sock_notify.notify()
 
+    def can_splice(self, s1, s2):
+        if not self.use_splice:
+            return False
+
+        for s in (s1, s2):
+            if not isinstance(s._sock, socket.socket) or isinstance(s._sock, ssl.SSLSocket):
+                return False
+
+            if s.replace_pattern or s.buf_size:
+                return False
+
+            # SNI split need the first packet.
+            if g.config.direct_split_SNI and s.port == 443 and s.host and g.gfwlist.in_block_list(s.host):
+                return False
+
+        return True
+
+    def splice_recv(self, s1):
+        pipe = self.splices[s1]
+        try:
+            n = os.splice(s1.fileno(), pipe.w, self.splice_size, flags=self.splice_flags)
+        except BlockingIOError:
+            return
+        except Exception as e:
+            xlog.debug("%s splice recv e:%r", s1, e)
+            self.close(s1, "r")
+            return
+
+        if not n:
+            xlog.debug("%s recv empty, close", s1)
+            self.close(s1, "r")
+            return
+
+        s1.recved_data += n
+        s1.recved_times += 1
+        pipe.pending += n
+        self.splice_send(pipe)
+
+    def splice_send(self, pipe):
+        s2 = pipe.dst
+        while pipe.pending:
+            try:
+                sent = os.splice(pipe.r, s2.fileno(), pipe.pending, flags=self.splice_flags)
+            except BlockingIOError:
+                break
+            except Exception as e:
+                xlog.debug("%s splice send e:%r", s2, e)
+                self.close(s2, "w")
+                return
+
+            if not sent:
+                break
+            s2.sent_data += sent
+            s2.sent_times += 1
+            pipe.pending -= sent
+
+        if pipe.pending:
+            # stop read until the pipe is drained.
+            self.try_remove("READ", pipe.src)
+            self.try_add("WRITE", s2)
+            return
+
+        self.try_remove("WRITE", s2)
+        if pipe.src_closed:
+            self.close(s2, "n")
+        elif not pipe.src.is_closed():
+            self.try_add("READ", pipe.src)
+
+    def release_splice(self, s1, s2):
+        for s in (s1, s2):
+            pipe = self.splices.pop(s, None)
+            if pipe:
+                pipe.close()
+
     def try_add(self, l, s):
         try:
             if l == "READ":
@@ -161,6 +275,20 @@ class PipeSocks(object):
         self.try_remove("WRITE", s1)
         s1.close()
 
+        if s1 in self.splices:
+            pipe = self.splices[s1]
+            if pipe.pending and not s2.is_closed():
+                xlog.debug("pipe close %s e:%s, but s2:%s have data(%d) to send", s1, e, s2, pipe.pending)
+                pipe.src_closed = True
+                return
+
+            if not s2.is_closed():
+                self.try_remove("READ", s2)
+                self.try_remove("WRITE", s2)
+                s2.close()
+            self.release_splice(s1, s2)
+            return
+
         if s2.buf_size:
             xlog.debug("pipe close %s e:%s, but s2:%s have data(%d) to send", s1, e, s2, s2.buf_size)
             s2.add_dat("")  # add empty block to close socket.
@@ -195,9 +323,12 @@ class PipeSocks(object):
             read_list = []
             write_list = []
             error_list = []
+            splice_list = []
             for key, event in events:
                 s1 = key.fileobj
-                if event & selectors.EVENT_READ:
+                if s1 in self.splices:
+                    splice_list.append((s1, event))
+                elif event & selectors.EVENT_READ:
                     s1.can_read = True
                     read_list.append(s1)
                     # xlog.debug("get read on %s", s1)
@@ -210,6 +341,12 @@ class PipeSocks(object):
                     xlog.error("get error on %s", s1)
 
             try:
+                for s1, event in splice_list:
+                    if event & selectors.EVENT_READ and not s1.is_closed():
+                        self.splice_recv(s1)
+                    if event & selectors.EVENT_WRITE and not s1.is_closed() and s1.pair_sock in self.splices:
+                        self.splice_send(self.splices[s1.pair_sock])
+
                 for s1 in read_list:
                     if s1.is_closed():
                         continue
@@ -242,7 +379,7 @@ class PipeSocks(object):
                     if g.config.direct_split_SNI and\
                                     s1.recved_times == 1 and \
                                     s2.port == 443 and \
-                                    d[0] == '\x16' and \
+                                    d[:1] == b'\x16' and \
                             g.gfwlist.in_block_list(s2.host):
                         p1 = d.find(s2.host)
                         if p1 > 1:
@@ -394,4 +531,25 @@ class PipeSocks(object):
             for s in list(self.read_set) + list(self.write_set):
                 self.close(s, "stop")
 
-        xlog.info("pipe stopped.")
\ No newline at end of file
+        xlog.info("pipe stopped.")
+
+
+class PipeSocksGroup(object):
+    # pairs are spread over num PipeSocks, each run a selector in it's own thread.
+    def __init__(self, buf_size=16*1024, num=1, use_splice=True):
+        self.pipes = [PipeSocks(buf_size, use_splice, name="pipe_%d" % i) for i in range(num)]
+
+    def __str__(self):
+        return "\n\n".join(str(pipe) for pipe in self.pipes)
+
+    def run(self):
+        for pipe in self.pipes:
+            pipe.run()
+
+    def stop(self):
+        for pipe in self.pipes:
+            pipe.stop()
+
+    def add_socks(self, s1, s2):
+        pipe = min(self.pipes, key=len)
+        pipe.add_socks(s1, s2)
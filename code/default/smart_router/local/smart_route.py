@@ -518,7 +518,7 @@ def handle_ip_proxy(sock, ip, port, client_address):
     elif g.ip_region.check_ip(ip):
         # China IP
         rule_list = ["direct", "socks"]
-    elif g.gfwlist.in_block_list(ip):
+    elif g.gfwlist.ip_in_black_list(ip) or g.gfwlist.in_block_list(ip):
         rule_list = ["gae", "socks"]
     else:
         rule_list = ["direct", "gae", "socks", ]
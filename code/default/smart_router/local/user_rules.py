@@ -10,6 +10,7 @@ root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
 
 import env_info
 import utils
+from domain_matcher import DomainMatcher
 from xlog import getLogger
 xlog = getLogger("smart_router")
 data_path = os.path.join(env_info.data_path, "smart_router")
@@ -17,14 +18,15 @@ data_path = os.path.join(env_info.data_path, "smart_router")
 
 class Config(object):
     rule_list = ["direct", "gae", "socks", "black", "redirect_https"]
+    # flag of section in end_rules is 1 << index, the first section win if domain match many.
+    redirect_https_flag = 1 << rule_list.index("redirect_https")
 
     def __init__(self):
         self.rule_lists = {}
         self.host_rules = {}
-        self.end_rules = {}
+        self.end_rules = DomainMatcher()
 
-        self.redirect_https_host_rules = ()
-        self.redirect_https_end_rules = ()
+        self.redirect_https_host_rules = set()
 
         self.load()
 
@@ -97,10 +99,11 @@ class Config(object):
         return hosts, end_fix
 
     def load(self):
-        self.host_rules = {}
-        self.end_rules = {}
+        host_rules = {}
+        end_rules = DomainMatcher()
+        redirect_https_host_rules = set()
 
-        for section in self.rule_list:
+        for section_index, section in enumerate(self.rule_list):
             self.rule_lists[section] = tuple()
             fn = os.path.join(data_path, "%s_list.txt" % section)
             if not os.path.isfile(fn):
@@ -111,27 +114,28 @@ class Config(object):
                 hosts, end_fix = self.parse_rules(content)
                 self.rule_lists[section] = tuple(hosts + end_fix)
                 if section == "redirect_https":
-                    self.redirect_https_host_rules = tuple(utils.to_bytes(hosts))
-                    self.redirect_https_end_rules = tuple(utils.to_bytes(end_fix))
+                    redirect_https_host_rules.update(hosts)
                 else:
                     for host in hosts:
-                        self.host_rules[host] = section
+                        host_rules[host] = section
+
+                end_rules.add_list(end_fix, 1 << section_index)
 
-                    if len(end_fix):
-                        self.end_rules[section] = tuple(utils.to_bytes(end_fix))
+        self.host_rules = host_rules
+        self.end_rules = end_rules
+        self.redirect_https_host_rules = redirect_https_host_rules
 
     def check_host(self, domain, port=None):
         domain = utils.to_bytes(domain)
+        flags = self.end_rules.match(domain)
         if port == 80:
-            if domain in self.redirect_https_host_rules or domain.endswith(self.redirect_https_end_rules):
+            if domain in self.redirect_https_host_rules or flags & self.redirect_https_flag:
                 return "redirect_https"
 
         if domain in self.host_rules:
             return self.host_rules[domain]
 
-        for sec in self.end_rules:
-            try:
-                if domain.endswith(self.end_rules[sec]):
-                    return sec
-            except Exception as e:
-                xlog.exception("check_host domain:%s sec:%s self.end_rules[sec]", domain, sec, self.end_rules[sec])
+        flags &= ~self.redirect_https_flag
+        if flags:
+            # lowest bit, the first section in rule_list.
+            return self.rule_list[(flags & -flags).bit_length() - 1]
@@ -2,6 +2,7 @@
 # coding:utf-8
 
 import os
+import json
 
 try:
     from urllib.parse import urlparse, parse_qs
@@ -158,5 +159,7 @@ class ControlHandler(simple_http_server.HttpServerHandler):
 
     def req_status(self):
         out_str = "pipe status:\n" + str(g.pipe_socks)
+        out_str += "\ndns query:\n" + json.dumps(g.dns_query.status(), indent=2)
+        out_str += "\ndns server:\n" + json.dumps(g.dns_srv.status(), indent=2)
         self.send_response("text/plain", out_str)
 
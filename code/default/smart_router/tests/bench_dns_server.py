@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import random
+import argparse
+import tempfile
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+sys.path.append(default_path)
+
+from dnslib import DNSRecord, DNSQuestion, QTYPE
+from smart_router.local import dns_server, host_records, global_var as g
+
+# DNS server load test with local UDP clients.
+# Upstream is a fake resolver with --upstream-delay, --domains names are queried at random by --clients,
+# like a browser loading pages of the same sites.
+#   thread: the old server, a thread per datagram and no response cache
+#   nocache: select loop + worker pool
+#   cache: select loop + worker pool + response cache
+
+
+class FakeConfig(object):
+    udp_relay_port = 0
+
+
+class FakeDnsQuery(object):
+    def __init__(self, delay):
+        self.delay = delay
+        self.query_num = 0
+
+    def query(self, domain, dns_type=1):
+        self.query_num += 1
+        time.sleep(self.delay)
+        g.domain_cache.set_ips(domain, [b"10.0.0.1"], dns_type)
+        g.domain_cache.set_ttl(domain, dns_type, 300)
+        return [b"10.0.0.1"]
+
+
+class ThreadDnsServer(dns_server.DnsServer):
+    def on_query(self, rsock, req_data, addr, head=b""):
+        threading.Thread(target=self.thread_query, args=(rsock, req_data, addr, head)).start()
+
+    def thread_query(self, rsock, req_data, addr, head):
+        res_data, ttl = self.dns_query(req_data, addr)
+        if res_data:
+            rsock.sendto(head + res_data, addr)
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(args, mode):
+    g.dns_query = FakeDnsQuery(args.upstream_delay)
+    if mode == "thread":
+        server = ThreadDnsServer(port=0, backup_port=0, ttl=3600)
+    else:
+        server = dns_server.DnsServer(port=0, backup_port=0, ttl=3600, worker_num=args.workers,
+                                      cache_size=args.domains * 2 if mode == "cache" else 0)
+    server.start()
+    port = server.sockets[-1].getsockname()[1]
+
+    domains = ["www%d.example.com" % i for i in range(args.domains)]
+    latencies = []
+    lost = [0]
+    stat_lock = threading.Lock()
+    max_threads = [threading.active_count()]
+    end_time = time.time() + args.duration
+
+    def client():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(2)
+        while time.time() < end_time:
+            req = DNSRecord(q=DNSQuestion(random.choice(domains), QTYPE.A))
+            req.header.id = random.randint(0, 65535)
+            start = time.time()
+            sock.sendto(req.pack(), ("127.0.0.1", port))
+            try:
+                while True:
+                    res = sock.recv(1024)
+                    if res[:2] == req.pack()[:2]:
+                        break
+            except socket.timeout:
+                with stat_lock:
+                    lost[0] += 1
+                continue
+
+            with stat_lock:
+                latencies.append(time.time() - start)
+                max_threads[0] = max(max_threads[0], threading.active_count())
+        sock.close()
+
+    cpu_start = time.process_time()
+    start_time = time.time()
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    time_cost = time.time() - start_time
+    cpu_cost = time.process_time() - cpu_start
+
+    server.stop()
+
+    print("%s clients:%d domains:%d upstream delay:%dms" % (
+        mode, args.clients, args.domains, args.upstream_delay * 1000))
+    print("  qps:%.1f  p50:%.2fms p99:%.2fms  lost:%d" % (
+        len(latencies) / time_cost, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, lost[0]))
+    print("  upstream queries:%d  max threads:%d  cpu per 1k queries:%.3fs" % (
+        g.dns_query.query_num, max_threads[0], cpu_cost * 1000 / max(1, len(latencies))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="smart_router DNS server UDP load test")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--domains", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--upstream-delay", type=float, default=0.005, help="seconds")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--modes", nargs="+", default=["thread", "nocache", "cache"])
+    args = parser.parse_args()
+
+    tmp_path = tempfile.mkdtemp()
+    try:
+        g.config = FakeConfig()
+        for mode in args.modes:
+            g.domain_cache = host_records.DomainRecords(os.path.join(tmp_path, "domain_records.txt"),
+                                                        capacity=args.domains * 2)
+            run(args, mode)
+    finally:
+        shutil.rmtree(tmp_path)
+    os._exit(0)
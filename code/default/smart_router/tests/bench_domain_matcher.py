@@ -0,0 +1,117 @@
+import os
+import re
+import sys
+import time
+import random
+import string
+import argparse
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+smart_route_path = os.path.abspath(os.path.join(current_path, os.path.pardir))
+local_path = os.path.join(smart_route_path, "local")
+sys.path.append(local_path)
+
+default_path = os.path.abspath(os.path.join(smart_route_path, os.path.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+
+import utils
+import gfwlist
+from domain_matcher import KeywordMatcher
+
+# GfwList lookups, the old bytes.endswith(tuple) + keyword regex vs DomainMatcher + KeywordMatcher.
+# Hostname corpus is made from the shipped lists:
+#   sub domains of black/white/advertisement list, hosts with a keyword, and random hosts not in any list.
+
+
+class OldGfwList(object):
+    def __init__(self, gfw):
+        _, _, self.keywords = gfw.load_banlist("sr_top500_banlist.conf")
+        self.keyword_re = re.compile("|".join(self.keywords))
+        self.gfw_black_list = tuple(b"." + d for d in gfw.gfw_black_list)
+        self.gfw_white_list = tuple(b"." + d for d in gfw.gfw_white_list)
+        self.advertisement_list = tuple(b"." + d for d in utils.to_bytes(gfw.load("advertisement_list.txt")))
+
+    def in_block_list(self, host):
+        dot_host = b"." + host
+        if dot_host.endswith(self.gfw_black_list):
+            return True
+        elif self.keyword_re.search(host.decode()):
+            return True
+        else:
+            return False
+
+    def in_white_list(self, host):
+        return (b"." + host).endswith(self.gfw_white_list)
+
+    def is_advertisement(self, host):
+        return (b"." + host).endswith(self.advertisement_list)
+
+
+def make_hosts(gfw, num):
+    subs = [b"www", b"m", b"api", b"cdn", b"img1", b"static", b"s3.us-west-2"]
+    listed = list(gfw.gfw_black_list) + list(gfw.gfw_white_list) + \
+        list(utils.to_bytes(gfw.load("advertisement_list.txt")))
+    hosts = []
+    for i in range(num):
+        r = random.random()
+        if r < 0.3:
+            hosts.append(random.choice(subs) + b"." + random.choice(listed))
+        elif r < 0.35:
+            hosts.append(b"shop.%damazon-%d.example" % (i, i))
+        else:
+            hosts.append(b"%s.site%d.%s" % (random.choice(subs), random.randint(0, 100000),
+                                             random.choice([b"com", b"net", b"org", b"co.uk", b"io"])))
+    return hosts
+
+
+def bench(name, fns, hosts, rounds):
+    start = time.time()
+    for _ in range(rounds):
+        for host in hosts:
+            for fn in fns:
+                fn(host)
+    cost = time.time() - start
+    num = len(hosts) * rounds
+    print("  %-28s %8.0f hosts/s  %.2fus/host" % (name, num / cost, cost * 1000000 / num))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GfwList host lookup")
+    parser.add_argument("--hosts", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    gfw = gfwlist.GfwList()
+    old = OldGfwList(gfw)
+    hosts = make_hosts(gfw, args.hosts)
+
+    for host in hosts:
+        assert gfw.in_block_list(host) == old.in_block_list(host), host
+        assert gfw.in_white_list(host) == old.in_white_list(host), host
+        assert gfw.is_advertisement(host) == old.is_advertisement(host), host
+
+    print("domains:%d keywords:%d hosts:%d, block:%d white:%d" % (
+        len(gfw.domain_matcher), len(old.keywords), len(hosts),
+        sum(1 for h in hosts if gfw.in_block_list(h)), sum(1 for h in hosts if gfw.in_white_list(h))))
+    bench("old in_block_list", [old.in_block_list], hosts, args.rounds)
+    bench("new in_block_list", [gfw.in_block_list], hosts, args.rounds)
+    bench("old block+white+ad", [old.in_block_list, old.in_white_list, old.is_advertisement], hosts, args.rounds)
+    bench("new block+white+ad", [gfw.in_block_list, gfw.in_white_list, gfw.is_advertisement], hosts, args.rounds)
+    bench("new check_host, one walk", [gfw.check_host], hosts, args.rounds)
+    bench("old keyword regex", [lambda h: old.keyword_re.search(h.decode())], hosts, args.rounds)
+    bench("new keyword matcher", [gfw.keyword_matcher.search], hosts, args.rounds)
+
+    # keyword number grow, re alternation slow down, automaton not.
+    for num in (12, 50, 300):
+        words = [utils.to_bytes("".join(random.choice(string.ascii_lowercase) for _ in range(8)))
+                 for _ in range(num)]
+        keyword_re = re.compile(b"|".join(words))
+        automaton = KeywordMatcher()
+        automaton.max_regex_keywords = 0
+        for word in words:
+            automaton.add(word)
+        automaton.build()
+        bench("%d keywords regex" % num, [keyword_re.search], hosts, 1)
+        bench("%d keywords automaton" % num, [automaton.search], hosts, 1)
+    os._exit(0)
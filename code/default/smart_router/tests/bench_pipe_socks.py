@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+sys.path.append(default_path)
+
+from smart_router.local import pipe_socks, global_var as g
+from smart_router.local.socket_wrap import SocketWrap
+
+# PipeSocks loopback throughput.
+# --pairs TCP connections are relayed: client -> pipe -> sink, each client send --size MB.
+#   copy: recv/send in python
+#   splice: os.splice through a kernel pipe, linux only
+
+
+class FakeConfig(object):
+    direct_split_SNI = 0
+
+
+def tcp_pair(listen_sock):
+    c = socket.create_connection(listen_sock.getsockname())
+    s, _ = listen_sock.accept()
+    return c, s
+
+
+def run(args, mode):
+    pipe = pipe_socks.PipeSocksGroup(g.config.pip_cache_size, args.threads, use_splice=(mode == "splice"))
+    pipe.run()
+
+    listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_sock.bind(("127.0.0.1", 0))
+    listen_sock.listen(args.pairs * 2)
+
+    clients = []
+    sinks = []
+    for i in range(args.pairs):
+        client, a = tcp_pair(listen_sock)
+        b, sink = tcp_pair(listen_sock)
+        pipe.add_socks(SocketWrap(a, "127.0.0.1", 1), SocketWrap(b, "1.2.3.4", 80, b"bench.com"))
+        clients.append(client)
+        sinks.append(sink)
+
+    size = int(args.size * 1024 * 1024)
+    block = b"x" * 65536
+    received = [0] * args.pairs
+
+    def send(client):
+        left = size
+        while left > 0:
+            left -= client.send(block[:left])
+        client.close()
+
+    def recv(i, sink):
+        while True:
+            d = sink.recv(65536)
+            if not d:
+                break
+            received[i] += len(d)
+        sink.close()
+
+    cpu_start = time.process_time()
+    start_time = time.time()
+    threads = [threading.Thread(target=send, args=(c,)) for c in clients]
+    threads += [threading.Thread(target=recv, args=(i, s)) for i, s in enumerate(sinks)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    time_cost = time.time() - start_time
+    cpu_cost = time.process_time() - cpu_start
+
+    pipe.stop()
+    listen_sock.close()
+
+    total = sum(received)
+    print("%s pairs:%d threads:%d size:%.1fMB" % (mode, args.pairs, args.threads, args.size))
+    print("  throughput:%.1f MB/s  cpu per GB:%.2fs  complete:%d" % (
+        total / time_cost / 1024 / 1024, cpu_cost * 1024 * 1024 * 1024 / max(1, total), total == size * args.pairs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="smart_router PipeSocks loopback throughput")
+    parser.add_argument("--pairs", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--size", type=float, default=64, help="MB per pair")
+    parser.add_argument("--modes", nargs="+", default=["copy", "splice"])
+    args = parser.parse_args()
+
+    g.config = FakeConfig()
+    g.config.pip_cache_size = 32 * 1024
+    for mode in args.modes:
+        run(args, mode)
+    os._exit(0)
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+sys.path.append(default_path)
+
+from smart_router.local import connect_manager, host_records, global_var as g
+
+
+class FakeConfig(object):
+    PROXY_ENABLE = 0
+
+
+class TestConnectManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.org = (g.config, g.ip_cache)
+        g.config = FakeConfig()
+        g.ip_cache = host_records.IpRecord(os.path.join(self.tmp_path, "ip_records.txt"))
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(50)
+        self.port = self.server.getsockname()[1]
+        self.manager = connect_manager.ConnectManager(attempt_delay=0.1)
+
+    def tearDown(self):
+        self.manager.stop()
+        self.server.close()
+        g.config, g.ip_cache = self.org
+        shutil.rmtree(self.tmp_path)
+
+    def test_connect(self):
+        sock = self.manager.get_conn(b"a.com", [b"127.0.0.1"], self.port)
+        self.assertEqual(sock.ip, b"127.0.0.1")
+        self.assertLess(g.ip_cache.get_connect_time(b"127.0.0.1", self.port), 1000)
+        sock.close()
+
+    def test_fail_fast(self):
+        # nothing listen on 127.0.0.3, refused attempt start the next at once.
+        t0 = time.time()
+        sock = self.manager.get_conn(b"b.com", [b"127.0.0.3", b"127.0.0.1"], self.port)
+        self.assertEqual(sock.ip, b"127.0.0.1")
+        self.assertLess(time.time() - t0, 0.1)
+        sock.close()
+
+        self.assertIsNone(self.manager.get_conn(b"c.com", [b"127.0.0.3"], self.port, timeout=1))
+
+    def test_pool(self):
+        # attempts connected after the winner are kept for the next request.
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("0.0.0.0", 0))
+        server.listen(50)
+        port = server.getsockname()[1]
+
+        self.manager.attempt_delay = 0
+        sock = self.manager.get_conn(b"d.com", [b"127.0.0.1", b"127.0.0.2"], port)
+        time.sleep(0.3)
+        pooled = self.manager.get_conn(b"d.com", [b"127.0.0.3"], port)
+        self.assertEqual({sock.ip, pooled.ip}, {b"127.0.0.1", b"127.0.0.2"})
+        sock.close()
+
+        # closed by server, not alive.
+        for _ in range(2):
+            peer, _ = server.accept()
+            peer.close()
+        server.close()
+        self.manager.add_sock("e.com:%d" % port, pooled)
+        time.sleep(0.1)
+        self.assertFalse(connect_manager.is_alive(pooled._sock))
+        self.assertIsNone(self.manager.get_sock_from_cache("e.com:%d" % port))
+
+    def test_interleave_ips(self):
+        self.assertEqual(connect_manager.interleave_ips([b"::1", b"::2", b"1.1.1.1", b"::3", b"2.2.2.2"]),
+                         [b"::1", b"1.1.1.1", b"::2", b"2.2.2.2", b"::3"])
+
+
+if __name__ == '__main__':
+    unittest.main()
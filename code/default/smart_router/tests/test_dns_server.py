@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+sys.path.append(default_path)
+
+from dnslib import DNSRecord, DNSQuestion, QTYPE
+from smart_router.local import dns_server, host_records, global_var as g
+
+
+class FakeConfig(object):
+    udp_relay_port = 0
+
+
+class FakeDnsQuery(object):
+    def __init__(self):
+        self.query_num = 0
+        self.delay = 0
+
+    def query(self, domain, dns_type=1):
+        self.query_num += 1
+        time.sleep(self.delay)
+        if domain.startswith(b"fail"):
+            return []
+        g.domain_cache.set_ips(domain, [b"1.2.3.4"], dns_type)
+        g.domain_cache.set_ttl(domain, dns_type, 300)
+        return [b"1.2.3.4"]
+
+
+class TestDnsServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.org = (g.config, g.dns_query, g.domain_cache)
+        g.config = FakeConfig()
+        g.dns_query = FakeDnsQuery()
+        g.domain_cache = host_records.DomainRecords(os.path.join(self.tmp_path, "domain_records.txt"))
+
+        self.server = dns_server.DnsServer(port=0, backup_port=0, ttl=3600, worker_num=2)
+        self.server.start()
+        self.port = self.server.sockets[-1].getsockname()[1]
+
+    def tearDown(self):
+        self.server.stop()
+        g.config, g.dns_query, g.domain_cache = self.org
+        shutil.rmtree(self.tmp_path)
+
+    def query(self, domain, id=1):
+        req = DNSRecord(q=DNSQuestion(domain, QTYPE.A))
+        req.header.id = id
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(3)
+        sock.sendto(req.pack(), ("127.0.0.1", self.port))
+        res = DNSRecord.parse(sock.recv(1024))
+        sock.close()
+        return res
+
+    def test_parse_question(self):
+        data = DNSRecord(q=DNSQuestion("WWW.Google.com", QTYPE.AAAA)).pack()
+        qname, qtype, question_end = dns_server.parse_question(data)
+        self.assertEqual(qname, b"\x03www\x06google\x03com\x00")
+        self.assertEqual(qtype, 28)
+        self.assertEqual(question_end, len(data))
+
+        self.assertIsNone(dns_server.parse_question(data[:20]))
+        self.assertIsNone(dns_server.parse_question(b"\x00" * 5))
+
+    def test_cache(self):
+        res = self.query("www.google.com", id=10)
+        self.assertEqual(res.header.id, 10)
+        self.assertEqual(str(res.rr[0].rdata), "1.2.3.4")
+        self.assertEqual(res.rr[0].ttl, 300)
+
+        res = self.query("WWW.google.COM", id=11)
+        self.assertEqual(res.header.id, 11)
+        self.assertEqual(str(res.q.qname), "WWW.google.COM.")
+        self.assertEqual(str(res.rr[0].rdata), "1.2.3.4")
+        self.assertEqual(g.dns_query.query_num, 1)
+        self.assertEqual(self.server.status()["hit"], 1)
+
+        # empty answer is not cached.
+        self.assertEqual(len(self.query("fail.com").rr), 0)
+        self.assertEqual(len(self.query("fail.com").rr), 0)
+        self.assertEqual(g.dns_query.query_num, 3)
+
+    def test_cache_ttl_left(self):
+        self.assertEqual(self.query("www.google.com").rr[0].ttl, 300)
+
+        # 200 seconds later, hit answer with the time left.
+        key = list(self.server.cache.keys())[0]
+        res_data, expire_time, ttl_offsets = self.server.cache[key]
+        self.server.cache[key] = (res_data, expire_time - 200, ttl_offsets)
+
+        res = self.query("www.google.com", id=2)
+        self.assertEqual(g.dns_query.query_num, 1)
+        self.assertEqual(res.header.id, 2)
+        self.assertEqual(res.rr[0].ttl, 100)
+        self.assertEqual(str(res.rr[0].rdata), "1.2.3.4")
+
+    def test_parse_ttl_offsets(self):
+        data = self.query("www.google.com").pack()
+        question_end = dns_server.parse_question(DNSRecord(q=DNSQuestion("www.google.com", QTYPE.A)).pack())[2]
+        offsets = dns_server.parse_ttl_offsets(data, question_end)
+        self.assertEqual(len(offsets), 1)
+
+        res = DNSRecord.parse(dns_server.set_ttl(data, offsets, 12))
+        self.assertEqual(res.rr[0].ttl, 12)
+
+        self.assertIsNone(dns_server.parse_ttl_offsets(data[:-2], question_end))
+
+    def test_domain_ttl(self):
+        g.domain_cache.set_ips(b"a.com", [b"1.2.3.4"], 1)
+        update_time = g.domain_cache.cache[b"a.com"]["update"]
+        time.sleep(0.01)
+        g.domain_cache.set_ttl(b"a.com", 1, 300)
+        self.assertEqual(g.domain_cache.cache[b"a.com"]["update"], update_time)
+        self.assertEqual(g.domain_cache.get_ttl(b"a.com", 1), 300)
+
+        # time left of the upstream answer.
+        g.domain_cache.cache[b"a.com"]["ttl"][1] -= 200
+        self.assertEqual(g.domain_cache.get_ttl(b"a.com", 1), 100)
+
+        g.domain_cache.cache[b"a.com"]["ttl"][1] -= 200
+        self.assertEqual(g.domain_cache.get_ttl(b"a.com", 1), 0)
+
+        # no upstream ttl, limited by the domain cache ttl.
+        g.domain_cache.set_ips(b"b.com", [b"1.2.3.4"], 1)
+        self.assertIn(g.domain_cache.get_ttl(b"b.com", 1), [g.domain_cache.ttl - 1, g.domain_cache.ttl])
+
+    def test_pending_query_once(self):
+        g.dns_query.delay = 0.3
+        results = []
+
+        def client(id):
+            results.append(self.query("slow.com", id=id).header.id)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(10)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        self.assertEqual(sorted(results), list(range(10)))
+        self.assertEqual(g.dns_query.query_num, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import re
+import random
+import unittest
+
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+smart_route_path = os.path.abspath(os.path.join(current_path, os.path.pardir))
+local_path = os.path.join(smart_route_path, "local")
+sys.path.append(local_path)
+
+default_path = os.path.abspath(os.path.join(smart_route_path, os.path.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+
+from domain_matcher import DomainMatcher, KeywordMatcher
+
+
+class TestDomainMatcher(unittest.TestCase):
+    def test_match(self):
+        m = DomainMatcher()
+        m.add_list([b"google.com", b"*.g.cn"], 1)
+        m.add_list([b".google.com", b"youtube.com"], 2)
+
+        self.assertEqual(m.match(b"google.com"), 1)
+        self.assertEqual(m.match(b"www.google.com"), 3)
+        self.assertEqual(m.match(b"agoogle.com"), 0)
+        self.assertEqual(m.match(b"g.cn"), 0)
+        self.assertEqual(m.match(b"a.b.g.cn"), 1)
+        self.assertEqual(m.match("m.youtube.com"), 2)
+        self.assertEqual(m.match(b"com"), 0)
+
+    def test_same_as_endswith(self):
+        domains = [b"a.com", b"b.a.com", b"c.net", b"x.y.z.org"]
+        m = DomainMatcher()
+        m.add_list(domains, 1)
+        dot_domains = tuple(b"." + d for d in domains)
+
+        labels = [b"a", b"b", b"c", b"com", b"net", b"x", b"y", b"z", b"org", b"ba"]
+        for _ in range(2000):
+            host = b".".join(random.choice(labels) for _ in range(random.randint(1, 4)))
+            self.assertEqual(bool(m.match(host)), (b"." + host).endswith(dot_domains), host)
+
+    def test_keyword(self):
+        keywords = ["he", "she", "his", "hers", "amazon", "aws", "blogspot"]
+        keyword_re = re.compile("|".join(keywords))
+        self.assertFalse(KeywordMatcher().search(b"www.amazon.com"))
+
+        for max_regex_keywords in (0, 20):
+            # automaton and regex.
+            m = KeywordMatcher()
+            m.max_regex_keywords = max_regex_keywords
+            for keyword in keywords:
+                m.add(keyword)
+            m.build()
+
+            self.assertTrue(m.search(b"www.amazon.com"))
+            self.assertTrue(m.search(b"ushers.org"))
+            self.assertFalse(m.search(b"www.apple.com"))
+            for _ in range(5000):
+                host = "".join(random.choice("hersiawmzonblg.") for _ in range(random.randint(0, 12)))
+                self.assertEqual(m.search(host), bool(keyword_re.search(host)), host)
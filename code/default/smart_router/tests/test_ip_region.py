@@ -0,0 +1,66 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+smart_route_path = os.path.abspath(os.path.join(current_path, os.path.pardir))
+local_path = os.path.join(smart_route_path, "local")
+sys.path.append(local_path)
+
+default_path = os.path.abspath(os.path.join(smart_route_path, os.path.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+
+import ip_region
+
+
+class TestIpRegion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.org_ipdb = ip_region.IpRegion.cn_ipdb
+        self.org_ipv6_range = ip_region.IpRegion.cn_ipv6_range
+        ip_region.IpRegion.cn_ipdb = os.path.join(self.tmp_path, "cn_ip_range.db")
+        ip_region.IpRegion.cn_ipv6_range = os.path.join(self.tmp_path, "cn_ipv6_range.txt")
+
+    def tearDown(self):
+        ip_region.IpRegion.cn_ipdb = self.org_ipdb
+        ip_region.IpRegion.cn_ipv6_range = self.org_ipv6_range
+        shutil.rmtree(self.tmp_path)
+
+    def test_check_ip(self):
+        with open(ip_region.IpRegion.cn_ipv6_range, "w") as fd:
+            fd.write("2001:250::/35\n")
+
+        region = ip_region.IpRegion()
+        self.assertTrue(region.check_ip("114.114.114.114"))
+        self.assertTrue(region.check_ip(b"111.63.255.255"))
+        self.assertFalse(region.check_ip("8.8.8.8"))
+        self.assertTrue(region.check_ip("192.168.1.1"))
+        self.assertTrue(region.check_ip("240.0.0.1"))
+        self.assertTrue(region.check_ip("2001:250:1::1"))
+        self.assertFalse(region.check_ip("2001:4860::8888"))
+        self.assertFalse(region.check_ip("not ip"))
+
+        ips = ["8.8.8.8", "114.114.114.114", "2001:250::1", "bad", "1.1.1.1"]
+        self.assertEqual(region.classify_ips(ips), [False, True, True, False, False])
+        self.assertTrue(region.check_ips([b"8.8.8.8", b"114.114.114.114"]))
+        self.assertFalse(region.check_ips(["8.8.8.8"]))
+
+        # database is mapped, next start don't generate again.
+        self.assertTrue(region.check_db())
+
+    def test_regenerate(self):
+        region = ip_region.IpRegion()
+        self.assertTrue(region.check_ip("114.114.114.114"))
+
+        # the mapped database is closed and generated again.
+        region.generate_db()
+        self.assertIsNone(region.mm)
+        self.assertFalse(region.check_ip("114.114.114.114"))
+
+        region.load_db()
+        self.assertTrue(region.check_ip("114.114.114.114"))
+        self.assertFalse(region.check_ip("8.8.8.8"))
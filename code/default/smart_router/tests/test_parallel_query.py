@@ -0,0 +1,402 @@
+import os
+import sys
+import time
+import struct
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+sys.path.append(default_path)
+
+import utils
+from dnslib import DNSRecord, DNSHeader, DNSQuestion, RR, A, QTYPE
+from smart_router.local import dns_query, host_records, global_var as g
+
+
+class FakeResolver(object):
+    def __init__(self, protocol, delay, ips):
+        self.protocol = protocol
+        self.delay = delay
+        self.ips = ips
+        self.query_num = 0
+
+    def query(self, domain, dns_type=1):
+        self.query_num += 1
+        time.sleep(self.delay)
+        return self.ips
+
+
+class TestParallelQuery(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.org_domain_cache = g.domain_cache
+        g.domain_cache = host_records.DomainRecords(os.path.join(self.tmp_path, "domain_records.txt"))
+        self.parallel_query = dns_query.ParallelQuery(worker_num=4, fanout=1, timeout=2)
+
+    def tearDown(self):
+        self.parallel_query.stop()
+        g.domain_cache = self.org_domain_cache
+        shutil.rmtree(self.tmp_path)
+
+    def test_fanout(self):
+        fast = FakeResolver("fast", 0.01, [b"1.1.1.1"])
+        slow = FakeResolver("slow", 0.2, [b"2.2.2.2"])
+        fail = FakeResolver("fail", 0, None)
+
+        # all new resolvers are tried first.
+        self.assertTrue(self.parallel_query.query(b"a.com", 1, [slow.query, fast.query, fail.query]))
+        time.sleep(0.3)
+        self.assertEqual(fast.query_num + slow.query_num + fail.query_num, 3)
+
+        # then only the fastest.
+        self.assertEqual(self.parallel_query.query(b"b.com", 1, [slow.query, fast.query, fail.query]), [b"1.1.1.1"])
+        time.sleep(0.3)
+        self.assertEqual(fast.query_num, 2)
+        self.assertEqual(slow.query_num, 1)
+
+        stats = self.parallel_query.stats.status()
+        self.assertLess(stats["fast"]["latency"], stats["slow"]["latency"])
+        self.assertEqual(stats["fail"]["fail"], 1)
+
+    def test_fallback(self):
+        fail = FakeResolver("fail", 0, None)
+        ok = FakeResolver("ok", 0.1, [b"3.3.3.3"])
+        self.parallel_query.query(b"a.com", 1, [fail.query, ok.query])
+        self.parallel_query.stats.stats["ok"]["last_try"] = time.time()
+        self.parallel_query.stats.stats["ok"]["latency"] = 10
+
+        # fail is faster than ok, but ok is queried after it fail.
+        self.assertEqual(self.parallel_query.query(b"b.com", 1, [fail.query, ok.query]), [b"3.3.3.3"])
+        self.assertEqual(g.domain_cache.get_ips(b"b.com", 1), [b"3.3.3.3"])
+
+    def test_empty_answer(self):
+        # NXDOMAIN or AAAA of an IPv4 only domain, valid answer without record.
+        empty = FakeResolver("empty", 0.01, [])
+        slow = FakeResolver("slow", 0.2, [b"2.2.2.2"])
+        self.assertEqual(self.parallel_query.query(b"a.com", 1, [empty.query, slow.query]), [b"2.2.2.2"])
+        time.sleep(0.1)
+
+        stats = self.parallel_query.stats.status()
+        self.assertEqual(stats["empty"]["fail"], 0)
+        self.assertEqual(stats["empty"]["success"], 1)
+        self.assertLess(stats["empty"]["latency"], 0.1)
+        self.assertEqual(self.parallel_query.stats.sort(["slow", "empty"]), ["empty", "slow"])
+        self.assertLess(self.parallel_query.stats.hedge_delay("empty"), 0.1)
+
+    def test_hedge(self):
+        slow = FakeResolver("slow", 0.5, [b"2.2.2.2"])
+        backup = FakeResolver("backup", 0.01, [b"3.3.3.3"])
+        self.parallel_query.query(b"a.com", 1, [slow.query, backup.query])
+        time.sleep(0.6)
+        self.parallel_query.stats.stats["slow"].update({"latency": 0.01, "last_try": time.time()})
+        self.parallel_query.stats.stats["backup"].update({"latency": 0.1, "last_try": time.time()})
+
+        # slow is the fastest one by stats, backup start after it's hedge delay.
+        t0 = time.time()
+        self.assertEqual(self.parallel_query.query(b"b.com", 1, [slow.query, backup.query]), [b"3.3.3.3"])
+        self.assertLess(time.time() - t0, 0.3)
+        time.sleep(0.5)
+
+    def test_costly(self):
+        free = FakeResolver("free", 0.01, [b"1.1.1.1"])
+        paid = FakeResolver("paid", 0, [b"4.4.4.4"])
+        self.parallel_query.costly.add("paid")
+        self.parallel_query.costly_delay = 0.2
+        self.parallel_query.stats.report("paid", 0.001, True)
+        self.parallel_query.stats.report("free", 0.1, True)
+
+        # paid is the fastest, but not used while a free one answer.
+        self.assertEqual(self.parallel_query.stats.sort(["paid", "free"], {"paid"}), ["free", "paid"])
+        self.assertEqual(self.parallel_query.query(b"a.com", 1, [paid.query, free.query]), [b"1.1.1.1"])
+        time.sleep(0.3)
+        self.assertEqual(paid.query_num, 0)
+
+        # free fail, paid start at once.
+        fail = FakeResolver("free", 0, None)
+        t0 = time.time()
+        self.assertEqual(self.parallel_query.query(b"b.com", 1, [paid.query, fail.query]), [b"4.4.4.4"])
+        self.assertLess(time.time() - t0, 0.15)
+
+        # free don't answer, paid start after costly_delay.
+        slow = FakeResolver("free", 1, [b"1.1.1.1"])
+        t0 = time.time()
+        self.assertEqual(self.parallel_query.query(b"c.com", 1, [paid.query, slow.query]), [b"4.4.4.4"])
+        self.assertGreaterEqual(time.time() - t0, 0.2)
+        self.assertEqual(paid.query_num, 2)
+        time.sleep(1)
+
+
+class TestDnsStreamConnection(unittest.TestCase):
+    def setUp(self):
+        self.listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_sock.bind(("127.0.0.1", 0))
+        self.listen_sock.listen(1)
+        threading.Thread(target=self.server).start()
+
+        sock = socket.create_connection(self.listen_sock.getsockname())
+        self.connection = dns_query.DnsStreamConnection(sock, "test", idle_timeout=2)
+
+    def tearDown(self):
+        self.connection.close()
+        self.listen_sock.close()
+
+    def server(self):
+        # answer a batch of 5 queries in reverse order.
+        sock, _ = self.listen_sock.accept()
+        requests = []
+        while len(requests) < 5:
+            length = struct.unpack("!H", sock.recv(2))[0]
+            requests.append(DNSRecord.parse(sock.recv(length)))
+
+        for request in reversed(requests):
+            reply = request.reply()
+            reply.add_answer(RR(request.q.qname, ttl=60, rdata=A("1.1.1.%d" % len(str(request.q.qname)))))
+            data = reply.pack()
+            sock.sendall(struct.pack("!H", len(data)) + data)
+        time.sleep(0.5)
+        sock.close()
+
+    def test_pipeline(self):
+        results = {}
+
+        def query(domain):
+            data = self.connection.query(DNSRecord(q=DNSQuestion(domain, QTYPE.A)).pack(), 2)
+            results[domain] = str(DNSRecord.parse(data).rr[0].rdata)
+
+        domains = ["a" * i + ".com" for i in range(1, 6)]
+        threads = [threading.Thread(target=query, args=(domain,)) for domain in domains]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        self.assertEqual(results, {domain: "1.1.1.%d" % (len(domain) + 1) for domain in domains})
+
+        # server closed, waiting query get None.
+        time.sleep(0.6)
+        self.assertFalse(self.connection.running)
+        self.assertIsNone(self.connection.query(DNSRecord(q=DNSQuestion("b.com", QTYPE.A)).pack(), 1))
+
+
+class TestDnsStreamTimeout(unittest.TestCase):
+    def setUp(self):
+        self.listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_sock.bind(("127.0.0.1", 0))
+        self.listen_sock.listen(1)
+        threading.Thread(target=self.server, daemon=True).start()
+
+        sock = socket.create_connection(self.listen_sock.getsockname())
+        self.connection = dns_query.DnsStreamConnection(sock, "test", idle_timeout=5)
+        self.connection.max_timeout_num = 2
+
+    def tearDown(self):
+        self.connection.close()
+        self.listen_sock.close()
+
+    def server(self):
+        # answer all queries except the drop ones.
+        sock, _ = self.listen_sock.accept()
+        while True:
+            try:
+                length = struct.unpack("!H", sock.recv(2))[0]
+                request = DNSRecord.parse(sock.recv(length))
+            except Exception:
+                break
+
+            if str(request.q.qname).startswith("drop"):
+                continue
+            reply = request.reply()
+            reply.add_answer(RR(request.q.qname, ttl=60, rdata=A("1.1.1.1")))
+            data = reply.pack()
+            sock.sendall(struct.pack("!H", len(data)) + data)
+        sock.close()
+
+    def query(self, domain, timeout=1):
+        return self.connection.query(DNSRecord(q=DNSQuestion(domain, QTYPE.A)).pack(), timeout)
+
+    def test_timeout(self):
+        results = {}
+
+        def query(domain, timeout):
+            results[domain] = self.query(domain, timeout)
+
+        # one lost answer don't fail the other queries on the connection.
+        threads = [threading.Thread(target=query, args=("drop.com", 0.2))]
+        threads += [threading.Thread(target=query, args=("a%d.com" % i, 1)) for i in range(5)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        self.assertIsNone(results.pop("drop.com"))
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(results.values()))
+        self.assertTrue(self.connection.running)
+        self.assertEqual(self.connection.waiters, {})
+
+        # timeout in a row close it, an answer reset the count.
+        self.assertTrue(self.query("b.com"))
+        self.assertIsNone(self.query("drop1.com", 0.2))
+        self.assertTrue(self.connection.running)
+        self.assertIsNone(self.query("drop2.com", 0.2))
+        self.assertFalse(self.connection.running)
+        self.assertIsNone(self.query("a.com"))
+
+
+class FakeUdpServer(object):
+    # reply each query after delay, with ips or without record, never if silent.
+    def __init__(self, ip, delay=0, ips=None, silent=False):
+        self.delay = delay
+        self.ips = ips
+        self.silent = silent
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, 0))
+        self.address = self.sock.getsockname()
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(8192)
+            except socket.error:
+                break
+
+            if self.silent:
+                continue
+            request = DNSRecord.parse(data)
+            reply = request.reply()
+            for ip in self.ips or []:
+                reply.add_answer(RR(request.q.qname, ttl=60, rdata=A(ip)))
+            time.sleep(self.delay)
+            self.sock.sendto(reply.pack(), address)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestLocalDnsQuery(unittest.TestCase):
+    def setUp(self):
+        self.servers = {}  # ip => FakeUdpServer
+        test = self
+
+        class LocalDnsQuery(dns_query.LocalDnsQuery):
+            def get_local_dns_server(self):
+                return []
+
+            def send_request(self, id, server_ip, domain, dns_type):
+                d = DNSRecord(DNSHeader(id))
+                d.add_question(DNSQuestion(domain, dns_type))
+                self.sock.sendto(d.pack(), test.servers[server_ip].address)
+
+        self.query = LocalDnsQuery()
+
+    def tearDown(self):
+        self.query.stop()
+        self.query.sock6.close()
+        for server in self.servers.values():
+            server.close()
+
+    def add_server(self, ip, **kwargs):
+        self.servers[ip] = FakeUdpServer(utils.to_str(ip), **kwargs)
+        self.query.dns_server.append(ip)
+
+    def test_empty_answer(self):
+        self.add_server(b"127.0.0.1", ips=[])
+        self.add_server(b"127.0.0.2", delay=0.1, ips=["1.1.1.1"])
+        self.assertEqual(self.query.query(b"a.com", 1, timeout=1), [b"1.1.1.1"])
+
+        stats = self.query.stats.status()
+        self.assertEqual(stats["127.0.0.1"]["fail"], 0)
+        self.assertEqual(stats["127.0.0.1"]["success"], 1)
+        self.assertLess(stats["127.0.0.1"]["latency"], 0.1)
+        self.assertEqual(self.query.stats.sort([b"127.0.0.2", b"127.0.0.1"]), [b"127.0.0.1", b"127.0.0.2"])
+
+    def test_no_reply(self):
+        # NXDOMAIN server is not charged, only the one never replied.
+        self.add_server(b"127.0.0.1", ips=[])
+        self.add_server(b"127.0.0.2", silent=True)
+        self.assertEqual(self.query.query(b"a.com", 1, timeout=0.5), [])
+
+        stats = self.query.stats.status()
+        self.assertEqual((stats["127.0.0.1"]["success"], stats["127.0.0.1"]["fail"]), (1, 0))
+        self.assertEqual((stats["127.0.0.2"]["success"], stats["127.0.0.2"]["fail"]), (0, 1))
+
+
+class FakeUserRules(object):
+    def check_host(self, domain, port):
+        return None
+
+
+class FakeGfwList(object):
+    def in_white_list(self, host):
+        return False
+
+    def in_block_list(self, host):
+        return False
+
+
+class FakeConfig(object):
+    pac_policy = "smart-router"
+
+
+class TestCombineDnsQuery(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.org = (g.domain_cache, g.user_rules, g.gfwlist, g.config)
+        g.domain_cache = host_records.DomainRecords(os.path.join(self.tmp_path, "domain_records.txt"))
+        g.user_rules = FakeUserRules()
+        g.gfwlist = FakeGfwList()
+        g.config = FakeConfig()
+
+        self.query = dns_query.CombineDnsQuery(negative_ttl=1, worker_num=2)
+        self.query_num = 0
+        self.query.query_unknown_domain = self.query_unknown_domain
+        self.query.local_dns_resolve.query = lambda domain, dns_type=1, timeout=1: []
+
+    def tearDown(self):
+        self.query.stop()
+        g.domain_cache, g.user_rules, g.gfwlist, g.config = self.org
+        shutil.rmtree(self.tmp_path)
+
+    def query_unknown_domain(self, domain, dns_type):
+        self.query_num += 1
+        time.sleep(0.2)
+        if domain.startswith(b"dead"):
+            return []
+        return [b"4.4.4.4"]
+
+    def test_coalescing(self):
+        results = []
+
+        def client():
+            results.append(self.query.query(b"www.a.com", 1))
+
+        threads = [threading.Thread(target=client) for _ in range(10)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        self.assertEqual(results, [[b"4.4.4.4"]] * 10)
+        self.assertEqual(self.query_num, 1)
+        self.assertEqual(self.query.status()["coalesced"], 9)
+
+    def test_negative_cache(self):
+        self.assertEqual(self.query.query(b"dead.a.com", 1), [])
+        self.assertEqual(self.query.query(b"dead.a.com", 1), [])
+        self.assertEqual(self.query_num, 1)
+
+        time.sleep(1.1)
+        self.assertEqual(self.query.query(b"dead.a.com", 1), [])
+        self.assertEqual(self.query_num, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
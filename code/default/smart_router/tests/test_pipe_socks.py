@@ -0,0 +1,79 @@
+import os
+import sys
+import socket
+import threading
+import unittest
+
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+noarch_path = os.path.join(default_path, "lib", "noarch")
+sys.path.append(noarch_path)
+sys.path.append(default_path)
+
+from smart_router.local import pipe_socks, global_var as g
+from smart_router.local.socket_wrap import SocketWrap
+
+
+class FakeConfig(object):
+    direct_split_SNI = 0
+
+
+class TestPipeSocks(unittest.TestCase):
+    def setUp(self):
+        self.org_config = g.config
+        g.config = FakeConfig()
+
+    def tearDown(self):
+        g.config = self.org_config
+
+    def relay(self, use_splice, size=3*1024*1024):
+        # client <-> (a, b) pipe (c, d) <-> server, server echo back.
+        pipe = pipe_socks.PipeSocksGroup(64 * 1024, num=2, use_splice=use_splice)
+        pipe.run()
+
+        client, a = socket.socketpair()
+        d, server = socket.socketpair()
+        pipe.add_socks(SocketWrap(a, "127.0.0.1", 1), SocketWrap(d, "1.2.3.4", 80, b"a.com"))
+        splice_num = sum(len(p.splices) for p in pipe.pipes)
+
+        def echo():
+            while True:
+                data = server.recv(65536)
+                if not data:
+                    break
+                server.sendall(data)
+            server.close()
+
+        th = threading.Thread(target=echo)
+        th.start()
+
+        data = os.urandom(size)
+        threading.Thread(target=client.sendall, args=(data,)).start()
+        received = []
+        left = size
+        while left:
+            d = client.recv(65536)
+            self.assertTrue(d)
+            received.append(d)
+            left -= len(d)
+        self.assertEqual(b"".join(received), data)
+
+        # close from client close the server side too.
+        client.close()
+        th.join(5)
+        self.assertFalse(th.is_alive())
+
+        pipe.stop()
+        return splice_num
+
+    def test_copy(self):
+        self.assertEqual(self.relay(False), 0)
+
+    @unittest.skipUnless(hasattr(os, "splice") and sys.platform.startswith("linux"), "need os.splice")
+    def test_splice(self):
+        self.assertEqual(self.relay(True), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
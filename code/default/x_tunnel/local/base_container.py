@@ -1,5 +1,6 @@
 import os
 import sys
+import heapq
 import threading
 import time
 import socket
@@ -283,6 +284,67 @@ class SendBuffer():
         return out_string
 
 
+class WaitAckPool():
+    # blocks sent to server and waiting for ack.
+    # caller hold the session lock.
+    #
+    # block_list: sn => [payload, send_time], acked block is removed at once.
+    # continue_sn: all sn <= continue_sn are acked.
+    # resend_heap: (resend_time, sn), old entry of acked or resent block is dropped when popped.
+    def __init__(self, resend_timeout):
+        self.resend_timeout = resend_timeout
+        self.reset()
+
+    def reset(self):
+        self.block_list = {}
+        self.continue_sn = 0
+        self.last_sn = 0
+        self.resend_heap = []
+
+    def __len__(self):
+        return len(self.block_list)
+
+    def put(self, sn, payload, time_now):
+        self.block_list[sn] = [payload, time_now]
+        if sn > self.last_sn:
+            self.last_sn = sn
+        heapq.heappush(self.resend_heap, (time_now + self.resend_timeout, sn))
+
+    def ack(self, last_ack, sn_list):
+        for sn in sn_list:
+            self.block_list.pop(sn, None)
+
+        # every sn only walk once, continue_sn never go back.
+        last_ack = min(last_ack, self.last_sn)
+        while self.continue_sn < last_ack:
+            self.continue_sn += 1
+            self.block_list.pop(self.continue_sn, None)
+
+        while self.continue_sn < self.last_sn and (self.continue_sn + 1) not in self.block_list:
+            self.continue_sn += 1
+
+    def get_resend(self, time_now):
+        # return (sn, payload) of one timeout block, or None.
+        heap = self.resend_heap
+        while heap and heap[0][0] < time_now:
+            resend_time, sn = heapq.heappop(heap)
+            block = self.block_list.get(sn)
+            if not block or block[1] + self.resend_timeout != resend_time:
+                continue
+
+            block[1] = time_now
+            heapq.heappush(heap, (time_now + self.resend_timeout, sn))
+            return sn, block[0]
+
+        return None
+
+    def status(self):
+        out_string = "WaitAckPool:\r\n"
+        out_string += " continue_sn:%d last_sn:%d\r\n" % (self.continue_sn, self.last_sn)
+        out_string += " wait_ack:%d resend_heap:%d\r\n" % (len(self.block_list), len(self.resend_heap))
+        return out_string
+
+
 class BlockReceivePool():
     def __init__(self, process_callback, logger):
         self.lock = threading.Lock()
@@ -293,7 +355,8 @@ class BlockReceivePool():
     def reset(self):
         # xlog.info("recv_pool reset")
         self.next_sn = 1
-        self.block_list = []
+        # received disorder sn
+        self.block_list = set()
         self.timeout_sn_list = {}
 
     def put(self, sn, data):
@@ -312,7 +375,7 @@ class BlockReceivePool():
                     # xlog.warn("recv_pool put sn:%d exist", sn)
                     return False
                 else:
-                    self.block_list.append(sn)
+                    self.block_list.add(sn)
                     self.process_callback(data)
                     return True
             else:
@@ -322,7 +385,7 @@ class BlockReceivePool():
 
                 while self.next_sn in self.block_list:
                     # xlog.debug("recv_pool sn:%d processed", sn)
-                    self.block_list.remove(self.next_sn)
+                    self.block_list.discard(self.next_sn)
                     self.next_sn += 1
                 return True
         except Exception as e:
@@ -359,6 +422,11 @@ class BlockReceivePool():
 
         return sn_list
 
+    def get_ack_list(self):
+        # last continue received sn, and the received disorder sn list.
+        with self.lock:
+            return self.next_sn - 1, list(self.block_list)
+
     def is_received(self, sn):
         if sn < self.next_sn:
             return True
@@ -101,7 +101,7 @@ class IpManager(IpManagerBase):
                         })
         return self.domain_map[top_domain]
 
-    def update_ip(self, ip_str, sni, handshake_time):
+    def update_ip(self, ip_str, sni, handshake_time, resumed=False):
         top_domain = ".".join(sni.split(".")[1:])
 
         info = self._get_domain(top_domain)
@@ -74,7 +74,7 @@ class ControlHandler(simple_http_server.HttpServerHandler):
         data += "<th>data_active</th><th>transfered_data</th><th>Trans</th>"
         data += "<th>history</th></tr>\n"
         i = 1
-        for ip in front.ip_manager.ip_list:
+        for ip in list(front.ip_manager.ip_list):
             handshake_time = front.ip_manager.ip_dict[ip]["handshake_time"]
 
             fail_times = front.ip_manager.ip_dict[ip]["fail_times"]
@@ -1,4 +1,3 @@
-import time
 import socket
 import struct
 
@@ -31,19 +30,24 @@ def netloc_to_host_port(netloc, default_port=80):
 
 class Socks5Server():
     handle_num = 0
+    handshake_timeout = 30
+    max_handshake_size = 64 * 1024
 
     def __init__(self, sock, client, args):
         self.connection = sock
         self.rfile = self.connection.makefile("rb", -1)
         self.wfile = self.connection.makefile("wb", 0)
         self.client_address = client
-        self.read_buffer = b""
+        # handshake data received, buffer_start is the consumed offset.
+        self.read_buffer = bytearray()
         self.buffer_start = 0
         self.args = args
 
     def handle(self):
         self.__class__.handle_num += 1
         try:
+            # blocking reads with timeout while parsing the handshake.
+            self.connection.settimeout(self.handshake_timeout)
             socks_version = self.read_bytes(1)
             if not socks_version:
                 return
@@ -68,117 +72,61 @@ class Socks5Server():
             xlog.exception("proxy handler err:%r", e)
             self.connection.close()
 
+    def recv_more(self):
+        data = self.connection.recv(8192)
+        if not data:
+            raise socket.error("recv fail")
+        self.read_buffer += data
+
+    def read_until(self, delimiter):
+        # search only the new data, large headers won't be scanned again and again.
+        search_start = self.buffer_start
+        while True:
+            n1 = self.read_buffer.find(delimiter, search_start)
+            if n1 > -1:
+                line = bytes(self.read_buffer[self.buffer_start:n1])
+                self.buffer_start = n1 + len(delimiter)
+                return line
+
+            if len(self.read_buffer) - self.buffer_start > self.max_handshake_size:
+                raise socket.error("handshake too large")
+
+            search_start = max(self.buffer_start, len(self.read_buffer) - len(delimiter) + 1)
+            self.recv_more()
+
     def read_null_end_line(self):
-        sock = self.connection
-        sock.setblocking(0)
-        try:
-            while True:
-                n1 = self.read_buffer.find(b"\x00", self.buffer_start)
-                if n1 > -1:
-                    line = self.read_buffer[self.buffer_start:n1]
-                    self.buffer_start = n1 + 1
-                    return line
-
-                try:
-                    data = sock.recv(8192)
-                except socket.error as e:
-                    # logging.exception("e:%r", e)
-                    if e.errno in [2, 11, 10035]:
-                        time.sleep(0.01)
-                        continue
-                    else:
-                        raise e
-
-                self.read_buffer += data
-        finally:
-            sock.setblocking(1)
+        return self.read_until(b"\x00")
 
     def read_crlf_line(self):
-        sock = self.connection
-        sock.setblocking(0)
-        try:
-            while True:
-                n1 = self.read_buffer.find(b"\r\n", self.buffer_start)
-                if n1 > -1:
-                    line = self.read_buffer[self.buffer_start:n1]
-                    self.buffer_start = n1 + 2
-                    return line
-
-                try:
-                    data = sock.recv(8192)
-                except socket.error as e:
-                    # logging.exception("e:%r", e)
-                    if e.errno in [2, 11, 10035]:
-                        time.sleep(0.01)
-                        continue
-                    else:
-                        raise e
-
-                self.read_buffer += data
-        finally:
-            sock.setblocking(1)
+        return self.read_until(b"\r\n")
 
     def read_headers(self):
-        sock = self.connection
-        sock.setblocking(0)
-        try:
-            while True:
-                if self.read_buffer[self.buffer_start:] == b"\r\n":
-                    self.buffer_start += 2
-                    return b""
-
-                n1 = self.read_buffer.find(b"\r\n\r\n", self.buffer_start)
-                if n1 > -1:
-                    block = self.read_buffer[self.buffer_start:n1]
-                    self.buffer_start = n1 + 4
-                    return block
-
-                try:
-                    data = sock.recv(8192)
-                except socket.error as e:
-                    # logging.exception("e:%r", e)
-                    if e.errno in [2, 11, 10035]:
-                        time.sleep(0.01)
-                        continue
-                    else:
-                        raise e
-
-                self.read_buffer += data
-        finally:
-            sock.setblocking(1)
+        while len(self.read_buffer) - self.buffer_start < 2:
+            self.recv_more()
+
+        if self.read_buffer[self.buffer_start:self.buffer_start + 2] == b"\r\n":
+            # no header.
+            self.buffer_start += 2
+            return b""
+
+        return self.read_until(b"\r\n\r\n")
 
     def read_bytes(self, size):
-        sock = self.connection
-        sock.setblocking(1)
-        try:
-            while True:
-                left = len(self.read_buffer) - self.buffer_start
-                if left >= size:
-                    break
-
-                need = size - left
-
-                try:
-                    data = sock.recv(need)
-                except socket.error as e:
-                    # logging.exception("e:%r", e)
-                    if e.errno in [2, 11, 10035]:
-                        time.sleep(0.01)
-                        continue
-                    else:
-                        raise e
-
-                if len(data):
-                    self.read_buffer += data
-                else:
-                    raise socket.error("recv fail")
-        finally:
-            sock.setblocking(1)
-
-        data = self.read_buffer[self.buffer_start:self.buffer_start + size]
+        while len(self.read_buffer) - self.buffer_start < size:
+            self.recv_more()
+
+        data = bytes(self.read_buffer[self.buffer_start:self.buffer_start + size])
         self.buffer_start += size
         return data
 
+    def start_conn(self, conn_id):
+        # handshake done, data received after it belong to the connection.
+        self.connection.settimeout(None)
+        if len(self.read_buffer) - self.buffer_start:
+            g.session.conn_list[conn_id].transfer_received_data(bytes(self.read_buffer[self.buffer_start:]))
+
+        g.session.conn_list[conn_id].start(block=True)
+
     def socks4_handler(self):
         # Socks4 or Socks4a
         sock = self.connection
@@ -190,7 +138,7 @@ class Socks5Server():
         data = self.read_bytes(6)
         port = struct.unpack(">H", data[0:2])[0]
         addr_pack = data[2:6]
-        if addr_pack[0:3] == b'\x00\x00\x00' and addr_pack[3] != b'\x00':
+        if addr_pack[0:3] == b'\x00\x00\x00' and addr_pack[3:4] != b'\x00':
             domain_mode = True
         else:
             ip = socket.inet_ntoa(addr_pack)
@@ -216,10 +164,7 @@ class Socks5Server():
         reply = b"\x00\x5a" + addr_pack + struct.pack(">H", port)
         sock.send(reply)
 
-        if len(self.read_buffer) - self.buffer_start:
-            g.session.conn_list[conn_id].transfer_received_data(self.read_buffer[self.buffer_start:])
-
-        g.session.conn_list[conn_id].start(block=True)
+        self.start_conn(conn_id)
 
     def socks5_handler(self):
         sock = self.connection
@@ -264,7 +209,7 @@ class Socks5Server():
             sock.send(b"\x05\x07\x00\x01")  # Command not supported
             return
 
-        port = struct.unpack('>H', self.rfile.read(2))[0]
+        port = struct.unpack('>H', self.read_bytes(2))[0]
 
         conn_id = proxy_session.create_conn(sock, addr, port)
         if not conn_id:
@@ -283,10 +228,7 @@ class Socks5Server():
             xlog.warn("socks5 %r connect to %s:%d conn_id:%d closed:%r", self.client_address, addr, port, conn_id, e)
             return
 
-        if len(self.read_buffer) - self.buffer_start:
-            g.session.conn_list[conn_id].transfer_received_data(self.read_buffer[self.buffer_start:])
-
-        g.session.conn_list[conn_id].start(block=True)
+        self.start_conn(conn_id)
 
     def https_handler(self):
         line = self.read_crlf_line()
@@ -324,13 +266,11 @@ class Socks5Server():
         except:
             xlog.warn("https %r connect to %s:%d conn:%d closed.", self.client_address, host, port, conn_id)
 
-        if (len(self.read_buffer) - self.buffer_start) > 0:
-            g.session.conn_list[conn_id].transfer_received_data(self.read_buffer[self.buffer_start:])
-
-        g.session.conn_list[conn_id].start(block=True)
+        self.start_conn(conn_id)
 
     def http_handler(self, first_char):
         req_line = self.read_crlf_line()
+        req_end = self.buffer_start
         words = req_line.split()
         if len(words) == 3:
             method, url, http_version = words
@@ -364,7 +304,7 @@ class Socks5Server():
                 key, _, value = line.partition(b":")
                 headers[key] = value
                 if key.lower() == b"host":
-                    host, port = netloc_to_host_port(value)
+                    host, port = netloc_to_host_port(value.strip())
             if host is None:
                 xlog.warn("http proxy host can't parsed. %s %s", req_line, header_block)
                 self.connection.send(b'HTTP/1.1 500 Fail\r\n\r\n')
@@ -373,6 +313,7 @@ class Socks5Server():
             if url.startswith(b"/openai/"):
                 content_length = int(headers.get(b"Content-Length", 0))
                 req_body = self.read_bytes(content_length)
+                self.connection.settimeout(None)
                 return openai_handler.handle_openai(method, url, headers, req_body, self.connection)
 
         sock = self.connection
@@ -384,9 +325,9 @@ class Socks5Server():
 
         xlog.info("http %r connect to %s:%d conn:%d", self.client_address, host, port, conn_id)
 
-        new_req_line = b"%s %s %s" % (method, path, http_version)
-        left_buf = new_req_line + self.read_buffer[(len(req_line) + 1):]
-        g.session.conn_list[conn_id].transfer_received_data(left_buf)
-
-        g.session.conn_list[conn_id].start(block=True)
+        # the request is sent again with the path only, headers read above are included.
+        new_req_line = b"%s %s %s\r\n" % (method, path, http_version)
+        self.read_buffer[:req_end] = new_req_line
+        self.buffer_start = 0
+        self.start_conn(conn_id)
 
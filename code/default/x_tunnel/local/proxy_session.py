@@ -4,6 +4,8 @@ import json
 import threading
 import xstruct as struct
 import hashlib
+import heapq
+import collections
 
 from xlog import getLogger, keep_log
 xlog = getLogger("x_tunnel")
@@ -21,16 +23,14 @@ root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
 
 def encrypt_data(data):
     if g.config.encrypt_data:
-        return encrypt.Encryptor(g.config.encrypt_password, g.config.encrypt_method).encrypt(data)
+        return encrypt.get_cipher_context(g.config.encrypt_password, g.config.encrypt_method).encrypt(data)
     else:
         return data
 
 
 def decrypt_data(data):
     if g.config.encrypt_data:
-        if isinstance(data, memoryview):
-            data = data.tobytes()
-        return encrypt.Encryptor(g.config.encrypt_password, g.config.encrypt_method).decrypt(data)
+        return encrypt.get_cipher_context(g.config.encrypt_password, g.config.encrypt_method).decrypt(data)
     else:
         return data
 
@@ -61,6 +61,7 @@ class ProxySession(object):
         self.wait_queue = base_container.WaitQueue()
         self.send_buffer = base_container.SendBuffer(max_payload=g.config.max_payload)
         self.receive_process = base_container.BlockReceivePool(self.download_data_processor, xlog)
+        self.wait_ack_pool = base_container.WaitAckPool(g.config.resend_timeout / 1000.0)
         self.connection_pipe = base_container.ConnectionPipe(self, xlog)
         self.lock = threading.Lock()  # lock for conn_id, sn generation, on_road_num change,
         self.get_data_lock = threading.Lock()
@@ -76,6 +77,7 @@ class ProxySession(object):
         self.last_transfer_no = 0
         self.conn_list = {}
         self.transfer_list = {}
+        self.init_transfer_index()
         self.on_road_num = 0
         self.last_receive_time = 0
         self.last_send_time = 0
@@ -124,6 +126,7 @@ class ProxySession(object):
             self.last_transfer_no = 0
             self.conn_list = {}
             self.transfer_list = {}
+            self.init_transfer_index()
             self.last_send_time = time.time()
             self.last_receive_time = 0
 
@@ -134,13 +137,8 @@ class ProxySession(object):
             self.last_traffic_download = 0
             self.last_traffic_reset_time = time.time()
 
-            # sn => (payload, send_time)
-            # sn => ack
-            self.wait_ack_send_list = dict()
-            self.ack_send_continue_sn = 0
+            self.wait_ack_pool.reset()
 
-            self.received_sn = []
-            self.receive_next_sn = 1
             self.target_on_roads = 0
             self.server_time_offset = 0
             self.server_time_deviation = 9999
@@ -163,6 +161,22 @@ class ProxySession(object):
             xlog.info("session started.")
             return True
 
+    def init_transfer_index(self):
+        # transfer_no of timeout transfers, wait for retry.
+        # stale entry is dropped when popped, check the stat.
+        self.timeout_transfer_list = collections.deque()
+        # (start_time, transfer_no) of transfers not confirmed received by server.
+        self.upload_check_heap = []
+        # (server_sent_time, transfer_no) of transfers sent by server out of order.
+        self.download_check_heap = []
+        # all transfer_no below it are received/sent by server.
+        self.server_received_next_no = 1
+        self.server_sent_next_no = 1
+
+    def set_transfer_timeout(self, data_info):
+        data_info["stat"] = "timeout"
+        self.timeout_transfer_list.append(data_info["transfer_no"])
+
     def timeout_checker(self):
         while self.running:
             timeout_num = 0
@@ -170,7 +184,7 @@ class ProxySession(object):
                 time_now = time.time()
                 for sn, data_info in self.transfer_list.items():
                     if data_info["stat"] != "timeout" and time_now - (data_info["start_time"] + data_info["server_timeout"]) > g.config.send_timeout_retry:
-                        data_info["stat"] = "timeout"
+                        self.set_transfer_timeout(data_info)
                         xlog.warn("timeout_checker found transfer_no:%d timeout:%f", sn, time_now - data_info["start_time"])
                         timeout_num += 1
 
@@ -375,6 +389,7 @@ class ProxySession(object):
 
         out_string += "\n" + self.wait_queue.status()
         out_string += "\n" + self.send_buffer.status()
+        out_string += "\n" + self.wait_ack_pool.status()
         out_string += "\n" + self.receive_process.status()
         out_string += "\n" + self.connection_pipe.status()
 
@@ -550,26 +565,24 @@ class ProxySession(object):
         buf = base_container.WriteBuffer()
 
         with self.lock:
-            for sn in self.wait_ack_send_list:
-                pk = self.wait_ack_send_list[sn]
-                if isinstance(pk, str):
-                    continue
+            while True:
+                resend = self.wait_ack_pool.get_resend(time_now)
+                if not resend:
+                    break
 
-                payload, send_time = pk
-                if time_now - send_time > self.resend_timeout:
-                    g.stat["resend"] += 1
-                    buf.append(self.sn_payload_head(sn, payload))
-                    buf.append(payload)
-                    self.wait_ack_send_list[sn] = (payload, time_now)
-                    if len(buf) > g.config.max_payload:
-                        return buf
+                sn, payload = resend
+                g.stat["resend"] += 1
+                buf.append(self.sn_payload_head(sn, payload))
+                buf.append(payload)
+                if len(buf) > g.config.max_payload:
+                    return buf
 
             if self.send_buffer.pool_size > g.config.max_payload or \
                     (self.send_buffer.pool_size > 0 and
                      time.time() - self.oldest_received_time > self.send_delay
                     ):
                 payload, sn = self.send_buffer.get()
-                self.wait_ack_send_list[sn] = (payload, time_now)
+                self.wait_ack_pool.put(sn, payload, time_now)
                 buf.append(self.sn_payload_head(sn, payload))
                 buf.append(payload)
 
@@ -593,11 +606,8 @@ class ProxySession(object):
                 (self.last_receive_time > self.last_send_time and
                  time_now - self.last_receive_time > self.ack_delay):
 
-            buf = base_container.WriteBuffer()
-            buf.append(struct.pack("<I", self.receive_process.next_sn - 1))
-            for sn in self.receive_process.block_list:
-                buf.append(struct.pack("<I", sn))
-            return buf
+            last_sn, sn_list = self.receive_process.get_ack_list()
+            return base_container.WriteBuffer(struct.pack("<I%dI" % (len(sn_list) + 1), last_sn, *sn_list))
 
         return ""
 
@@ -641,26 +651,9 @@ class ProxySession(object):
         self.lock.acquire()
         try:
             last_ack = struct.unpack("<I", ack.get(4))[0]
-
-            while len(ack):
-                sn = struct.unpack("<I", ack.get(4))[0]
-                # xlog.debug("ack: %d", sn)
-                if sn in self.wait_ack_send_list:
-                    self.wait_ack_send_list[sn] = "acked"
-
-            for sn in self.wait_ack_send_list:
-                if sn > last_ack:
-                    continue
-                if self.wait_ack_send_list[sn] == "acked":
-                    continue
-
-                # xlog.debug("last_ack:%d sn:%d", last_ack, sn)
-                self.wait_ack_send_list[sn] = "acked"
-
-            while (self.ack_send_continue_sn + 1) in self.wait_ack_send_list and \
-                    self.wait_ack_send_list[self.ack_send_continue_sn + 1] == "acked":
-                self.ack_send_continue_sn += 1
-                del self.wait_ack_send_list[self.ack_send_continue_sn]
+            sn_num = len(ack) // 4
+            sn_list = struct.unpack("<%dI" % sn_num, ack.get(sn_num * 4))
+            self.wait_ack_pool.ack(last_ack, sn_list)
 
         except Exception as e:
             xlog.exception("ack_process:%r", e)
@@ -694,24 +687,34 @@ class ProxySession(object):
                 xlog.error("check_upload_not_acked lock time:%f", now - entry_time)
                 return
 
-            for no, data_info in self.transfer_list.items():
-                if data_info["stat"] == "timeout":
+            # only pop the heads past the deadline, entries changed after push are dropped.
+            heap = self.upload_check_heap
+            while heap and server_local_time - heap[0][0] > g.config.send_timeout_retry:
+                start_time, no = heapq.heappop(heap)
+                data_info = self.transfer_list.get(no)
+                if not data_info or data_info["stat"] == "timeout" or data_info["start_time"] != start_time or \
+                        data_info["server_received"] != False:
                     continue
 
-                if data_info["server_received"] == False and server_local_time - data_info["start_time"] > g.config.send_timeout_retry:
-                    data_info["stat"] = "timeout"
-                    xlog.warn("check_upload_not_acked found transfer_no:%d upload timeout:%f", no,
-                              server_local_time - data_info["start_time"])
-                    timeout_num += 1
-                    continue
+                self.set_transfer_timeout(data_info)
+                xlog.warn("check_upload_not_acked found transfer_no:%d upload timeout:%f", no,
+                          server_local_time - data_info["start_time"])
+                timeout_num += 1
 
-                if data_info["server_sent"] and server_time - data_info["server_sent"] > g.config.send_timeout_retry:
-                    data_info["stat"] = "timeout"
-                    xlog.warn("check_upload_not_acked found transfer_no:%d down timeout:%f", no,
-                              server_time - data_info["server_sent"])
-                    timeout_num += 1
+            # sent in order transfers got the newest server time on every response, never timeout here.
+            heap = self.download_check_heap
+            while heap and server_time - heap[0][0] > g.config.send_timeout_retry:
+                server_sent, no = heapq.heappop(heap)
+                data_info = self.transfer_list.get(no)
+                if not data_info or data_info["stat"] == "timeout" or data_info["server_sent"] != server_sent or \
+                        no < self.server_sent_next_no:
                     continue
 
+                self.set_transfer_timeout(data_info)
+                xlog.warn("check_upload_not_acked found transfer_no:%d down timeout:%f", no,
+                          server_time - data_info["server_sent"])
+                timeout_num += 1
+
         if timeout_num:
             self.target_on_roads = \
                 min(g.config.concurent_thread_num - g.config.min_on_road, self.target_on_roads + timeout_num)
@@ -721,12 +724,20 @@ class ProxySession(object):
         server_received_next_no = struct.unpack("<I", server_received_no_list.get(4))[0]
         server_sent_next_no = struct.unpack("<I", server_sent_no_list.get(4))[0]
         with self.lock:
-            for no, info in self.transfer_list.items():
-                if no < server_received_next_no:
+            # transfer_no is increasing, walk every no only once.
+            server_received_next_no = min(server_received_next_no, self.last_transfer_no + 1)
+            while self.server_received_next_no < server_received_next_no:
+                info = self.transfer_list.get(self.server_received_next_no)
+                if info:
                     info["server_received"] = True
+                self.server_received_next_no += 1
 
-                if no < server_sent_next_no:
+            server_sent_next_no = min(server_sent_next_no, self.last_transfer_no + 1)
+            while self.server_sent_next_no < server_sent_next_no:
+                info = self.transfer_list.get(self.server_sent_next_no)
+                if info:
                     info["server_sent"] = server_time
+                self.server_sent_next_no += 1
 
             server_unordered_received_no_num = struct.unpack("<I", server_received_no_list.get(4))[0]
             for i in range(0, server_unordered_received_no_num):
@@ -738,9 +749,10 @@ class ProxySession(object):
             server_unordered_sent_no_num = struct.unpack("<I", server_sent_no_list.get(4))[0]
             for i in range(0, server_unordered_sent_no_num):
                 no, t = struct.unpack("<Id", server_sent_no_list.get(12))
-                if no in self.transfer_list:
+                if no in self.transfer_list and no >= self.server_sent_next_no:
                     # xlog.debug("server unordered confirmed transfer_no:%d", sn)
                     self.transfer_list[no]["server_sent"] = t
+                    heapq.heappush(self.download_check_heap, (t, no))
 
     def process_server_unacked_sent_sn(self, data):
         if self.server_time_deviation > g.config.server_time_max_deviation:
@@ -810,22 +822,23 @@ class ProxySession(object):
         # Get a timeout request to retry
         time_now = time.time()
         with self.lock:
-            wrong_sn = []
-            for sn, data_info in self.transfer_list.items():
-                if data_info["session_id"] != self.session_id:
-                    wrong_sn.append(sn)
+            while self.timeout_transfer_list:
+                sn = self.timeout_transfer_list.popleft()
+                data_info = self.transfer_list.get(sn)
+                if not data_info or data_info["stat"] != "timeout":
                     continue
 
-                if data_info["stat"] == "timeout":
-                    xlog.warn("retry transfer_no:%d t:%f", sn, time_now - data_info["start_time"])
-                    data_info["stat"] = "retry"
-                    data_info["retry"] += 1
-                    data_info["start_time"] = time_now
+                if data_info["session_id"] != self.session_id:
+                    del self.transfer_list[sn]
+                    continue
 
-                    return data_info
+                xlog.warn("retry transfer_no:%d t:%f", sn, time_now - data_info["start_time"])
+                data_info["stat"] = "retry"
+                data_info["retry"] += 1
+                data_info["start_time"] = time_now
+                heapq.heappush(self.upload_check_heap, (time_now, sn))
 
-            for sn in wrong_sn:
-                del self.transfer_list[sn]
+                return data_info
 
         # Generate a new request
         data, ack, download_timeout = self.get_send_data(work_id)
@@ -850,6 +863,7 @@ class ProxySession(object):
 
         with self.lock:
             self.transfer_list[transfer_no] = info
+            heapq.heappush(self.upload_check_heap, (start_time, transfer_no))
 
         return info
 
@@ -901,8 +915,9 @@ class ProxySession(object):
         upload_post_buf.append(send_data)
         upload_post_buf.append(send_ack)
         upload_post_buf.append(download_timeout)
-        upload_post_data = upload_post_buf.to_bytes()
-        upload_post_data = encrypt_data(upload_post_data)
+        # WriteBuffer segments go down to the worker without join,
+        # encrypt write them into one buffer.
+        upload_post_data = encrypt_data(upload_post_buf)
         self.last_send_time = time.time()
 
         if g.config.show_debug:
@@ -914,18 +929,17 @@ class ProxySession(object):
         sleep_time = 1
         # Use one time loop for easy quit and clean up.
         for _ in range(1):
-            upload_post_data2 = bytearray(upload_post_data)
             try:
                 content, status, response = g.http_client.request(method="POST", host=g.server_host,
                                                                   path="/data?tid=%d" % transfer_no,
-                                                                  data=upload_post_data2,
+                                                                  data=upload_post_data,
                                                                   headers={
-                                                                      "Content-Length": str(len(upload_post_data2)),
+                                                                      "Content-Length": str(len(upload_post_data)),
                                                                   },
                                                                   timeout=server_timeout + g.config.network_timeout)
 
-                traffic = len(upload_post_data2) + len(content) + 645
-                self.traffic_upload += len(upload_post_data2) + 645
+                traffic = len(upload_post_data) + len(content) + 645
+                self.traffic_upload += len(upload_post_data) + 645
                 self.traffic_download += len(content)
                 g.quota -= traffic
                 if g.quota < 0:
@@ -934,7 +948,7 @@ class ProxySession(object):
                 if self.running:
                     xlog.exception("request except:%r ", e)
 
-                data_info["stat"] = "timeout"
+                self.set_transfer_timeout(data_info)
                 time.sleep(sleep_time)
                 continue
             finally:
@@ -953,10 +967,10 @@ class ProxySession(object):
                 return
 
             if status != 200:
-                head = upload_post_data2[:3]
+                head = upload_data_head[:3]
                 xlog.warn("roundtrip time:%f transfer_no:%d send:%d head:%s status:%r ",
                           roundtrip_time, transfer_no, send_data_len, utils.str2hex(head), status)
-                data_info["stat"] = "timeout"
+                self.set_transfer_timeout(data_info)
                 time.sleep(sleep_time)
                 continue
 
@@ -966,7 +980,7 @@ class ProxySession(object):
                 xlog.warn("roundtrip time:%f transfer_no:%d send:%d recv:%d Head:%d",
                           roundtrip_time, transfer_no, send_data_len, content_len, content_length)
 
-                data_info["stat"] = "timeout"
+                self.set_transfer_timeout(data_info)
                 continue
 
             try:
@@ -976,7 +990,7 @@ class ProxySession(object):
                 magic, version, pack_type = struct.unpack("<cBB", payload.get(3))
                 if magic != b"P" or version != g.protocol_version or pack_type not in [2, 3]:
                     xlog.warn("get data head:%s", utils.str2hex(content[:2]))
-                    data_info["stat"] = "timeout"
+                    self.set_transfer_timeout(data_info)
                     time.sleep(sleep_time)
                     continue
 
@@ -993,7 +1007,7 @@ class ProxySession(object):
                         # unpack error
                         xlog.warn("roundtrip time:%f transfer_no:%d send:%d recv:%d unpack_error:%s",
                                   roundtrip_time, transfer_no, send_data_len, len(content), message)
-                        data_info["stat"] = "timeout"
+                        self.set_transfer_timeout(data_info)
                         continue
                     elif error_code == 3:
                         # session not exist
@@ -1012,7 +1026,7 @@ class ProxySession(object):
                 if head_len < 3 + 40:
                     xlog.warn("no:%d recv_len:%d data:%d ack:%d head:%d",
                               transfer_no, content_len, data_len, ack_len, head_len)
-                    data_info["stat"] = "timeout"
+                    self.set_transfer_timeout(data_info)
                     continue
 
                 rtt = roundtrip_time - (time_cost/1000.0)
@@ -1070,7 +1084,7 @@ class ProxySession(object):
                     if checksum != checksum_str:
                         xlog.warn("checksum error:%s %s", checksum_str, checksum)
 
-                        data_info["stat"] = "timeout"
+                        self.set_transfer_timeout(data_info)
                         continue
 
                 self.last_receive_time = time.time()
@@ -1090,7 +1104,7 @@ class ProxySession(object):
             except Exception as e:
                 xlog.exception("trip:%d no:%d data not enough %r", work_id, transfer_no, e)
 
-                data_info["stat"] = "timeout"
+                self.set_transfer_timeout(data_info)
                 continue
 
                 # xlog.debug("trip:%d no:%d recv data:%s", work_id, transfer_no, parse_data(data))
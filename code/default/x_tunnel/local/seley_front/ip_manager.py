@@ -144,10 +144,11 @@ class IpManager(IpManagerBase):
             "adjust": best_params.get("adjust", 0),
         }
 
-    def update_ip(self, ip_str, sni, handshake_time):
+    def update_ip(self, ip_str, sni, handshake_time, resumed=False):
         info = self._get_ip_dict(ip_str)
         info["fail_times"] = 0
-        info["rtt"] = handshake_time
+        if not resumed:
+            info["rtt"] = handshake_time
         # self.logger.debug("ip %s connect success", ip)
 
     def report_connect_fail(self, ip_str, sni=None, reason="", force_remove=False):
@@ -71,12 +71,13 @@ class IpManager(IpManagerBase):
             "host": None,
         }
 
-    def update_ip(self, ip_str, sni, handshake_time):
+    def update_ip(self, ip_str, sni, handshake_time, resumed=False):
         ip, _ = utils.get_ip_port(ip_str)
         ip = utils.to_str(ip)
         info = self._get_ip_info(ip)
         info["fail_times"] = 0
-        info["rtt"] = handshake_time
+        if not resumed:
+            info["rtt"] = handshake_time
         info["last_try"] = 0.0
         # self.logger.debug("ip %s connect success", ip)
 
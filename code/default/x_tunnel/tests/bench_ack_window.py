@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import heapq
+import random
+import argparse
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+local_path = os.path.abspath(os.path.join(current_path, os.path.pardir, "local"))
+noarch_lib = os.path.abspath(os.path.join(current_path, os.path.pardir, os.path.pardir, 'lib', 'noarch'))
+sys.path.append(noarch_lib)
+sys.path.append(local_path)
+
+import xlog
+import base_container
+
+# Simulate x_tunnel block transfer on a high BDP link with loss and reorder.
+# Sender keep --window blocks on road, every block and every ack can be lost,
+# delay is random so blocks arrive out of order.
+# Time is virtual, the wall time is only the cost of the sender/receiver bookkeeping.
+#
+# "old" is the list/dict scanning bookkeeping used before WaitAckPool and the receive set.
+
+
+class OldWaitAck(object):
+    def __init__(self, resend_timeout):
+        self.resend_timeout = resend_timeout
+        self.wait_ack_send_list = {}
+        self.ack_send_continue_sn = 0
+
+    def __len__(self):
+        return len(self.wait_ack_send_list)
+
+    def put(self, sn, payload, time_now):
+        self.wait_ack_send_list[sn] = (payload, time_now)
+
+    def get_resend_list(self, time_now):
+        res = []
+        for sn in self.wait_ack_send_list:
+            pk = self.wait_ack_send_list[sn]
+            if isinstance(pk, str):
+                continue
+            payload, send_time = pk
+            if time_now - send_time > self.resend_timeout:
+                self.wait_ack_send_list[sn] = (payload, time_now)
+                res.append(sn)
+        return res
+
+    def ack(self, last_ack, sn_list):
+        for sn in sn_list:
+            if sn in self.wait_ack_send_list:
+                self.wait_ack_send_list[sn] = "acked"
+
+        for sn in self.wait_ack_send_list:
+            if sn > last_ack:
+                continue
+            if self.wait_ack_send_list[sn] == "acked":
+                continue
+            self.wait_ack_send_list[sn] = "acked"
+
+        while (self.ack_send_continue_sn + 1) in self.wait_ack_send_list and \
+                self.wait_ack_send_list[self.ack_send_continue_sn + 1] == "acked":
+            self.ack_send_continue_sn += 1
+            del self.wait_ack_send_list[self.ack_send_continue_sn]
+
+
+class NewWaitAck(base_container.WaitAckPool):
+    def get_resend_list(self, time_now):
+        res = []
+        while True:
+            resend = self.get_resend(time_now)
+            if not resend:
+                return res
+            res.append(resend[0])
+
+
+class OldReceivePool(object):
+    def __init__(self):
+        self.next_sn = 1
+        self.block_list = []
+
+    def put(self, sn, data):
+        if sn < self.next_sn:
+            return False
+        elif sn > self.next_sn:
+            if sn in self.block_list:
+                return False
+            self.block_list.append(sn)
+            return True
+        else:
+            self.next_sn += 1
+            while self.next_sn in self.block_list:
+                self.block_list.remove(self.next_sn)
+                self.next_sn += 1
+            return True
+
+    def get_ack_list(self):
+        return self.next_sn - 1, list(self.block_list)
+
+
+def simulate(args, sender, receiver):
+    rnd = random.Random(args.seed)
+    channel = []  # heap of (arrive_time, random order, kind, value)
+    now = 0.0
+    next_sn = 1
+    sent = 0
+    tick = args.rtt / 20.0
+    cost = 0.0
+
+    def transmit(kind, value):
+        if rnd.random() < args.loss:
+            return
+        delay = args.rtt / 2 * (1 + rnd.random() * args.jitter)
+        heapq.heappush(channel, (now + delay, rnd.random(), kind, value))
+
+    while receiver.next_sn <= args.blocks:
+        now += tick
+        arrived = []
+        while channel and channel[0][0] <= now:
+            arrived.append(heapq.heappop(channel))
+
+        start = time.time()
+        for _, _, kind, value in arrived:
+            if kind == "data":
+                receiver.put(value, b"")
+            else:
+                sender.ack(*value)
+
+        resend_list = sender.get_resend_list(now)
+        while len(sender) < args.window and next_sn <= args.blocks:
+            sender.put(next_sn, b"", now)
+            resend_list.append(next_sn)
+            next_sn += 1
+
+        ack = receiver.get_ack_list()
+        cost += time.time() - start
+
+        sent += len(resend_list)
+        for sn in resend_list:
+            transmit("data", sn)
+        transmit("ack", ack)
+
+    return cost, now, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="x_tunnel ack/resend bookkeeping with loss and reorder")
+    parser.add_argument("--blocks", type=int, default=20000)
+    parser.add_argument("--window", type=int, nargs="+", default=[100, 1000, 4000])
+    parser.add_argument("--rtt", type=float, default=0.3, help="seconds")
+    parser.add_argument("--jitter", type=float, default=1.0, help="delay random range, times of rtt/2")
+    parser.add_argument("--loss", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    resend_timeout = args.rtt * 3
+    for window in args.window:
+        args.window = window
+        res = []
+        for name, sender, receiver in [
+                ("old", OldWaitAck(resend_timeout), OldReceivePool()),
+                ("new", NewWaitAck(resend_timeout), base_container.BlockReceivePool(lambda d: None, xlog))]:
+            cost, virtual_time, sent = simulate(args, sender, receiver)
+            res.append("%s:%.3fs (%.1fus/block)" % (name, cost, cost * 1000000 / args.blocks))
+        print("blocks:%d window:%d loss:%.2f sent:%d virtual time:%.1fs  %s" % (
+            args.blocks, window, args.loss, sent, virtual_time, "  ".join(res)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import socket
+import struct
+import argparse
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.abspath(os.path.join(current_path, os.path.pardir, os.path.pardir))
+noarch_lib = os.path.abspath(os.path.join(default_path, 'lib', 'noarch'))
+sys.path.append(noarch_lib)
+sys.path.append(default_path)
+
+from x_tunnel.local import proxy_handler
+
+# SOCKS4/SOCKS5/HTTP proxy handshake latency, from the first byte sent to the reply.
+# create_conn always fail, so only the handshake parsing is measured.
+# Clients write the request in two parts, like the request line and the headers,
+# the second part often arrive after the server start to parse, --gap ms between them for slow clients.
+#   old: non-blocking reads spinning with sleep(0.01), bytes buffer rebuilt with +=
+#   new: blocking reads with timeout, bytearray and consumed offset
+
+
+class OldSocks5Server(proxy_handler.Socks5Server):
+    def old_read_until(self, delimiter):
+        sock = self.connection
+        sock.setblocking(0)
+        try:
+            while True:
+                n1 = bytes(self.read_buffer).find(delimiter, self.buffer_start)
+                if n1 > -1:
+                    line = bytes(self.read_buffer[self.buffer_start:n1])
+                    self.buffer_start = n1 + len(delimiter)
+                    return line
+
+                try:
+                    data = sock.recv(8192)
+                except socket.error as e:
+                    if e.errno in [2, 11, 10035]:
+                        time.sleep(0.01)
+                        continue
+                    else:
+                        raise e
+
+                self.read_buffer = bytes(self.read_buffer) + data
+        finally:
+            sock.setblocking(1)
+
+    def read_null_end_line(self):
+        return self.old_read_until(b"\x00")
+
+    def read_crlf_line(self):
+        return self.old_read_until(b"\r\n")
+
+    def read_headers(self):
+        if self.read_buffer[self.buffer_start:] == b"\r\n":
+            self.buffer_start += 2
+            return b""
+        return self.old_read_until(b"\r\n\r\n")
+
+    def read_bytes(self, size):
+        sock = self.connection
+        sock.setblocking(1)
+        while len(self.read_buffer) - self.buffer_start < size:
+            data = sock.recv(size - (len(self.read_buffer) - self.buffer_start))
+            if not data:
+                raise socket.error("recv fail")
+            self.read_buffer = bytes(self.read_buffer) + data
+
+        data = bytes(self.read_buffer[self.buffer_start:self.buffer_start + size])
+        self.buffer_start += size
+        return data
+
+
+def recv_reply(sock, size=None):
+    if size:
+        data = b""
+        while len(data) < size:
+            data += sock.recv(size - len(data))
+        return data
+
+    data = b""
+    while b"\r\n\r\n" not in data:
+        d = sock.recv(4096)
+        if not d:
+            break
+        data += d
+    return data
+
+
+def socks4(sock, args):
+    req = b"\x04\x01" + struct.pack(">H", 443) + b"\x00\x00\x00\x01" + b"user\x00"
+    sock.sendall(req)
+    time.sleep(args.gap / 1000.0)
+    sock.sendall(b"www.example.com\x00")
+    recv_reply(sock, 8)
+
+
+def socks5(sock, args):
+    sock.sendall(b"\x05\x01\x00")
+    recv_reply(sock, 2)
+    sock.sendall(b"\x05\x01\x00\x03" + b"\x0fwww.example.com")
+    time.sleep(args.gap / 1000.0)
+    sock.sendall(struct.pack(">H", 443))
+    recv_reply(sock, 4 + 16 + 2)
+
+
+def http_connect(sock, args):
+    sock.sendall(b"CONNECT www.example.com:443 HTTP/1.1\r\n")
+    time.sleep(args.gap / 1000.0)
+    sock.sendall(b"Host: www.example.com:443\r\n" + b"X-Pad: %s\r\n" % (b"x" * args.header_size) + b"\r\n")
+    recv_reply(sock)
+
+
+def http_get(sock, args):
+    sock.sendall(b"GET / HTTP/1.1\r\n")
+    time.sleep(args.gap / 1000.0)
+    sock.sendall(b"Host: www.example.com\r\n" + b"X-Pad: %s\r\n" % (b"x" * args.header_size) + b"\r\n")
+    recv_reply(sock)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(args, mode, name, client):
+    handler_class = OldSocks5Server if mode == "old" else proxy_handler.Socks5Server
+
+    listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_sock.bind(("127.0.0.1", 0))
+    listen_sock.listen(128)
+    address = listen_sock.getsockname()
+
+    def serve(sock, address):
+        handler_class(sock, address, None).handle()
+        sock.close()
+
+    def server():
+        while True:
+            sock, address = listen_sock.accept()
+            if not running[0]:
+                sock.close()
+                break
+            threading.Thread(target=serve, args=(sock, address)).start()
+
+    running = [True]
+    threading.Thread(target=server).start()
+
+    latencies = []
+    cpu_start = time.process_time()
+    for i in range(args.num):
+        sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        start = time.time()
+        client(sock, args)
+        latencies.append(time.time() - start)
+        sock.close()
+    cpu_cost = time.process_time() - cpu_start
+
+    running[0] = False
+    socket.create_connection(address).close()
+    listen_sock.close()
+
+    print("%s %-12s p50:%.2fms p90:%.2fms p99:%.2fms cpu:%.0fus/handshake" % (
+        mode, name, percentile(latencies, 50) * 1000, percentile(latencies, 90) * 1000,
+        percentile(latencies, 99) * 1000,
+        cpu_cost * 1000000 / args.num))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="x_tunnel proxy handshake latency")
+    parser.add_argument("--num", type=int, default=300)
+    parser.add_argument("--header-size", type=int, default=200)
+    parser.add_argument("--gap", type=float, default=0, help="ms between the two parts")
+    parser.add_argument("--modes", nargs="+", default=["old", "new"])
+    args = parser.parse_args()
+
+    # no session, every create_conn fail.
+    proxy_handler.xlog.setLevel("ERROR")
+    proxy_handler.proxy_session.create_conn = lambda sock, host, port, log=False: None
+    for name, client in [("socks4", socks4), ("socks5", socks5), ("http_connect", http_connect),
+                         ("http_get", http_get)]:
+        for mode in args.modes:
+            run(args, mode, name, client)
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+local_path = os.path.abspath(os.path.join(current_path, os.path.pardir, "local"))
+noarch_lib = os.path.abspath(os.path.join(current_path, os.path.pardir, os.path.pardir, 'lib', 'noarch'))
+sys.path.append(noarch_lib)
+sys.path.append(local_path)
+
+import xlog
+import base_container
+
+
+class TestWaitAckPool(unittest.TestCase):
+    def test_ack(self):
+        pool = base_container.WaitAckPool(resend_timeout=1)
+        for sn in range(1, 6):
+            pool.put(sn, b"d%d" % sn, 0)
+
+        pool.ack(2, [4])
+        self.assertEqual(pool.continue_sn, 2)
+        self.assertEqual(sorted(pool.block_list), [3, 5])
+
+        pool.ack(3, [])
+        self.assertEqual(pool.continue_sn, 4)
+
+        pool.ack(10, [])
+        self.assertEqual(pool.continue_sn, 5)
+        self.assertEqual(len(pool), 0)
+
+    def test_resend(self):
+        pool = base_container.WaitAckPool(resend_timeout=1)
+        pool.put(1, b"a", 0)
+        pool.put(2, b"b", 0.5)
+        pool.put(3, b"c", 0.6)
+        pool.ack(0, [1])
+
+        self.assertIsNone(pool.get_resend(1))
+        self.assertEqual(pool.get_resend(1.55), (2, b"b"))
+        self.assertIsNone(pool.get_resend(1.55))
+        self.assertEqual(pool.get_resend(1.7), (3, b"c"))
+        # resent block wait another timeout.
+        self.assertIsNone(pool.get_resend(2.5))
+        self.assertEqual(pool.get_resend(2.6), (2, b"b"))
+
+
+class TestBlockReceivePool(unittest.TestCase):
+    def test_disorder(self):
+        received = []
+        pool = base_container.BlockReceivePool(received.append, xlog.getLogger("test_base_container"))
+        self.assertTrue(pool.put(3, b"3"))
+        self.assertTrue(pool.put(2, b"2"))
+        self.assertFalse(pool.put(3, b"3"))
+        self.assertEqual(pool.get_ack_list(), (0, [2, 3]))
+
+        self.assertTrue(pool.put(1, b"1"))
+        self.assertFalse(pool.put(2, b"2"))
+        self.assertEqual(pool.get_ack_list(), (3, []))
+        self.assertTrue(pool.is_received(2))
+        self.assertFalse(pool.is_received(4))
+        self.assertEqual(received, [b"3", b"2", b"1"])
@@ -0,0 +1,236 @@
+import os
+import sys
+import time
+import socket
+import struct
+import unittest
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.abspath(os.path.join(current_path, os.path.pardir, os.path.pardir))
+noarch_lib = os.path.abspath(os.path.join(default_path, 'lib', 'noarch'))
+sys.path.append(noarch_lib)
+sys.path.append(default_path)
+
+import env_info
+# module loggers write start logs to the data dir.
+for name in ["gae_proxy", "x_tunnel"]:
+    if not os.path.isdir(os.path.join(env_info.data_path, name)):
+        os.makedirs(os.path.join(env_info.data_path, name))
+
+from x_tunnel.local import proxy_handler
+
+
+class FakeConn(object):
+    def __init__(self):
+        self.received = b""
+        self.started = False
+
+    def transfer_received_data(self, data):
+        self.received += data
+
+    def start(self, block=False):
+        self.started = True
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.conn_list = {}
+
+
+class TestSocks5Server(unittest.TestCase):
+    def setUp(self):
+        self.org_create_conn = proxy_handler.proxy_session.create_conn
+        self.org_session = proxy_handler.g.session
+        self.org_max_handshake_size = proxy_handler.Socks5Server.max_handshake_size
+
+        self.session = FakeSession()
+        proxy_handler.g.session = self.session
+        self.created = []
+        self.conn = None
+        self.create_ok = True
+
+        def create_conn(sock, host, port, log=False):
+            self.created.append((host, port))
+            if not self.create_ok:
+                return None
+
+            self.conn = FakeConn()
+            self.session.conn_list[1] = self.conn
+            return 1
+
+        proxy_handler.proxy_session.create_conn = create_conn
+
+        self.server_sock, self.client_sock = socket.socketpair()
+        self.client_sock.settimeout(5)
+        handler = proxy_handler.Socks5Server(self.server_sock, ("127.0.0.1", 1000), None)
+        handler.handshake_timeout = 5
+        self.th = threading.Thread(target=handler.handle)
+        self.th.start()
+
+    def tearDown(self):
+        self.client_sock.close()
+        self.th.join(5)
+        self.server_sock.close()
+        proxy_handler.proxy_session.create_conn = self.org_create_conn
+        proxy_handler.g.session = self.org_session
+        proxy_handler.Socks5Server.max_handshake_size = self.org_max_handshake_size
+
+    def send(self, data, split=None):
+        # split: sizes of the parts, so the server get them in different recv.
+        for size in split or []:
+            self.client_sock.sendall(data[:size])
+            data = data[size:]
+            time.sleep(0.02)
+        if data:
+            self.client_sock.sendall(data)
+
+    def recv(self, size):
+        data = b""
+        while len(data) < size:
+            d = self.client_sock.recv(size - len(data))
+            if not d:
+                break
+            data += d
+        return data
+
+    def wait_done(self):
+        self.th.join(5)
+        self.assertFalse(self.th.is_alive())
+
+    def test_socks4(self):
+        self.send(b"\x04\x01" + struct.pack(">H", 443) + socket.inet_aton("1.2.3.4") + b"user\x00" + b"data",
+                  [1, 2, 5])
+        self.assertEqual(self.recv(8), b"\x00\x5a" + socket.inet_aton("1.2.3.4") + struct.pack(">H", 443))
+        self.wait_done()
+
+        self.assertEqual(self.created, [("1.2.3.4", 443)])
+        self.assertTrue(self.conn.started)
+        self.assertEqual(self.conn.received, b"data")
+
+    def test_socks4a(self):
+        req = b"\x04\x01" + struct.pack(">H", 80) + b"\x00\x00\x00\x01" + b"\x00" + b"www.example.com\x00"
+        self.send(req, [1] * len(req))
+        self.assertEqual(self.recv(8)[0:2], b"\x00\x5a")
+        self.wait_done()
+
+        self.assertEqual(self.created, [(b"www.example.com", 80)])
+        self.assertEqual(self.conn.received, b"")
+
+    def test_socks4_fail(self):
+        self.create_ok = False
+        self.send(b"\x04\x01" + struct.pack(">H", 443) + socket.inet_aton("1.2.3.4") + b"\x00")
+        self.assertEqual(self.recv(8)[0:2], b"\x00\x5b")
+        self.wait_done()
+
+    def test_socks5(self):
+        self.send(b"\x05\x02\x00\x02", [1, 2])
+        self.assertEqual(self.recv(2), b"\x05\x00")
+
+        req = b"\x05\x01\x00\x03\x0fwww.example.com" + struct.pack(">H", 443)
+        self.send(req + b"\x16\x03\x01", [5, 10])
+        self.assertEqual(self.recv(len(req)), b"\x05\x00\x00\x03\x0fwww.example.com" + struct.pack(">H", 443))
+        self.wait_done()
+
+        self.assertEqual(self.created, [(b"www.example.com", 443)])
+        self.assertEqual(self.conn.received, b"\x16\x03\x01")
+
+    def test_socks5_ip(self):
+        addr = socket.inet_pton(socket.AF_INET6, "2001:db8::1")
+        self.send(b"\x05\x01\x00" + b"\x05\x01\x00\x04" + addr + struct.pack(">H", 443))
+        self.assertEqual(self.recv(2), b"\x05\x00")
+        self.assertEqual(self.recv(4 + 16 + 2), b"\x05\x00\x00\x04" + addr + struct.pack(">H", 443))
+        self.wait_done()
+        self.assertEqual(self.created, [("2001:db8::1", 443)])
+
+    def test_socks5_fail(self):
+        self.create_ok = False
+        self.send(b"\x05\x01\x00" + b"\x05\x01\x00\x01" + socket.inet_aton("1.2.3.4") + struct.pack(">H", 80))
+        self.assertEqual(self.recv(2), b"\x05\x00")
+        self.assertEqual(self.recv(4)[0:2], b"\x05\x01")
+        self.wait_done()
+
+    def test_socks5_command(self):
+        # bind is not supported
+        self.send(b"\x05\x01\x00" + b"\x05\x02\x00\x01")
+        self.assertEqual(self.recv(2), b"\x05\x00")
+        self.assertEqual(self.recv(4), b"\x05\x07\x00\x01")
+        self.wait_done()
+        self.assertEqual(self.created, [])
+
+    def test_connect(self):
+        req = b"CONNECT www.example.com:443 HTTP/1.1\r\nHost: www.example.com:443\r\n\r\n"
+        self.send(req + b"\x16\x03\x01hello", [3, 20])
+        self.assertEqual(self.recv(19), b"HTTP/1.1 200 OK\r\n\r\n")
+        self.wait_done()
+
+        self.assertEqual(self.created, [(b"www.example.com", 443)])
+        self.assertEqual(self.conn.received, b"\x16\x03\x01hello")
+
+    def test_connect_no_header(self):
+        self.send(b"CONNECT 1.2.3.4:8443 HTTP/1.1\r\n\r\n", [30])
+        self.assertEqual(self.recv(19), b"HTTP/1.1 200 OK\r\n\r\n")
+        self.wait_done()
+        self.assertEqual(self.created, [(b"1.2.3.4", 8443)])
+        self.assertEqual(self.conn.received, b"")
+
+    def test_connect_fail(self):
+        self.create_ok = False
+        self.send(b"CONNECT www.example.com:443 HTTP/1.1\r\n\r\n")
+        self.assertEqual(self.recv(21), b"HTTP/1.1 500 Fail\r\n\r\n")
+        self.wait_done()
+
+    def test_http_absolute_url(self):
+        self.send(b"GET http://www.example.com:8080/a?b=1 HTTP/1.1\r\nHost: www.example.com:8080\r\n\r\n", [10])
+        self.wait_done()
+
+        self.assertEqual(self.created, [(b"www.example.com", 8080)])
+        self.assertEqual(self.conn.received, b"GET /a?b=1 HTTP/1.1\r\nHost: www.example.com:8080\r\n\r\n")
+
+    def test_http_absolute_url_no_path(self):
+        self.send(b"GET http://www.example.com HTTP/1.0\r\n\r\n")
+        self.wait_done()
+
+        self.assertEqual(self.created, [(b"www.example.com", 80)])
+        self.assertEqual(self.conn.received, b"GET / HTTP/1.0\r\n\r\n")
+
+    def test_http_host_header(self):
+        req = b"POST /upload HTTP/1.1\r\nHost: www.example.com\r\nContent-Length: 4\r\n\r\nbody"
+        # pipelined request is forwarded too.
+        req2 = b"GET /next HTTP/1.1\r\nHost: www.example.com\r\n\r\n"
+        self.send(req + req2, [1, 15, 20])
+        self.wait_done()
+
+        self.assertEqual(self.created, [(b"www.example.com", 80)])
+        self.assertEqual(self.conn.received, req + req2)
+
+    def test_http_no_host(self):
+        self.send(b"GET /a HTTP/1.1\r\nAccept: */*\r\n\r\n")
+        self.assertEqual(self.recv(21), b"HTTP/1.1 500 Fail\r\n\r\n")
+        self.wait_done()
+        self.assertEqual(self.created, [])
+
+    def test_oversize_header(self):
+        proxy_handler.Socks5Server.max_handshake_size = 1024
+        try:
+            self.send(b"CONNECT www.example.com:443 HTTP/1.1\r\nX-Pad: " + b"x" * 8192)
+        except socket.error:
+            pass
+        self.wait_done()
+
+        self.assertEqual(self.created, [])
+        # closed, reset if the unread data is dropped.
+        try:
+            self.assertEqual(self.recv(1), b"")
+        except ConnectionResetError:
+            pass
+
+    def test_closed(self):
+        self.send(b"CONNECT www.exam")
+        self.client_sock.shutdown(socket.SHUT_WR)
+        self.wait_done()
+        self.assertEqual(self.created, [])
+
+
+if __name__ == '__main__':
+    unittest.main()